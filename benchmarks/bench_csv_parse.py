@@ -0,0 +1,66 @@
+"""
+Compares the parse throughput of the nvidia-smi CSV output: csv module with pydantic models against the
+hand-written parser with tuple-backed records.
+
+Usage: python -m benchmarks.bench_csv_parse
+"""
+
+import csv
+import timeit
+
+from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.processing.gpu.records import (
+    GPURecord,
+    parse_nvidia_smi_csv,
+    to_gpus,
+)
+
+ROWS = 10_000
+REPEAT = 5
+LINE = (
+    "{index}, GPU-8bfb8a55-1787-40ee-38fc-{index:012d}, 37, 49152, 1024, 48128, 535.104.05, Quadro RTX 8000,"
+    " 1324821109943, Disabled, Disabled, 35"
+)
+
+
+def parse_with_models(output: str):
+    """
+    Previous path: csv.reader and validated pydantic models
+    """
+    return [GPU.from_nvidia_smi_list(line) for line in csv.reader(output.splitlines())]
+
+
+def parse_to_records(output: str):
+    """
+    Polling and broker path: records only
+    """
+    return [GPURecord.from_nvidia_smi_list(line) for line in parse_nvidia_smi_csv(output)]
+
+
+def parse_records_to_models(output: str):
+    """
+    Records converted to models at the API boundary
+    """
+    return to_gpus(parse_to_records(output))
+
+
+def main():
+    """
+    Prints the throughput of all parse paths for ROWS rows
+    """
+    output = "\n".join(LINE.format(index=index) for index in range(ROWS)) + "\n"
+    assert parse_with_models(output) == parse_records_to_models(output)
+
+    baseline = None
+    for name, parse in (
+        ("csv + models", parse_with_models),
+        ("records", parse_to_records),
+        ("records + models", parse_records_to_models),
+    ):
+        duration = min(timeit.repeat(lambda: parse(output), number=1, repeat=REPEAT))  # pylint: disable=W0640
+        baseline = baseline or duration
+        print(f"{name:<18} {duration * 1000:>8.2f} ms {ROWS / duration:>12,.0f} rows/s {baseline / duration:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
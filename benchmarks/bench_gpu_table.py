@@ -0,0 +1,101 @@
+"""
+Compares GPU availability filtering and sorting on lists of GPU objects with the columnar GPUTable.
+The speedup is the one of the production path (select_with_table): the GPUManager builds a GPUTable from the GPUs of
+every snapshot and converts the selection back to GPU objects, so "columns only" is a lower bound it does not reach.
+
+Usage: python -m benchmarks.bench_gpu_table
+"""
+
+import random
+import timeit
+from typing import List
+
+from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.processing.gpu.strategies import (
+    SelectionStrategyEnum,
+    SelectionStrategyFactory,
+    get_table_strategy,
+)
+from experiment_runner.processing.gpu.table import GPUTable
+from experiment_runner.utils import nan_safe_float
+
+SIZES = (8, 64, 512, 4096, 32768)
+
+
+def create_gpus(count: int) -> List[GPU]:
+    """
+    Creates count GPUs with random load and memory usage
+    """
+    gpus = []
+    for gpu_id in range(count):
+        memory_used = random.randint(0, 49152)
+        gpus.append(
+            GPU(
+                id=gpu_id,
+                uuid=f"GPU-{gpu_id}",
+                load=random.random(),
+                memory_total=49152,
+                memory_used=memory_used,
+                memory_free=49152 - memory_used,
+                driver="535.104.05",
+                name="Quadro RTX 8000",
+                serial=str(gpu_id),
+                display_mode="Disabled",
+                display_active="Disabled",
+                temperature=35,
+            )
+        )
+    return gpus
+
+
+def select_with_objects(gpus: List[GPU]) -> List[GPU]:
+    """
+    Per-object filter and sort (previous implementation of GPUManager.get_available)
+    """
+    available = [gpu for gpu in gpus if gpu.is_available()]
+    available.sort(
+        key=lambda x: (nan_safe_float(x.load), nan_safe_float(x.memory_util), random.randint(0, len(available)))
+    )
+    return available
+
+
+def select_with_table(gpus: List[GPU]) -> List[GPU]:
+    """
+    Vectorized filter and sort, including the conversion from and to GPU objects
+    """
+    strategy = get_table_strategy(SelectionStrategyFactory.get_instance(SelectionStrategyEnum.LOAD_MEMORY_RANDOM))
+    table = GPUTable.from_gpus(gpus)
+    available = table.take(table.is_available())
+    return available.to_gpus(strategy(available))
+
+
+def select_on_table(table: GPUTable) -> GPUTable:
+    """
+    Vectorized filter and sort on an existing table (e.g. kept from a snapshot)
+    """
+    strategy = get_table_strategy(SelectionStrategyFactory.get_instance(SelectionStrategyEnum.LOAD_MEMORY_RANDOM))
+    available = table.take(table.is_available())
+    return available.take(strategy(available))
+
+
+def main():
+    """
+    Prints the mean runtime per decision for all SIZES
+    """
+    print(f"{'GPUs':>8} {'objects [ms]':>14} {'table [ms]':>12} {'columns only [ms]':>18} {'speedup':>8}")
+    for size in SIZES:
+        gpus = create_gpus(size)
+        columns = GPUTable.from_gpus(gpus)
+        repeat = max(1, 20000 // size)
+        # pylint: disable=cell-var-from-loop
+        objects = timeit.timeit(lambda: select_with_objects(gpus), number=repeat) / repeat
+        table = timeit.timeit(lambda: select_with_table(gpus), number=repeat) / repeat
+        columns_only = timeit.timeit(lambda: select_on_table(columns), number=repeat) / repeat
+        print(
+            f"{size:>8} {objects * 1000:>14.3f} {table * 1000:>12.3f} {columns_only * 1000:>18.3f}"
+            f" {objects / table:>8.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
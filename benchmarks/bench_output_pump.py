@@ -0,0 +1,161 @@
+"""
+Compares the line-wise text mode output loop of CommandRunner with the chunked binary pump on commands flooding
+stdout, and measures the latency from a write of a command to its callbacks on pipes and pseudo-terminals.
+
+Usage: python -m benchmarks.bench_output_pump
+"""
+
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from experiment_runner.processing.callbacks import STDOUT, Callback
+from experiment_runner.processing.subprocesses import CommandRunner
+
+SIZES_IN_MB = (16, 64)
+LINE_LENGTHS = (16, 120, 4096)
+LATENCY_SAMPLES = 1000
+
+
+class CountingCallback(Callback):
+    """
+    Counts the characters passed to the callbacks
+    """
+
+    def __init__(self) -> None:
+        self.characters = 0
+
+    def on_start(self, command):
+        pass
+
+    def on_end(self, command, returncode):
+        pass
+
+    def on_log(self, command, log, stream=STDOUT):
+        self.characters += len(log)
+
+    def on_logs(self, command, logs, stream=STDOUT):
+        self.characters += sum(map(len, logs))
+
+
+class LatencyCallback(Callback):
+    """
+    Keeps the time between the write of every line (a monotonic timestamp) and its callback
+    """
+
+    def __init__(self) -> None:
+        self.latencies_in_ns: List[int] = []
+
+    def on_start(self, command):
+        pass
+
+    def on_end(self, command, returncode):
+        pass
+
+    def on_log(self, command, log, stream=STDOUT):
+        self.on_logs(command, [log], stream)
+
+    def on_logs(self, command, logs, stream=STDOUT):
+        now = time.monotonic_ns()
+        self.latencies_in_ns.extend(now - int(log) for log in logs)
+
+
+def flood_command(size_in_mb: int, line_length: int) -> str:
+    """
+    Returns a command writing size_in_mb of lines with line_length characters to stdout
+    """
+    script = (
+        f"import sys; line = b'x' * {line_length - 1} + b'\\n'; block = line * max(1, 65536 // len(line));"
+        f" [sys.stdout.buffer.write(block) for _ in range({size_in_mb} * 1024**2 // len(block))]"
+    )
+    return f"{shlex.quote(sys.executable)} -c {shlex.quote(script)}"
+
+
+def run_line_wise(command: str, callback: Callback) -> int:
+    """
+    Text mode loop reading one line at a time (previous implementation of CommandRunner.run)
+    """
+    with subprocess.Popen(
+        command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=1, universal_newlines=True
+    ) as process:
+        for line in process.stdout:  # type: ignore[union-attr]
+            print(line, end="")
+            callback.on_log(command, line)
+        return process.wait()
+
+
+@contextmanager
+def stdout_to_devnull() -> Iterator[None]:
+    """
+    Redirects the file descriptor of stdout to /dev/null, so the terminal does not limit the throughput
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+
+def measure(size_in_mb: int, line_length: int, chunked: bool) -> float:
+    """
+    Returns the throughput in MB/s of one run
+    """
+    command = flood_command(size_in_mb, line_length)
+    callback = CountingCallback()
+    with stdout_to_devnull():
+        started_at = time.perf_counter()
+        if chunked:
+            CommandRunner([callback]).run(command, {})
+        else:
+            run_line_wise(command, callback)
+        duration = time.perf_counter() - started_at
+    return callback.characters / 1024**2 / duration
+
+
+def measure_latency(use_pty: bool) -> List[int]:
+    """
+    Returns the latencies in ns of LATENCY_SAMPLES lines written 1 ms apart
+    """
+    script = (
+        "import os, time; [(os.write(1, b'%d\\n' % time.monotonic_ns()), time.sleep(0.001))"
+        f" for _ in range({LATENCY_SAMPLES})]"
+    )
+    callback = LatencyCallback()
+    with stdout_to_devnull():
+        CommandRunner([callback], use_pty=use_pty).run(f"{shlex.quote(sys.executable)} -c {shlex.quote(script)}", {})
+    return callback.latencies_in_ns
+
+
+def main():
+    """
+    Prints the throughput of both loops for all SIZES_IN_MB and LINE_LENGTHS, then the latency of both outputs
+    """
+    print(f"{'MB':>6} {'line length':>12} {'line-wise [MB/s]':>17} {'chunked [MB/s]':>15} {'speedup':>8}")
+    for size in SIZES_IN_MB:
+        for line_length in LINE_LENGTHS:
+            line_wise = measure(size, line_length, chunked=False)
+            chunked = measure(size, line_length, chunked=True)
+            print(f"{size:>6} {line_length:>12} {line_wise:>17.1f} {chunked:>15.1f} {chunked / line_wise:>8.1f}x")
+
+    print(f"\n{'output':>8} {'median [us]':>12} {'p99 [us]':>10} {'max [us]':>10}")
+    for name, use_pty in (("pipe", False), ("pty", True)):
+        latencies = sorted(measure_latency(use_pty))
+        print(
+            f"{name:>8} {statistics.median(latencies) / 1000:>12.1f}"
+            f" {latencies[int(len(latencies) * 0.99)] / 1000:>10.1f} {latencies[-1] / 1000:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,25 +2,87 @@
 This module provides the main cmd interface
 """
 
+import os
+import signal
 import sys
+from datetime import datetime
 from pathlib import Path
-from time import sleep
-from typing import List
+from typing import FrozenSet, List, Optional, Tuple
 
 import typer
 from rich import print  # pylint: disable=redefined-builtin
+from rich.table import Table
 
 from experiment_runner import __version__
+from experiment_runner.processing.cache import OutputCapture, ResultCache
 from experiment_runner.processing.callbacks import LoggerCallback, MailerCallback
 from experiment_runner.processing.configurator import CONFIG_PATH, Configurator
+from experiment_runner.processing.gpu.broker import (
+    BrokerAlreadyRunningException,
+    GPUBroker,
+    InsecureSocketDirectoryException,
+)
 from experiment_runner.processing.gpu.exceptions import GPUNotFoundException
+from experiment_runner.processing.gpu.history import GPUUtilizationHistory, get_history
 from experiment_runner.processing.gpu.manager import GPU, GPUManager
+from experiment_runner.processing.gpu.providers import (
+    BROKER_SOCKET_PATH,
+    BrokerGPUProvider,
+    GPUProvider,
+    GPUProviderEnum,
+    GPUProviderFactory,
+    NvidiaGPUProvider,
+    NvidiaXMLGPUProvider,
+)
+from experiment_runner.processing.gpu.rendering import (
+    OutputFormat,
+    render_utilization,
+    validate_attributes,
+)
+from experiment_runner.processing.gpu.report import (
+    create_usage_report,
+    render_usage_report,
+)
+from experiment_runner.processing.gpu.reservations import GPUReservationLedger
+from experiment_runner.processing.gpu.sampler import StreamingGPUSampler
+from experiment_runner.processing.gpu.snapshot import GPUSnapshot
 from experiment_runner.processing.gpu.strategies import (
     SelectionStrategyEnum,
     SelectionStrategyFactory,
+    requires_memory_request,
+)
+from experiment_runner.processing.gpu.waiting import (
+    MAX_BACKOFF_IN_SECONDS,
+    Backoff,
+    GPUWaiter,
+    WaitTimeoutException,
+    notify_waiters,
+)
+from experiment_runner.processing.gpu.watch import watch_gpus
+from experiment_runner.processing.jobs import (
+    ACTIVE_STATES,
+    JOB_DIRECTORY,
+    JobNotFoundException,
+    JobQueue,
 )
 from experiment_runner.processing.mail import Mailer
+from experiment_runner.processing.pipeline import (
+    PipelineRunner,
+    load_pipeline,
+    summarize,
+)
+from experiment_runner.processing.scheduler import (
+    Scheduler,
+    SchedulerAlreadyRunningException,
+    is_scheduler_running,
+)
 from experiment_runner.processing.subprocesses import CommandRunner
+from experiment_runner.processing.sweep import (
+    SweepRunner,
+    expand_trials,
+    load_sweep_spec,
+)
+from experiment_runner.utils import parse_memory_size
 
 app = typer.Typer()
 
@@ -28,16 +90,111 @@ app = typer.Typer()
 POLLING_RATE_IN_SECONDS = 1.0
 
 
+def get_provider(streaming: bool = False) -> GPUProvider:
+    """
+    Creates the GPU provider selected in the configuration
+
+    Args:
+        streaming: Keep one nvidia-smi process alive for repeated queries instead of forking on every query
+    """
+    config = Configurator().config
+    try:
+        provider_type = GPUProviderEnum(config.gpu_provider)
+    except ValueError:
+        typer.echo(
+            typer.style(
+                f"Unknown gpu_provider '{config.gpu_provider}' in {Configurator().config_path}. "
+                f"Allowed values: {', '.join(member.value for member in GPUProviderEnum)}",
+                fg=typer.colors.WHITE,
+                bg=typer.colors.RED,
+                bold=True,
+                blink=True,
+            )
+        )
+        sys.exit(-1)
+
+    provider = GPUProviderFactory.get_instance(provider_type)
+    # Only the CSV queries fork per sample, the XML provider returns health details the stream does not have
+    if streaming and isinstance(provider, NvidiaGPUProvider) and not isinstance(provider, NvidiaXMLGPUProvider):
+        return StreamingGPUSampler(provider.nvidia_smi_path, config.polling_rate_in_seconds)
+    return provider
+
+
+def get_manager(
+    gpu_selection: SelectionStrategyEnum = SelectionStrategyEnum.FIRST, provider: Optional[GPUProvider] = None
+) -> GPUManager:
+    """
+    Creates a GPUManager using the configured provider and GPU limits
+    """
+    config = Configurator().config
+    return GPUManager(
+        SelectionStrategyFactory.get_instance(gpu_selection),
+        provider or get_provider(),
+        staff_group_name=config.staff_group_name,
+        max_gpus_per_staff=config.max_gpus_per_staff,
+        max_gpus_per_other=config.max_gpus_per_other,
+        ledger=GPUReservationLedger(),
+        history=get_history(),
+    )
+
+
+def check_memory_request(
+    gpu_selection: SelectionStrategyEnum, min_free_memory: int, job_memory: Optional[int] = None
+) -> None:
+    """
+    Raises:
+        typer.BadParameter: if the strategy needs the GPU memory of the job (e.g. best_fit), but none is given
+    """
+    if job_memory is None and min_free_memory <= 0:
+        if requires_memory_request(SelectionStrategyFactory.get_instance(gpu_selection)):
+            raise typer.BadParameter(
+                f"The {gpu_selection.value} strategy needs the GPU memory of the command.",
+                param_hint="--min-free-memory",
+            )
+
+
 @app.command()
-def run(
+def run(  # pylint: disable=too-many-locals,too-many-branches,too-many-statements
     command: str,
     gpu_selection: SelectionStrategyEnum = typer.Option(
         SelectionStrategyEnum.LOAD_MEMORY_RANDOM.value,
         help="Strategy for GPU selection. No GPU will be available if none",
     ),
     num_gpus: int = typer.Option(1, help="Desired number of GPUs. Not guaranteed."),
+    min_free_memory: int = typer.Option(0, help="Minimum free memory (MiB) of a GPU to be considered available."),
+    max_load: float = typer.Option(0.5, help="Maximum load (0-1) of a GPU to be considered available."),
+    max_memory_util: float = typer.Option(
+        0.5, help="Maximum memory usage (0-1) of a GPU to be considered available."
+    ),
+    gpu_memory: Optional[str] = typer.Option(
+        None,
+        help="Expected GPU memory of the command (e.g. 6G). The command then shares GPUs with other commands"
+        + " while their memory suffices, regardless of max-load and max-memory-util.",
+    ),
+    per_gpu: bool = typer.Option(
+        False, help="Start one copy of the command per GPU with RANK, LOCAL_RANK and WORLD_SIZE set."
+    ),
+    pty: bool = typer.Option(
+        False,
+        help="Run the command on a pseudo-terminal, so it keeps the line buffering and progress bars of a shell.",
+    ),
+    cache: bool = typer.Option(
+        False, help="Restore outputs and log of an identical successful run instead of running the command."
+    ),
+    inputs: Optional[List[Path]] = typer.Option(
+        None, "--input", help="File or directory the command reads. Part of the cache key. (Repeatable)"
+    ),
+    outputs: Optional[List[Path]] = typer.Option(
+        None, "--output", help="File or directory the command writes. Restored from the cache. (Repeatable)"
+    ),
+    cache_env: Optional[List[str]] = typer.Option(
+        None, help="Environment variable the command depends on. Part of the cache key. (Repeatable)"
+    ),
     send_mail: bool = typer.Option(False, help="Send email after experiment finishes or fails."),
     wait_for_gpus: bool = typer.Option(False, help="Wait until num_gpus are available."),
+    wait_timeout: Optional[float] = typer.Option(
+        None, help="Give up waiting for GPUs after this many seconds. (Default: wait forever)"
+    ),
     logging: Path = typer.Option(None, help="Write all output into a file at this location."),
     config_path: Path = typer.Option(CONFIG_PATH, help=f"Use this configuration file.(Default: {CONFIG_PATH})"),
 ):
@@ -45,18 +202,37 @@ def run(
     Runs a specified command
     """
 
+    try:
+        job_memory = parse_memory_size(gpu_memory) if gpu_memory else None
+    except ValueError as err:
+        raise typer.BadParameter(str(err), param_hint="--gpu-memory") from err
+    check_memory_request(gpu_selection, min_free_memory, job_memory)
+
     Configurator().load_config(config_path)
-    manager = GPUManager(SelectionStrategyFactory.get_instance(gpu_selection))
-    runner = CommandRunner()
+    runner = CommandRunner(use_pty=pty)
 
     if send_mail or Configurator().config.use_mailer:
         runner.register_callback(MailerCallback(Mailer(), logging))
     if logging:
         runner.register_callback(LoggerCallback(logging))
 
+    result_cache = ResultCache(max_size_in_bytes=Configurator().config.cache_size_in_mb * 1024**2)
+    cache_key = None
+    if cache:
+        cache_key, log = restore_cached_result(result_cache, command, inputs or [], outputs or [], cache_env or [])
+        if log is not None:
+            # Mail and log the restored run like a run of the command
+            return runner.replay(command, log)
+        runner.register_callback(OutputCapture(result_cache.captures / f"{os.getpid()}.log"))
+
     cuda_devices: List[GPU] = []
     return_code = 1
+    provider: Optional[GPUProvider] = None
+    manager: Optional[GPUManager] = None
     try:
+        provider = get_provider(streaming=wait_for_gpus)
+        manager = get_manager(gpu_selection, provider)
+        snapshot = manager.snapshot()
         if manager.get_gpu_limit_of_current_user() < num_gpus:
             typer.echo(
                 "🚨 "
@@ -70,12 +246,12 @@ def run(
                 )
                 + " 🚨"
             )
-        elif len(manager.gpus) < num_gpus:
+        elif len(snapshot) < num_gpus:
             typer.echo(
                 "🚨 "
                 + typer.style(
                     "Your requested number of GPUs is not available on this device."
-                    + f"({len(manager.gpus)}/{num_gpus} GPUs avaliable.)",
+                    + f"({len(snapshot)}/{num_gpus} GPUs avaliable.)",
                     fg=typer.colors.WHITE,
                     bg=typer.colors.RED,
                     bold=True,
@@ -84,12 +260,37 @@ def run(
                 + " 🚨"
             )
         else:
-            while len(cuda_devices) < num_gpus:
-                # Check cuda devices available
-                cuda_devices = list(manager.get_gpus_of_current_user())
-                if len(cuda_devices) < num_gpus:
-                    cuda_devices = manager.get_available(limit=num_gpus)
 
+            def acquire(
+                current_snapshot: Optional[GPUSnapshot] = None, reserved: FrozenSet[str] = frozenset()
+            ) -> List[GPU]:
+                # Check cuda devices available. One sample per decision.
+                if current_snapshot is None:
+                    current_snapshot = manager.snapshot()
+                gpus = list(manager.get_gpus_of_current_user(current_snapshot))
+                if len(gpus) < num_gpus:
+                    # Claimed atomically, so concurrent runs do not pick the same idle GPU
+                    gpus = manager.reserve_available(
+                        limit=num_gpus,
+                        max_load=max_load,
+                        max_memory=max_memory_util,
+                        memory_free=min_free_memory,
+                        snapshot=current_snapshot,
+                        job_memory=job_memory,
+                        excluded=reserved,
+                    )
+                return gpus
+
+            if wait_for_gpus:
+                waiter = GPUWaiter(
+                    timeout_in_seconds=wait_timeout,
+                    backoff=Backoff(Configurator().config.polling_rate_in_seconds, MAX_BACKOFF_IN_SECONDS),
+                )
+                cuda_devices = waiter.wait(
+                    num_gpus, lambda reserved: acquire(reserved=reserved), manager.release_reservations, typer.echo
+                )
+            else:
+                cuda_devices = acquire(snapshot)
                 if len(cuda_devices) != num_gpus:
                     typer.echo(
                         "🚨 "
@@ -104,11 +305,23 @@ def run(
                         + " 🚨"
                     )
 
-                if not wait_for_gpus:
-                    break
-
-                sleep(Configurator().config.polling_rate_in_seconds)
-            return_code = runner.run_gpu(command, cuda_devices)
+            # The sampler is not needed while the command runs
+            if isinstance(provider, StreamingGPUSampler):
+                provider.close()
+            if per_gpu and cuda_devices:
+                return_code = runner.run_per_gpu(command, cuda_devices)
+            else:
+                return_code = runner.run_gpu(command, cuda_devices)
+    except WaitTimeoutException as err:
+        typer.echo(
+            typer.style(
+                f"{err}",
+                fg=typer.colors.WHITE,
+                bg=typer.colors.RED,
+                bold=True,
+                blink=True,
+            )
+        )
     except GPUNotFoundException as err:
         typer.echo(
             typer.style(
@@ -121,20 +334,85 @@ def run(
         )
         if typer.confirm("🚨 Do you want to continue without nvidia-smi? 🚨"):
             return_code = runner.run_gpu(command, cuda_devices)
+    finally:
+        # Also on timeouts, errors and interrupts
+        if isinstance(provider, StreamingGPUSampler):
+            provider.close()
+        if manager is not None:
+            manager.release_reservations()
+            # Waiting runs may take the GPUs now
+            notify_waiters()
+    if cache_key is not None:
+        cache_result(result_cache, cache_key, command, outputs or [], return_code)
     return return_code
 
 
+def restore_cached_result(
+    result_cache: ResultCache, command: str, inputs: List[Path], outputs: List[Path], env_names: List[str]
+) -> Tuple[str, Optional[str]]:
+    """
+    Restores the outputs of an identical successful run, if cached
+
+    Returns:
+        The cache key of the run and the log of the restored run (None if the result was not cached)
+    """
+    try:
+        key = result_cache.key(command, inputs, env_names, outputs=outputs)
+    except FileNotFoundError as err:
+        raise typer.BadParameter(str(err), param_hint="--input") from err
+    entry = result_cache.lookup(key)
+    log = result_cache.restore(entry) if entry is not None else None
+    if log is not None:
+        typer.echo(f"{typer.style('♻️  Restored cached result:', fg=typer.colors.GREEN, bold=True)} {command}")
+    return key, log
+
+
+def cache_result(result_cache: ResultCache, key: str, command: str, outputs: List[Path], return_code: int):
+    """
+    Stores the outputs and the captured log of a successful run
+    """
+    log_path = result_cache.captures / f"{os.getpid()}.log"
+    try:
+        if return_code == 0:
+            result_cache.store(key, command, outputs, log_path)
+    except FileNotFoundError as err:
+        typer.echo(f"🚨 The result was not cached: {err} 🚨")
+    finally:
+        log_path.unlink(missing_ok=True)
+
+
 @app.command()
-def gpu_info(attributes: List[str] = typer.Option(["load", "memory_util", "temperature"])):
+def gpu_info(
+    attributes: List[str] = typer.Option(["load", "memory_util", "temperature"]),
+    output_format: OutputFormat = typer.Option(OutputFormat.TABLE.value, "--format", help="Output format."),
+    watch: bool = typer.Option(False, "--watch", help="Keep refreshing the table until interrupted."),
+    interval: Optional[float] = typer.Option(None, help="Refresh interval of --watch. (Default: polling rate)"),
+):
     """
     Prints current GPU util
     """
     try:
-        manager = GPUManager()
-        util_table = manager.create_utilization_table(tuple(attributes))
-        typer.echo(util_table)
-
-    except GPUNotFoundException as err:
+        # Fail before sampling the GPUs
+        attributes = list(validate_attributes(attributes))
+        if watch and output_format != OutputFormat.TABLE:
+            raise ValueError("--watch only supports the table format.")
+
+        if watch:
+            interval = interval or Configurator().config.polling_rate_in_seconds
+            provider = get_provider(streaming=True)
+            try:
+                watch_gpus(provider, attributes, interval)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                if isinstance(provider, StreamingGPUSampler):
+                    provider.close()
+            return
+
+        manager = get_manager()
+        typer.echo(render_utilization(manager.snapshot().gpus, attributes, output_format))
+
+    except (GPUNotFoundException, ValueError) as err:
         typer.echo(
             typer.style(
                 f"{err}",
@@ -153,16 +431,31 @@ def print_gpus_env(
         help="Strategy for GPU selection. No GPU will be available if none",
     ),
     num_gpus: int = typer.Option(1, help="Desired number of GPUs. Not guaranteed."),
+    min_free_memory: int = typer.Option(0, help="Minimum free memory (MiB) of a GPU to be considered available."),
+    max_load: float = typer.Option(0.5, help="Maximum load (0-1) of a GPU to be considered available."),
+    max_memory_util: float = typer.Option(
+        0.5, help="Maximum memory usage (0-1) of a GPU to be considered available."
+    ),
 ):
     """
     Creates an environment variable of maximum num_gpus available.
     Use `export $(experiment print-gpus-env)` to only make a subset of gpus available.
     """
+    check_memory_request(gpu_selection, min_free_memory)
     try:
-        manager = GPUManager(SelectionStrategyFactory.get_instance(gpu_selection))
-        cuda_devices = list(manager.get_gpus_of_current_user())
+        manager = get_manager(gpu_selection)
+        snapshot = manager.snapshot()
+        cuda_devices = list(manager.get_gpus_of_current_user(snapshot))
         if len(cuda_devices) == 0:
-            cuda_devices = manager.get_available(limit=num_gpus)
+            # This process ends immediately, so the claims only last for the grace period
+            cuda_devices = manager.reserve_available(
+                limit=num_gpus,
+                max_load=max_load,
+                max_memory=max_memory_util,
+                memory_free=min_free_memory,
+                snapshot=snapshot,
+                hold_until_exit=False,
+            )
 
         cuda_devices_str = ",".join([str(device.id) for device in cuda_devices])
         print(f"CUDA_VISIBLE_DEVICES={cuda_devices_str}")
@@ -179,26 +472,196 @@ def print_gpus_env(
 
 
 @app.command()
-def gpu_usage_report():
+def gpu_usage_report(
+    output_format: OutputFormat = typer.Option(OutputFormat.TABLE.value, "--format", help="Output format."),
+):
     """
     Prints a GPU usage report for all currently active Users
     """
     try:
-        manager = GPUManager()
+        report = create_usage_report(get_manager().snapshot())
+        typer.echo(render_usage_report(report, output_format))
+    except GPUNotFoundException as err:
+        typer.echo(
+            typer.style(
+                f"{err}",
+                fg=typer.colors.WHITE,
+                bg=typer.colors.RED,
+                bold=True,
+                blink=True,
+            )
+        )
 
-        for user in manager.active_users:
-            typer.echo(f"Report for user {user}:")
 
-            used_gpus = sorted([gpu.id for gpu in manager.get_gpus_of_user(user)])
-            used_gpus_str = f"\tUsed GPUs: {used_gpus}"
-            if len(used_gpus) > 1:
-                typer.echo(typer.style(used_gpus_str, fg=typer.colors.WHITE, bg=typer.colors.RED, bold=True))
-            else:
-                typer.echo(used_gpus_str)
+@app.command()
+def broker(
+    socket_path: Path = typer.Option(BROKER_SOCKET_PATH, help="Unix socket to serve the GPU samples on."),
+    config_path: Path = typer.Option(CONFIG_PATH, help=f"Use this configuration file.(Default: {CONFIG_PATH})"),
+):
+    """
+    Samples the GPUs once per polling interval and serves the samples to all local experiment commands
+    """
+    Configurator().load_config(config_path)
+    try:
+        provider = get_provider(streaming=True)
+        if isinstance(provider, BrokerGPUProvider):
+            raise BrokerAlreadyRunningException(f"A GPU broker is already listening on {provider.socket_path}.")
 
-            typer.echo(f"\tPIDs: {sorted([proc.pid for proc in manager.get_gpu_processes_of_user(user)])}")
-            typer.echo()
-    except GPUNotFoundException as err:
+        gpu_broker = GPUBroker(
+            provider, socket_path, Configurator().config.polling_rate_in_seconds, history=GPUUtilizationHistory()
+        )
+        gpu_broker.start()
+        typer.echo(f"📡 Serving GPU samples on {socket_path}")
+        gpu_broker.serve_forever()
+    except (GPUNotFoundException, BrokerAlreadyRunningException, InsecureSocketDirectoryException) as err:
+        typer.echo(
+            typer.style(
+                f"{err}",
+                fg=typer.colors.WHITE,
+                bg=typer.colors.RED,
+                bold=True,
+                blink=True,
+            )
+        )
+        sys.exit(-1)
+    except KeyboardInterrupt:
+        typer.echo("Broker stopped.")
+
+
+@app.command()
+def submit(  # pylint: disable=too-many-positional-arguments
+    command: str,
+    num_gpus: int = typer.Option(1, help="Number of GPUs of the job."),
+    priority: int = typer.Option(0, help="Jobs with higher priority are started first."),
+    walltime: Optional[float] = typer.Option(
+        None, help="Max. runtime in seconds. The job is terminated afterwards. Short jobs may start earlier."
+    ),
+    gpu_selection: SelectionStrategyEnum = typer.Option(
+        SelectionStrategyEnum.LOAD_MEMORY_RANDOM.value, help="Strategy for GPU selection."
+    ),
+    min_free_memory: int = typer.Option(0, help="Minimum free memory (MiB) of a GPU to be considered available."),
+    logging: Path = typer.Option(
+        None, help=f"Write all output into a file at this location. (Default: {JOB_DIRECTORY})"
+    ),
+    config_path: Path = typer.Option(CONFIG_PATH, help=f"Use this configuration file.(Default: {CONFIG_PATH})"),
+):
+    """
+    Adds a command to the job queue. Every user runs their own scheduler (experiment scheduler), it starts the jobs
+    of its user once GPUs are free. Jobs of users without a running scheduler stay pending.
+    """
+    check_memory_request(gpu_selection, min_free_memory)
+    Configurator().load_config(config_path)
+    try:
+        manager = get_manager()
+        if manager.get_gpu_limit_of_current_user() < num_gpus:
+            raise ValueError(
+                "Your requested number of GPUs is not allowed for your user group."
+                + f"({manager.get_gpu_limit_of_current_user()}/{num_gpus} GPUs are allowed)"
+            )
+        if len(manager.gpus) < num_gpus:
+            raise ValueError(f"Your requested number of GPUs is not available on this device. ({num_gpus} GPUs)")
+
+        job = JobQueue().submit(
+            command,
+            num_gpus,
+            priority,
+            walltime,
+            gpu_selection=gpu_selection.value,
+            min_free_memory=min_free_memory,
+            log_path=logging.absolute() if logging else None,
+            environment=dict(os.environ),
+        )
+        notify_waiters()
+        typer.echo(f"📥 Submitted job {job.id}")
+        if not is_scheduler_running(job.user):
+            typer.echo(
+                f"🚨 No scheduler of {job.user} is running. The job starts once you run 'experiment scheduler'"
+                " (e.g. as systemd user service). 🚨"
+            )
+    except (GPUNotFoundException, ValueError) as err:
+        typer.echo(
+            typer.style(
+                f"{err}",
+                fg=typer.colors.WHITE,
+                bg=typer.colors.RED,
+                bold=True,
+                blink=True,
+            )
+        )
+        sys.exit(-1)
+
+
+@app.command()
+def queue(
+    show_all: bool = typer.Option(False, "--all", help="Also show ended jobs."),
+    user: Optional[str] = typer.Option(None, help="Only show the jobs of this user."),
+):
+    """
+    Prints the job queue in dispatch order
+    """
+    jobs = JobQueue().jobs(None if show_all else ACTIVE_STATES, user)
+    table = Table(show_edge=False)
+    for column in ("ID", "User", "State", "Priority", "GPUs", "Walltime", "Submitted", "Command"):
+        table.add_column(column)
+    for job in jobs:
+        table.add_row(
+            str(job.id),
+            job.user,
+            job.state.value,
+            str(job.priority),
+            job.gpus or str(job.num_gpus),
+            "" if job.walltime_in_seconds is None else f"{job.walltime_in_seconds:.0f}s",
+            datetime.fromtimestamp(job.submitted_at).strftime("%Y-%m-%d %H:%M"),
+            job.command,
+        )
+    print(table)
+
+
+@app.command()
+def cancel(job_ids: List[int]):
+    """
+    Cancels pending or running jobs of the current user
+    """
+    failed = False
+    for job_id in job_ids:
+        try:
+            JobQueue().cancel(job_id)
+            typer.echo(f"Cancelled job {job_id}")
+        except (JobNotFoundException, PermissionError, ValueError) as err:
+            failed = True
+            typer.echo(
+                typer.style(
+                    f"{err}",
+                    fg=typer.colors.WHITE,
+                    bg=typer.colors.RED,
+                    bold=True,
+                    blink=True,
+                )
+            )
+    # Running jobs are terminated by their scheduler
+    notify_waiters()
+    if failed:
+        sys.exit(-1)
+
+
+@app.command()
+def scheduler(
+    config_path: Path = typer.Option(CONFIG_PATH, help=f"Use this configuration file.(Default: {CONFIG_PATH})"),
+):
+    """
+    Starts the jobs you submitted whenever GPUs are free. Keep it running (e.g. as systemd user service).
+    """
+    Configurator().load_config(config_path)
+    try:
+        job_scheduler = Scheduler(
+            get_manager(provider=get_provider(streaming=True)),
+            backoff=Backoff(Configurator().config.polling_rate_in_seconds, MAX_BACKOFF_IN_SECONDS),
+        )
+        # systemd stops services with SIGTERM
+        signal.signal(signal.SIGTERM, lambda *_: job_scheduler.stop())
+        typer.echo(f"🗓️  Scheduling the jobs of {job_scheduler.user}")
+        job_scheduler.serve_forever()
+    except (GPUNotFoundException, SchedulerAlreadyRunningException) as err:
         typer.echo(
             typer.style(
                 f"{err}",
@@ -208,6 +671,169 @@ def gpu_usage_report():
                 blink=True,
             )
         )
+        sys.exit(-1)
+    except KeyboardInterrupt:
+        typer.echo("Scheduler stopped. Running jobs were requeued.")
+
+
+@app.command()
+def sweep(  # pylint: disable=too-many-locals,too-many-positional-arguments
+    command: str,
+    spec_path: Path = typer.Argument(..., exists=True, dir_okay=False, readable=True, help="Sweep file (YAML)."),
+    gpus_per_trial: int = typer.Option(1, help="Number of GPUs of every trial."),
+    max_workers: Optional[int] = typer.Option(None, help="Max. number of trials at once. (Default: all free GPUs)"),
+    gpu_selection: SelectionStrategyEnum = typer.Option(
+        SelectionStrategyEnum.LOAD_MEMORY_RANDOM.value, help="Strategy for GPU selection."
+    ),
+    min_free_memory: int = typer.Option(0, help="Minimum free memory (MiB) of a GPU to be considered available."),
+    max_load: float = typer.Option(0.5, help="Maximum load (0-1) of a GPU to be considered available."),
+    max_memory_util: float = typer.Option(
+        0.5, help="Maximum memory usage (0-1) of a GPU to be considered available."
+    ),
+    log_dir: Path = typer.Option(None, help="Directory of the trial logs and summary.csv. (Default: sweep-<time>)"),
+    config_path: Path = typer.Option(CONFIG_PATH, help=f"Use this configuration file.(Default: {CONFIG_PATH})"),
+):
+    """
+    Runs a hyperparameter sweep. The command is a template filled with the parameters of every trial,
+    e.g. "python train.py --lr {lr} --seed {trial}". Trials run on all free GPUs at once.
+    """
+    check_memory_request(gpu_selection, min_free_memory)
+    Configurator().load_config(config_path)
+    log_dir = log_dir or Path(f"sweep-{datetime.now():%Y%m%d-%H%M%S}")
+    try:
+        trials = expand_trials(command, load_sweep_spec(spec_path))
+        provider = get_provider(streaming=True)
+        manager = get_manager(gpu_selection, provider)
+        if manager.get_gpu_limit_of_current_user() < gpus_per_trial or len(manager.gpus) < gpus_per_trial:
+            raise ValueError(f"Your requested number of GPUs per trial ({gpus_per_trial}) is not available.")
+
+        typer.echo(f"🧪 Running {len(trials)} trials, logs in {log_dir}")
+        runner = SweepRunner(
+            manager,
+            log_dir,
+            gpus_per_trial=gpus_per_trial,
+            max_workers=max_workers,
+            backoff=Backoff(Configurator().config.polling_rate_in_seconds, MAX_BACKOFF_IN_SECONDS),
+            max_load=max_load,
+            max_memory=max_memory_util,
+            memory_free=min_free_memory,
+        )
+        try:
+            results = runner.run(trials)
+        finally:
+            runner.write_summary()
+            if isinstance(provider, StreamingGPUSampler):
+                provider.close()
+    except (GPUNotFoundException, ValueError) as err:
+        typer.echo(
+            typer.style(
+                f"{err}",
+                fg=typer.colors.WHITE,
+                bg=typer.colors.RED,
+                bold=True,
+                blink=True,
+            )
+        )
+        sys.exit(-1)
+
+    table = Table(show_edge=False)
+    for column in ("Trial", "Parameters", "GPUs", "Return code", "Duration"):
+        table.add_column(column)
+    for result in results:
+        table.add_row(
+            str(result.trial.index),
+            ", ".join(f"{name}={value}" for name, value in result.trial.parameters.items()),
+            ",".join(str(gpu_id) for gpu_id in result.gpus),
+            str(result.return_code),
+            f"{result.duration_in_seconds:.1f}s",
+        )
+    print(table)
+    if any(result.return_code != 0 for result in results):
+        sys.exit(1)
+
+
+@app.command()
+def pipeline(  # pylint: disable=too-many-locals,too-many-positional-arguments
+    pipeline_path: Path = typer.Argument(
+        ..., exists=True, dir_okay=False, readable=True, help="Pipeline file (YAML)."
+    ),
+    gpu_selection: SelectionStrategyEnum = typer.Option(
+        SelectionStrategyEnum.LOAD_MEMORY_RANDOM.value, help="Strategy for GPU selection."
+    ),
+    min_free_memory: int = typer.Option(0, help="Minimum free memory (MiB) of a GPU to be considered available."),
+    max_load: float = typer.Option(0.5, help="Maximum load (0-1) of a GPU to be considered available."),
+    max_memory_util: float = typer.Option(
+        0.5, help="Maximum memory usage (0-1) of a GPU to be considered available."
+    ),
+    log_dir: Path = typer.Option(None, help="Directory of the stage logs. (Default: pipeline-<time>)"),
+    send_mail: bool = typer.Option(False, help="Send one email with a summary after the pipeline ended."),
+    config_path: Path = typer.Option(CONFIG_PATH, help=f"Use this configuration file.(Default: {CONFIG_PATH})"),
+):
+    """
+    Runs the stages of a pipeline file. Every stage starts once the stages it needs succeeded and enough GPUs are
+    free, so independent stages run concurrently.
+    """
+    check_memory_request(gpu_selection, min_free_memory)
+    Configurator().load_config(config_path)
+    log_dir = log_dir or Path(f"pipeline-{datetime.now():%Y%m%d-%H%M%S}")
+    try:
+        stages = load_pipeline(pipeline_path)
+        provider = get_provider(streaming=True)
+        manager = get_manager(gpu_selection, provider)
+        max_gpus = max((stage.gpus for stage in stages.stages.values()), default=0)
+        if manager.get_gpu_limit_of_current_user() < max_gpus or len(manager.gpus) < max_gpus:
+            raise ValueError(f"Your requested number of GPUs per stage ({max_gpus}) is not available.")
+
+        typer.echo(f"🧪 Running {len(stages.stages)} stages, logs in {log_dir}")
+        runner = PipelineRunner(
+            manager,
+            log_dir,
+            backoff=Backoff(Configurator().config.polling_rate_in_seconds, MAX_BACKOFF_IN_SECONDS),
+            max_load=max_load,
+            max_memory=max_memory_util,
+            memory_free=min_free_memory,
+        )
+        try:
+            results = runner.run(stages)
+        finally:
+            if isinstance(provider, StreamingGPUSampler):
+                provider.close()
+    except (GPUNotFoundException, ValueError) as err:
+        typer.echo(
+            typer.style(
+                f"{err}",
+                fg=typer.colors.WHITE,
+                bg=typer.colors.RED,
+                bold=True,
+                blink=True,
+            )
+        )
+        sys.exit(-1)
+
+    return_code, summary = summarize(results)
+    if send_mail or Configurator().config.use_mailer:
+        # One notification for the whole pipeline
+        mailer = MailerCallback(Mailer())
+        for line in summary:
+            mailer.on_log(str(pipeline_path), line)
+        if return_code == 0:
+            mailer.on_success(str(pipeline_path), return_code)
+        else:
+            mailer.on_error(str(pipeline_path), return_code)
+
+    table = Table(show_edge=False)
+    for column in ("Stage", "GPUs", "Return code", "Duration"):
+        table.add_column(column)
+    for result in results:
+        table.add_row(
+            result.name,
+            ",".join(str(gpu_id) for gpu_id in result.gpus),
+            "skipped" if result.return_code is None else str(result.return_code),
+            f"{result.duration_in_seconds:.1f}s",
+        )
+    print(table)
+    if return_code != 0:
+        sys.exit(1)
 
 
 @app.command()
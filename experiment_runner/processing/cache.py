@@ -0,0 +1,351 @@
+"""
+Content-addressed cache of successful runs. A run is keyed on its command, working directory, the contents of its
+declared inputs, the paths of its declared outputs and selected environment variables. On a hit, the declared outputs
+and the log are restored from the store instead of running the command again.
+"""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, TextIO, Union
+
+from pydantic import BaseModel
+
+from experiment_runner.processing.callbacks import STDOUT, Callback
+
+# Private to the user, the outputs of runs may be confidential
+CACHE_DIRECTORY = Path("~/.cache/experiment-runner/results").expanduser()
+MAX_CACHE_SIZE_IN_BYTES = 10 * 1024**3
+HASH_CHUNK_SIZE = 64 * 1024**2  # Bytes hashed per update, keeps the memoryviews of huge files small
+MAX_KNOWN_FILES = 100_000  # Hashes remembered in stats.json, the least recently hashed are dropped first
+
+
+def hash_file(path: Path) -> str:
+    """
+    Returns the SHA-256 of a file. The file is memory-mapped instead of read into buffers.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size > 0:  # Empty files can not be mapped
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                for offset in range(0, size, HASH_CHUNK_SIZE):
+                    digest.update(view[offset : offset + HASH_CHUNK_SIZE])
+    return digest.hexdigest()
+
+
+def expand_files(paths: Iterable[Path]) -> List[Path]:
+    """
+    Returns the given files and all files within the given directories, sorted
+
+    Raises:
+        FileNotFoundError: if a path does not exist
+    """
+    files: Set[Path] = set()
+    for path in paths:
+        if path.is_dir():
+            files.update(child for child in path.rglob("*") if child.is_file())
+        elif path.is_file():
+            files.add(path)
+        else:
+            raise FileNotFoundError(f"{path} does not exist.")
+    return sorted(files)
+
+
+class CachedFile(BaseModel):
+    """
+    DTO representing one output file of a cached run
+    """
+
+    digest: str
+    size: int
+    mode: int
+
+
+class CacheEntry(BaseModel):
+    """
+    DTO representing a cached run
+    """
+
+    key: str
+    command: str
+    outputs: Dict[str, CachedFile] = {}  # By path relative to the working directory (or absolute)
+    log_digest: Optional[str] = None
+    created_at: float
+
+
+class OutputCapture(Callback):
+    """
+    Callback writing the output of a command to a file, e.g. to cache it
+    """
+
+    file: Optional[TextIO] = None
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def on_start(self, command: Union[str, List[str]]) -> None:
+        """
+        Opens (and truncates) the file
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+
+    def on_end(self, command: Union[str, List[str]], returncode: int) -> None:
+        """
+        Closes the file
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def on_log(self, command, log, stream: str = STDOUT) -> None:
+        if self.file is not None:
+            self.file.write(log)
+
+    def on_logs(self, command, logs: List[str], stream: str = STDOUT) -> None:
+        if self.file is not None:
+            self.file.writelines(logs)
+
+
+class ResultCache:
+    """
+    Store of objects (files by SHA-256) and entries (runs by key) in a directory of the user.
+    Entries are evicted least recently used first, once the objects exceed the size limit.
+    """
+
+    def __init__(self, directory: Optional[Path] = None, max_size_in_bytes: int = MAX_CACHE_SIZE_IN_BYTES):
+        """
+        Args:
+            directory: Directory of the store (Default: CACHE_DIRECTORY)
+            max_size_in_bytes: Max. size of all cached files
+        """
+        self.directory: Path = directory or CACHE_DIRECTORY
+        self.max_size_in_bytes = max_size_in_bytes
+        self.objects = self.directory / "objects"
+        self.entries = self.directory / "entries"
+        self.temporary = self.directory / "tmp"
+        self.captures = self.directory / "captures"  # Logs of running commands (see OutputCapture)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        self.directory.mkdir(parents=True, exist_ok=True, mode=0o700)
+        with open(self.directory / "lock", "a", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest[2:]
+
+    def _entry_path(self, key: str) -> Path:
+        return self.entries / f"{key}.json"
+
+    @staticmethod
+    def _touch(path: Path):
+        # The modification time of an entry is its last use. Set explicitly, the file system clock is coarse.
+        now = time.time_ns()
+        os.utime(path, ns=(now, now))
+
+    def digest(self, paths: Iterable[Path]) -> Dict[str, str]:
+        """
+        Returns the SHA-256 of every file (directories are expanded). Files unchanged since they were last hashed
+        (same size, inode and modification times) are not read again.
+        The hashes are remembered in stats.json, which is only rewritten if a file was hashed. Deleted files are dropped
+        then and at most MAX_KNOWN_FILES are kept.
+
+        Raises:
+            FileNotFoundError: if a path does not exist
+        """
+        files = expand_files(paths)
+        with self._locked():
+            stats_path = self.directory / "stats.json"
+            try:
+                known: Dict[str, List] = json.loads(stats_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                known = {}
+
+            digests = {}
+            hashed = False
+            for file in files:
+                absolute = str(file.absolute())
+                stat = file.stat()
+                signature = [stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino, stat.st_dev]
+                cached = known.get(absolute)
+                if cached is not None and cached[:-1] == signature:
+                    digests[str(file)] = cached[-1]
+                    continue
+                digests[str(file)] = hash_file(file)
+                # Re-inserted last, the dict is ordered from the least to the most recently hashed file
+                known.pop(absolute, None)
+                known[absolute] = [*signature, digests[str(file)]]
+                hashed = True
+
+            if hashed:
+                known = {path: cached for path, cached in known.items() if os.path.exists(path)}
+                known = dict(list(known.items())[-MAX_KNOWN_FILES:])
+                temporary = stats_path.with_suffix(f".{uuid.uuid4().hex}")
+                temporary.write_text(json.dumps(known), encoding="utf-8")
+                os.replace(temporary, stats_path)
+        return digests
+
+    def key(
+        self,
+        command: str,
+        inputs: Iterable[Path] = (),
+        env_names: Iterable[str] = (),
+        cwd: Optional[Path] = None,
+        outputs: Iterable[Path] = (),
+    ) -> str:
+        """
+        Returns the cache key of a run
+
+        Args:
+            command: The command
+            inputs: Files and directories the command reads
+            env_names: Environment variables the command depends on
+            cwd: Working directory of the command (Default: the current one)
+            outputs: Files and directories the command writes, restored on a hit
+
+        Raises:
+            FileNotFoundError: if an input does not exist
+        """
+        description = {
+            "command": command,
+            "cwd": str((cwd or Path.cwd()).absolute()),
+            "inputs": self.digest(inputs),
+            "outputs": sorted(str(path) for path in outputs),
+            "env": {name: os.environ.get(name) for name in sorted(env_names)},
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        """
+        Returns the entry of a key (None if it is not cached) and marks it as recently used
+        """
+        with self._locked():
+            path = self._entry_path(key)
+            try:
+                entry = CacheEntry.model_validate_json(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                return None
+            if not all(self._object_path(file.digest).exists() for file in entry.outputs.values()):
+                path.unlink(missing_ok=True)
+                return None
+            self._touch(path)
+        return entry
+
+    def _add_object(self, source: Path, digest: str):
+        target = self._object_path(digest)
+        if target.exists():
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        self.temporary.mkdir(parents=True, exist_ok=True)
+        temporary = self.temporary / uuid.uuid4().hex
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, target)
+
+    def store(
+        self, key: str, command: str, outputs: Iterable[Path] = (), log_path: Optional[Path] = None
+    ) -> CacheEntry:
+        """
+        Caches the outputs and the log of a successful run, then evicts old entries if the store is too large
+
+        Raises:
+            FileNotFoundError: if an output does not exist
+        """
+        files = expand_files(outputs)
+        digests = self.digest(files)
+        with self._locked():
+            cached_files = {}
+            for file in files:
+                digest = digests[str(file)]
+                self._add_object(file, digest)
+                stat = file.stat()
+                cached_files[str(file)] = CachedFile(digest=digest, size=stat.st_size, mode=stat.st_mode & 0o777)
+
+            log_digest = None
+            if log_path is not None:
+                log_digest = hash_file(log_path)
+                self._add_object(log_path, log_digest)
+
+            entry = CacheEntry(
+                key=key, command=command, outputs=cached_files, log_digest=log_digest, created_at=time.time()
+            )
+            self.entries.mkdir(parents=True, exist_ok=True)
+            self._entry_path(key).write_text(entry.model_dump_json(), encoding="utf-8")
+            self._touch(self._entry_path(key))
+            self._evict()
+        return entry
+
+    def restore(self, entry: CacheEntry) -> Optional[str]:
+        """
+        Copies the cached outputs of an entry to their paths. The store stays locked, so the objects are not evicted
+        meanwhile.
+
+        Returns:
+            The captured log of the run, None if the entry was evicted since its lookup (nothing is restored then)
+        """
+        with self._locked():
+            if not all(self._object_path(file.digest).exists() for file in entry.outputs.values()):
+                return None
+            for name, file in entry.outputs.items():
+                target = Path(name)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                temporary = target.with_name(f".{target.name}.{uuid.uuid4().hex}")
+                shutil.copyfile(self._object_path(file.digest), temporary)
+                os.chmod(temporary, file.mode)
+                os.replace(temporary, target)
+            if entry.log_digest is None:
+                return ""
+            try:
+                return self._object_path(entry.log_digest).read_text(encoding="utf-8")
+            except OSError:
+                return ""
+
+    def _evict(self):
+        # Called with the store locked
+        entries = []
+        for path in self.entries.glob("*.json"):
+            try:
+                entries.append((path.stat().st_mtime_ns, path, CacheEntry.model_validate_json(path.read_text())))
+            except (OSError, ValueError):
+                path.unlink(missing_ok=True)
+        entries.sort(key=lambda item: item[0])
+
+        # Objects may be shared by several entries, they are freed with the last one
+        sizes: Dict[str, int] = {}
+        references: Dict[str, int] = defaultdict(int)
+        digests_of_entries = []
+        for _, _, entry in entries:
+            digests = {file.digest: file.size for file in entry.outputs.values()}
+            if entry.log_digest is not None:
+                log = self._object_path(entry.log_digest)
+                digests[entry.log_digest] = log.stat().st_size if log.exists() else 0
+            for digest, size in digests.items():
+                sizes[digest] = size
+                references[digest] += 1
+            digests_of_entries.append(digests)
+        total = sum(sizes.values())
+
+        evicted = 0
+        while evicted < len(entries) and total > self.max_size_in_bytes:
+            entries[evicted][1].unlink(missing_ok=True)
+            for digest in digests_of_entries[evicted]:
+                references[digest] -= 1
+                if references[digest] == 0:
+                    total -= sizes.pop(digest)
+            evicted += 1
+
+        # Objects of evicted entries (and of interrupted stores)
+        for path in self.objects.glob("*/*"):
+            if path.parent.name + path.name not in sizes:
+                path.unlink(missing_ok=True)
+        shutil.rmtree(self.temporary, ignore_errors=True)
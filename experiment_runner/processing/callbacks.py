@@ -2,19 +2,47 @@
 This module defines usable callbacks
 """
 
+import inspect
 import socket
 import sys
 from abc import ABC, abstractmethod
 from collections import deque
 from datetime import datetime
 from pathlib import Path
-from typing import Deque, List, Optional, TextIO, Union
+from typing import Callable, Deque, List, Optional, TextIO, Union
 
 from rich import print  # pylint: disable=redefined-builtin
 
 from experiment_runner.processing.configurator import Configurator
 from experiment_runner.processing.mail import Mailer
 
+# Names of the output streams of a command, passed to the callbacks with every line
+STDOUT = "stdout"
+STDERR = "stderr"
+
+
+def _accepts_stream(on_log: Callable) -> bool:
+    try:
+        parameters = list(inspect.signature(on_log).parameters.values())
+    except (TypeError, ValueError):
+        return True
+    if any(parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD) for parameter in parameters):
+        return True
+    return len(parameters) >= 3
+
+
+def call_on_log(on_log: Callable, command, logs: List[str], stream: str) -> None:
+    """
+    Passes every line of logs to on_log. The stream is left out for on_log methods written before streams were
+    separated (on_log(self, command, log)), so they keep working.
+    """
+    if _accepts_stream(on_log):
+        for log in logs:
+            on_log(command, log, stream)
+    else:
+        for log in logs:
+            on_log(command, log)
+
 
 class Callback(ABC):
     """
@@ -35,12 +63,18 @@ class Callback(ABC):
         """
         raise NotImplementedError()
 
-    def on_log(self, command, log) -> None:
+    def on_log(self, command, log, stream: str = STDOUT) -> None:
         """
-        Handle a new logline in stdout
+        Handle a new logline of stream (STDOUT or STDERR)
         """
         raise NotImplementedError()
 
+    def on_logs(self, command, logs: List[str], stream: str = STDOUT) -> None:
+        """
+        Handle a batch of new loglines of stream (everything read at once). Defaults to on_log for every line.
+        """
+        call_on_log(self.on_log, command, logs, stream)
+
     def on_error(self, command: Union[str, List[str]], returncode: int) -> None:
         """
         Called when the command ends with an error. Defaults to on_end.
@@ -106,9 +140,12 @@ class MailerCallback(Callback):
             self.logging_path,
         )
 
-    def on_log(self, command, log) -> None:
+    def on_log(self, command, log, stream: str = STDOUT) -> None:
         self.log.append(log)
 
+    def on_logs(self, command, logs: List[str], stream: str = STDOUT) -> None:
+        self.log.extend(logs)
+
     def on_success(self, command: Union[str, List[str]], returncode: int) -> None:
         """
         Sends an E-Mail on experiment success.
@@ -178,7 +215,7 @@ class LoggerCallback(Callback):
         Nothing to do here
         """
 
-    def on_log(self, command: Union[str, List[str]], log: str) -> None:
+    def on_log(self, command: Union[str, List[str]], log: str, stream: str = STDOUT) -> None:
         """
         Log everything from stdout and stderr to log or write log to file if log reached maxlen
         """
@@ -190,6 +227,16 @@ class LoggerCallback(Callback):
         # Write in log queue
         self.log_queue.append(log)
 
+    def on_logs(self, command: Union[str, List[str]], logs: List[str], stream: str = STDOUT) -> None:
+        """
+        Same as on_log for a batch of lines, written with one call once the buffer is full
+        """
+        if not self.log_queue.maxlen or len(self.log_queue) + len(logs) > self.log_queue.maxlen:
+            self.write_to_file([*self.log_queue, *logs])
+            self.log_queue.clear()
+        else:
+            self.log_queue.extend(logs)
+
     def on_success(self, command: Union[str, List[str]], returncode: int) -> None:
         """
         Nothing to do here
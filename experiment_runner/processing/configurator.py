@@ -12,6 +12,12 @@ from rich import print  # pylint: disable=redefined-builtin
 from rich.prompt import Confirm, IntPrompt, Prompt
 from rich.syntax import Syntax
 
+from experiment_runner.processing.gpu.limits import (
+    MAX_GPUS_PER_OTHER,
+    MAX_GPUS_PER_STAFF,
+    STAFF_GROUP_NAME,
+)
+
 CONFIG_PATH = Path("~/.config/experiment-runner/config.yml").expanduser()
 
 
@@ -44,6 +50,13 @@ class ConfigurationFile:
 
     # Runner Config
     polling_rate_in_seconds: int = 1
+    gpu_provider: str = "auto"  # auto, broker, nvml, nvidia-smi or nvidia-smi-xml
+    cache_size_in_mb: int = 10240  # Max. size of the result cache (run --cache)
+
+    # GPU limits
+    staff_group_name: str = STAFF_GROUP_NAME
+    max_gpus_per_staff: int = MAX_GPUS_PER_STAFF
+    max_gpus_per_other: int = MAX_GPUS_PER_OTHER
 
     # Logger Config
     logging_buffer_size: int = 10
@@ -189,5 +202,10 @@ class Configurator(metaclass=ConfiguratorMeta):
             f"Password: {self.config.password}\n",
             "------- Other Configurations -------\n",
             f"Polling_rate_in_seconds: {self.config.polling_rate_in_seconds}\n",
+            f"GPU_provider: {self.config.gpu_provider}\n",
+            f"Cache_size_in_mb: {self.config.cache_size_in_mb}\n",
+            f"Staff_group_name: {self.config.staff_group_name}\n",
+            f"Max_gpus_per_staff: {self.config.max_gpus_per_staff}\n",
+            f"Max_gpus_per_other: {self.config.max_gpus_per_other}\n",
             f"Logging_buffer_size: {self.config.logging_buffer_size}\n",
         )
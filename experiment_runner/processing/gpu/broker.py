@@ -0,0 +1,175 @@
+"""
+Local GPU broker: samples the GPUs once per interval and serves the samples to all local clients
+"""
+
+import logging
+import os
+import socket
+import socketserver
+import threading
+from pathlib import Path
+from typing import Optional
+
+from experiment_runner.processing.gpu.history import GPUUtilizationHistory
+from experiment_runner.processing.gpu.providers import (
+    BROKER_REQUEST,
+    BROKER_SOCKET_PATH,
+    GPUProvider,
+    encode_error,
+    encode_sample,
+    is_secure_directory,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BrokerAlreadyRunningException(Exception):
+    """
+    Another broker is already listening on the socket
+    """
+
+
+class InsecureSocketDirectoryException(Exception):
+    """
+    Other users could replace the socket of the broker
+    """
+
+
+class _SampleRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answers every request line with the latest encoded sample
+    """
+
+    server: "_BrokerServer"
+
+    def handle(self):
+        for line in self.rfile:
+            if line != BROKER_REQUEST:
+                self.wfile.write(encode_error(f"Unknown request {line!r}"))
+                return
+            self.wfile.write(self.server.broker.payload)
+
+
+class _BrokerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, broker: "GPUBroker"):
+        self.broker = broker
+        super().__init__(str(socket_path), _SampleRequestHandler)
+
+
+class GPUBroker:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Samples the GPUs with a single provider and shares the result over a Unix domain socket.
+    The load on the GPUs stays constant no matter how many clients query the broker.
+    """
+
+    def __init__(
+        self,
+        provider: GPUProvider,
+        socket_path: Path = BROKER_SOCKET_PATH,
+        interval_in_seconds: float = 1.0,
+        history: Optional[GPUUtilizationHistory] = None,
+    ):
+        """
+        Args:
+            provider: Provider used for sampling. Should not fork per sample (e.g. NVML or the streaming sampler).
+            socket_path: Socket to listen on
+            interval_in_seconds: Time between two samples
+            history: Every sample is added to this utilization history (Default: no history)
+        """
+        self.provider = provider
+        self.history = history
+        self.socket_path = socket_path
+        self.interval_in_seconds = interval_in_seconds
+        self.payload: bytes = encode_error("No sample yet.")
+
+        self._stopped = threading.Event()
+        self._server: Optional[_BrokerServer] = None
+        self._sampler: Optional[threading.Thread] = None
+
+    def update(self):
+        """
+        Takes a new sample and publishes it to all following requests
+        """
+        try:
+            gpus, processes = self.provider.sample_records()
+            self.payload = encode_sample(gpus, processes, interval_in_seconds=self.interval_in_seconds)
+            if self.history is not None:
+                self.history.append(gpus)
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            # Keeps the sampler alive, but never serves the previous sample as current
+            logger.exception("Sampling the GPUs failed")
+            self.payload = encode_error(str(err) or type(err).__name__)
+
+    def _sample_loop(self):
+        while not self._stopped.wait(self.interval_in_seconds):
+            self.update()
+
+    def _remove_stale_socket(self):
+        if not self.socket_path.exists():
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(str(self.socket_path))
+            except OSError:
+                self.socket_path.unlink()
+                return
+        raise BrokerAlreadyRunningException(f"A GPU broker is already listening on {self.socket_path}.")
+
+    def start(self):
+        """
+        Binds the socket and starts sampling in the background
+
+        Raises:
+            BrokerAlreadyRunningException: if another broker serves the socket
+            InsecureSocketDirectoryException: if the directory of the socket belongs to another user or is writable
+                                              by others
+        """
+        self.socket_path.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+        if not is_secure_directory(self.socket_path.parent, [os.getuid(), 0]):
+            raise InsecureSocketDirectoryException(
+                f"{self.socket_path.parent} must belong to you (or root) and must not be writable by others."
+            )
+        self._remove_stale_socket()
+
+        self.update()
+        self._server = _BrokerServer(self.socket_path, self)
+        # Every local user may ask for samples
+        os.chmod(self.socket_path, 0o666)
+
+        self._stopped.clear()
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+        self._sampler.start()
+
+    def serve_forever(self):
+        """
+        Starts the broker and blocks until shutdown() is called
+        """
+        if self._server is None:
+            self.start()
+        try:
+            self._server.serve_forever()  # type: ignore
+        finally:
+            self.close()
+
+    def shutdown(self):
+        """
+        Stops serve_forever (thread-safe)
+        """
+        if self._server is not None:
+            self._server.shutdown()
+
+    def close(self):
+        """
+        Stops sampling and removes the socket
+        """
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        if self._server is not None:
+            self._server.server_close()
+            self._server = None
+            self.socket_path.unlink(missing_ok=True)
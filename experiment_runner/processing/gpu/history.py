@@ -0,0 +1,279 @@
+"""
+Host-wide utilization history of all GPUs, kept as fixed-size ring buffers in a memory-mapped .npy file.
+Only the GPU broker appends to the shared file (mode 0644), so strategies can look at more than the last sample without
+trusting the samples of other users.
+"""
+
+import fcntl
+import math
+import os
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.processing.gpu.providers import (
+    BROKER_SOCKET_PATH,
+    is_trusted_broker,
+)
+from experiment_runner.processing.gpu.records import GPURecord
+
+HISTORY_PATH = BROKER_SOCKET_PATH.parent / "history.npy"  # In the directory of the broker, the only writer
+HISTORY_LENGTH = 512  # Samples per GPU
+MAX_GPUS = 32  # GPUs tracked at once, the least recently sampled GPU is replaced by new ones
+MIN_SAMPLE_INTERVAL_IN_SECONDS = 1.0  # Samples of a GPU arriving faster (e.g. from several processes) are dropped
+UUID_LENGTH = 64
+
+
+def history_dtype(length: int = HISTORY_LENGTH) -> np.dtype:
+    """
+    Returns the record type of one GPU in the history file.
+    The file holds MAX_GPUS of these records, so its size only depends on the length.
+    """
+    return np.dtype(
+        [
+            ("uuid", f"S{UUID_LENGTH}"),
+            ("head", "<i8"),  # Index of the next sample to write
+            ("timestamp", "<f8", (length,)),  # 0: no sample
+            ("load", "<f4", (length,)),
+            ("memory_util", "<f4", (length,)),
+        ]
+    )
+
+
+class GPUUtilizationHistory:
+    # pylint: disable=unsubscriptable-object,unsupported-assignment-operation
+    """
+    Ring buffers of load and memory usage per GPU (by uuid) shared by all processes of the host.
+    Writes are guarded by an exclusive fcntl lock, reads by a shared one.
+    Read-only histories never create or change the file and ignore files of untrusted users (see is_trusted_broker).
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        length: int = HISTORY_LENGTH,
+        max_gpus: int = MAX_GPUS,
+        min_sample_interval_in_seconds: float = MIN_SAMPLE_INTERVAL_IN_SECONDS,
+        read_only: bool = False,
+    ):
+        """
+        Args:
+            path: History file, shared by all users of the host (Default: HISTORY_PATH)
+            length: Samples kept per GPU
+            max_gpus: GPUs kept at once
+            min_sample_interval_in_seconds: Min. time between two samples of a GPU
+            read_only: Only read the samples of the owner of the file (e.g. the broker)
+        """
+        self.path: Path = path or HISTORY_PATH
+        self.length = length
+        self.max_gpus = max_gpus
+        self.min_sample_interval_in_seconds = min_sample_interval_in_seconds
+        self.read_only = read_only
+        self._buffers: Optional[np.memmap] = None
+
+    @property
+    def size_in_bytes(self) -> int:
+        """
+        Returns the size of the history file (without the .npy header)
+        """
+        return self.max_gpus * history_dtype(self.length).itemsize
+
+    def _open_buffers(self) -> np.memmap:
+        # Called with the file locked
+        if self.path.stat().st_size > 0:
+            try:
+                buffers = np.lib.format.open_memmap(self.path, mode="r+")
+                if buffers.dtype == history_dtype(self.length) and buffers.shape == (self.max_gpus,):
+                    return buffers
+            except ValueError:
+                pass
+        # New, damaged or created with another layout
+        buffers = np.lib.format.open_memmap(
+            self.path, mode="w+", dtype=history_dtype(self.length), shape=(self.max_gpus,)
+        )
+        buffers.flush()
+        return buffers
+
+    @contextmanager
+    def _locked(self, exclusive: bool = False) -> Iterator[np.memmap]:
+        if self.read_only:
+            raise PermissionError(f"History {self.path} is read-only")
+        self.path.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+        # Others may read but not write the samples
+        descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX)
+            buffers = self._buffers
+            if buffers is None or self.path.stat().st_size == 0:
+                buffers = self._buffers = self._open_buffers()
+            if not exclusive:
+                # Readers may share the lock once the file is valid
+                fcntl.flock(descriptor, fcntl.LOCK_SH)
+            yield buffers
+            if exclusive:
+                buffers.flush()
+        finally:
+            os.close(descriptor)  # Releases the lock
+
+    @contextmanager
+    def _shared(self) -> Iterator[Optional[np.memmap]]:
+        """
+        Locks the file for reading. Yields None if there is no trusted and valid history file (yet).
+        """
+        if not self.read_only:
+            with self._locked() as buffers:
+                yield buffers
+            return
+        try:
+            descriptor = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            yield None
+            return
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_SH)
+            shared: Optional[np.memmap] = None
+            if is_trusted_broker(os.fstat(descriptor).st_uid, self.path):
+                try:
+                    shared = np.lib.format.open_memmap(self.path, mode="r")
+                except ValueError:
+                    pass  # Damaged, the writer recreates it
+            if shared is not None and (
+                shared.dtype != history_dtype(self.length) or shared.shape != (self.max_gpus,)
+            ):
+                shared = None
+            yield shared
+        finally:
+            os.close(descriptor)  # Releases the lock
+
+    def append(self, gpus: Iterable[Union[GPU, GPURecord]], timestamp: Optional[float] = None):
+        """
+        Adds one sample of every GPU (GPU models or records)
+
+        Args:
+            gpus: GPUs sampled at the same time
+            timestamp: Time of sampling (Default: now)
+
+        Raises:
+            PermissionError: if the history is read-only
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._locked(exclusive=True) as buffers:
+            slots = {uuid: slot for slot, uuid in enumerate(buffers["uuid"]) if uuid}
+            for gpu in gpus:
+                uuid = gpu.uuid.encode()[:UUID_LENGTH]
+                slot = slots.get(uuid)
+                if slot is None:
+                    slot = self._free_slot(buffers)
+                    buffers[slot] = np.zeros((), dtype=buffers.dtype)
+                    buffers["uuid"][slot] = uuid
+                    slots = {key: value for key, value in slots.items() if value != slot}
+                    slots[uuid] = slot
+
+                head = int(buffers["head"][slot])
+                latest = buffers["timestamp"][slot, (head - 1) % self.length]
+                if latest and timestamp - latest < self.min_sample_interval_in_seconds:
+                    continue
+                buffers["timestamp"][slot, head] = timestamp
+                buffers["load"][slot, head] = gpu.load
+                buffers["memory_util"][slot, head] = (
+                    gpu.memory_used / gpu.memory_total if gpu.memory_total else math.nan
+                )
+                buffers["head"][slot] = (head + 1) % self.length
+
+    @staticmethod
+    def _free_slot(buffers: np.memmap) -> int:
+        free = np.flatnonzero(buffers["uuid"] == b"")
+        if len(free):
+            return int(free[0])
+        return int(np.argmin(buffers["timestamp"].max(axis=1)))
+
+    def window(
+        self, uuids: Sequence[str], window_in_seconds: Optional[float] = None, now: Optional[float] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the samples of the given GPUs as matrices with one row per GPU (unsorted within a row)
+
+        Args:
+            uuids: GPUs to read
+            window_in_seconds: Only samples this young are valid (Default: all samples)
+            now: End of the window (Default: now)
+
+        Returns:
+            Timestamps, loads and a mask of the valid samples. Unknown GPUs have no valid samples.
+        """
+        now = time.time() if now is None else now
+        with self._shared() as buffers:
+            if buffers is None:
+                timestamps = np.zeros((len(uuids), self.length))
+                loads = np.full((len(uuids), self.length), np.nan)
+            else:
+                slots = {uuid: slot for slot, uuid in enumerate(buffers["uuid"]) if uuid}
+                rows = np.array([slots.get(uuid.encode()[:UUID_LENGTH], -1) for uuid in uuids], dtype=np.intp)
+                known = rows >= 0
+                timestamps = np.where(known[:, None], buffers["timestamp"][rows], 0.0)
+                loads = buffers["load"][rows].astype(np.float64)
+
+        valid = (timestamps > 0) & (timestamps <= now) & ~np.isnan(loads)
+        if window_in_seconds is not None:
+            valid &= timestamps >= now - window_in_seconds
+        return timestamps, loads, valid
+
+    def ewma(self, uuids: Sequence[str], half_life_in_seconds: float, now: Optional[float] = None) -> np.ndarray:
+        """
+        Returns the exponentially weighted mean load of every GPU. A sample loses half of its weight every
+        half_life_in_seconds, so irregular sampling intervals are weighted correctly.
+
+        Returns:
+            One value per GPU, NaN for GPUs without samples
+        """
+        now = time.time() if now is None else now
+        timestamps, loads, valid = self.window(uuids, now=now)
+        weights = np.where(valid, np.exp2(-(now - timestamps) / half_life_in_seconds), 0.0)
+        total = weights.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(total > 0, (weights * np.where(valid, loads, 0.0)).sum(axis=1) / total, np.nan)
+
+    def percentile(
+        self, uuids: Sequence[str], percent: float, window_in_seconds: float, now: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        Returns the given percentile (nearest rank) of the load of every GPU within the window
+
+        Returns:
+            One value per GPU, NaN for GPUs without samples in the window
+        """
+        _, loads, valid = self.window(uuids, window_in_seconds, now)
+        # Invalid samples are sorted last
+        ordered = np.sort(np.where(valid, loads, np.inf), axis=1)
+        counts = valid.sum(axis=1)
+        ranks = np.clip(np.ceil(percent / 100 * counts).astype(np.intp) - 1, 0, self.length - 1)
+        values = np.take_along_axis(ordered, ranks[:, None], axis=1)[:, 0]
+        return np.where(counts > 0, values, np.nan)
+
+    def idle_seconds(self, uuids: Sequence[str], max_load: float, now: Optional[float] = None) -> np.ndarray:
+        """
+        Returns for how long the load of every GPU stayed at or below max_load. GPUs that were never busy count as
+        idle since their oldest sample.
+
+        Returns:
+            One value per GPU, 0 for GPUs without samples
+        """
+        now = time.time() if now is None else now
+        timestamps, loads, valid = self.window(uuids, now=now)
+        last_busy = np.max(np.where(valid & (loads > max_load), timestamps, -np.inf), axis=1, initial=-np.inf)
+        oldest = np.min(np.where(valid, timestamps, np.inf), axis=1, initial=np.inf)
+        since = np.where(np.isfinite(last_busy), last_busy, np.where(np.isfinite(oldest), oldest, now))
+        return now - since
+
+
+@lru_cache(maxsize=None)
+def get_history() -> GPUUtilizationHistory:
+    """
+    Returns the history the GPU broker of this host records (read-only, see 'experiment broker')
+    """
+    return GPUUtilizationHistory(read_only=True)
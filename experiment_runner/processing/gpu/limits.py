@@ -0,0 +1,7 @@
+"""
+Default GPU limits of the user groups, configurable in the ConfigurationFile
+"""
+
+STAFF_GROUP_NAME: str = "mitarbeiter"  # This group is for more privileged users
+MAX_GPUS_PER_STAFF: int = 10  # This defines the max GPUs for the privileged user
+MAX_GPUS_PER_OTHER: int = 1  # This defines the max GPUs for all other users (e.g. students)
@@ -2,24 +2,48 @@
 Contains managers to handle GPU (and later CPU and TPU?)
 """
 
-import grp
-import pwd
-from typing import List, Set, Tuple
+import os
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
 
+import numpy as np
 import psutil
 
-from experiment_runner.processing.gpu.models import GPU
-from experiment_runner.processing.gpu.providers import GPUProvider, NvidiaGPUProvider
+from experiment_runner.processing.gpu.history import GPUUtilizationHistory
+from experiment_runner.processing.gpu.limits import (
+    MAX_GPUS_PER_OTHER,
+    MAX_GPUS_PER_STAFF,
+    STAFF_GROUP_NAME,
+)
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.providers import (
+    GPUProvider,
+    GPUProviderEnum,
+    GPUProviderFactory,
+)
+from experiment_runner.processing.gpu.rendering import OutputFormat, render_utilization
+from experiment_runner.processing.gpu.reservations import GPUClaim, GPUReservationLedger
+from experiment_runner.processing.gpu.snapshot import GPUSnapshot
 from experiment_runner.processing.gpu.strategies import (
     SelectionStrategy,
     SelectionStrategyEnum,
     SelectionStrategyFactory,
+    get_group_selection,
+    get_load_estimate,
+    get_table_strategy,
+    requires_memory_request,
 )
-from experiment_runner.utils import get_user_for_pid
+from experiment_runner.utils import get_current_username, get_group_names_of_user
+
+# Share of the memory of a GPU kept free when packing jobs, since the declared memory is only an estimate
+PACKING_MEMORY_MARGIN: float = 0.1
+
 
-STAFF_GROUP_NAME: str = "mitarbeiter"  # This group is for more privileged users
-MAX_GPUS_PER_STAFF: int = 10  # This defines the max GPUs for the privileged user
-MAX_GPUS_PER_OTHER: int = 1  # This defines the max GPUs for all other users (e.g. students)
+def _process_tree(pid: int) -> Set[int]:
+    try:
+        return {pid, *(child.pid for child in psutil.Process(pid).children(recursive=True))}
+    except psutil.Error:
+        return {pid}
 
 
 class GPUManager:
@@ -30,10 +54,32 @@ class GPUManager:
     def __init__(
         self,
         selection_strategy: SelectionStrategy = SelectionStrategyFactory.get_instance(SelectionStrategyEnum.FIRST),
-        provider: GPUProvider = NvidiaGPUProvider(),
+        provider: Optional[GPUProvider] = None,
+        staff_group_name: str = STAFF_GROUP_NAME,
+        max_gpus_per_staff: int = MAX_GPUS_PER_STAFF,
+        max_gpus_per_other: int = MAX_GPUS_PER_OTHER,
+        *,
+        ledger: Optional[GPUReservationLedger] = None,
+        history: Optional[GPUUtilizationHistory] = None,
     ):
-        self.gpu_provider: GPUProvider = provider
+        """
+        Args:
+            selection_strategy: Strategy to order available GPUs
+            provider: Source of GPU information. Uses NVML if possible and nvidia-smi otherwise (Default).
+            staff_group_name: Members of this group may use max_gpus_per_staff GPUs
+            max_gpus_per_staff: Max. GPUs for members of staff_group_name
+            max_gpus_per_other: Max. GPUs for all other users
+            ledger: Host-wide GPU reservations. Claimed GPUs are considered busy. (Default: no reservations)
+            history: Utilization history the strategies based on the history judge the GPUs by. Every snapshot is
+                added to it unless it is read-only, like the history of the broker. (Default: no history)
+        """
+        self.gpu_provider: GPUProvider = provider or GPUProviderFactory.get_instance(GPUProviderEnum.AUTO)
         self.strategy = selection_strategy
+        self.staff_group_name = staff_group_name
+        self.max_gpus_per_staff = max_gpus_per_staff
+        self.max_gpus_per_other = max_gpus_per_other
+        self.ledger = ledger
+        self.history = history
 
     @property
     def gpus(self) -> List[GPU]:
@@ -42,6 +88,17 @@ class GPUManager:
         """
         return self.gpu_provider.gpus
 
+    def snapshot(self) -> GPUSnapshot:
+        """
+        Samples all GPUs and compute processes once.
+        Pass the result to the other queries to base a whole decision on a single point in time.
+        """
+        gpus, processes = self.gpu_provider.sample()
+        snapshot = GPUSnapshot(gpus, processes)
+        if self.history is not None and not self.history.read_only:
+            self.history.append(gpus, snapshot.timestamp)
+        return snapshot
+
     @property
     def active_users(self) -> Set[str]:
         """
@@ -49,17 +106,14 @@ class GPUManager:
         Returns:
             Set of users active on one or more GPUs
         """
-        processes = self.gpu_provider.get_compute_processes()
-        users = {get_user_for_pid(process.pid) for process in processes}
-        return {user for user in users if user is not None}
+        return set(self.snapshot().users)
 
     @property
     def username(self) -> str:
         """
         Gets the name of the current user
         """
-        name: str = psutil.Process().username()
-        return name
+        return get_current_username()
 
     def __getitem__(self, uuid: str) -> GPU:
         """
@@ -68,7 +122,6 @@ class GPUManager:
         Args:
             uuid (str): uuid of the wanted GPU
         """
-
         for gpu in self.gpus:
             if gpu.uuid == uuid:
                 return gpu
@@ -78,117 +131,295 @@ class GPUManager:
         """
         Returns a list of all groups of the current user
         """
-        groups = [g.gr_name for g in grp.getgrall() if self.username in g.gr_mem]
-        gid = pwd.getpwnam(self.username).pw_gid
-        groups.append(grp.getgrgid(gid).gr_name)
-        return groups
+        return sorted(get_group_names_of_user(self.username))
 
-    def get_gpus_of_current_user(self):
+    def get_gpus_of_current_user(self, snapshot: Optional[GPUSnapshot] = None) -> Set[GPU]:
         """
         Returns a list of all GPUs currently in use by the active user
         """
-        return self.get_gpus_of_user(self.username)
+        return self.get_gpus_of_user(self.username, snapshot)
 
-    def get_gpu_processes_of_user(self, username: str):
+    def get_gpu_processes_of_user(self, username: str, snapshot: Optional[GPUSnapshot] = None) -> List[GPUProcess]:
         """
         Returns a List of all active gpu processes of the given user
         Args:
             username: user to get the gpu processes for
+            snapshot: sample to query (Default: a fresh one)
 
         Returns:
             List of GPU processes for user
         """
-        return [
-            gpu_process
-            for gpu_process in self.gpu_provider.get_compute_processes()
-            if get_user_for_pid(gpu_process.pid) == username
-        ]
+        if snapshot is None:
+            snapshot = self.snapshot()
+        return snapshot.get_processes_of_user(username)
 
-    def get_gpus_of_user(self, username: str) -> Set[GPU]:
+    def get_gpus_of_user(self, username: str, snapshot: Optional[GPUSnapshot] = None) -> Set[GPU]:
         """
         Returns a list of all GPUs currently in use by the given user
         """
-
-        gpus_used_by_current_user = {
-            self[gpu_process.gpu_uuid] for gpu_process in self.get_gpu_processes_of_user(username)
-        }
-
-        return {gpu for gpu in gpus_used_by_current_user if gpu is not None}
+        if snapshot is None:
+            snapshot = self.snapshot()
+        return snapshot.get_gpus_of_user(username)
 
     def get_gpu_limit_of_current_user(self) -> int:
         """
         Return the total number of gpus the current user is allowed to use
         """
-        return MAX_GPUS_PER_STAFF if STAFF_GROUP_NAME in self.get_groups_of_current_user() else MAX_GPUS_PER_STAFF
+        return self.get_gpu_limit_of_user(self.username)
+
+    def get_gpu_limit_of_user(self, username: str) -> int:
+        """
+        Return the total number of gpus the given user is allowed to use (the limit of others for unknown users)
+        """
+        try:
+            groups = get_group_names_of_user(username)
+        except KeyError:
+            return self.max_gpus_per_other
+        if self.staff_group_name in groups:
+            return self.max_gpus_per_staff
+        return self.max_gpus_per_other
+
+    def get_remaining_gpus_of_user(
+        self, username: str, snapshot: Optional[GPUSnapshot] = None, claims: Optional[List[GPUClaim]] = None
+    ) -> int:
+        """
+        Returns the number of GPUs the user may still start jobs on: their limit minus the GPUs they use or claimed
+
+        Args:
+            claims: Active GPU reservations (Default: read from the ledger, if any)
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        if claims is None:
+            claims = self.ledger.claims() if self.ledger else []
+        used = {gpu.uuid for gpu in self.get_gpus_of_user(username, snapshot)}
+        used.update(claim.gpu_uuid for claim in claims if claim.user == username)
+        limit = (
+            self.get_gpu_limit_of_current_user()
+            if username == self.username
+            else self.get_gpu_limit_of_user(username)
+        )
+        return max(limit - len(used), 0)
+
+    @staticmethod
+    def get_committed_memory(snapshot: GPUSnapshot, claims: List[GPUClaim]) -> np.ndarray:
+        """
+        Returns the memory (MiB) of every GPU that is used or promised to packed jobs: the observed memory plus
+        the part of the declared memory the packed jobs did not allocate yet. Processes of a packed job
+        (the claiming process and its children) are matched by pid. Unmatched jobs count with their full
+        declaration, e.g. if nvidia-smi reports the pids of another namespace.
+
+        Returns:
+            One value per row of snapshot.table
+        """
+        declared: Dict[Tuple[str, Optional[int]], int] = defaultdict(int)
+        for claim in claims:
+            if claim.memory is not None:
+                declared[(claim.gpu_uuid, claim.pid)] += claim.memory
+
+        pending: Dict[str, float] = defaultdict(float)
+        for (uuid, pid), memory in declared.items():
+            observed = 0
+            if pid is not None:
+                pids = _process_tree(pid)
+                observed = sum(
+                    process.used_memory or 0
+                    for process in snapshot.processes
+                    if process.gpu_uuid == uuid and process.pid in pids
+                )
+            pending[uuid] += max(memory - observed, 0)
+
+        table = snapshot.table
+        return table.memory_used + np.fromiter(
+            (pending.get(gpu.uuid, 0.0) for gpu in table.rows), dtype=np.float64, count=len(table)
+        )
 
-    def get_available(
+    def _get_available_mask(
+        self,
+        snapshot: GPUSnapshot,
+        claims: List[GPUClaim],
+        *,
+        max_load: float,
+        max_memory: float,
+        memory_free: float,
+        job_memory: Optional[int],
+        committed: Optional[np.ndarray],
+        excluded: FrozenSet[str],
+    ) -> np.ndarray:
+        table = snapshot.table
+        if job_memory is None or committed is None:
+            claimed = {claim.gpu_uuid for claim in claims}
+            # Strategies based on the utilization history judge the load over time, not by a single sample
+            mask = table.is_available(
+                max_load=max_load,
+                max_memory=max_memory,
+                memory_free=memory_free,
+                load=get_load_estimate(self.strategy)(table, self.history),
+            )
+        else:
+            # Packed jobs only avoid GPUs claimed as a whole
+            claimed = {claim.gpu_uuid for claim in claims if claim.memory is None}
+            budget = table.memory_total * (1 - PACKING_MEMORY_MARGIN)
+            mask = (committed + job_memory <= budget) & (table.memory_free >= memory_free)
+        claimed |= excluded
+        if claimed:
+            mask &= np.fromiter((gpu.uuid not in claimed for gpu in table.rows), dtype=bool, count=len(table))
+        return mask
+
+    @staticmethod
+    def _limit_packed(gpus: List[GPU], gpus_of_current_user: Set[str], remaining: int) -> List[GPU]:
+        # Packing onto GPUs the user already uses does not count towards the limit again
+        new_gpus = [gpu for gpu in gpus if gpu.uuid not in gpus_of_current_user]
+        allowed = {gpu.uuid for gpu in new_gpus[: max(remaining, 0)]} | gpus_of_current_user
+        return [gpu for gpu in gpus if gpu.uuid in allowed]
+
+    def get_available(  # pylint: disable=too-many-locals
         self,
         limit=1,
         max_load=0.5,
         max_memory=0.5,
         memory_free=0,
+        snapshot: Optional[GPUSnapshot] = None,
+        *,
+        claims: Optional[List[GPUClaim]] = None,
+        job_memory: Optional[int] = None,
+        excluded: Iterable[str] = (),
     ) -> List[GPU]:
         """
         Returns all available GPUs sorted by order with no load higher than max_load
-        and no memory_usage higher than max_memory
+        and no memory_usage higher than max_memory. Claimed GPUs are not available.
+
+        With job_memory the job is packed instead: every GPU without an exclusive claim is available if the
+        committed memory (see get_committed_memory) plus job_memory stays below the PACKING_MEMORY_MARGIN.
+        Load and memory usage are not checked then, the job shares the GPU. Combine it with the best_fit strategy
+        to fill GPUs before starting on empty ones.
+
+        Args:
+            claims: Active GPU reservations (Default: read from the ledger, if any)
+            job_memory: Expected memory (MiB) of a job that may share GPUs with other packed jobs
+            excluded: uuids of GPUs that are not available, e.g. usable by runs ahead in the wait queue
+
+        Raises:
+            ValueError: if the strategy needs the memory of the job (e.g. best_fit), but neither job_memory nor
+                        memory_free is given
         """
+        if requires_memory_request(self.strategy) and job_memory is None and memory_free <= 0:
+            raise ValueError(
+                f"The strategy {self.strategy.__name__} needs the GPU memory of the job (job_memory or memory_free)."
+            )
+        if snapshot is None:
+            snapshot = self.snapshot()
+        if claims is None:
+            claims = self.ledger.claims() if self.ledger else []
+        committed = self.get_committed_memory(snapshot, claims) if job_memory is not None else None
 
-        # Get device IDs, load and memory usage
-        gpus = [
-            gpu
-            for gpu in self.gpus
-            if gpu.is_available(max_load=max_load, max_memory=max_memory, memory_free=memory_free)
-        ]
+        # Filter and sort on columns instead of GPU objects
+        mask = self._get_available_mask(
+            snapshot,
+            claims,
+            max_load=max_load,
+            max_memory=max_memory,
+            memory_free=memory_free,
+            job_memory=job_memory,
+            committed=committed,
+            excluded=frozenset(excluded),
+        )
+        available = snapshot.table.take(mask)
+        if committed is None or job_memory is None:
+            memory_left = available.memory_free - memory_free
+        else:
+            # Packed jobs also leave the memory declared by the jobs already packed onto the GPU
+            memory_left = available.memory_total - committed[mask] - job_memory
 
         # Sort available GPUs according to the configured strategy
-        gpus = self.strategy(gpus)
+        order = get_table_strategy(self.strategy, self.history, memory_left)(available)
 
-        total_gpus = len(gpus)
-        available_gpus_for_current_user = self.get_gpu_limit_of_current_user() - len(self.get_gpus_of_current_user())
+        # Claimed GPUs count towards the limit until the job shows up on them
+        gpus_of_current_user = {gpu.uuid for gpu in self.get_gpus_of_current_user(snapshot)}
+        gpus_of_current_user.update(claim.gpu_uuid for claim in claims if claim.user == self.username)
 
-        upper_limit = min(total_gpus, available_gpus_for_current_user, limit)
-        gpus = gpus[0:upper_limit]
-        return gpus
+        available_gpus_for_current_user = self.get_gpu_limit_of_current_user() - len(gpus_of_current_user)
+        gpus = available.to_gpus(order)
+        if job_memory is not None:
+            gpus = self._limit_packed(gpus, gpus_of_current_user, available_gpus_for_current_user)
+            available_gpus_for_current_user = len(gpus)
 
-    def create_utilization_table(self, attributes: Tuple[str, ...] = ("load", "memory_util", "temperature")) -> str:
+        upper_limit = max(min(len(gpus), available_gpus_for_current_user, limit), 0)
+        if upper_limit > 1:
+            # Strategies may prefer a group over the first GPUs (e.g. by topology)
+            return get_group_selection(self.strategy)(gpus, upper_limit)
+        return gpus[0:upper_limit]
+
+    def reserve_available(
+        self,
+        limit=1,
+        max_load=0.5,
+        max_memory=0.5,
+        memory_free=0,
+        snapshot: Optional[GPUSnapshot] = None,
+        *,
+        hold_until_exit: bool = True,
+        until_released: bool = False,
+        job_memory: Optional[int] = None,
+        excluded: Iterable[str] = (),
+    ) -> List[GPU]:
+        """
+        Same as get_available, but atomically claims the returned GPUs in the ledger.
+        Concurrent selections on this host never return the same GPU, unless both pack jobs onto it.
+
+        Args:
+            hold_until_exit: Keep the claims until this process exits (or the grace period ends).
+                             Otherwise they only last for the grace period.
+            until_released: Keep the claims without grace period until they are released or this process exits,
+                            e.g. for GPUs running one job after the other
+            job_memory: Expected memory (MiB) of a packed job (see get_available). Its claims last until
+                        this process exits, so later placements account for the job.
+            excluded: uuids of GPUs that are not available (see get_available)
+        """
+        if self.ledger is None:
+            return self.get_available(
+                limit, max_load, max_memory, memory_free, snapshot, job_memory=job_memory, excluded=excluded
+            )
+
+        if snapshot is None:
+            snapshot = self.snapshot()
+        return self.ledger.claim(
+            lambda claims: self.get_available(
+                limit,
+                max_load,
+                max_memory,
+                memory_free,
+                snapshot,
+                claims=claims,
+                job_memory=job_memory,
+                excluded=excluded,
+            ),
+            self.username,
+            os.getpid() if hold_until_exit or until_released else None,
+            job_memory,
+            held=until_released,
+        )
+
+    def release_reservations(self, gpus: Optional[List[GPU]] = None):
+        """
+        Releases the GPUs claimed by this process
+
+        Args:
+            gpus: Only release these GPUs (Default: all claimed GPUs)
+        """
+        if self.ledger is not None:
+            self.ledger.release(os.getpid(), None if gpus is None else [gpu.uuid for gpu in gpus])
+
+    def create_utilization_table(
+        self,
+        attributes: Tuple[str, ...] = ("load", "memory_util", "temperature"),
+        snapshot: Optional[GPUSnapshot] = None,
+    ) -> str:
         """
         Creates a markdown table containing the selected information
+
+        Raises:
+            ValueError: if an attribute can not be rendered
         """
-        gpus = self.gpus
-        column_name_mapping = {
-            "id": "ID",
-            "name": "Name",
-            "serial": "Serial",
-            "uuid": "UUID",
-            "temperature": "GPU temp.",
-            "load": "GPU util.",
-            "memory_util": "Memory util.",
-            "memory_total": "Memory total",
-            "memory_used": "Memory used",
-            "memory_free": "Memory free",
-            "display_mode": "Display mode",
-            "display_active": "Display active",
-        }
-
-        attributes = ("id",) + attributes
-        # Get max len for each field in gpus
-        max_len = {
-            attr: max([len(str(gpu.to_dict()[attr])) for gpu in gpus] + [len(column_name_mapping[attr])])
-            for attr in attributes
-        }
-
-        header = "| "
-        seperator = "|"
-        formatstring = "| "
-        for attr in attributes:
-            name = attr
-            header += f"{column_name_mapping[attr]:^{max_len[attr]}s} | "
-            seperator += f"{'-' * (max_len[attr]+1)}-|"
-            formatstring += f"{{{name}:^{max_len[attr]}}} | "
-
-        lines = [header, seperator]
-        for gpu in gpus:
-            gdict = gpu.to_dict()
-            lines.append(formatstring.format(**gdict))
-
-        return "\n".join(lines)
+        gpus = snapshot.gpus if snapshot else self.gpus
+        return render_utilization(gpus, attributes, OutputFormat.TABLE)
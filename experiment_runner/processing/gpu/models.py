@@ -2,7 +2,7 @@
 Contains models for GPU and GPUProcess
 """
 
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -26,12 +26,13 @@ class GPU(BaseModel):
     display_mode: str
     display_active: str
     temperature: float
+    throttle_reasons: List[str] = []  # Active clock throttle reasons, if reported by the provider
 
     def to_dict(self) -> Dict[str, str]:
         """
         Convert GPU object to a dictionary all float values will be convereted to strings with two decimal places
         """
-        tmp_dict = {**self.dict(), "memory_util": self.memory_util}
+        tmp_dict = {**self.model_dump(exclude={"throttle_reasons"}), "memory_util": self.memory_util}
         # create new dict ret and format all numbers in tmp_dict as string with two decimal places
         ret = {key: f"{value:.2f}" if isinstance(value, float) else str(value) for key, value in tmp_dict.items()}
         return ret
@@ -93,6 +94,7 @@ class GPUProcess(BaseModel):
     pid: int
     process_name: str
     gpu_uuid: str
+    used_memory: Optional[int] = None  # MiB, if reported by the provider
 
     @classmethod
     def from_nvidia_smi_list(cls, line: List[str]):
@@ -0,0 +1,266 @@
+"""
+Minimal ctypes binding for the NVIDIA Management Library (libnvidia-ml)
+"""
+
+# pylint: disable=too-few-public-methods
+import atexit
+import ctypes
+import ctypes.util
+from functools import lru_cache
+from typing import Any, List, Optional, Sequence
+
+NVML_SUCCESS = 0
+NVML_ERROR_NOT_SUPPORTED = 3
+NVML_ERROR_INSUFFICIENT_SIZE = 7
+
+NVML_TEMPERATURE_GPU = 0
+NVML_FEATURE_ENABLED = 1
+
+NVML_DEVICE_NAME_BUFFER_SIZE = 96
+NVML_DEVICE_UUID_BUFFER_SIZE = 96
+NVML_DEVICE_SERIAL_BUFFER_SIZE = 30
+NVML_DRIVER_VERSION_BUFFER_SIZE = 80
+NVML_PROCESS_NAME_BUFFER_SIZE = 1024
+
+NVML_LIBRARY_NAMES: Sequence[str] = ("libnvidia-ml.so.1", "libnvidia-ml.so")
+
+
+class NvmlError(Exception):
+    """
+    A NVML function returned an error code
+    """
+
+    def __init__(self, code: int, message: str = ""):
+        super().__init__(f"NVML error {code}: {message}" if message else f"NVML error {code}")
+        self.code = code
+
+
+class NvmlMemory(ctypes.Structure):
+    """
+    nvmlMemory_t: Memory information in bytes
+    """
+
+    _fields_ = [("total", ctypes.c_ulonglong), ("free", ctypes.c_ulonglong), ("used", ctypes.c_ulonglong)]
+
+
+class NvmlUtilization(ctypes.Structure):
+    """
+    nvmlUtilization_t: Utilization in percent during the last sample period
+    """
+
+    _fields_ = [("gpu", ctypes.c_uint), ("memory", ctypes.c_uint)]
+
+
+class NvmlProcessInfo(ctypes.Structure):
+    """
+    nvmlProcessInfo_t: A compute process running on a device
+    """
+
+    _fields_ = [
+        ("pid", ctypes.c_uint),
+        ("usedGpuMemory", ctypes.c_ulonglong),
+        ("gpuInstanceId", ctypes.c_uint),
+        ("computeInstanceId", ctypes.c_uint),
+    ]
+
+
+def load_library(names: Sequence[str] = NVML_LIBRARY_NAMES) -> Any:
+    """
+    Loads the first NVML shared library found
+
+    Raises:
+        OSError: if no library could be loaded
+    """
+    candidates = list(names)
+    found = ctypes.util.find_library("nvidia-ml")
+    if found:
+        candidates.append(found)
+
+    for name in candidates:
+        try:
+            return ctypes.CDLL(name)
+        except OSError:
+            continue
+    raise OSError(f"Could not load NVML. Tried: {candidates}")
+
+
+class NvmlLibrary:
+    """
+    Thin pythonic wrapper around the NVML C functions used by this tool
+    """
+
+    def __init__(self, library: Optional[Any] = None):
+        """
+        Loads and initializes NVML.
+
+        Args:
+            library: An already loaded library (e.g. ctypes.CDLL). Loads libnvidia-ml if None.
+
+        Raises:
+            OSError: if the library could not be loaded
+            NvmlError: if NVML could not be initialized
+        """
+        self.library = library if library is not None else load_library()
+        if isinstance(self.library, ctypes.CDLL):
+            self.library.nvmlErrorString.restype = ctypes.c_char_p
+        self._call("nvmlInit_v2")
+
+    def _call(self, function_name: str, *args) -> int:
+        function = getattr(self.library, function_name)
+        code: int = function(*args)
+        if code != NVML_SUCCESS:
+            raise NvmlError(code, self.error_string(code))
+        return code
+
+    def _call_string(self, function_name: str, size: int, *args) -> str:
+        buffer = ctypes.create_string_buffer(size)
+        self._call(function_name, *args, buffer, ctypes.c_uint(size))
+        return buffer.value.decode("utf-8", errors="replace")
+
+    def error_string(self, code: int) -> str:
+        """
+        Returns the description of a NVML error code
+        """
+        try:
+            message = self.library.nvmlErrorString(code)
+        except AttributeError:
+            return ""
+        return message.decode("utf-8", errors="replace") if message else ""
+
+    def shutdown(self):
+        """
+        Releases NVML resources
+        """
+        self._call("nvmlShutdown")
+
+    def driver_version(self) -> str:
+        """
+        Returns the installed driver version
+        """
+        return self._call_string("nvmlSystemGetDriverVersion", NVML_DRIVER_VERSION_BUFFER_SIZE)
+
+    def device_count(self) -> int:
+        """
+        Returns the number of devices visible to NVML
+        """
+        count = ctypes.c_uint(0)
+        self._call("nvmlDeviceGetCount_v2", ctypes.byref(count))
+        return count.value
+
+    def device_handle(self, index: int) -> ctypes.c_void_p:
+        """
+        Returns the handle of the device with the given index
+        """
+        handle = ctypes.c_void_p()
+        self._call("nvmlDeviceGetHandleByIndex_v2", ctypes.c_uint(index), ctypes.byref(handle))
+        return handle
+
+    def index(self, handle: ctypes.c_void_p) -> int:
+        """
+        Returns the index of the device (as used by nvidia-smi)
+        """
+        index = ctypes.c_uint(0)
+        self._call("nvmlDeviceGetIndex", handle, ctypes.byref(index))
+        return index.value
+
+    def uuid(self, handle: ctypes.c_void_p) -> str:
+        """
+        Returns the UUID of the device
+        """
+        return self._call_string("nvmlDeviceGetUUID", NVML_DEVICE_UUID_BUFFER_SIZE, handle)
+
+    def name(self, handle: ctypes.c_void_p) -> str:
+        """
+        Returns the product name of the device
+        """
+        return self._call_string("nvmlDeviceGetName", NVML_DEVICE_NAME_BUFFER_SIZE, handle)
+
+    def serial(self, handle: ctypes.c_void_p) -> str:
+        """
+        Returns the serial number of the device
+        """
+        return self._call_string("nvmlDeviceGetSerial", NVML_DEVICE_SERIAL_BUFFER_SIZE, handle)
+
+    def memory(self, handle: ctypes.c_void_p) -> NvmlMemory:
+        """
+        Returns total, free and used memory of the device in bytes
+        """
+        memory = NvmlMemory()
+        self._call("nvmlDeviceGetMemoryInfo", handle, ctypes.byref(memory))
+        return memory
+
+    def utilization(self, handle: ctypes.c_void_p) -> NvmlUtilization:
+        """
+        Returns GPU and memory utilization in percent
+        """
+        utilization = NvmlUtilization()
+        self._call("nvmlDeviceGetUtilizationRates", handle, ctypes.byref(utilization))
+        return utilization
+
+    def temperature(self, handle: ctypes.c_void_p) -> int:
+        """
+        Returns the GPU core temperature in degrees celsius
+        """
+        temperature = ctypes.c_uint(0)
+        self._call("nvmlDeviceGetTemperature", handle, ctypes.c_int(NVML_TEMPERATURE_GPU), ctypes.byref(temperature))
+        return temperature.value
+
+    def display_mode(self, handle: ctypes.c_void_p) -> bool:
+        """
+        Returns whether a physical display is connected
+        """
+        state = ctypes.c_int(0)
+        self._call("nvmlDeviceGetDisplayMode", handle, ctypes.byref(state))
+        return state.value == NVML_FEATURE_ENABLED
+
+    def display_active(self, handle: ctypes.c_void_p) -> bool:
+        """
+        Returns whether a display is initialized on the device
+        """
+        state = ctypes.c_int(0)
+        self._call("nvmlDeviceGetDisplayActive", handle, ctypes.byref(state))
+        return state.value == NVML_FEATURE_ENABLED
+
+    def compute_processes(self, handle: ctypes.c_void_p) -> List[NvmlProcessInfo]:
+        """
+        Returns all compute processes running on the device
+        """
+        function_name = (
+            "nvmlDeviceGetComputeRunningProcesses_v3"
+            if hasattr(self.library, "nvmlDeviceGetComputeRunningProcesses_v3")
+            else "nvmlDeviceGetComputeRunningProcesses_v2"
+        )
+        function = getattr(self.library, function_name)
+
+        count = ctypes.c_uint(0)
+        code = function(handle, ctypes.byref(count), None)
+        if code == NVML_SUCCESS:
+            return []
+        if code != NVML_ERROR_INSUFFICIENT_SIZE:
+            raise NvmlError(code, self.error_string(code))
+
+        # Processes may start between both calls. Leave some headroom.
+        count = ctypes.c_uint(count.value + 8)
+        infos = (NvmlProcessInfo * count.value)()
+        self._call(function_name, handle, ctypes.byref(count), infos)
+        return list(infos[: count.value])
+
+    def process_name(self, pid: int) -> str:
+        """
+        Returns the executable of the given process
+        """
+        return self._call_string("nvmlSystemGetProcessName", NVML_PROCESS_NAME_BUFFER_SIZE, ctypes.c_uint(pid))
+
+
+@lru_cache(maxsize=None)
+def get_nvml_library() -> NvmlLibrary:
+    """
+    Returns the NVML binding of this process. NVML is initialized once and shut down when the process exits.
+
+    Raises:
+        OSError: if the library could not be loaded
+        NvmlError: if NVML could not be initialized
+    """
+    library = NvmlLibrary()
+    atexit.register(library.shutdown)
+    return library
@@ -2,14 +2,56 @@
 GPUProvider retrieve GPU-Information
 """
 
-import csv
+import json
+import logging
+import math
 import os
+import socket
+import stat
+import struct
 import subprocess
+import time
 from abc import ABC, abstractmethod
-from typing import Iterator, List
+from enum import Enum
+from pathlib import Path
+from typing import IO, Callable, Dict, List, Optional, Sequence, Tuple
+from xml.etree import ElementTree
 
 from experiment_runner.processing.gpu.exceptions import GPUNotFoundException
 from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.nvml import (
+    NvmlError,
+    NvmlLibrary,
+    get_nvml_library,
+)
+from experiment_runner.processing.gpu.records import (
+    GPUProcessRecord,
+    GPURecord,
+    parse_nvidia_smi_csv,
+    to_gpus,
+    to_processes,
+)
+from experiment_runner.utils import safe_float_cast
+
+logger = logging.getLogger(__name__)
+
+MIB = 1024 * 1024
+
+# Fields queried from nvidia-smi in the order expected by GPURecord.from_nvidia_smi_list
+GPU_QUERY_FIELDS = (
+    "index,uuid,utilization.gpu,memory.total,memory.used,memory.free,driver_version,name,"
+    "gpu_serial,display_active,display_mode,temperature.gpu"
+)
+# Fields queried from nvidia-smi in the order expected by GPUProcessRecord.from_nvidia_smi_list
+COMPUTE_APPS_QUERY_FIELDS = "pid,process_name,gpu_uuid"
+
+# Socket of the local GPU broker (see experiment_runner.processing.gpu.broker). Clients only trust brokers of root
+# and of their own user there. A broker of a service user must listen in a directory only root could have created
+# for it, e.g. /run/experiment-runner.
+BROKER_SOCKET_PATH = Path("/tmp/experiment-runner/broker.sock")
+BROKER_REQUEST = b"sample\n"
+STALE_SAMPLE_INTERVALS = 3  # Broker samples older than this many sampling intervals are rejected
+NVML_VALUE_NOT_AVAILABLE = 2**64 - 1
 
 
 class GPUProvider(ABC):
@@ -32,6 +74,21 @@ class GPUProvider(ABC):
         """
         raise NotImplementedError()
 
+    def sample(self) -> Tuple[List[GPU], List[GPUProcess]]:
+        """
+        Returns all installed GPUs and all active compute processes.
+        Providers able to query both at once should override this.
+        """
+        return self.gpus, self.get_compute_processes()
+
+    def sample_records(self) -> Tuple[List[GPURecord], List[GPUProcessRecord]]:
+        """
+        Same as sample(), but returns lightweight records for the polling and broker paths.
+        Providers parsing raw output should override this to skip the pydantic models.
+        """
+        gpus, processes = self.sample()
+        return [GPURecord.from_model(gpu) for gpu in gpus], [GPUProcessRecord.from_model(proc) for proc in processes]
+
 
 class NvidiaGPUProvider(GPUProvider):
     """
@@ -41,7 +98,7 @@ class NvidiaGPUProvider(GPUProvider):
     def __init__(self, nvidia_smi_path: str = "nvidia-smi"):
         self.nvidia_smi_path = nvidia_smi_path
 
-    def _run_nvidia_smi(self, params: List[str]) -> Iterator[List[str]]:
+    def _run_nvidia_smi(self, params: List[str]) -> List[List[str]]:
         output = ""
         try:
             process = subprocess.run(
@@ -58,33 +115,508 @@ class NvidiaGPUProvider(GPUProvider):
         except subprocess.CalledProcessError as ex:
             raise ValueError("Could not call nvidia-smi command. Please check your path.") from ex
 
-        lines = [line for line in output.split(os.linesep) if line]
+        return parse_nvidia_smi_csv(output)
 
-        return csv.reader(lines, delimiter=",")
+    def _process_records(self) -> List[GPUProcessRecord]:
+        reader = self._run_nvidia_smi(
+            [f"--query-compute-apps={COMPUTE_APPS_QUERY_FIELDS}", "--format=csv,noheader,nounits"]
+        )
+        return [GPUProcessRecord.from_nvidia_smi_list(line) for line in reader]
+
+    def _gpu_records(self) -> List[GPURecord]:
+        reader = self._run_nvidia_smi([f"--query-gpu={GPU_QUERY_FIELDS}", "--format=csv,noheader,nounits"])
+        return [GPURecord.from_nvidia_smi_list(line) for line in reader]
 
     def get_compute_processes(self) -> List[GPUProcess]:
         """
         Returns all currently active Nvidia compute processes
         """
-        reader = self._run_nvidia_smi(
-            ["--query-compute-apps=pid,process_name,gpu_uuid", "--format=csv,noheader,nounits"]
+        return to_processes(self._process_records())
+
+    @property
+    def gpus(self) -> List[GPU]:
+        """
+        Returns a list of all installed Nvidia GPUs
+        """
+        return to_gpus(self._gpu_records())
+
+    def sample_records(self) -> Tuple[List[GPURecord], List[GPUProcessRecord]]:
+        """
+        Returns all installed GPUs and all active compute processes as records without creating models
+        """
+        return self._gpu_records(), self._process_records()
+
+
+def _xml_text(element: ElementTree.Element, path: str, default: str = "N/A") -> str:
+    text = element.findtext(path)
+    return text.strip() if text is not None else default
+
+
+def _xml_number(element: ElementTree.Element, path: str) -> float:
+    """
+    Parses values like '49152 MiB', '35 C' or '0 %' (NaN if not available)
+    """
+    return safe_float_cast(_xml_text(element, path).split(" ", 1)[0])
+
+
+def _xml_throttle_reasons(gpu: ElementTree.Element) -> List[str]:
+    # Renamed from clocks_throttle_reasons to clocks_event_reasons in driver 535
+    for tag, prefix in (
+        ("clocks_event_reasons", "clocks_event_reason_"),
+        ("clocks_throttle_reasons", "clocks_throttle_reason_"),
+    ):
+        reasons = gpu.find(tag)
+        if reasons is not None:
+            return [reason.tag.removeprefix(prefix) for reason in reasons if (reason.text or "").strip() == "Active"]
+    return []
+
+
+def parse_nvidia_smi_xml(stream: IO[bytes]) -> Tuple[List[GPU], List[GPUProcess]]:
+    """
+    Incrementally parses the output of 'nvidia-smi -q -x'.
+    Every <gpu> element is converted and released as soon as it is complete.
+
+    Args:
+        stream: Binary stream with the XML document
+
+    Returns:
+        All GPUs (indexed in order of appearance as nvidia-smi does) and all compute processes
+    """
+    gpus: List[GPU] = []
+    processes: List[GPUProcess] = []
+    driver = "N/A"
+
+    for _, element in ElementTree.iterparse(stream, events=("end",)):
+        if element.tag == "driver_version":
+            driver = (element.text or driver).strip()
+        elif element.tag == "gpu":
+            uuid = _xml_text(element, "uuid")
+            gpus.append(
+                GPU(
+                    id=len(gpus),
+                    uuid=uuid,
+                    load=_xml_number(element, "utilization/gpu_util") / 100,
+                    memory_total=int(_xml_number(element, "fb_memory_usage/total")),
+                    memory_used=int(_xml_number(element, "fb_memory_usage/used")),
+                    memory_free=int(_xml_number(element, "fb_memory_usage/free")),
+                    driver=driver,
+                    name=_xml_text(element, "product_name"),
+                    serial=_xml_text(element, "serial"),
+                    display_mode=_xml_text(element, "display_mode"),
+                    display_active=_xml_text(element, "display_active"),
+                    temperature=_xml_number(element, "temperature/gpu_temp"),
+                    throttle_reasons=_xml_throttle_reasons(element),
+                )
+            )
+            for info in element.iterfind("processes/process_info"):
+                # Graphics-only processes are not listed by --query-compute-apps either
+                if "C" not in _xml_text(info, "type", "C"):
+                    continue
+                used_memory = _xml_number(info, "used_memory")
+                processes.append(
+                    GPUProcess(
+                        pid=int(_xml_text(info, "pid")),
+                        process_name=_xml_text(info, "process_name"),
+                        gpu_uuid=uuid,
+                        used_memory=None if math.isnan(used_memory) else int(used_memory),
+                    )
+                )
+            element.clear()
+
+    return gpus, processes
+
+
+class NvidiaXMLGPUProvider(NvidiaGPUProvider):
+    """
+    This class defines a GPU Provider reading GPUs, processes and health from a single 'nvidia-smi -q -x' call
+    """
+
+    def _run_nvidia_smi_xml(self) -> Tuple[List[GPU], List[GPUProcess]]:
+        try:
+            with subprocess.Popen(
+                [self.nvidia_smi_path, "-q", "-x"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            ) as process:
+                try:
+                    result = parse_nvidia_smi_xml(process.stdout)  # type: ignore
+                except ElementTree.ParseError as ex:
+                    process.kill()
+                    raise ValueError("Could not parse the XML output of nvidia-smi.") from ex
+                returncode = process.wait()
+
+        except FileNotFoundError as exc:
+            raise GPUNotFoundException("🚨 File 'nvidia-smi' not found. 🚨") from exc
+
+        if returncode != 0:
+            raise ValueError("Could not call nvidia-smi command. Please check your path.")
+
+        return result
+
+    def get_compute_processes(self) -> List[GPUProcess]:
+        """
+        Returns all currently active Nvidia compute processes
+        """
+        return self._run_nvidia_smi_xml()[1]
+
+    @property
+    def gpus(self) -> List[GPU]:
+        """
+        Returns a list of all installed Nvidia GPUs
+        """
+        return self._run_nvidia_smi_xml()[0]
+
+    def sample(self) -> Tuple[List[GPU], List[GPUProcess]]:
+        """
+        Returns all GPUs and compute processes from one consistent nvidia-smi call
+        """
+        return self._run_nvidia_smi_xml()
+
+    def sample_records(self) -> Tuple[List[GPURecord], List[GPUProcessRecord]]:
+        """
+        Returns the XML sample as records (instead of the CSV queries of the parent class)
+        """
+        return GPUProvider.sample_records(self)
+
+
+class NvmlGPUProvider(GPUProvider):
+    """
+    This class defines a GPU Provider querying libnvidia-ml in-process instead of forking nvidia-smi
+    """
+
+    def __init__(self, library: Optional[NvmlLibrary] = None):
+        """
+        Args:
+            library: An initialized NVML binding (Default: the one of this process, see get_nvml_library)
+
+        Raises:
+            GPUNotFoundException: if NVML is not available on this machine
+        """
+        if library is None:
+            try:
+                library = get_nvml_library()
+            except (OSError, NvmlError) as exc:
+                raise GPUNotFoundException(f"🚨 NVML could not be loaded: {exc} 🚨") from exc
+        self.nvml = library
+
+    def _optional(self, query: Callable[[], str]) -> str:
+        try:
+            return query()
+        except NvmlError:
+            return "[N/A]"
+
+    def _enabled(self, query: Callable[[], bool]) -> str:
+        return self._optional(lambda: "Enabled" if query() else "Disabled")
+
+    def _to_gpu(self, handle, driver: str) -> GPU:
+        memory = self.nvml.memory(handle)
+        try:
+            load = self.nvml.utilization(handle).gpu / 100
+        except NvmlError:
+            load = float("nan")
+        temperature = safe_float_cast(self._optional(lambda: str(self.nvml.temperature(handle))))
+
+        return GPU(
+            id=self.nvml.index(handle),
+            uuid=self.nvml.uuid(handle),
+            load=load,
+            memory_total=memory.total // MIB,
+            memory_used=memory.used // MIB,
+            memory_free=memory.free // MIB,
+            driver=driver,
+            name=self.nvml.name(handle),
+            serial=self._optional(lambda: self.nvml.serial(handle)),
+            display_mode=self._enabled(lambda: self.nvml.display_mode(handle)),
+            display_active=self._enabled(lambda: self.nvml.display_active(handle)),
+            temperature=temperature,
         )
 
-        return [GPUProcess.from_nvidia_smi_list(line) for line in reader]
+    def _handles(self) -> list:
+        return [self.nvml.device_handle(index) for index in range(self.nvml.device_count())]
+
+    def _process_name(self, pid: int) -> str:
+        try:
+            return self.nvml.process_name(pid)
+        except NvmlError:
+            return "[N/A]"
+
+    def _processes_of(self, handle) -> List[GPUProcess]:
+        uuid = self.nvml.uuid(handle)
+        return [
+            GPUProcess(
+                pid=info.pid,
+                process_name=self._process_name(info.pid),
+                gpu_uuid=uuid,
+                used_memory=None if info.usedGpuMemory == NVML_VALUE_NOT_AVAILABLE else info.usedGpuMemory // MIB,
+            )
+            for info in self.nvml.compute_processes(handle)
+        ]
+
+    def get_compute_processes(self) -> List[GPUProcess]:
+        """
+        Returns all currently active Nvidia compute processes
+        """
+        return [process for handle in self._handles() for process in self._processes_of(handle)]
 
     @property
     def gpus(self) -> List[GPU]:
         """
         Returns a list of all installed Nvidia GPUs
         """
-        reader = self._run_nvidia_smi(
-            [
-                "--query-gpu=index,uuid,utilization.gpu,memory.total,memory.used,memory.free,driver_version,name,"
-                "gpu_serial,display_active,display_mode,temperature.gpu",
-                "--format=csv,noheader,nounits",
-            ]
+        driver = self.nvml.driver_version()
+        return [self._to_gpu(handle, driver) for handle in self._handles()]
+
+    def sample(self) -> Tuple[List[GPU], List[GPUProcess]]:
+        """
+        Returns all GPUs and compute processes. Device handles are only looked up once.
+        """
+        driver = self.nvml.driver_version()
+        handles = self._handles()
+        gpus = [self._to_gpu(handle, driver) for handle in handles]
+        processes = [process for handle in handles for process in self._processes_of(handle)]
+        return gpus, processes
+
+
+def encode_sample(
+    gpus: Sequence[GPURecord],
+    processes: Sequence[GPUProcessRecord],
+    timestamp: Optional[float] = None,
+    interval_in_seconds: float = 1.0,
+) -> bytes:
+    """
+    Encodes a sample as one line of JSON for the broker protocol
+
+    Args:
+        gpus: Sampled GPUs
+        processes: Sampled compute processes
+        timestamp: Time of sampling (Default: now)
+        interval_in_seconds: Time until the broker takes the next sample, clients reject older samples as stale
+    """
+    sample = {
+        "timestamp": time.time() if timestamp is None else timestamp,
+        "interval": interval_in_seconds,
+        "gpus": [gpu._asdict() for gpu in gpus],
+        "processes": [process._asdict() for process in processes],
+    }
+    return json.dumps(sample, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def encode_error(message: str) -> bytes:
+    """
+    Encodes an error as one line of JSON for the broker protocol
+    """
+    return json.dumps({"error": message}).encode("utf-8") + b"\n"
+
+
+def get_peer_uid(connection: socket.socket) -> int:
+    """
+    Returns the user id of the process on the other end of a connected Unix domain socket
+    """
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", credentials)
+    return int(uid)
+
+
+def is_secure_directory(path: Path, uids: Sequence[int]) -> bool:
+    """
+    Checks that a directory belongs to one of uids and no one else may create or replace files in it
+    """
+    try:
+        info = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(info.st_mode) and info.st_uid in uids and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def is_trusted_broker(uid: int, socket_path: Path) -> bool:
+    """
+    Checks whether samples of a broker running as uid may be trusted.
+    Brokers of root and of the current user are trusted. Brokers of other users are only trusted if they listen in
+    their own secure directory and all parent directories belong to root, so only root could have set them up.
+    Otherwise, any local user could squat the socket path and serve forged samples.
+
+    Args:
+        uid: User id of the broker process (see get_peer_uid)
+        socket_path: Socket the broker listens on
+    """
+    if uid in (0, os.getuid()):
+        return True
+    directory = socket_path.resolve().parent
+    return is_secure_directory(directory, [uid]) and all(
+        is_secure_directory(parent, [0]) for parent in directory.parents
+    )
+
+
+def decode_sample(line: bytes, now: Optional[float] = None) -> Tuple[List[GPU], List[GPUProcess]]:
+    """
+    Decodes a line of the broker protocol
+
+    Args:
+        line: Line sent by the broker
+        now: Time to judge the age of the sample by (Default: now)
+
+    Raises:
+        GPUNotFoundException: if the broker could not sample the GPUs, its sample is older than
+                              STALE_SAMPLE_INTERVALS sampling intervals (e.g. the sampler of the broker hangs) or
+                              the line is no valid sample (e.g. a broker speaking another protocol version)
+    """
+    try:
+        sample = json.loads(line)
+        if "error" in sample:
+            raise GPUNotFoundException(f"🚨 GPU broker: {sample['error']} 🚨")
+        age = (time.time() if now is None else now) - sample["timestamp"]
+        if age > STALE_SAMPLE_INTERVALS * sample.get("interval", 1.0):
+            raise GPUNotFoundException(f"🚨 GPU broker: The latest sample is stale ({age:.1f}s old). 🚨")
+        return (
+            [GPU.model_validate(gpu) for gpu in sample["gpus"]],
+            [GPUProcess.model_validate(process) for process in sample["processes"]],
         )
+    # ValueError covers invalid JSON and pydantic's ValidationError
+    except (ValueError, KeyError, TypeError, AttributeError) as exc:
+        raise GPUNotFoundException(f"🚨 GPU broker sent an invalid sample: {exc!r} 🚨") from exc
+
+
+class BrokerGPUProvider(GPUProvider):
+    """
+    This class defines a GPU Provider fetching samples from a local GPU broker over its Unix socket
+    """
+
+    def __init__(
+        self,
+        socket_path: Optional[Path] = None,
+        timeout: float = 5.0,
+        fallback: Optional[Callable[[], GPUProvider]] = None,
+    ):
+        """
+        Args:
+            socket_path: Socket the broker listens on (Default: BROKER_SOCKET_PATH)
+            timeout: Max. time for one round-trip
+            fallback: Creates the provider used instead, once the broker stops serving current samples
+                      (Default: raise GPUNotFoundException)
+
+        Raises:
+            GPUNotFoundException: if no trusted broker serves current samples on socket_path
+        """
+        self.socket_path: Path = socket_path or BROKER_SOCKET_PATH
+        self.timeout = timeout
+        self.fallback = fallback
+        self._fallback_provider: Optional[GPUProvider] = None
+        self._request()
+
+    def _connect(self) -> socket.socket:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        try:
+            connection.connect(str(self.socket_path))
+            uid = get_peer_uid(connection)
+        except OSError:
+            connection.close()
+            raise
+        if not is_trusted_broker(uid, self.socket_path):
+            connection.close()
+            raise GPUNotFoundException(f"🚨 GPU broker on {self.socket_path} runs as untrusted user {uid}. 🚨")
+        return connection
+
+    def _request(self) -> Tuple[List[GPU], List[GPUProcess]]:
+        try:
+            with self._connect() as connection:
+                connection.sendall(BROKER_REQUEST)
+                with connection.makefile("rb") as stream:
+                    line = stream.readline()
+        except OSError as exc:
+            raise GPUNotFoundException(f"🚨 GPU broker on {self.socket_path} is not reachable: {exc} 🚨") from exc
+
+        if not line:
+            raise GPUNotFoundException("🚨 GPU broker closed the connection. 🚨")
+        return decode_sample(line)
+
+    def sample(self) -> Tuple[List[GPU], List[GPUProcess]]:
+        """
+        Returns the latest sample of the broker with a single socket round-trip.
+        Once the broker failed, all following samples are taken by the fallback provider (if any).
+        """
+        if self._fallback_provider is not None:
+            return self._fallback_provider.sample()
+        try:
+            return self._request()
+        except GPUNotFoundException as err:
+            if self.fallback is None:
+                raise
+            logger.warning("%s Falling back to the next GPU provider.", err)
+            self._fallback_provider = self.fallback()
+            return self._fallback_provider.sample()
+
+    def get_compute_processes(self) -> List[GPUProcess]:
+        """
+        Returns all compute processes of the latest broker sample
+        """
+        return self.sample()[1]
+
+    @property
+    def gpus(self) -> List[GPU]:
+        """
+        Returns all GPUs of the latest broker sample
+        """
+        return self.sample()[0]
+
+
+class GPUProviderEnum(Enum):
+    """
+    Enum containing all available GPU providers
+    """
+
+    AUTO = "auto"  # use the first provider available on this machine
+    BROKER = "broker"  # fetch samples from the local GPU broker
+    NVML = "nvml"  # query libnvidia-ml in-process
+    NVIDIA_SMI = "nvidia-smi"  # fork nvidia-smi and parse its CSV output
+    NVIDIA_SMI_XML = "nvidia-smi-xml"  # fork nvidia-smi once per sample and parse its XML output
+
+
+class GPUProviderFactory:  # pylint: disable=too-few-public-methods
+    """
+    Factory for GPUProviders
+    """
+
+    class_dictionary: Dict[GPUProviderEnum, Callable[[], GPUProvider]] = {
+        GPUProviderEnum.BROKER: BrokerGPUProvider,
+        GPUProviderEnum.NVML: NvmlGPUProvider,
+        GPUProviderEnum.NVIDIA_SMI: NvidiaGPUProvider,
+        GPUProviderEnum.NVIDIA_SMI_XML: NvidiaXMLGPUProvider,
+    }
+
+    # Providers tried in this order for GPUProviderEnum.AUTO
+    auto_order: List[GPUProviderEnum] = [GPUProviderEnum.BROKER, GPUProviderEnum.NVML, GPUProviderEnum.NVIDIA_SMI]
+
+    @classmethod
+    def get_instance(cls, provider_type: GPUProviderEnum = GPUProviderEnum.AUTO) -> GPUProvider:
+        """
+        Creates a provider from GPUProviderEnum.
+        AUTO returns the first provider of auto_order that can be created on this machine.
+
+        Raises:
+            GPUNotFoundException: if the requested provider is not available
+        """
+        if provider_type == GPUProviderEnum.AUTO:
+            return cls._get_first_available(cls.auto_order)
+
+        try:
+            provider = cls.class_dictionary[provider_type]
+        except KeyError as exc:
+            known_providers = [key.value for key in cls.class_dictionary]
+            raise ValueError(f"Unknown provider. The following providers exist: {known_providers}") from exc
 
-        gpus = [GPU.from_nvidia_smi_list(line) for line in reader]
+        return provider()
 
-        return gpus
+    @classmethod
+    def _get_first_available(cls, candidates: List[GPUProviderEnum]) -> GPUProvider:
+        errors = []
+        for index, candidate in enumerate(candidates):
+            try:
+                if candidate == GPUProviderEnum.BROKER:
+                    # A broker that stops serving current samples hands over to the next provider
+                    remaining = candidates[index + 1 :]
+                    return BrokerGPUProvider(fallback=lambda: cls._get_first_available(remaining))
+                return cls.get_instance(candidate)
+            except GPUNotFoundException as err:
+                errors.append(str(err))
+        raise GPUNotFoundException(f"🚨 No GPU provider available: {errors} 🚨")
@@ -0,0 +1,156 @@
+"""
+Contains lightweight tuple-backed records of GPUs and GPU processes.
+They are used on the polling and broker paths and are converted to the pydantic models only at API boundaries.
+"""
+
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.utils import safe_float_cast
+
+# Number of CSV columns after the name of a GPU (serial, display_active, display_mode, temperature)
+_GPU_COLUMNS_AFTER_NAME = 4
+
+
+class GPURecord(NamedTuple):
+    """
+    Record of one GPU with the fields of the GPU model
+    """
+
+    id: int
+    uuid: str
+    load: float
+    memory_total: int
+    memory_used: int
+    memory_free: int
+    driver: str
+    name: str
+    serial: str
+    display_mode: str
+    display_active: str
+    temperature: float
+    throttle_reasons: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_nvidia_smi_list(cls, line: Sequence[str]) -> "GPURecord":
+        """
+        Parses a given nvidia-smi output line (see GPU_QUERY_FIELDS) without validation.
+        Names containing the separator are joined again.
+
+        Args:
+            line: List of str representing one GPU
+
+        Returns:
+            The created GPURecord
+        """
+        name_end = len(line) - _GPU_COLUMNS_AFTER_NAME
+        return cls(
+            int(line[0]),
+            line[1].strip(),
+            safe_float_cast(line[2]) / 100,
+            int(line[3]),
+            int(line[4]),
+            int(line[5]),
+            line[6].strip(),
+            ",".join(line[7:name_end]).strip(),
+            line[name_end].strip(),
+            line[name_end + 2].strip(),
+            line[name_end + 1].strip(),
+            safe_float_cast(line[name_end + 3]),
+        )
+
+    @classmethod
+    def from_model(cls, gpu: GPU) -> "GPURecord":
+        """
+        Creates a record from a GPU model
+        """
+        return cls(
+            gpu.id,
+            gpu.uuid,
+            gpu.load,
+            gpu.memory_total,
+            gpu.memory_used,
+            gpu.memory_free,
+            gpu.driver,
+            gpu.name,
+            gpu.serial,
+            gpu.display_mode,
+            gpu.display_active,
+            gpu.temperature,
+            tuple(gpu.throttle_reasons),
+        )
+
+    def to_model(self) -> GPU:
+        """
+        Converts the record to a (validated) GPU model
+        """
+        fields = self._asdict()  # pylint: disable=no-member
+        fields["throttle_reasons"] = list(self.throttle_reasons)
+        return GPU(**fields)
+
+    @property
+    def memory_util(self) -> float:
+        """
+        Calculates relative memory usage
+        """
+        return float(self.memory_used) / float(self.memory_total)
+
+
+class GPUProcessRecord(NamedTuple):
+    """
+    Record of one compute process with the fields of the GPUProcess model
+    """
+
+    pid: int
+    process_name: str
+    gpu_uuid: str
+    used_memory: Optional[int] = None
+
+    @classmethod
+    def from_nvidia_smi_list(cls, line: Sequence[str]) -> "GPUProcessRecord":
+        """
+        Parses a given nvidia-smi output line (see COMPUTE_APPS_QUERY_FIELDS) without validation.
+        Process names containing the separator are joined again.
+
+        Args:
+            line: List of str representing one GPUProcess
+
+        Returns:
+            The created GPUProcessRecord
+        """
+        return cls(int(line[0]), ",".join(line[1:-1]).strip(), line[-1].strip())
+
+    @classmethod
+    def from_model(cls, process: GPUProcess) -> "GPUProcessRecord":
+        """
+        Creates a record from a GPUProcess model
+        """
+        return cls(process.pid, process.process_name, process.gpu_uuid, process.used_memory)
+
+    def to_model(self) -> GPUProcess:
+        """
+        Converts the record to a (validated) GPUProcess model
+        """
+        return GPUProcess(**self._asdict())  # pylint: disable=no-member
+
+
+def parse_nvidia_smi_csv(output: str) -> List[List[str]]:
+    """
+    Splits the output of a nvidia-smi query with --format=csv,noheader,nounits into rows.
+    nvidia-smi does not quote values, so splitting on the separator is enough and much faster than the csv module.
+    """
+    return [line.split(",") for line in output.splitlines() if line]
+
+
+def to_gpus(records: Sequence[GPURecord]) -> List[GPU]:
+    """
+    Converts GPU records to GPU models
+    """
+    return [record.to_model() for record in records]
+
+
+def to_processes(records: Sequence[GPUProcessRecord]) -> List[GPUProcess]:
+    """
+    Converts process records to GPUProcess models
+    """
+    return [record.to_model() for record in records]
@@ -0,0 +1,169 @@
+"""
+Renders GPU information as text table, JSON, CSV or Prometheus text format
+"""
+
+import csv
+import io
+import json
+import math
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from experiment_runner.processing.gpu.models import GPU
+
+# Column titles of all attributes that can be rendered
+COLUMN_NAMES: Dict[str, str] = {
+    "id": "ID",
+    "name": "Name",
+    "serial": "Serial",
+    "uuid": "UUID",
+    "temperature": "GPU temp.",
+    "load": "GPU util.",
+    "memory_util": "Memory util.",
+    "memory_total": "Memory total",
+    "memory_used": "Memory used",
+    "memory_free": "Memory free",
+    "display_mode": "Display mode",
+    "display_active": "Display active",
+}
+# Attributes exported as Prometheus gauges, all others are exported as labels
+NUMERIC_ATTRIBUTES = frozenset(("temperature", "load", "memory_util", "memory_total", "memory_used", "memory_free"))
+PROMETHEUS_PREFIX = "experiment_runner"
+
+# (name, help, labels, value) of one Prometheus sample
+PrometheusSample = Tuple[str, str, Dict[str, str], float]
+
+
+class OutputFormat(Enum):
+    """
+    Enum containing all output formats of reports
+    """
+
+    TABLE = "table"  # human readable text
+    JSON = "json"
+    CSV = "csv"
+    PROM = "prom"  # Prometheus text exposition format (e.g. for the node exporter textfile collector)
+
+
+def validate_attributes(attributes: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Checks all attributes before rendering and prepends the id
+
+    Raises:
+        ValueError: if an attribute can not be rendered
+    """
+    attributes = tuple(attributes)
+    unknown = [attr for attr in attributes if attr not in COLUMN_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown attributes {unknown}. The following attributes exist: {list(COLUMN_NAMES)}")
+    return ("id",) + tuple(attr for attr in attributes if attr != "id")
+
+
+def format_value(value: Any) -> str:
+    """
+    Formats a value as displayed in tables (floats with two decimal places)
+    """
+    return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+
+def _json_value(value: Any) -> Any:
+    # NaN is not valid JSON
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def _prometheus_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _prometheus_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def render_prometheus(samples: Sequence[PrometheusSample]) -> str:
+    """
+    Renders gauges in Prometheus text exposition format. Samples of a metric are grouped below one HELP/TYPE header.
+    """
+    by_name: Dict[str, List[PrometheusSample]] = {}
+    for sample in samples:
+        by_name.setdefault(sample[0], []).append(sample)
+
+    lines = []
+    for name, metric_samples in by_name.items():
+        lines.append(f"# HELP {name} {metric_samples[0][1]}")
+        lines.append(f"# TYPE {name} gauge")
+        for _, _, labels, value in metric_samples:
+            label_str = ",".join(f'{key}="{_prometheus_label(label)}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_str}}} {_prometheus_value(value)}")
+    return "\n".join(lines)
+
+
+def _render_table(attributes: Tuple[str, ...], rows: List[List[Any]]) -> str:
+    # Format every cell once and size the columns in the same pass
+    widths = [len(COLUMN_NAMES[attr]) for attr in attributes]
+    cells = []
+    for row in rows:
+        formatted = [format_value(value) for value in row]
+        widths = [max(width, len(cell)) for width, cell in zip(widths, formatted)]
+        cells.append(formatted)
+
+    header = "| " + "".join(f"{COLUMN_NAMES[attr]:^{width}s} | " for attr, width in zip(attributes, widths))
+    seperator = "|" + "".join(f"{'-' * (width + 1)}-|" for width in widths)
+    lines = [header, seperator]
+    for formatted in cells:
+        lines.append("| " + "".join(f"{cell:^{width}} | " for cell, width in zip(formatted, widths)))
+    return "\n".join(lines)
+
+
+def _render_prometheus(gpus: Sequence[GPU], attributes: Tuple[str, ...], rows: List[List[Any]]) -> str:
+    gauges = [(index, attr) for index, attr in enumerate(attributes) if attr in NUMERIC_ATTRIBUTES]
+    label_columns = [(index, attr) for index, attr in enumerate(attributes) if attr not in NUMERIC_ATTRIBUTES]
+
+    samples: List[PrometheusSample] = []
+    for gpu, row in zip(gpus, rows):
+        labels = {"uuid": gpu.uuid, **{attr: str(row[index]) for index, attr in label_columns}}
+        # The info gauge keeps GPUs visible if only labels were selected
+        samples.append((f"{PROMETHEUS_PREFIX}_gpu_info", "GPU information", labels, 1))
+        for index, attr in gauges:
+            samples.append((f"{PROMETHEUS_PREFIX}_gpu_{attr}", COLUMN_NAMES[attr], labels, row[index]))
+    return render_prometheus(samples)
+
+
+def render_utilization(
+    gpus: Sequence[GPU],
+    attributes: Iterable[str] = ("load", "memory_util", "temperature"),
+    output_format: OutputFormat = OutputFormat.TABLE,
+) -> str:
+    """
+    Renders the selected attributes of all GPUs. Every attribute is read exactly once per GPU.
+
+    Args:
+        gpus: GPUs to render
+        attributes: Attributes to render (see COLUMN_NAMES). The id is always rendered first.
+        output_format: Output format
+
+    Raises:
+        ValueError: if an attribute can not be rendered
+    """
+    attributes = validate_attributes(attributes)
+    rows = [[getattr(gpu, attr) for attr in attributes] for gpu in gpus]
+
+    if output_format == OutputFormat.JSON:
+        return json.dumps(
+            [{attr: _json_value(value) for attr, value in zip(attributes, row)} for row in rows], indent=2
+        )
+
+    if output_format == OutputFormat.CSV:
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow(attributes)
+        writer.writerows(["" if _json_value(value) is None else value for value in row] for row in rows)
+        return output.getvalue().rstrip("\n")
+
+    if output_format == OutputFormat.PROM:
+        return _render_prometheus(gpus, attributes, rows)
+
+    return _render_table(attributes, rows)
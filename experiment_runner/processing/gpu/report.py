@@ -0,0 +1,141 @@
+"""
+Contains the GPU usage report of all active users
+"""
+
+import csv
+import io
+import json
+from typing import Dict, List, Optional
+
+import typer
+from pydantic import BaseModel
+
+from experiment_runner.processing.gpu.rendering import (
+    PROMETHEUS_PREFIX,
+    OutputFormat,
+    PrometheusSample,
+    render_prometheus,
+)
+from experiment_runner.processing.gpu.snapshot import GPUSnapshot
+
+
+class ProcessUsage(BaseModel):
+    """
+    DTO representing one GPU process of a user
+    """
+
+    pid: int
+    process_name: str
+    gpu_id: Optional[int]
+    gpu_uuid: str
+    used_memory: Optional[int]
+
+
+class UserUsage(BaseModel):
+    """
+    DTO representing the GPU usage of one user
+    """
+
+    user: str
+    gpus: List[int]
+    pids: List[int]
+    used_memory: int
+    processes: List[ProcessUsage]
+
+
+def create_usage_report(snapshot: GPUSnapshot) -> List[UserUsage]:
+    """
+    Aggregates the processes of a snapshot by user and GPU in a single pass
+
+    Returns:
+        The usage of every user with GPU processes, sorted by username
+    """
+    processes_by_user: Dict[str, List[ProcessUsage]] = {}
+    for process in snapshot.processes:
+        user = snapshot.get_user_of_pid(process.pid)
+        if user is None:
+            continue
+        gpu = snapshot.get_by_uuid(process.gpu_uuid)
+        processes_by_user.setdefault(user, []).append(
+            ProcessUsage(
+                pid=process.pid,
+                process_name=process.process_name,
+                gpu_id=gpu.id if gpu else None,
+                gpu_uuid=process.gpu_uuid,
+                used_memory=process.used_memory,
+            )
+        )
+
+    return [
+        UserUsage(
+            user=user,
+            gpus=sorted({process.gpu_id for process in processes if process.gpu_id is not None}),
+            pids=sorted({process.pid for process in processes}),
+            used_memory=sum(process.used_memory or 0 for process in processes),
+            processes=processes,
+        )
+        for user, processes in sorted(processes_by_user.items())
+    ]
+
+
+def render_usage_report(report: List[UserUsage], output_format: OutputFormat = OutputFormat.TABLE) -> str:
+    """
+    Renders a usage report. CSV contains one row per process.
+    """
+    if output_format == OutputFormat.JSON:
+        return json.dumps([usage.model_dump() for usage in report], indent=2)
+
+    if output_format == OutputFormat.CSV:
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow(["user", "gpu_id", "gpu_uuid", "pid", "process_name", "used_memory"])
+        for usage in report:
+            for process in usage.processes:
+                writer.writerow(
+                    [
+                        usage.user,
+                        "" if process.gpu_id is None else process.gpu_id,
+                        process.gpu_uuid,
+                        process.pid,
+                        process.process_name,
+                        "" if process.used_memory is None else process.used_memory,
+                    ]
+                )
+        return output.getvalue().rstrip("\n")
+
+    if output_format == OutputFormat.PROM:
+        samples: List[PrometheusSample] = []
+        for usage in report:
+            labels = {"user": usage.user}
+            samples.append(
+                (f"{PROMETHEUS_PREFIX}_user_gpus", "Number of GPUs used by the user", labels, len(usage.gpus))
+            )
+            samples.append(
+                (
+                    f"{PROMETHEUS_PREFIX}_user_processes",
+                    "Number of GPU processes of the user",
+                    labels,
+                    len(usage.pids),
+                )
+            )
+            samples.append(
+                (
+                    f"{PROMETHEUS_PREFIX}_user_used_memory_mib",
+                    "GPU memory used by the user",
+                    labels,
+                    usage.used_memory,
+                )
+            )
+        return render_prometheus(samples)
+
+    lines = []
+    for usage in report:
+        lines.append(f"Report for user {usage.user}:")
+        used_gpus_str = f"\tUsed GPUs: {usage.gpus}"
+        if len(usage.gpus) > 1:
+            lines.append(typer.style(used_gpus_str, fg=typer.colors.WHITE, bg=typer.colors.RED, bold=True))
+        else:
+            lines.append(used_gpus_str)
+        lines.append(f"\tPIDs: {usage.pids}")
+        lines.append("")
+    return "\n".join(lines)
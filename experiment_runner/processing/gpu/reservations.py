@@ -0,0 +1,201 @@
+"""
+Host-wide ledger of GPU reservations. Selecting and claiming GPUs happens under one file lock, so concurrent
+selections never hand out the same GPU before the first job allocated memory on it.
+Every local user may write the ledger, so claims are only trusted if their process belongs to their user, they do
+not outlast the grace period and their user does not hold more GPUs than any limit allows.
+"""
+
+import fcntl
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from pydantic import BaseModel
+
+from experiment_runner.processing.gpu.limits import MAX_GPUS_PER_STAFF
+from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.utils import get_users_for_pids, open_shared_file
+
+RESERVATION_PATH = Path("/dev/shm/experiment-runner/reservations.json")
+# Jobs usually allocate GPU memory within this time, afterwards the GPU is busy by itself
+GRACE_PERIOD_IN_SECONDS = 120.0
+
+
+class GPUClaim(BaseModel):
+    """
+    DTO representing the reservation of one GPU
+    """
+
+    gpu_uuid: str
+    user: str
+    pid: Optional[int]  # The claim ends with this process. None: only the grace period applies.
+    expires_at: float
+    memory: Optional[int] = None  # MiB declared by a packed job sharing the GPU. None: the whole GPU is claimed.
+    held: bool = False  # The claim lasts until it is released or its process exits, without grace period
+
+
+def is_process_alive(pid: int) -> bool:
+    """
+    Checks whether a process exists (also if it belongs to another user)
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class GPUReservationLedger:
+    """
+    JSON file of all active claims, guarded by an exclusive fcntl lock.
+    Expired claims (process exited or grace period over) are dropped whenever the ledger is written.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        grace_period_in_seconds: float = GRACE_PERIOD_IN_SECONDS,
+        max_held_claims_per_user: int = MAX_GPUS_PER_STAFF,
+    ):
+        """
+        Args:
+            path: Ledger file, shared by all users of the host (Default: RESERVATION_PATH)
+            grace_period_in_seconds: Max. lifetime of a claim
+            max_held_claims_per_user: Held claims of a user beyond this number are dropped
+                                      (Default: the limit of staff members)
+        """
+        self.path: Path = path or RESERVATION_PATH
+        self.grace_period_in_seconds = grace_period_in_seconds
+        self.max_held_claims_per_user = max_held_claims_per_user
+
+    @staticmethod
+    def _is_active(claim: GPUClaim, now: float) -> bool:
+        if (claim.memory is not None or claim.held) and claim.pid is not None:
+            # Packed jobs share the GPU, so their declared memory counts until they exit
+            return is_process_alive(claim.pid)
+        return claim.expires_at > now and (claim.pid is None or is_process_alive(claim.pid))
+
+    def _trusted(self, claims: List[GPUClaim], now: float) -> List[GPUClaim]:
+        # Anyone may write the ledger, e.g. claims of pid 1 in the name of others would block GPUs for good
+        owners = get_users_for_pids(claim.pid for claim in claims if claim.pid is not None)
+        held: Dict[str, int] = defaultdict(int)
+        trusted = []
+        for claim in claims:
+            if claim.pid is not None and owners.get(claim.pid) != claim.user:
+                continue
+            if claim.expires_at > now + max(self.grace_period_in_seconds, GRACE_PERIOD_IN_SECONDS):
+                continue
+            if claim.held:
+                held[claim.user] += 1
+                if held[claim.user] > self.max_held_claims_per_user:
+                    continue
+            trusted.append(claim)
+        return trusted
+
+    @staticmethod
+    def _read(content: str) -> List[GPUClaim]:
+        try:
+            return [GPUClaim.model_validate(claim) for claim in json.loads(content)] if content else []
+        except ValueError:
+            # A damaged ledger must not block all selections, the claims are short-lived anyway
+            return []
+
+    @contextmanager
+    def _locked(self, exclusive: bool = True) -> Iterator[List[GPUClaim]]:
+        """
+        Yields all active claims while holding the lock. With exclusive, changes to the list are written back.
+        """
+        descriptor = open_shared_file(self.path)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            with os.fdopen(os.dup(descriptor), "r+", encoding="utf-8") as ledger:
+                now = time.time()
+                claims = self._trusted(
+                    [claim for claim in self._read(ledger.read()) if self._is_active(claim, now)], now
+                )
+
+                yield claims
+
+                if exclusive:
+                    ledger.seek(0)
+                    ledger.truncate()
+                    json.dump([claim.model_dump() for claim in claims], ledger)
+                    ledger.flush()
+        finally:
+            os.close(descriptor)  # Releases the lock
+
+    def claims(self) -> List[GPUClaim]:
+        """
+        Returns all active claims
+        """
+        with self._locked(exclusive=False) as claims:
+            return list(claims)
+
+    def claimed_uuids(self) -> Set[str]:
+        """
+        Returns the uuids of all claimed GPUs
+        """
+        return {claim.gpu_uuid for claim in self.claims()}
+
+    def claim(
+        self,
+        select: Callable[[List[GPUClaim]], List[GPU]],
+        user: str,
+        pid: Optional[int],
+        memory: Optional[int] = None,
+        *,
+        held: bool = False,
+    ) -> List[GPU]:
+        """
+        Selects and claims GPUs atomically
+
+        Args:
+            select: Selects the GPUs to claim. It gets all active claims and must not choose claimed GPUs.
+            user: Owner of the claims
+            pid: Process holding the claims. Use None for claims of short-lived processes, which then last for the
+                 grace period.
+            memory: Memory (MiB) of a packed job, which shares the GPUs with other packed jobs
+                    (Default: claim the whole GPUs)
+            held: Keep the claims until they are released or the process exits, e.g. for GPUs running one job
+                  after the other. Otherwise they end with the grace period.
+
+        Returns:
+            The claimed GPUs
+        """
+        with self._locked() as claims:
+            gpus = select(claims)
+            expires_at = time.time() + self.grace_period_in_seconds
+            claims.extend(
+                GPUClaim(gpu_uuid=gpu.uuid, user=user, pid=pid, expires_at=expires_at, memory=memory, held=held)
+                for gpu in gpus
+            )
+        return gpus
+
+    def release(self, pid: Optional[int] = None, gpu_uuids: Optional[Iterable[str]] = None) -> int:
+        """
+        Removes all claims of a process (Default: the current process)
+
+        Args:
+            pid: Process holding the claims
+            gpu_uuids: Only release the claims of these GPUs (Default: all GPUs)
+
+        Returns:
+            Number of released claims
+        """
+        pid = os.getpid() if pid is None else pid
+        selected = None if gpu_uuids is None else set(gpu_uuids)
+        with self._locked() as claims:
+            kept = [
+                claim
+                for claim in claims
+                if claim.pid != pid or (selected is not None and claim.gpu_uuid not in selected)
+            ]
+            released = len(claims) - len(kept)
+            claims[:] = kept
+        return released
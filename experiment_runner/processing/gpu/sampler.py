@@ -0,0 +1,285 @@
+"""
+Long-lived GPU sampling based on the loop mode of nvidia-smi
+"""
+
+import atexit
+import logging
+import os
+import select
+import subprocess
+import threading
+import time
+from typing import Callable, Generic, List, Optional, Tuple, TypeVar
+
+from experiment_runner.processing.gpu.exceptions import GPUNotFoundException
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.providers import (
+    COMPUTE_APPS_QUERY_FIELDS,
+    GPU_QUERY_FIELDS,
+    GPUProvider,
+    NvidiaGPUProvider,
+)
+from experiment_runner.processing.gpu.records import (
+    GPUProcessRecord,
+    GPURecord,
+    to_gpus,
+    to_processes,
+)
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Samples older than this many intervals are outdated, e.g. because nvidia-smi hangs
+STALE_AFTER_INTERVALS = 3
+
+
+class _StreamReader(Generic[T]):
+    # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """
+    Reads one looping nvidia-smi query on a background thread.
+    Rows are grouped by their timestamp column; a group is published once no row follows within group_gap_in_seconds
+    or the next group starts. With fixed_size, groups are published as soon as they reach the size of the first group.
+    Malformed rows are skipped.
+    """
+
+    def __init__(
+        self,
+        command: List[str],
+        parse: Callable[[List[str]], T],
+        fixed_size: bool = False,
+        group_gap_in_seconds: float = 0.05,
+    ):
+        self.command = command
+        self.parse = parse
+        self.fixed_size = fixed_size
+        self.group_gap_in_seconds = group_gap_in_seconds
+        self.expected_size: Optional[int] = None
+        self.lock = threading.Lock()
+        self.published = threading.Event()
+
+        self.latest: List[T] = []
+        self.started_at = time.monotonic()
+        self.last_line_at: Optional[float] = None  # None until the first row was read
+        self.error: Optional[str] = None
+
+        self._pending: List[T] = []
+        self._pending_timestamp: Optional[str] = None
+
+        try:
+            self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        except FileNotFoundError as exc:
+            raise GPUNotFoundException("🚨 File 'nvidia-smi' not found. 🚨") from exc
+
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _publish(self):
+        with self.lock:
+            self.latest = self._pending
+            if self.fixed_size and self.expected_size is None:
+                self.expected_size = len(self._pending)
+        self._pending = []
+        self.published.set()
+
+    def _handle(self, line: str):
+        if not line.strip():
+            return
+        # nvidia-smi does not quote values, see parse_nvidia_smi_csv
+        timestamp, *values = line.split(",")
+        try:
+            record = self.parse(values)
+        except (ValueError, IndexError):
+            return
+        self.last_line_at = time.monotonic()
+
+        if self._pending and timestamp != self._pending_timestamp:
+            self._publish()
+        self._pending_timestamp = timestamp
+        self._pending.append(record)
+
+        if self.expected_size and len(self._pending) == self.expected_size:
+            self._publish()
+
+    def _waits_for_group_end(self) -> bool:
+        # Groups of a known size are complete with their last row
+        return bool(self._pending) and (not self.fixed_size or self.expected_size is None)
+
+    def _pump(self):
+        descriptor = self.process.stdout.fileno()  # type: ignore
+        rest = b""
+        while True:
+            if self._waits_for_group_end():
+                readable, _, _ = select.select([descriptor], [], [], self.group_gap_in_seconds)
+                if not readable:
+                    self._publish()
+                    continue
+            chunk = os.read(descriptor, 65536)
+            if not chunk:
+                break
+            *lines, rest = (rest + chunk).split(b"\n")
+            for line in lines:
+                self._handle(line.decode("utf-8", errors="replace"))
+        self._handle(rest.decode("utf-8", errors="replace"))
+        if self._pending:
+            self._publish()
+
+    def _read(self):
+        try:
+            self._pump()
+            self.error = f"{self.command[0]} exited with return code {self.process.wait()}"
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            self.error = f"Reading the output of {self.command[0]} failed: {err!r}"
+        finally:
+            self.published.set()
+
+    def close(self):
+        """
+        Stops the nvidia-smi process and waits for the reader thread
+        """
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.thread.join(timeout=5)
+
+
+class StreamingGPUSampler(GPUProvider):
+    """
+    This class defines a GPU Provider keeping one 'nvidia-smi -lms' process per query alive.
+    Samples are parsed incrementally on background threads, so reading the latest sample never forks.
+    Once the stream fails (nvidia-smi exited or stopped printing), all following samples are taken by forking
+    nvidia-smi, so long waits for GPUs do not end with the stream.
+    """
+
+    def __init__(self, nvidia_smi_path: str = "nvidia-smi", interval_in_seconds: float = 1.0, timeout: float = 10.0):
+        """
+        Starts sampling.
+
+        Args:
+            nvidia_smi_path: Path of the nvidia-smi executable
+            interval_in_seconds: Time between two samples
+            timeout: Max. time to wait for the first sample
+        """
+        self.interval_in_seconds = interval_in_seconds
+        self.timeout = timeout
+        # Queried instead while the process stream did not deliver its first sample yet or after the stream failed
+        self._fallback = NvidiaGPUProvider(nvidia_smi_path)
+        self._stream_failed = False
+
+        interval_ms = str(max(int(interval_in_seconds * 1000), 1))
+        self._gpu_reader = _StreamReader(
+            [
+                nvidia_smi_path,
+                f"--query-gpu=timestamp,{GPU_QUERY_FIELDS}",
+                "--format=csv,noheader,nounits",
+                "-lms",
+                interval_ms,
+            ],
+            GPURecord.from_nvidia_smi_list,
+            fixed_size=True,
+        )
+        self._process_reader = _StreamReader(
+            [
+                nvidia_smi_path,
+                f"--query-compute-apps=timestamp,{COMPUTE_APPS_QUERY_FIELDS}",
+                "--format=csv,noheader,nounits",
+                "-lms",
+                interval_ms,
+            ],
+            GPUProcessRecord.from_nvidia_smi_list,
+        )
+        atexit.register(self.close)
+
+    def __enter__(self) -> "StreamingGPUSampler":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Stops sampling
+        """
+        self._gpu_reader.close()
+        self._process_reader.close()
+        atexit.unregister(self.close)
+
+    def sample(self) -> Tuple[List[GPU], List[GPUProcess]]:
+        """
+        Returns the latest GPUs and compute processes without starting a process.
+        Blocks until the first sample arrived.
+
+        Raises:
+            GPUNotFoundException: if nvidia-smi did not deliver a sample in time
+            ValueError: if nvidia-smi exited
+        """
+        gpus, processes = self.sample_records()
+        return to_gpus(gpus), to_processes(processes)
+
+    def sample_records(self) -> Tuple[List[GPURecord], List[GPUProcessRecord]]:
+        """
+        Returns the latest sample as records, as parsed by the reader threads.
+        Blocks until the first sample arrived. Forks nvidia-smi instead once the stream failed.
+
+        Raises:
+            GPUNotFoundException: if nvidia-smi is not found
+            ValueError: if nvidia-smi fails
+        """
+        if self._stream_failed:
+            return self._fallback.sample_records()
+        try:
+            return self._stream_records()
+        except (GPUNotFoundException, ValueError) as err:
+            logger.warning("%s Falling back to forking nvidia-smi.", err)
+            self._stream_failed = True
+            self.close()
+            return self._fallback.sample_records()
+
+    def _stream_records(self) -> Tuple[List[GPURecord], List[GPUProcessRecord]]:
+        """
+        Raises:
+            GPUNotFoundException: if nvidia-smi did not deliver a sample in time or the latest sample is outdated
+            ValueError: if nvidia-smi exited
+        """
+        if not self._gpu_reader.published.wait(self.timeout):
+            raise GPUNotFoundException("🚨 nvidia-smi did not deliver a sample in time. 🚨")
+        for reader in (self._gpu_reader, self._process_reader):
+            if reader.error or not reader.thread.is_alive():
+                raise ValueError(f"GPU sampling stopped: {reader.error or 'reader exited'}")
+
+        age = time.monotonic() - (self._gpu_reader.last_line_at or self._gpu_reader.started_at)
+        if age > STALE_AFTER_INTERVALS * self.interval_in_seconds:
+            raise GPUNotFoundException(f"🚨 nvidia-smi delivered no GPU sample for {age:.1f} s. 🚨")
+        with self._gpu_reader.lock:
+            gpus = list(self._gpu_reader.latest)
+
+        # No output at all is printed while no compute process runs
+        quiet_since = self._process_reader.last_line_at or self._process_reader.started_at
+        if time.monotonic() - quiet_since > 2 * self.interval_in_seconds:
+            return gpus, []
+        if not self._process_reader.published.is_set():
+            # nvidia-smi did not print its first sample yet, an empty list would hide the running processes
+            return gpus, self._fallback._process_records()  # pylint: disable=protected-access
+        with self._process_reader.lock:
+            processes = list(self._process_reader.latest)
+        return gpus, processes
+
+    def get_compute_processes(self) -> List[GPUProcess]:
+        """
+        Returns the latest compute processes
+        """
+        return self.sample()[1]
+
+    @property
+    def gpus(self) -> List[GPU]:
+        """
+        Returns the latest sample of all installed GPUs
+        """
+        return self.sample()[0]
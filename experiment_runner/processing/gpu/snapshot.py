@@ -0,0 +1,188 @@
+"""
+Contains an immutable point-in-time view of all GPUs and their compute processes
+"""
+
+import time
+from types import MappingProxyType
+from typing import (
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.table import GPUTable
+from experiment_runner.utils import get_users_for_pids
+
+# Resolves the owners of many pids at once
+UserResolver = Callable[[Iterable[int]], Mapping[int, Optional[str]]]
+
+
+class GPUSnapshot:
+    # pylint: disable = R0902
+    """
+    Samples GPUs and compute processes once and indexes them by uuid, id, pid and user.
+    All queries on a snapshot see the same moment in time.
+    """
+
+    __slots__ = (
+        "timestamp",
+        "_gpus",
+        "_processes",
+        "_by_uuid",
+        "_by_id",
+        "_by_pid",
+        "_by_user",
+        "_user_of_pid",
+        "_table",
+    )
+
+    def __init__(
+        self,
+        gpus: Iterable[GPU],
+        processes: Iterable[GPUProcess],
+        user_resolver: Optional[UserResolver] = None,
+        timestamp: Optional[float] = None,
+    ):
+        """
+        Creates a snapshot from already sampled GPUs and processes.
+
+        Args:
+            gpus: All GPUs at the time of sampling
+            processes: All compute processes at the time of sampling
+            user_resolver: Resolves the owners of all pids in one call. (Default: get_users_for_pids)
+            timestamp: Time of sampling (Default: now)
+        """
+        user_resolver = user_resolver or get_users_for_pids
+        self._table: Optional[GPUTable] = None
+        self.timestamp: float = time.time() if timestamp is None else timestamp
+        self._gpus: Tuple[GPU, ...] = tuple(gpus)
+        self._processes: Tuple[GPUProcess, ...] = tuple(processes)
+
+        self._by_uuid: Mapping[str, GPU] = MappingProxyType({gpu.uuid: gpu for gpu in self._gpus})
+        self._by_id: Mapping[int, GPU] = MappingProxyType({gpu.id: gpu for gpu in self._gpus})
+
+        by_pid: Dict[int, List[GPUProcess]] = {}
+        for process in self._processes:
+            by_pid.setdefault(process.pid, []).append(process)
+        self._by_pid: Mapping[int, Tuple[GPUProcess, ...]] = MappingProxyType(
+            {pid: tuple(procs) for pid, procs in by_pid.items()}
+        )
+
+        users = user_resolver(self._by_pid.keys())
+        self._user_of_pid: Mapping[int, Optional[str]] = MappingProxyType(
+            {pid: users.get(pid) for pid in self._by_pid}
+        )
+
+        by_user: Dict[str, List[GPUProcess]] = {}
+        for process in self._processes:
+            user = self._user_of_pid[process.pid]
+            if user is not None:
+                by_user.setdefault(user, []).append(process)
+        self._by_user: Mapping[str, Tuple[GPUProcess, ...]] = MappingProxyType(
+            {user: tuple(procs) for user, procs in by_user.items()}
+        )
+
+    def __setattr__(self, name, value):
+        if hasattr(self, "_by_user"):
+            raise AttributeError("GPUSnapshot is immutable.")
+        super().__setattr__(name, value)
+
+    def __len__(self) -> int:
+        return len(self._gpus)
+
+    def __getitem__(self, uuid: str) -> GPU:
+        """
+        Allows using the bracket operator to access GPUs by their UUIDs
+
+        Args:
+            uuid (str): uuid of the wanted GPU
+        """
+        try:
+            return self._by_uuid[uuid]
+        except KeyError as exc:
+            raise ValueError("The given GPU UUID does not exist.") from exc
+
+    @property
+    def gpus(self) -> List[GPU]:
+        """
+        Returns a list of all GPUs sorted as reported by the provider
+        """
+        return list(self._gpus)
+
+    @property
+    def processes(self) -> List[GPUProcess]:
+        """
+        Returns a list of all compute processes
+        """
+        return list(self._processes)
+
+    @property
+    def table(self) -> GPUTable:
+        """
+        Returns the GPUs as columnar GPUTable (created on first access)
+        """
+        if self._table is None:
+            # The table is derived from the immutable GPUs, so caching it does not change the snapshot
+            object.__setattr__(self, "_table", GPUTable.from_gpus(self._gpus))
+        return self._table  # type: ignore[return-value]
+
+    @property
+    def users(self) -> FrozenSet[str]:
+        """
+        Returns all usernames with running GPU processes
+        """
+        return frozenset(self._by_user)
+
+    @property
+    def users_of_pids(self) -> Mapping[int, Optional[str]]:
+        """
+        Returns the owner of every GPU process pid as resolved at sampling time
+        """
+        return self._user_of_pid
+
+    def get_by_id(self, gpu_id: int) -> Optional[GPU]:
+        """
+        Returns the GPU with the given index or None
+        """
+        return self._by_id.get(gpu_id)
+
+    def get_by_uuid(self, uuid: str) -> Optional[GPU]:
+        """
+        Returns the GPU with the given UUID or None
+        """
+        return self._by_uuid.get(uuid)
+
+    def get_processes_of_pid(self, pid: int) -> List[GPUProcess]:
+        """
+        Returns all compute processes (one per GPU) of the given pid
+        """
+        return list(self._by_pid.get(pid, ()))
+
+    def get_user_of_pid(self, pid: int) -> Optional[str]:
+        """
+        Returns the owner of the given GPU process pid as resolved at sampling time
+        """
+        return self._user_of_pid.get(pid)
+
+    def get_processes_of_user(self, username: str) -> List[GPUProcess]:
+        """
+        Returns all compute processes of the given user
+        """
+        return list(self._by_user.get(username, ()))
+
+    def get_gpus_of_user(self, username: str) -> Set[GPU]:
+        """
+        Returns all GPUs the given user has compute processes on
+        """
+        return {
+            self._by_uuid[process.gpu_uuid]
+            for process in self._by_user.get(username, ())
+            if process.gpu_uuid in self._by_uuid
+        }
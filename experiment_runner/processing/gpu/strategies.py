@@ -4,12 +4,32 @@ Contains Strategies for GPU Selection
 
 import random
 from enum import Enum
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Optional
 
+import numpy as np
+
+from experiment_runner.processing.gpu.history import GPUUtilizationHistory
 from experiment_runner.processing.gpu.models import GPU
-from experiment_runner.utils import nan_safe_float
+from experiment_runner.processing.gpu.table import GPUTable
+from experiment_runner.processing.gpu.topology import select_best_connected
 
 SelectionStrategy = Callable[[List[GPU]], List[GPU]]
+# Returns the row indices of a GPUTable in order of preference
+TableStrategy = Callable[[GPUTable], np.ndarray]
+# TableStrategy judging the GPUs by the utilization history (if any)
+HistoryStrategy = Callable[[GPUTable, Optional[GPUUtilizationHistory]], np.ndarray]
+# TableStrategy judging the GPUs by the memory (MiB) every row has left once the job is placed on it
+FitStrategy = Callable[[GPUTable, np.ndarray], np.ndarray]
+# Selects count GPUs as a group from GPUs sorted by preference
+GroupSelection = Callable[[List[GPU], int], List[GPU]]
+# Returns the load of every row of a GPUTable as judged by a strategy
+LoadEstimate = Callable[[GPUTable, Optional[GPUUtilizationHistory]], np.ndarray]
+
+# Parameters of the strategies based on the utilization history
+EWMA_HALF_LIFE_IN_SECONDS = 30.0
+PERCENTILE_WINDOW_IN_SECONDS = 300.0
+IDLE_MAX_LOAD = 0.05  # GPUs with at most this load count as idle
+MIN_IDLE_IN_SECONDS = 60.0
 
 
 class SelectionStrategyEnum(Enum):
@@ -24,6 +44,11 @@ class SelectionStrategyEnum(Enum):
     LOAD = "load"  # select the GPU with the lowest load
     MEMORY = "memory"  # select the GPU with the most memory available
     LOAD_MEMORY_RANDOM = "load_memory_random"
+    BEST_FIT = "best_fit"  # select the GPU with the least memory left once the job is placed (needs its memory)
+    TOPOLOGY = "topology"  # select the best connected GPUs (NVLink, PCIe switch, NUMA node), then by load and memory
+    EWMA_LOAD = "ewma_load"  # select the GPU with the lowest smoothed load (see history)
+    P95_LOAD = "p95_load"  # select the GPU with the lowest 95th percentile of the load in the last minutes
+    IDLE = "idle"  # select GPUs idle for at least MIN_IDLE_IN_SECONDS first, then by smoothed load
 
 
 class SelectionStrategyFactory:
@@ -59,76 +84,283 @@ class SelectionStrategyFactory:
         return strategy
 
 
+def as_selection_strategy(table_strategy: TableStrategy) -> SelectionStrategy:
+    """
+    Adapter turning a vectorized TableStrategy into a SelectionStrategy on lists of GPUs.
+    The TableStrategy stays accessible as attribute table_strategy of the returned callable.
+    """
+
+    def selection_strategy(gpus: List[GPU]) -> List[GPU]:
+        table = GPUTable.from_gpus(gpus)
+        return table.to_gpus(table_strategy(table))
+
+    selection_strategy.__name__ = table_strategy.__name__
+    selection_strategy.__doc__ = table_strategy.__doc__
+    selection_strategy.table_strategy = table_strategy  # type: ignore[attr-defined]
+    return selection_strategy
+
+
+def as_history_strategy(history_strategy: HistoryStrategy) -> SelectionStrategy:
+    """
+    Adapter turning a HistoryStrategy into a SelectionStrategy on lists of GPUs.
+    The GPUManager passes its history to the HistoryStrategy (see get_table_strategy). Called on lists of GPUs, there
+    is no history and the current load is used.
+    """
+
+    def table_strategy(table: GPUTable) -> np.ndarray:
+        return history_strategy(table, None)
+
+    table_strategy.__name__ = history_strategy.__name__
+    table_strategy.__doc__ = history_strategy.__doc__
+    strategy = as_selection_strategy(table_strategy)
+    strategy.history_strategy = history_strategy  # type: ignore[attr-defined]
+    return strategy
+
+
+def as_fit_strategy(fit_strategy: FitStrategy) -> SelectionStrategy:
+    """
+    Adapter turning a FitStrategy into a SelectionStrategy on lists of GPUs.
+    FitStrategies need the memory request of the job (see requires_memory_request). The GPUManager passes the memory
+    left on every GPU (see get_table_strategy). Called on lists of GPUs, the free memory is used.
+    """
+
+    def table_strategy(table: GPUTable) -> np.ndarray:
+        return fit_strategy(table, table.memory_free)
+
+    table_strategy.__name__ = fit_strategy.__name__
+    table_strategy.__doc__ = fit_strategy.__doc__
+    strategy = as_selection_strategy(table_strategy)
+    strategy.fit_strategy = fit_strategy  # type: ignore[attr-defined]
+    return strategy
+
+
+def requires_memory_request(strategy: SelectionStrategy) -> bool:
+    """
+    Checks whether a SelectionStrategy can only order GPUs by the memory the job requests
+    """
+    return getattr(strategy, "fit_strategy", None) is not None
+
+
+def get_table_strategy(
+    strategy: SelectionStrategy,
+    history: Optional[GPUUtilizationHistory] = None,
+    memory_left: Optional[np.ndarray] = None,
+) -> TableStrategy:
+    """
+    Returns the vectorized version of a SelectionStrategy.
+    Plain SelectionStrategies (e.g. user defined ones) are called on the GPU objects of the table instead.
+
+    Args:
+        strategy: Strategy to vectorize
+        history: Utilization history passed to HistoryStrategies (Default: judge the current load)
+        memory_left: Memory (MiB) left on every row once the job is placed, passed to FitStrategies
+                     (Default: the free memory)
+    """
+    history_strategy: Optional[HistoryStrategy] = getattr(strategy, "history_strategy", None)
+    if history_strategy is not None:
+        return lambda table: history_strategy(table, history)
+    fit_strategy: Optional[FitStrategy] = getattr(strategy, "fit_strategy", None)
+    if fit_strategy is not None and memory_left is not None:
+        return lambda table: fit_strategy(table, memory_left)
+    table_strategy: Optional[TableStrategy] = getattr(strategy, "table_strategy", None)
+    if table_strategy is not None:
+        return table_strategy
+
+    def fallback(table: GPUTable) -> np.ndarray:
+        row_of_gpu = {id(gpu): row for row, gpu in enumerate(table.rows)}
+        return np.fromiter((row_of_gpu[id(gpu)] for gpu in strategy(table.to_gpus())), dtype=np.intp)
+
+    return fallback
+
+
+def with_group_selection(group_selection: GroupSelection) -> Callable[[SelectionStrategy], SelectionStrategy]:
+    """
+    Decorator attaching a GroupSelection to a SelectionStrategy.
+    It is used whenever more than one GPU is requested (see get_group_selection).
+    """
+
+    def inner_method(strategy: SelectionStrategy) -> SelectionStrategy:
+        strategy.group_selection = group_selection  # type: ignore[attr-defined]
+        return strategy
+
+    return inner_method
+
+
+def get_group_selection(strategy: SelectionStrategy) -> GroupSelection:
+    """
+    Returns the GroupSelection of a SelectionStrategy. By default the first GPUs are selected.
+    """
+    group_selection: Optional[GroupSelection] = getattr(strategy, "group_selection", None)
+    if group_selection is not None:
+        return group_selection
+    return lambda gpus, count: gpus[:count]
+
+
+def with_load_estimate(load_estimate: LoadEstimate) -> Callable[[SelectionStrategy], SelectionStrategy]:
+    """
+    Decorator attaching a LoadEstimate to a SelectionStrategy.
+    GPUs are only available if their estimated load stays below max_load (see get_load_estimate).
+    """
+
+    def inner_method(strategy: SelectionStrategy) -> SelectionStrategy:
+        strategy.load_estimate = load_estimate  # type: ignore[attr-defined]
+        return strategy
+
+    return inner_method
+
+
+def get_load_estimate(strategy: SelectionStrategy) -> LoadEstimate:
+    """
+    Returns the LoadEstimate of a SelectionStrategy. By default the load of the current sample is used.
+    """
+    load_estimate: Optional[LoadEstimate] = getattr(strategy, "load_estimate", None)
+    if load_estimate is not None:
+        return load_estimate
+    return lambda table, history: table.load
+
+
+def _rng() -> np.random.Generator:
+    # Seeded from the random module so random.seed() keeps results reproducible
+    return np.random.default_rng(random.getrandbits(64))
+
+
 @SelectionStrategyFactory.register(SelectionStrategyEnum.FIRST)
-def select_first(gpus: List[GPU]) -> List[GPU]:
+@as_selection_strategy
+def select_first(table: GPUTable) -> np.ndarray:
     """
     Select the first available GPU
     """
-    glist = list(gpus)
-    glist.sort(key=lambda x: x.id, reverse=False)
-    return glist
+    return np.argsort(table.id, kind="stable")
 
 
 @SelectionStrategyFactory.register(SelectionStrategyEnum.LAST)
-def select_last(gpus: List[GPU]) -> List[GPU]:
+@as_selection_strategy
+def select_last(table: GPUTable) -> np.ndarray:
     """
     Select the last available GPU
     """
-    glist = list(gpus)
-    glist.sort(key=lambda x: x.id, reverse=True)
-    return glist
+    return np.argsort(-table.id, kind="stable")
 
 
 @SelectionStrategyFactory.register(SelectionStrategyEnum.RANDOM)
-def select_random(gpus: List[GPU]) -> List[GPU]:
+@as_selection_strategy
+def select_random(table: GPUTable) -> np.ndarray:
     """
     Select a random available GPU
     """
+    return _rng().permutation(len(table))
 
-    glist = [gpus[g] for g in random.sample(range(0, len(gpus)), len(gpus))]
-    return glist
+
+# NumPy sorts NaN values last (same order as sorting with nan_safe_float)
 
 
 @SelectionStrategyFactory.register(SelectionStrategyEnum.LOAD)
-def select_load(gpus: List[GPU]) -> List[GPU]:
+@as_selection_strategy
+def select_load(table: GPUTable) -> np.ndarray:
     """
     Select the GPU with the least load
     """
-
-    glist = list(gpus)
-    glist.sort(key=lambda x: nan_safe_float(x.load), reverse=False)
-    return glist
+    return np.argsort(table.load, kind="stable")
 
 
 @SelectionStrategyFactory.register(SelectionStrategyEnum.MEMORY)
-def select_memory(gpus: List[GPU]) -> List[GPU]:
+@as_selection_strategy
+def select_memory(table: GPUTable) -> np.ndarray:
     """
     Select the GPU with the most memory available
     """
-
-    glist = list(gpus)
-    glist.sort(key=lambda x: nan_safe_float(x.memory_util), reverse=False)
-    return glist
+    return np.argsort(table.memory_util, kind="stable")
 
 
 @SelectionStrategyFactory.register(SelectionStrategyEnum.LOAD_MEMORY_RANDOM)
-def select_load_memory_random(gpus: List[GPU]) -> List[GPU]:
+@as_selection_strategy
+def select_load_memory_random(table: GPUTable) -> np.ndarray:
     """
     Select the GPU with least load, most memory and then at random
     """
+    # lexsort uses the last key as primary key
+    return np.lexsort((_rng().random(len(table)), table.memory_util, table.load))
+
+
+@SelectionStrategyFactory.register(SelectionStrategyEnum.BEST_FIT)
+@as_fit_strategy
+def select_best_fit(table: GPUTable, memory_left: np.ndarray) -> np.ndarray:
+    """
+    Select the GPU with the least memory left once the job is placed on it, then the one with the least load.
+    GPUs the job does not fit on come last, so large GPUs stay free for large jobs.
+    """
+    return np.lexsort((table.id, table.load, memory_left, memory_left < 0))
+
 
-    glist = list(gpus)
-    glist.sort(
-        key=lambda x: (nan_safe_float(x.load), nan_safe_float(x.memory_util), random.randint(0, len(gpus))),
-        reverse=False,
-    )
-    return glist
+@SelectionStrategyFactory.register(SelectionStrategyEnum.TOPOLOGY)
+@with_group_selection(select_best_connected)
+@as_selection_strategy
+def select_topology(table: GPUTable) -> np.ndarray:
+    """
+    Select the best connected GPUs. Single GPUs and ties are selected by least load and most memory.
+    """
+    return np.lexsort((table.id, table.memory_util, table.load))
+
+
+def _uuids(table: GPUTable) -> List[str]:
+    return [gpu.uuid for gpu in table.rows]
+
+
+def _or_current_load(values: np.ndarray, table: GPUTable) -> np.ndarray:
+    # GPUs without history are judged by their current sample
+    return np.where(np.isnan(values), table.load, values)
+
+
+def _ewma_load(table: GPUTable, history: Optional[GPUUtilizationHistory]) -> np.ndarray:
+    if history is None or len(table) == 0:
+        return table.load
+    return _or_current_load(history.ewma(_uuids(table), EWMA_HALF_LIFE_IN_SECONDS), table)
+
+
+def _p95_load(table: GPUTable, history: Optional[GPUUtilizationHistory]) -> np.ndarray:
+    if history is None or len(table) == 0:
+        return table.load
+    return _or_current_load(history.percentile(_uuids(table), 95, PERCENTILE_WINDOW_IN_SECONDS), table)
+
+
+@SelectionStrategyFactory.register(SelectionStrategyEnum.EWMA_LOAD)
+@with_load_estimate(_ewma_load)
+@as_history_strategy
+def select_ewma_load(table: GPUTable, history: Optional[GPUUtilizationHistory]) -> np.ndarray:
+    """
+    Select the GPU with the least load, averaged over the recent samples with exponentially decaying weights.
+    A GPU pausing between two epochs does not look idle.
+    """
+    return np.lexsort((table.id, table.memory_util, _ewma_load(table, history)))
+
+
+@SelectionStrategyFactory.register(SelectionStrategyEnum.P95_LOAD)
+@with_load_estimate(_p95_load)
+@as_history_strategy
+def select_p95_load(table: GPUTable, history: Optional[GPUUtilizationHistory]) -> np.ndarray:
+    """
+    Select the GPU with the lowest 95th percentile of the load within PERCENTILE_WINDOW_IN_SECONDS
+    """
+    return np.lexsort((table.id, table.memory_util, _p95_load(table, history)))
+
+
+@SelectionStrategyFactory.register(SelectionStrategyEnum.IDLE)
+@with_load_estimate(_ewma_load)
+@as_history_strategy
+def select_idle(table: GPUTable, history: Optional[GPUUtilizationHistory]) -> np.ndarray:
+    """
+    Select GPUs idle for at least MIN_IDLE_IN_SECONDS first, then the GPU with the least smoothed load
+    """
+    if history is None or len(table) == 0:
+        return np.lexsort((table.id, table.memory_util, _ewma_load(table, history)))
+    idle = history.idle_seconds(_uuids(table), IDLE_MAX_LOAD) >= MIN_IDLE_IN_SECONDS
+    return np.lexsort((table.id, table.memory_util, _ewma_load(table, history), ~idle))
 
 
 @SelectionStrategyFactory.register(SelectionStrategyEnum.NONE)
-def select_none(gpus: List[GPU]) -> List[GPU]:
+@as_selection_strategy
+def select_none(table: GPUTable) -> np.ndarray:  # pylint: disable=unused-argument
     """
     Select no GPU
     """
-    gpus.sort()  # Pylint does not like it
-    return []
+    return np.empty(0, dtype=np.intp)
@@ -0,0 +1,114 @@
+"""
+Contains a columnar NumPy representation of many GPUs for vectorized filtering and sorting
+"""
+
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from experiment_runner.processing.gpu.models import GPU
+
+# Numeric GPU attributes stored as columns
+COLUMNS = ("id", "load", "memory_used", "memory_total", "memory_free", "temperature")
+
+
+class GPUTable:
+    """
+    Column store of GPU metrics. Every column is a NumPy array with one entry per GPU.
+    The original GPU objects are kept in rows to convert selections back.
+    """
+
+    __slots__ = ("rows", *COLUMNS)
+
+    def __init__(
+        self,
+        rows: Sequence[GPU],
+        *,
+        id: np.ndarray,  # pylint: disable=redefined-builtin
+        load: np.ndarray,
+        memory_used: np.ndarray,
+        memory_total: np.ndarray,
+        memory_free: np.ndarray,
+        temperature: np.ndarray,
+    ):
+        """
+        Creates a table from columns of equal length. Use from_gpus to create it from GPU objects.
+        """
+        self.rows: Sequence[GPU] = rows
+        self.id = np.asarray(id, dtype=np.int64)
+        self.load = np.asarray(load, dtype=np.float64)
+        self.memory_used = np.asarray(memory_used, dtype=np.float64)
+        self.memory_total = np.asarray(memory_total, dtype=np.float64)
+        self.memory_free = np.asarray(memory_free, dtype=np.float64)
+        self.temperature = np.asarray(temperature, dtype=np.float64)
+
+    @classmethod
+    def from_gpus(cls, gpus: Sequence[GPU]) -> "GPUTable":
+        """
+        Creates a table from GPU objects
+        """
+        # A single pass over the (slow) pydantic attributes, the columns are split in NumPy
+        values = np.array(
+            # same order as COLUMNS
+            [(gpu.id, gpu.load, gpu.memory_used, gpu.memory_total, gpu.memory_free, gpu.temperature) for gpu in gpus],
+            dtype=np.float64,
+        ).reshape(-1, len(COLUMNS))
+        return cls(list(gpus), **dict(zip(COLUMNS, values.T)))
+
+    def __len__(self) -> int:
+        return len(self.id)
+
+    @property
+    def memory_util(self) -> np.ndarray:
+        """
+        Relative memory usage of every GPU (NaN if the total memory is unknown)
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.memory_total > 0, self.memory_used / self.memory_total, np.nan)
+
+    def is_available(
+        self,
+        max_load: float = 0.5,
+        max_memory: float = 0.5,
+        memory_free: float = 0,
+        load: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Vectorized GPU.is_available for all rows
+
+        Args:
+            max_load: Max load of the GPU to be considered available
+            max_memory: Max memory of the GPU to be considered available
+            memory_free: Minmum amount of free memory to be considered available
+            load: Load of every row to compare with max_load instead of the sampled load (e.g. averaged over time)
+
+        Returns:
+            Boolean mask, True for every available GPU
+        """
+        if load is None:
+            load = self.load
+        return (load <= max_load) & (self.memory_util <= max_memory) & (self.memory_free >= memory_free)
+
+    def take(self, indices: np.ndarray) -> "GPUTable":
+        """
+        Returns a new table containing the given rows (indices or boolean mask) in the given order
+        """
+        if indices.dtype == np.bool_:
+            indices = np.flatnonzero(indices)
+        return GPUTable(
+            rows=[self.rows[i] for i in indices],
+            id=self.id[indices],
+            load=self.load[indices],
+            memory_used=self.memory_used[indices],
+            memory_total=self.memory_total[indices],
+            memory_free=self.memory_free[indices],
+            temperature=self.temperature[indices],
+        )
+
+    def to_gpus(self, indices: Optional[np.ndarray] = None) -> List[GPU]:
+        """
+        Returns the GPU objects of the given rows (Default: all rows)
+        """
+        if indices is None:
+            return list(self.rows)
+        return [self.rows[i] for i in indices]
@@ -0,0 +1,192 @@
+"""
+Contains the interconnect topology of the GPUs (nvidia-smi topo -m) and the selection of well connected GPU sets
+"""
+
+import itertools
+import math
+import re
+import subprocess
+from functools import cached_property, lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from experiment_runner.processing.gpu.exceptions import GPUNotFoundException
+from experiment_runner.processing.gpu.models import GPU
+
+# Rank of every link type, lower is better: NVLink, same PCIe switch, same host bridge, same NUMA node, across NUMA
+LINK_RANKS: Dict[str, int] = {"NV": 0, "PIX": 1, "PXB": 2, "PHB": 3, "NODE": 4, "SYS": 5, "SOC": 5}
+UNKNOWN_LINK_RANK = 6
+MAX_COMBINATIONS = 10_000  # Larger searches fall back to a greedy selection
+
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+_GPU_NAME = re.compile(r"^GPU(\d+)$")
+_NVLINK = re.compile(r"^NV(\d+)$")
+
+
+class GPUTopology:
+    """
+    Links between all pairs of GPUs (by GPU index)
+    """
+
+    def __init__(self, links: Dict[Tuple[int, int], str]):
+        self.links = links
+
+    @property
+    def gpu_ids(self) -> List[int]:
+        """
+        Returns the indices of all GPUs in the topology
+        """
+        return sorted({gpu_id for pair in self.links for gpu_id in pair})
+
+    def link(self, first: int, second: int) -> Optional[str]:
+        """
+        Returns the link type between two GPUs as printed by nvidia-smi (e.g. NV12, PIX or SYS)
+        """
+        return self.links.get((first, second))
+
+    def rank(self, first: int, second: int) -> int:
+        """
+        Returns the rank of the link between two GPUs (see LINK_RANKS)
+        """
+        link = self.link(first, second)
+        if link is None:
+            return UNKNOWN_LINK_RANK
+        return LINK_RANKS["NV"] if _NVLINK.match(link) else LINK_RANKS.get(link, UNKNOWN_LINK_RANK)
+
+    def nvlinks(self, first: int, second: int) -> int:
+        """
+        Returns the number of bonded NVLinks between two GPUs
+        """
+        match = _NVLINK.match(self.link(first, second) or "")
+        return int(match.group(1)) if match else 0
+
+    def score(self, gpu_ids: Iterable[int]) -> Tuple[int, int, int]:
+        """
+        Scores a set of GPUs, lower is better: worst link first, then the number of NVLinks and the sum of all ranks
+        """
+        pairs = list(itertools.combinations(gpu_ids, 2))
+        if not pairs:
+            return (0, 0, 0)
+        ranks = [self.rank(first, second) for first, second in pairs]
+        return (max(ranks), -sum(self.nvlinks(first, second) for first, second in pairs), sum(ranks))
+
+
+def parse_nvidia_smi_topo(output: str) -> GPUTopology:
+    """
+    Parses the matrix printed by 'nvidia-smi topo -m'. Other devices (e.g. NICs) and affinities are ignored.
+
+    Raises:
+        ValueError: if the output contains no GPU matrix
+    """
+    lines = [_ANSI_ESCAPE.sub("", line) for line in output.splitlines()]
+    header_index = next((index for index, line in enumerate(lines) if line.lstrip().startswith("GPU0")), None)
+    if header_index is None:
+        raise ValueError("No GPU topology found in the output of nvidia-smi topo -m.")
+
+    columns = [column.strip() for column in lines[header_index].split("\t")]
+    if columns and columns[0] == "":
+        columns = columns[1:]
+
+    links: Dict[Tuple[int, int], str] = {}
+    for line in lines[header_index + 1 :]:
+        cells = [cell.strip() for cell in line.split("\t")]
+        row_match = _GPU_NAME.match(cells[0])
+        if not row_match:
+            # The matrix ends with the first row of another device or the legend
+            if cells[0] and not cells[0].startswith(("NIC", "mlx")):
+                break
+            continue
+        row_id = int(row_match.group(1))
+        for column, cell in zip(columns, cells[1:]):
+            column_match = _GPU_NAME.match(column)
+            if column_match and int(column_match.group(1)) != row_id:
+                links[(row_id, int(column_match.group(1)))] = cell
+    return GPUTopology(links)
+
+
+class NvidiaTopologyProvider:  # pylint: disable=too-few-public-methods
+    """
+    Reads the GPU topology with 'nvidia-smi topo -m'. The topology does not change, so it is read only once.
+    """
+
+    def __init__(self, nvidia_smi_path: str = "nvidia-smi"):
+        self.nvidia_smi_path = nvidia_smi_path
+
+    @cached_property
+    def topology(self) -> GPUTopology:
+        """
+        Returns the topology of all GPUs
+
+        Raises:
+            GPUNotFoundException: if nvidia-smi is not installed
+            ValueError: if nvidia-smi failed
+        """
+        try:
+            process = subprocess.run(
+                [self.nvidia_smi_path, "topo", "-m"],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+        except FileNotFoundError as exc:
+            raise GPUNotFoundException("🚨 File 'nvidia-smi' not found. 🚨") from exc
+        except subprocess.CalledProcessError as ex:
+            raise ValueError("Could not call nvidia-smi command. Please check your path.") from ex
+        return parse_nvidia_smi_topo(process.stdout)
+
+
+@lru_cache(maxsize=None)
+def get_topology(nvidia_smi_path: str = "nvidia-smi") -> Optional[GPUTopology]:
+    """
+    Returns the cached topology of this host or None if it is unknown
+    """
+    try:
+        return NvidiaTopologyProvider(nvidia_smi_path).topology
+    except (GPUNotFoundException, ValueError):
+        return None
+
+
+def _select_greedy(gpu_ids: List[int], count: int, topology: GPUTopology) -> FrozenSet[int]:
+    best_score: Optional[Tuple[int, int, int]] = None
+    best: FrozenSet[int] = frozenset()
+    for start in gpu_ids:
+        selected = [start]
+        while len(selected) < count:
+            candidates = [gpu_id for gpu_id in gpu_ids if gpu_id not in selected]
+            # pylint: disable-next=cell-var-from-loop
+            selected.append(min(candidates, key=lambda gpu_id: topology.score(selected + [gpu_id])))
+        score = topology.score(selected)
+        if best_score is None or score < best_score:
+            best_score, best = score, frozenset(selected)
+    return best
+
+
+def select_best_connected(gpus: List[GPU], count: int, topology: Optional[GPUTopology] = None) -> List[GPU]:
+    """
+    Selects the best connected set of count GPUs: NVLink first, then the same PCIe switch, then the same NUMA node.
+    Ties are broken by the given order of the GPUs (e.g. from another strategy).
+
+    Args:
+        gpus: Available GPUs, in order of preference
+        count: Number of GPUs to select
+        topology: Topology of the GPUs (Default: topology of this host)
+
+    Returns:
+        The selected GPUs in order of preference. Without topology the first count GPUs are returned.
+    """
+    topology = topology or get_topology()
+    if topology is None or count <= 1 or len(gpus) <= count:
+        return list(gpus[:count])
+
+    gpu_ids = [gpu.id for gpu in gpus]
+    if math.comb(len(gpu_ids), count) > MAX_COMBINATIONS:
+        selected = _select_greedy(gpu_ids, count, topology)
+    else:
+        position = {gpu_id: index for index, gpu_id in enumerate(gpu_ids)}
+        known_topology = topology
+        selected = frozenset(
+            min(
+                itertools.combinations(gpu_ids, count),
+                key=lambda group: (known_topology.score(group), sum(position[gpu_id] for gpu_id in group)),
+            )
+        )
+    return [gpu for gpu in gpus if gpu.id in selected]
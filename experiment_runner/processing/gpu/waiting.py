@@ -0,0 +1,416 @@
+"""
+Waiting for GPUs: runs queue up host-wide and are served in arrival order. Once the runs ahead failed to acquire
+their GPUs, later runs may take the GPUs none of them can use (backfilling).
+Waiters sleep on a datagram socket and are woken up whenever GPUs are released, with a jittered backoff as fallback
+for changes nobody announces (e.g. jobs started without experiment-runner). After a failed attempt, the next run in
+the queue is woken up as well, so it may backfill right away.
+"""
+
+import fcntl
+import json
+import math
+import os
+import random
+import select
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.utils import (
+    get_current_username,
+    get_users_for_pids,
+    make_shared_directory,
+    open_shared_file,
+)
+
+WAIT_DIRECTORY = Path("/dev/shm/experiment-runner/wait")
+QUEUE_FILE_NAME = "queue.json"
+WAKEUP_MESSAGE = b"changed"
+ATTEMPT_MESSAGE = b"attempted"  # The run ahead failed to acquire its GPUs, nothing was released
+MIN_BACKOFF_IN_SECONDS = 1.0
+MAX_BACKOFF_IN_SECONDS = 30.0
+# Runs try to acquire their GPUs soon after they joined the queue. Tickets without attempt after this time are dropped,
+# they would block the backfilling of all runs behind them.
+UNATTEMPTED_TICKET_TIMEOUT_IN_SECONDS = 2 * MAX_BACKOFF_IN_SECONDS
+
+
+class WaitTimeoutException(Exception):
+    """
+    The requested GPUs did not become available in time
+    """
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter, so waiters started together do not poll in lockstep
+    """
+
+    def __init__(
+        self,
+        initial_in_seconds: float = MIN_BACKOFF_IN_SECONDS,
+        maximum_in_seconds: float = MAX_BACKOFF_IN_SECONDS,
+        factor: float = 2.0,
+    ):
+        self.initial_in_seconds = initial_in_seconds
+        self.maximum_in_seconds = maximum_in_seconds
+        self.factor = factor
+        self._current = initial_in_seconds
+
+    def next(self) -> float:
+        """
+        Returns the next delay, somewhere between half of the current step and the full step
+        """
+        delay = random.uniform(self._current / 2, self._current)
+        self._current = min(self._current * self.factor, self.maximum_in_seconds)
+        return delay
+
+    def reset(self):
+        """
+        Starts over with the initial delay (e.g. after something changed)
+        """
+        self._current = self.initial_in_seconds
+
+
+class WaitTicket(BaseModel):
+    """
+    DTO representing one waiting run
+    """
+
+    ticket_id: str
+    user: str
+    pid: int
+    num_gpus: int
+    created_at: float
+    attempted_at: Optional[float] = None  # Time of the last failed attempt to acquire the GPUs
+    usable: List[str] = []  # uuids of the GPUs the last failed attempt could use, later runs may not take them
+
+    @property
+    def order(self) -> Tuple[float, str]:
+        """
+        Returns the sort key of the ticket (arrival time, ties broken by id)
+        """
+        return (self.created_at, self.ticket_id)
+
+
+class WaitQueue:
+    """
+    Host-wide FIFO of waiting runs, stored as JSON file guarded by an exclusive fcntl lock.
+    Tickets of exited processes are dropped whenever the queue is written. Every local user may write the queue,
+    so tickets are dropped as well if their process does not belong to their user, if they never tried to acquire
+    their GPUs within UNATTEMPTED_TICKET_TIMEOUT_IN_SECONDS or if their last attempt lies in the future.
+    """
+
+    def __init__(self, directory: Optional[Path] = None):
+        """
+        Args:
+            directory: Directory of the queue and the wakeup sockets (Default: WAIT_DIRECTORY)
+        """
+        self.directory: Path = directory or WAIT_DIRECTORY
+        self.path = self.directory / QUEUE_FILE_NAME
+
+    @staticmethod
+    def _trusted(tickets: List[WaitTicket], now: float) -> List[WaitTicket]:
+        owners = get_users_for_pids(ticket.pid for ticket in tickets)
+        return [
+            ticket
+            for ticket in tickets
+            if owners.get(ticket.pid) == ticket.user
+            and (ticket.attempted_at is not None or now - ticket.created_at <= UNATTEMPTED_TICKET_TIMEOUT_IN_SECONDS)
+            and (ticket.attempted_at is None or ticket.attempted_at <= now)
+        ]
+
+    @staticmethod
+    def _read(content: str) -> List[WaitTicket]:
+        try:
+            return [WaitTicket.model_validate(ticket) for ticket in json.loads(content)] if content else []
+        except ValueError:
+            # Waiters add their tickets again (see position)
+            return []
+
+    @contextmanager
+    def _locked(self) -> Iterator[List[WaitTicket]]:
+        """
+        Yields all tickets of running processes in arrival order. Changes to the list are written back.
+        """
+        descriptor = open_shared_file(self.path)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX)
+            with os.fdopen(os.dup(descriptor), "r+", encoding="utf-8") as queue:
+                tickets = self._trusted(self._read(queue.read()), time.time())
+
+                yield tickets
+
+                tickets.sort(key=lambda ticket: ticket.order)
+                queue.seek(0)
+                queue.truncate()
+                json.dump([ticket.model_dump() for ticket in tickets], queue)
+                queue.flush()
+        finally:
+            os.close(descriptor)  # Releases the lock
+
+    def tickets(self) -> List[WaitTicket]:
+        """
+        Returns all tickets in arrival order
+        """
+        with self._locked() as tickets:
+            return sorted(tickets, key=lambda ticket: ticket.order)
+
+    def enqueue(self, num_gpus: int, user: Optional[str] = None, pid: Optional[int] = None) -> WaitTicket:
+        """
+        Adds a ticket to the end of the queue
+
+        Args:
+            num_gpus: Number of GPUs the run waits for
+            user: Owner of the run (Default: the current user)
+            pid: Process waiting (Default: the current process)
+        """
+        ticket = WaitTicket(
+            ticket_id=uuid.uuid4().hex,
+            user=user or get_current_username(),
+            pid=os.getpid() if pid is None else pid,
+            num_gpus=num_gpus,
+            created_at=time.time(),
+        )
+        with self._locked() as tickets:
+            tickets.append(ticket)
+        return ticket
+
+    def position(self, ticket: WaitTicket) -> int:
+        """
+        Returns the number of runs ahead of the ticket. A lost ticket is added again at its original position.
+        """
+        with self._locked() as tickets:
+            if all(queued.ticket_id != ticket.ticket_id for queued in tickets):
+                tickets.append(ticket)
+            return sum(1 for queued in tickets if queued.order < ticket.order)
+
+    def record_attempt(self, ticket: WaitTicket, usable: Iterable[str]) -> Optional[WaitTicket]:
+        """
+        Records a failed attempt of the ticket to acquire its GPUs
+
+        Args:
+            ticket: The ticket (updated in place)
+            usable: uuids of the GPUs the attempt could use
+
+        Returns:
+            The next ticket in the queue or None if the ticket is the last one
+        """
+        ticket.attempted_at = time.time()
+        ticket.usable = sorted(usable)
+        with self._locked() as tickets:
+            tickets[:] = [queued for queued in tickets if queued.ticket_id != ticket.ticket_id]
+            tickets.append(ticket)
+            behind = [queued for queued in tickets if queued.order > ticket.order]
+            return min(behind, key=lambda queued: queued.order, default=None)
+
+    def reserved_ahead(self, ticket: WaitTicket, since: float) -> Optional[FrozenSet[str]]:
+        """
+        Returns the uuids of the GPUs the runs ahead of the ticket could use in their last attempt
+
+        Args:
+            ticket: The ticket
+            since: Attempts before this time are outdated (e.g. GPUs were released since then)
+
+        Returns:
+            The uuids or None if a run ahead did not try to acquire its GPUs since then
+        """
+        reserved: Set[str] = set()
+        for queued in self.tickets():
+            if queued.order >= ticket.order:
+                break
+            if queued.attempted_at is None or queued.attempted_at < since:
+                return None
+            reserved.update(queued.usable)
+        return frozenset(reserved)
+
+    def leave(self, ticket: WaitTicket):
+        """
+        Removes a ticket from the queue
+        """
+        with self._locked() as tickets:
+            tickets[:] = [queued for queued in tickets if queued.ticket_id != ticket.ticket_id]
+
+
+class WakeupSocket:
+    """
+    Datagram socket a waiter sleeps on. Every message wakes it up (see notify_waiters).
+    """
+
+    def __init__(self, directory: Optional[Path], name: str):
+        self.path = (directory or WAIT_DIRECTORY) / f"{name}.sock"
+        make_shared_directory(self.path.parent)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.socket.bind(str(self.path))
+        self.received: Set[bytes] = set()  # Messages of the last wakeup
+        # Every local user may wake up waiters
+        os.chmod(self.path, 0o666)
+
+    def __enter__(self) -> "WakeupSocket":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def wait(self, timeout_in_seconds: float) -> bool:
+        """
+        Sleeps until a notification arrives or the timeout passed
+
+        Returns:
+            True if woken up by a notification
+        """
+        self.received = set()
+        readable, _, _ = select.select([self.socket], [], [], max(timeout_in_seconds, 0.0))
+        if not readable:
+            return False
+        # Several notifications in a row need only one check
+        try:
+            while message := self.socket.recv(64):
+                self.received.add(message)
+        except BlockingIOError:
+            pass
+        return True
+
+    def notify(self):
+        """
+        Wakes up this socket only, e.g. from another thread of the waiting process
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.setblocking(False)
+            try:
+                sender.sendto(WAKEUP_MESSAGE, str(self.path))
+            except (BlockingIOError, ConnectionRefusedError, FileNotFoundError):
+                pass  # Unread notifications pending or the socket was closed
+
+    def close(self):
+        """
+        Closes and removes the socket
+        """
+        self.socket.close()
+        self.path.unlink(missing_ok=True)
+
+
+def notify_waiters(
+    directory: Optional[Path] = None, message: bytes = WAKEUP_MESSAGE, names: Optional[Iterable[str]] = None
+):
+    """
+    Wakes up all waiting runs of this host, e.g. after GPUs were released
+
+    Args:
+        directory: Directory of the wakeup sockets (Default: WAIT_DIRECTORY)
+        message: What changed (WAKEUP_MESSAGE or ATTEMPT_MESSAGE)
+        names: Wake up only the sockets with these names (Default: all)
+    """
+    directory = directory or WAIT_DIRECTORY
+    if not directory.exists():
+        return
+    paths = directory.glob("*.sock") if names is None else [directory / f"{name}.sock" for name in names]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+        sender.setblocking(False)
+        for path in paths:
+            try:
+                sender.sendto(message, str(path))
+            except BlockingIOError:
+                pass  # The waiter has unread notifications anyway
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The waiter was killed before removing its socket
+                try:
+                    path.unlink(missing_ok=True)
+                except PermissionError:
+                    pass
+            except PermissionError:
+                pass
+
+
+class GPUWaiter:  # pylint: disable=too-few-public-methods
+    """
+    Waits in the host-wide queue until the requested GPUs can be acquired.
+    The first run in the queue tries to acquire any GPUs. Later runs try only after every run ahead failed since the
+    last release and never take the GPUs those runs could use, so a run that can not start (e.g. over its limit or
+    with tight thresholds) does not block runs that can.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[Path] = None,
+        timeout_in_seconds: Optional[float] = None,
+        backoff: Optional[Backoff] = None,
+    ):
+        """
+        Args:
+            directory: Directory of the queue and the wakeup sockets (Default: WAIT_DIRECTORY)
+            timeout_in_seconds: Max. time to wait (Default: forever)
+            backoff: Delays between two checks without notification (Default: 1 to 30 seconds)
+        """
+        self.directory: Path = directory or WAIT_DIRECTORY
+        self.timeout_in_seconds = timeout_in_seconds
+        self.backoff = backoff or Backoff()
+
+    def wait(  # pylint: disable=too-many-locals
+        self,
+        num_gpus: int,
+        acquire: Callable[[FrozenSet[str]], List[GPU]],
+        release: Callable[[], None],
+        on_progress: Optional[Callable[[str], None]] = None,
+    ) -> List[GPU]:
+        """
+        Waits until acquire returns num_gpus GPUs
+
+        Args:
+            num_gpus: Number of GPUs to wait for
+            acquire: Samples and claims the GPUs, except those with the given uuids (usable by runs ahead)
+            release: Releases a partial selection of acquire
+            on_progress: Called with a short status message whenever the status changed
+
+        Raises:
+            WaitTimeoutException: if the GPUs did not become available in time
+        """
+        deadline = None if self.timeout_in_seconds is None else time.monotonic() + self.timeout_in_seconds
+        queue = WaitQueue(self.directory)
+        ticket = queue.enqueue(num_gpus)
+        last_message = None
+        # Attempts of the runs ahead before the last release are outdated
+        released_at = 0.0
+        try:
+            with WakeupSocket(self.directory, ticket.ticket_id) as wakeup:
+                while True:
+                    position = queue.position(ticket)
+                    reserved = frozenset() if position == 0 else queue.reserved_ahead(ticket, released_at)
+                    if reserved is not None:
+                        gpus = acquire(reserved)
+                        if len(gpus) >= num_gpus:
+                            return gpus
+                        # Do not hold a partial selection while waiting
+                        release()
+                        behind = queue.record_attempt(ticket, [gpu.uuid for gpu in gpus])
+                        if behind is not None:
+                            # The next run may backfill now instead of after its backoff
+                            notify_waiters(self.directory, ATTEMPT_MESSAGE, [behind.ticket_id])
+                        ahead = f", {position} runs ahead in the queue" if position > 0 else ""
+                        message = f"Waiting for GPUs ({len(gpus)}/{num_gpus} available{ahead})"
+                    else:
+                        message = f"Waiting for GPUs ({position} runs ahead in the queue)"
+
+                    if on_progress is not None and message != last_message:
+                        on_progress(message)
+                        last_message = message
+
+                    remaining = math.inf if deadline is None else deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise WaitTimeoutException(
+                            f"🚨 Your requested number of GPUs did not become available within "
+                            f"{self.timeout_in_seconds} seconds. 🚨"
+                        )
+                    if wakeup.wait(min(self.backoff.next(), remaining)) and wakeup.received != {ATTEMPT_MESSAGE}:
+                        released_at = time.time()
+                        self.backoff.reset()
+        finally:
+            queue.leave(ticket)
+            # The next run in the queue may try now
+            notify_waiters(self.directory)
@@ -0,0 +1,144 @@
+"""
+Live view of the GPU utilization (gpu-info --watch)
+"""
+
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Sequence
+
+from rich.console import Console
+from rich.live import Live
+from rich.table import Table
+from rich.text import Text
+
+from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.processing.gpu.providers import GPUProvider
+from experiment_runner.processing.gpu.rendering import (
+    COLUMN_NAMES,
+    format_value,
+    validate_attributes,
+)
+
+SPARKLINE_CHARACTERS = "▁▂▃▄▅▆▇█"
+HISTORY_LENGTH = 30  # Samples per GPU kept for the sparklines
+
+
+def sparkline(values: Iterable[float]) -> str:
+    """
+    Renders relative values (0 to 1) as a line of block characters. Unknown values are rendered as space.
+    """
+    top = len(SPARKLINE_CHARACTERS) - 1
+    return "".join(
+        " " if math.isnan(value) else SPARKLINE_CHARACTERS[round(min(max(value, 0.0), 1.0) * top)] for value in values
+    )
+
+
+class GPUHistory:
+    """
+    In-memory ring buffer of the load and memory usage of every GPU
+    """
+
+    def __init__(self, length: int = HISTORY_LENGTH):
+        self.length = length
+        self._load: Dict[str, Deque[float]] = {}
+        self._memory: Dict[str, Deque[float]] = {}
+
+    def append(self, gpus: Iterable[GPU]):
+        """
+        Adds one sample of every GPU. Old samples are dropped.
+        """
+        for gpu in gpus:
+            self._load.setdefault(gpu.uuid, deque(maxlen=self.length)).append(gpu.load)
+            memory_util = gpu.memory_used / gpu.memory_total if gpu.memory_total else math.nan
+            self._memory.setdefault(gpu.uuid, deque(maxlen=self.length)).append(memory_util)
+
+    def load(self, uuid: str) -> List[float]:
+        """
+        Returns the load history of a GPU, oldest first
+        """
+        return list(self._load.get(uuid, ()))
+
+    def memory(self, uuid: str) -> List[float]:
+        """
+        Returns the memory usage history of a GPU, oldest first
+        """
+        return list(self._memory.get(uuid, ()))
+
+
+class GPUWatchView:
+    """
+    Keeps the latest sample and the history of the live view. Every redraw formats the shown GPUs anew, the
+    sparklines shift with every sample anyway.
+    """
+
+    def __init__(
+        self, attributes: Iterable[str] = ("load", "memory_util", "temperature"), history_length=HISTORY_LENGTH
+    ):
+        """
+        Raises:
+            ValueError: if an attribute can not be rendered
+        """
+        self.attributes = validate_attributes(attributes)
+        self.history = GPUHistory(history_length)
+        self._gpus: List[GPU] = []
+
+    def update(self, gpus: Sequence[GPU]):
+        """
+        Adds a sample to the view
+        """
+        self.history.append(gpus)
+        self._gpus = list(gpus)
+
+    def render(self, max_rows: Optional[int] = None) -> Table:
+        """
+        Builds the table of the latest sample. At most max_rows GPUs are shown to bound the cost of a redraw.
+        """
+        table = Table(show_edge=False)
+        for attr in self.attributes:
+            table.add_column(COLUMN_NAMES[attr], justify="center")
+        table.add_column("Load history")
+        table.add_column("Memory history")
+
+        gpus = self._gpus if max_rows is None else self._gpus[:max_rows]
+        for gpu in gpus:
+            table.add_row(
+                *(Text(format_value(getattr(gpu, attr)), justify="center") for attr in self.attributes),
+                sparkline(self.history.load(gpu.uuid)),
+                sparkline(self.history.memory(gpu.uuid)),
+            )
+        if len(gpus) < len(self._gpus):
+            table.caption = f"{len(self._gpus) - len(gpus)} more GPUs not shown"
+        return table
+
+
+def watch_gpus(
+    provider: GPUProvider,
+    attributes: Iterable[str] = ("load", "memory_util", "temperature"),
+    interval_in_seconds: float = 1.0,
+    console: Optional[Console] = None,
+    max_updates: Optional[int] = None,
+):
+    """
+    Shows the GPU utilization until interrupted. The terminal is redrawn once per sample.
+
+    Args:
+        provider: Provider sampled once per interval (should not fork, e.g. the streaming sampler)
+        attributes: Attributes to show (see COLUMN_NAMES)
+        interval_in_seconds: Time between two samples
+        console: Console to draw on (Default: stdout)
+        max_updates: Stop after this many samples (Default: never)
+    """
+    view = GPUWatchView(attributes)
+    console = console or Console()
+    updates = 0
+    with Live(view.render(), console=console, auto_refresh=False) as live:
+        while max_updates is None or updates < max_updates:
+            started_at = time.monotonic()
+            gpus, _ = provider.sample()
+            view.update(gpus)
+            # Header, separator and caption need 4 lines
+            live.update(view.render(max_rows=max(console.size.height - 4, 1)), refresh=True)
+            updates += 1
+            if max_updates is None or updates < max_updates:
+                time.sleep(max(interval_in_seconds - (time.monotonic() - started_at), 0.0))
@@ -0,0 +1,403 @@
+"""
+Persistent job queue shared by all users of a host (SQLite). Jobs are dispatched by the scheduler daemon.
+Every user can write the shared queue, so what a job runs (command, working directory, log file and environment)
+is kept in a private spec of its user. Schedulers run only jobs with such a spec.
+"""
+
+import math
+import os
+import sqlite3
+import stat
+import time
+from contextlib import closing, contextmanager
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from pydantic import BaseModel
+
+from experiment_runner.utils import get_current_username, open_shared_file
+
+# /var/tmp survives reboots, so does the queue
+JOB_DATABASE_PATH = Path("/var/tmp/experiment-runner/jobs.sqlite")
+# Private files of the jobs of the current user (specs and default log files)
+JOB_DIRECTORY = Path("~/.local/share/experiment-runner/jobs").expanduser()
+DEFAULT_GPU_SELECTION = "load_memory_random"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    command TEXT NOT NULL,
+    working_directory TEXT NOT NULL,
+    num_gpus INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    walltime_in_seconds REAL,
+    gpu_selection TEXT NOT NULL,
+    min_free_memory INTEGER NOT NULL,
+    log_path TEXT,
+    state TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    ended_at REAL,
+    pid INTEGER,
+    process_started_at REAL,
+    gpus TEXT NOT NULL DEFAULT '',
+    return_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, priority DESC, submitted_at, id);
+"""
+
+
+class JobState(Enum):
+    """
+    Enum containing all states of a job
+    """
+
+    PENDING = "pending"  # waiting for GPUs
+    RUNNING = "running"
+    COMPLETED = "completed"  # exited with return code 0
+    FAILED = "failed"  # exited with another return code
+    CANCELLED = "cancelled"
+    TIMEOUT = "timeout"  # terminated after its walltime
+
+
+ACTIVE_STATES = (JobState.PENDING, JobState.RUNNING)
+
+
+class JobNotFoundException(Exception):
+    """
+    No job with the given id exists
+    """
+
+
+class Job(BaseModel):
+    """
+    DTO representing one submitted command
+    """
+
+    id: int
+    user: str
+    command: str
+    working_directory: str
+    num_gpus: int
+    priority: int = 0  # Higher priorities are dispatched first
+    walltime_in_seconds: Optional[float] = None  # Max. runtime, used for backfilling
+    gpu_selection: str = DEFAULT_GPU_SELECTION
+    min_free_memory: int = 0
+    log_path: Optional[str] = None
+    state: JobState = JobState.PENDING
+    submitted_at: float
+    started_at: Optional[float] = None
+    ended_at: Optional[float] = None
+    pid: Optional[int] = None
+    process_started_at: Optional[float] = None  # Start time of the process, pids are reused
+    gpus: str = ""  # Comma separated GPU ids
+    return_code: Optional[int] = None
+
+    @property
+    def expected_end(self) -> float:
+        """
+        Returns the time the job ends at the latest (inf if it is not running or has no walltime)
+        """
+        if self.started_at is None or self.walltime_in_seconds is None:
+            return math.inf
+        return self.started_at + self.walltime_in_seconds
+
+    @property
+    def gpu_ids(self) -> List[int]:
+        """
+        Returns the ids of the GPUs assigned to the job
+        """
+        return [int(gpu_id) for gpu_id in self.gpus.split(",") if gpu_id]
+
+
+class JobSpec(BaseModel):
+    """
+    DTO representing what a job runs, stored readable only by its user
+    """
+
+    job_id: int
+    submitted_at: float  # Of the job, so the spec does not match a later job with the same id
+    command: str
+    working_directory: str
+    log_path: Optional[str] = None
+    environment: Optional[Dict[str, str]] = None  # None: the environment of the scheduler
+
+
+def spec_path(job_id: int, directory: Optional[Path] = None) -> Path:
+    """
+    Returns the file holding the spec of a job
+    """
+    return (directory or JOB_DIRECTORY) / f"{job_id}.json"
+
+
+def save_spec(spec: JobSpec, directory: Optional[Path] = None):
+    """
+    Stores the spec of a job readable only by its user (the environment may contain secrets)
+    """
+    path = spec_path(spec.job_id, directory)
+    path.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+    path.unlink(missing_ok=True)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+    with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+        file.write(spec.model_dump_json())
+
+
+def load_spec(job: Job, directory: Optional[Path] = None) -> Optional[JobSpec]:
+    """
+    Returns the spec of a job, or None if the current user did not submit it: the spec does not exist, belongs to
+    another user, is accessible by others or was saved for another job
+    """
+    try:
+        descriptor = os.open(spec_path(job.id, directory), os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    with os.fdopen(descriptor, "r", encoding="utf-8") as file:
+        status = os.fstat(descriptor)
+        if status.st_uid != os.getuid() or stat.S_IMODE(status.st_mode) & 0o077:
+            return None
+        try:
+            spec = JobSpec.model_validate_json(file.read())
+        except (OSError, ValueError):
+            return None
+    if spec.job_id != job.id or spec.submitted_at != job.submitted_at:
+        return None
+    return spec
+
+
+def remove_spec(job_id: int, directory: Optional[Path] = None):
+    """
+    Removes the spec of an ended job, so it can not be run again
+    """
+    spec_path(job_id, directory).unlink(missing_ok=True)
+
+
+class JobQueue:
+    """
+    Jobs of all users in one SQLite database. Every operation is a single transaction,
+    so concurrent clients (submit, cancel and the schedulers of all users) never see partial updates.
+    """
+
+    def __init__(self, path: Optional[Path] = None, spec_directory: Optional[Path] = None):
+        """
+        Args:
+            path: Database file, shared by all users of the host (Default: JOB_DATABASE_PATH)
+            spec_directory: Private directory of the job specs of the current user (Default: JOB_DIRECTORY)
+        """
+        self.path: Path = path or JOB_DATABASE_PATH
+        self.spec_directory: Path = spec_directory or JOB_DIRECTORY
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # Creates the database file, refusing symlinks planted by other users. sqlite starts empty files over.
+        os.close(open_shared_file(self.path))
+        # The rollback journal (not WAL) works for files shared by several users
+        with closing(sqlite3.connect(str(self.path), timeout=30, isolation_level=None)) as connection:
+            connection.row_factory = sqlite3.Row
+            connection.executescript(_SCHEMA)
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Job:
+        return Job(**dict(row))
+
+    def submit(
+        self,
+        command: str,
+        num_gpus: int = 1,
+        priority: int = 0,
+        walltime_in_seconds: Optional[float] = None,
+        *,
+        gpu_selection: str = DEFAULT_GPU_SELECTION,
+        min_free_memory: int = 0,
+        log_path: Optional[Path] = None,
+        working_directory: Optional[Path] = None,
+        environment: Optional[Dict[str, str]] = None,
+        user: Optional[str] = None,
+    ) -> Job:
+        """
+        Adds a pending job and saves its spec
+
+        Args:
+            command: The command to run
+            num_gpus: Number of GPUs of the job
+            priority: Jobs with higher priority are dispatched first
+            walltime_in_seconds: Max. runtime. Jobs with walltime may be backfilled into gaps.
+            gpu_selection: Strategy for GPU selection (see SelectionStrategyEnum)
+            min_free_memory: Minimum free memory (MiB) of a GPU
+            log_path: Output file (Default: <JOB_DIRECTORY>/<id>.log)
+            working_directory: Working directory of the command (Default: the current one)
+            environment: Environment of the command (Default: the one of the scheduler)
+            user: Owner of the job (Default: the current user)
+
+        Returns:
+            The created job
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "INSERT INTO jobs (user, command, working_directory, num_gpus, priority, walltime_in_seconds,"
+                " gpu_selection, min_free_memory, log_path, state, submitted_at) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                (
+                    user or get_current_username(),
+                    command,
+                    str(working_directory or Path.cwd()),
+                    num_gpus,
+                    priority,
+                    walltime_in_seconds,
+                    gpu_selection,
+                    min_free_memory,
+                    str(log_path) if log_path else None,
+                    JobState.PENDING.value,
+                    time.time(),
+                ),
+            )
+            job = self._job(connection.execute("SELECT * FROM jobs WHERE id = ?", (cursor.lastrowid,)).fetchone())
+            # Before the commit, so schedulers never see the job without its spec
+            save_spec(
+                JobSpec(
+                    job_id=job.id,
+                    submitted_at=job.submitted_at,
+                    command=job.command,
+                    working_directory=job.working_directory,
+                    log_path=job.log_path,
+                    environment=environment,
+                ),
+                self.spec_directory,
+            )
+        return job
+
+    def get(self, job_id: int) -> Job:
+        """
+        Returns a job
+
+        Raises:
+            JobNotFoundException: if the job does not exist
+        """
+        with self._transaction() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFoundException(f"Job {job_id} does not exist.")
+        return self._job(row)
+
+    def jobs(self, states: Optional[Iterable[JobState]] = None, user: Optional[str] = None) -> List[Job]:
+        """
+        Returns jobs in dispatch order (highest priority first, then in order of submission)
+
+        Args:
+            states: Only jobs in these states (Default: all)
+            user: Only jobs of this user (Default: all users)
+        """
+        query = "SELECT * FROM jobs WHERE 1 = 1"
+        parameters: List[object] = []
+        if states is not None:
+            values = [state.value for state in states]
+            query += f" AND state IN ({','.join('?' * len(values))})"
+            parameters.extend(values)
+        if user is not None:
+            query += " AND user = ?"
+            parameters.append(user)
+        query += " ORDER BY priority DESC, submitted_at, id"
+        with self._transaction() as connection:
+            rows = connection.execute(query, parameters).fetchall()
+        return [self._job(row) for row in rows]
+
+    def start(self, job_id: int, gpu_ids: Iterable[int], pid: Optional[int] = None) -> bool:
+        """
+        Marks a pending job as running
+
+        Returns:
+            False if the job is not pending anymore (e.g. cancelled meanwhile)
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET state = ?, started_at = ?, gpus = ?, pid = ? WHERE id = ? AND state = ?",
+                (
+                    JobState.RUNNING.value,
+                    time.time(),
+                    ",".join(str(gpu_id) for gpu_id in gpu_ids),
+                    pid,
+                    job_id,
+                    JobState.PENDING.value,
+                ),
+            )
+        return cursor.rowcount == 1
+
+    def set_pid(self, job_id: int, pid: int, process_started_at: Optional[float] = None):
+        """
+        Records the process of a running job
+
+        Args:
+            job_id: The job
+            pid: The process
+            process_started_at: Start time of the process (see get_process_start_time)
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET pid = ?, process_started_at = ? WHERE id = ?", (pid, process_started_at, job_id)
+            )
+
+    def finish(self, job_id: int, return_code: Optional[int], state: Optional[JobState] = None):
+        """
+        Records the end of a running job. Cancelled jobs stay cancelled.
+
+        Args:
+            job_id: The job
+            return_code: Return code of the command
+            state: Final state (Default: by return code)
+        """
+        state = state or (JobState.COMPLETED if return_code == 0 else JobState.FAILED)
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = CASE WHEN state = ? THEN ? ELSE state END, ended_at = ?, return_code = ?"
+                " WHERE id = ?",
+                (JobState.RUNNING.value, state.value, time.time(), return_code, job_id),
+            )
+
+    def requeue(self, job_id: int):
+        """
+        Puts a running job back into the queue (e.g. after its scheduler stopped). It keeps its position.
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = ?, started_at = NULL, pid = NULL, process_started_at = NULL, gpus = ''"
+                " WHERE id = ? AND state = ?",
+                (JobState.PENDING.value, job_id, JobState.RUNNING.value),
+            )
+
+    def cancel(self, job_id: int, user: Optional[str] = None) -> Job:
+        """
+        Cancels a pending or running job. Running jobs are terminated by their scheduler.
+
+        Args:
+            job_id: The job
+            user: User cancelling the job (Default: the current user)
+
+        Raises:
+            JobNotFoundException: if the job does not exist
+            PermissionError: if the job belongs to another user
+            ValueError: if the job already ended
+        """
+        user = user or get_current_username()
+        with self._transaction() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                raise JobNotFoundException(f"Job {job_id} does not exist.")
+            job = self._job(row)
+            if job.user != user:
+                raise PermissionError(f"Job {job_id} belongs to {job.user}.")
+            if job.state not in ACTIVE_STATES:
+                raise ValueError(f"Job {job_id} already ended ({job.state.value}).")
+            connection.execute(
+                "UPDATE jobs SET state = ?, ended_at = COALESCE(ended_at, ?) WHERE id = ?",
+                (JobState.CANCELLED.value, time.time() if job.state == JobState.PENDING else None, job_id),
+            )
+        if job.state == JobState.PENDING:
+            remove_spec(job_id, self.spec_directory)
+        return job.model_copy(update={"state": JobState.CANCELLED})
@@ -0,0 +1,272 @@
+"""
+Multi-stage pipelines: stages declare their dependencies and GPUs, and every stage starts as soon as its
+dependencies succeeded and GPUs are free, so independent stages run concurrently.
+"""
+
+import os
+import queue
+import threading
+import time
+from functools import lru_cache
+from graphlib import CycleError, TopologicalSorter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from omegaconf import OmegaConf
+from pydantic import BaseModel
+
+from experiment_runner.processing.callbacks import LoggerCallback
+from experiment_runner.processing.gpu.manager import GPUManager
+from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.processing.gpu.waiting import (
+    MAX_BACKOFF_IN_SECONDS,
+    WAIT_DIRECTORY,
+    Backoff,
+    WakeupSocket,
+    notify_waiters,
+)
+from experiment_runner.processing.subprocesses import CommandRunner
+
+
+class Stage(BaseModel):
+    """
+    DTO representing one stage of a pipeline
+    """
+
+    command: str
+    needs: List[str] = []  # Stages which must succeed before this one starts
+    gpus: int = 0  # 0: the stage needs no GPU
+    per_gpu: bool = False  # Start one rank per GPU (see CommandRunner.run_per_gpu)
+    env: Dict[str, str] = {}
+
+
+class Pipeline(BaseModel):
+    """
+    DTO representing a pipeline file
+    """
+
+    stages: Dict[str, Stage]
+
+    def validate_graph(self):
+        """
+        Raises:
+            ValueError: if a stage needs an unknown stage or the dependencies contain a cycle
+        """
+        for name, stage in self.stages.items():
+            unknown = [need for need in stage.needs if need not in self.stages]
+            if unknown:
+                raise ValueError(f"Stage {name} needs unknown stages: {unknown}")
+        try:
+            TopologicalSorter(self.graph).prepare()
+        except CycleError as exc:
+            raise ValueError(f"The stages depend on each other in a cycle: {exc.args[1]}") from exc
+
+    @property
+    def graph(self) -> Dict[str, List[str]]:
+        """
+        Returns the dependencies of every stage
+        """
+        return {name: list(stage.needs) for name, stage in self.stages.items()}
+
+    def critical_path_lengths(self) -> Dict[str, int]:
+        """
+        Returns the number of stages on the longest chain from every stage to the end of the pipeline.
+        Stages with longer chains are started first.
+        """
+        dependents: Dict[str, List[str]] = {name: [] for name in self.stages}
+        for name, stage in self.stages.items():
+            for need in stage.needs:
+                dependents[need].append(name)
+
+        @lru_cache(maxsize=None)
+        def length(name: str) -> int:
+            return 1 + max((length(dependent) for dependent in dependents[name]), default=0)
+
+        return {name: length(name) for name in self.stages}
+
+
+class StageResult(BaseModel):
+    """
+    DTO representing the outcome of a stage
+    """
+
+    name: str
+    gpus: List[int] = []
+    return_code: Optional[int] = None  # None: skipped, because a dependency failed
+    duration_in_seconds: float = 0.0
+    log_path: Optional[str] = None
+
+    @property
+    def succeeded(self) -> bool:
+        """
+        Returns True if the stage ran successfully
+        """
+        return self.return_code == 0
+
+
+def load_pipeline(path: Path) -> Pipeline:
+    """
+    Reads a pipeline file (YAML, interpolations are resolved by OmegaConf)
+
+    Raises:
+        ValueError: if the file is no valid pipeline
+    """
+    content = OmegaConf.to_container(OmegaConf.load(path), resolve=True)
+    if not isinstance(content, dict):
+        raise ValueError(f"{path} does not contain a pipeline.")
+    pipeline = Pipeline.model_validate(content)
+    pipeline.validate_graph()
+    return pipeline
+
+
+class PipelineRunner:  # pylint: disable=too-few-public-methods
+    """
+    Runs the stages of a pipeline in dependency order. Ready stages start whenever the manager finds enough free
+    GPUs, stages on the longest remaining chain first. Stages depending on a failed stage are skipped.
+    """
+
+    def __init__(
+        self,
+        manager: GPUManager,
+        log_directory: Path,
+        *,
+        backoff: Optional[Backoff] = None,
+        wakeup_directory: Optional[Path] = None,
+        **availability: Any,
+    ):
+        """
+        Args:
+            manager: Selects and claims the GPUs of the stages
+            log_directory: Directory of the stage logs
+            backoff: Delays between two checks for free GPUs without notification
+            wakeup_directory: Directory of the wakeup sockets (Default: WAIT_DIRECTORY)
+            availability: max_load, max_memory and memory_free passed to GPUManager.get_available
+        """
+        self.manager = manager
+        self.log_directory = log_directory
+        self.backoff = backoff or Backoff(maximum_in_seconds=MAX_BACKOFF_IN_SECONDS)
+        self.wakeup_directory: Path = wakeup_directory or WAIT_DIRECTORY
+        self.availability = availability
+        self.results: Dict[str, StageResult] = {}
+        self._finished: "queue.Queue[StageResult]" = queue.Queue()
+
+    def _run_stage(self, name: str, stage: Stage, gpus: List[GPU], wakeup: WakeupSocket):
+        log_path = self.log_directory / f"{name}.log"
+        runner = CommandRunner([LoggerCallback(log_path)], echo=False)
+        # The name of the stage wins over an EXPERIMENT_STAGE in the env of the stage
+        env = {**os.environ, **stage.env, "EXPERIMENT_STAGE": name}
+        started_at = time.monotonic()
+        return_code = -1
+        try:
+            if stage.per_gpu and gpus:
+                return_code = runner.run_per_gpu(stage.command, gpus, env=env)
+            else:
+                return_code = runner.run_gpu(stage.command, gpus, env=env)
+        finally:
+            if gpus:
+                self.manager.release_reservations(gpus)
+                notify_waiters(self.wakeup_directory)
+            self._finished.put(
+                StageResult(
+                    name=name,
+                    gpus=[gpu.id for gpu in gpus],
+                    return_code=return_code,
+                    duration_in_seconds=time.monotonic() - started_at,
+                    log_path=str(log_path),
+                )
+            )
+            wakeup.notify()
+
+    def _try_start(self, name: str, stage: Stage, wakeup: WakeupSocket) -> Optional[threading.Thread]:
+        gpus: List[GPU] = []
+        if stage.gpus > 0:
+            gpus = self.manager.reserve_available(limit=stage.gpus, **self.availability)
+            if len(gpus) < stage.gpus:
+                self.manager.release_reservations(gpus)
+                return None
+        thread = threading.Thread(target=self._run_stage, args=(name, stage, gpus, wakeup), daemon=True)
+        thread.start()
+        return thread
+
+    def _skip_dependents(self, pipeline: Pipeline, failed: str):
+        skipped = [failed]
+        while skipped:
+            current = skipped.pop()
+            for name, stage in pipeline.stages.items():
+                if current in stage.needs and name not in self.results:
+                    self.results[name] = StageResult(name=name)
+                    skipped.append(name)
+
+    def run(self, pipeline: Pipeline) -> List[StageResult]:
+        """
+        Runs all stages and blocks until they ended
+
+        Returns:
+            The results in the order of the pipeline file
+        """
+        pipeline.validate_graph()
+        self.log_directory.mkdir(parents=True, exist_ok=True)
+        priorities = pipeline.critical_path_lengths()
+        sorter = TopologicalSorter(pipeline.graph)
+        sorter.prepare()
+
+        ready: List[str] = []
+        running: Dict[str, threading.Thread] = {}
+        with WakeupSocket(self.wakeup_directory, f"pipeline-{os.getpid()}") as wakeup:
+            while sorter.is_active():
+                ready.extend(sorter.get_ready())
+                self._mark_skipped(ready, sorter)
+                ready.sort(key=lambda name: (-priorities[name], list(pipeline.stages).index(name)))
+
+                started = False
+                for name in list(ready):
+                    thread = self._try_start(name, pipeline.stages[name], wakeup)
+                    if thread is not None:
+                        ready.remove(name)
+                        running[name] = thread
+                        started = True
+                if started:
+                    self.backoff.reset()
+
+                if not running and not ready:
+                    continue
+                # Wakes up when a stage ended or GPUs were released, e.g. by other runs
+                if wakeup.wait(self.backoff.next()):
+                    self.backoff.reset()
+                for result in self._drain_finished():
+                    running.pop(result.name).join()
+                    self.results[result.name] = result
+                    if not result.succeeded:
+                        self._skip_dependents(pipeline, result.name)
+                    sorter.done(result.name)
+
+        return [self.results[name] for name in pipeline.stages]
+
+    def _mark_skipped(self, ready: List[str], sorter: "TopologicalSorter[str]"):
+        # Skipped stages are marked done, so the sorter keeps handing out the independent stages
+        for name in [name for name in ready if name in self.results]:
+            ready.remove(name)
+            sorter.done(name)
+
+    def _drain_finished(self) -> List[StageResult]:
+        results = []
+        while True:
+            try:
+                results.append(self._finished.get_nowait())
+            except queue.Empty:
+                return results
+
+
+def summarize(results: List[StageResult]) -> Tuple[int, List[str]]:
+    """
+    Summarizes the results of a pipeline, e.g. for a notification
+
+    Returns:
+        The return code of the pipeline (the one of the first failed stage or 0) and one line per stage
+    """
+    return_code = next((result.return_code for result in results if result.return_code), 0)
+    lines = []
+    for result in results:
+        status = "skipped" if result.return_code is None else f"return code {result.return_code}"
+        lines.append(f"{result.name}: {status} after {result.duration_in_seconds:.1f}s\n")
+    return return_code or 0, lines
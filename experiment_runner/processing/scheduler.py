@@ -0,0 +1,396 @@
+"""
+Scheduler daemon dispatching the jobs of the queue (experiment submit) as GPUs become available.
+Every user runs their own scheduler. All schedulers plan on the shared queue, so they agree on which jobs start,
+and each one starts only the jobs of its user. Jobs of users without a running scheduler are not planned, so they
+do not hold back GPUs nobody would start them on. What a job runs is read from the private spec of the user, never
+from the shared queue, which every user can write.
+"""
+
+import fcntl
+import math
+import os
+import signal
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from experiment_runner.processing.callbacks import LoggerCallback
+from experiment_runner.processing.gpu.manager import GPUManager
+from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.processing.gpu.reservations import GPUClaim, is_process_alive
+from experiment_runner.processing.gpu.snapshot import GPUSnapshot
+from experiment_runner.processing.gpu.strategies import (
+    SelectionStrategyEnum,
+    SelectionStrategyFactory,
+)
+from experiment_runner.processing.gpu.waiting import (
+    MAX_BACKOFF_IN_SECONDS,
+    WAIT_DIRECTORY,
+    Backoff,
+    WakeupSocket,
+    notify_waiters,
+)
+from experiment_runner.processing.jobs import (
+    JOB_DIRECTORY,
+    Job,
+    JobNotFoundException,
+    JobQueue,
+    JobSpec,
+    JobState,
+    load_spec,
+    remove_spec,
+)
+from experiment_runner.processing.subprocesses import CommandRunner
+from experiment_runner.utils import get_process_start_time, open_shared_file
+
+# Time a terminated job gets to exit before it is killed, so jobs ignoring SIGTERM do not keep their GPUs
+TERMINATION_TIMEOUT_IN_SECONDS = 5.0
+
+
+class SchedulerAlreadyRunningException(Exception):
+    """
+    Another scheduler of the same user is running
+    """
+
+
+def _get_lock_path(queue: JobQueue, user: str) -> Path:
+    return queue.path.parent / f"scheduler-{user}.lock"
+
+
+def is_scheduler_running(user: str, queue: Optional[JobQueue] = None) -> bool:
+    """
+    Checks whether a scheduler of the user is running, i.e. whether the jobs of the user are started
+
+    Args:
+        user: The user
+        queue: The job queue (Default: the queue of this host)
+    """
+    try:
+        pid = int(_get_lock_path(queue or JobQueue(), user).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    return is_process_alive(pid)
+
+
+def _reservation(job: Job, free_gpus: int, releases: List[Tuple[float, int]]) -> Tuple[float, int]:
+    # Earliest time enough GPUs for the job are free and the GPUs left over at that time
+    available = free_gpus
+    for end, num_gpus in sorted(releases):
+        if end == math.inf:
+            break
+        available += num_gpus
+        if available >= job.num_gpus:
+            return end, available - job.num_gpus
+    return math.inf, 0
+
+
+def plan_jobs(
+    pending: Sequence[Job],
+    running: Sequence[Job],
+    free_gpus: Union[int, Sequence[float]],
+    now: float,
+    quotas: Optional[Dict[str, int]] = None,
+) -> List[Job]:
+    """
+    Selects the pending jobs to start now (EASY backfilling).
+    Jobs start in order until the first one does not fit. That job gets a reservation at the earliest time enough
+    GPUs are free (by the walltimes of the running jobs). Later jobs may start before it, if they end before the
+    reservation or only use GPUs the reserved job does not need (e.g. with too little free memory for it).
+
+    Args:
+        pending: Pending jobs in dispatch order
+        running: Running jobs
+        free_gpus: Free memory (MiB) of every GPU available now, or their number if the memory does not matter.
+            A job fits on GPUs with at least its min_free_memory.
+        now: Current time
+        quotas: Number of GPUs every user may still use (Default: no limits). Jobs over the quota of their user
+            are skipped without a reservation, they could not get their GPUs anyway.
+
+    Returns:
+        The jobs to start, in dispatch order
+    """
+    free_memory = sorted([math.inf] * free_gpus if isinstance(free_gpus, int) else free_gpus)
+    remaining = dict(quotas) if quotas is not None else None
+    releases = [(job.expected_end, job.num_gpus) for job in running]
+    started = []
+    shadow_time: Optional[float] = None
+    extra_gpus = 0
+    for job in pending:
+        if remaining is not None and job.num_gpus > remaining.get(job.user, 0):
+            continue
+        fitting = [index for index, memory in enumerate(free_memory) if memory >= job.min_free_memory]
+        if job.num_gpus > len(fitting):
+            if shadow_time is None:
+                shadow_time, extra_gpus = _reservation(job, len(fitting), releases)
+                # The reserved job does not need the free GPUs it does not fit on
+                extra_gpus += len(free_memory) - len(fitting)
+            continue
+
+        if shadow_time is not None:
+            ends_in_time = job.walltime_in_seconds is not None and now + job.walltime_in_seconds <= shadow_time
+            if not ends_in_time:
+                if job.num_gpus > extra_gpus:
+                    continue
+                extra_gpus -= job.num_gpus
+
+        started.append(job)
+        if remaining is not None:
+            remaining[job.user] -= job.num_gpus
+        # The job gets the fitting GPUs with the least free memory
+        for index in reversed(fitting[: job.num_gpus]):
+            del free_memory[index]
+        end = math.inf if job.walltime_in_seconds is None else now + job.walltime_in_seconds
+        releases.append((end, job.num_gpus))
+    return started
+
+
+@dataclass
+class _RunningJob:
+    job: Job
+    spec: JobSpec
+    gpus: List[GPU]
+    runner: CommandRunner
+    thread: Optional[threading.Thread] = None
+    return_code: Optional[int] = None
+    final_state: Optional[JobState] = None  # Set when the scheduler terminated the job
+    kill_at: Optional[float] = None  # Time (monotonic) the terminated job is killed at if it is still running
+
+
+class Scheduler:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Dispatches the jobs of the current user. Wakes up on submissions, cancellations and released GPUs,
+    and checks at least every MAX_BACKOFF_IN_SECONDS otherwise.
+    """
+
+    def __init__(
+        self,
+        manager: GPUManager,
+        queue: Optional[JobQueue] = None,
+        job_directory: Optional[Path] = None,
+        wakeup_directory: Optional[Path] = None,
+        backoff: Optional[Backoff] = None,
+    ):
+        """
+        Args:
+            manager: Selects and claims the GPUs of the jobs
+            queue: The job queue (Default: the queue of this host)
+            job_directory: Directory of the default logs (Default: JOB_DIRECTORY)
+            wakeup_directory: Directory of the wakeup sockets (Default: WAIT_DIRECTORY)
+            backoff: Delays between two checks without notification
+        """
+        self.manager = manager
+        self.queue = queue or JobQueue()
+        self.job_directory: Path = job_directory or JOB_DIRECTORY
+        self.wakeup_directory: Path = wakeup_directory or WAIT_DIRECTORY
+        self.backoff = backoff or Backoff(maximum_in_seconds=MAX_BACKOFF_IN_SECONDS)
+        self.user = manager.username
+        self._running: Dict[int, _RunningJob] = {}
+        self._stopped = threading.Event()
+        self._lock_descriptor: Optional[int] = None
+
+    def _acquire_lock(self):
+        descriptor = open_shared_file(_get_lock_path(self.queue, self.user))
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as exc:
+            os.close(descriptor)
+            raise SchedulerAlreadyRunningException(f"A scheduler of {self.user} is already running.") from exc
+        # The schedulers of the other users plan the jobs of this user while this process is alive
+        os.ftruncate(descriptor, 0)
+        os.write(descriptor, str(os.getpid()).encode())
+        self._lock_descriptor = descriptor
+
+    def is_scheduler_running(self, user: str) -> bool:
+        """
+        Checks whether a scheduler of the user is running (always True for the user of this scheduler)
+        """
+        return user == self.user or is_scheduler_running(user, self.queue)
+
+    def recover(self):
+        """
+        Requeues the running jobs of a previous scheduler of this user. Orphaned processes are terminated,
+        because their result can not be observed anymore. Processes are only terminated if their start time
+        matches the recorded one, the pid may belong to another process by now (e.g. after a reboot).
+        """
+        for job in self.queue.jobs([JobState.RUNNING], user=self.user):
+            if job.id in self._running:
+                continue
+            if (
+                job.pid is not None
+                and job.process_started_at is not None
+                and get_process_start_time(job.pid) == job.process_started_at
+            ):
+                try:
+                    os.kill(job.pid, signal.SIGTERM)
+                except (ProcessLookupError, PermissionError):
+                    pass
+            self.queue.requeue(job.id)
+
+    def _free_gpus(self, snapshot: GPUSnapshot, claims: List[GPUClaim]) -> List[float]:
+        # Free memory of the available GPUs, every job needs its own min_free_memory on top (see plan_jobs)
+        mask = snapshot.table.is_available()
+        claimed = {claim.gpu_uuid for claim in claims}
+        return [
+            float(memory_free)
+            for gpu, memory_free, available in zip(snapshot.table.rows, snapshot.table.memory_free, mask)
+            if available and gpu.uuid not in claimed
+        ]
+
+    def _execute(self, running: _RunningJob):
+        running.return_code = running.runner.run_gpu(
+            running.spec.command,
+            running.gpus,
+            cwd=Path(running.spec.working_directory),
+            env=running.spec.environment,
+        )
+        # Wakes up this scheduler and all waiting runs
+        notify_waiters(self.wakeup_directory)
+
+    def _reject(self, job: Job):
+        # Anyone can add jobs in the name of this user to the shared queue
+        try:
+            self.queue.cancel(job.id, self.user)
+        except (JobNotFoundException, PermissionError, ValueError):
+            pass
+
+    def _dispatch(self, job: Job) -> bool:
+        spec = load_spec(job, self.queue.spec_directory)
+        if spec is None:
+            self._reject(job)
+            return False
+
+        self.manager.strategy = SelectionStrategyFactory.get_instance(SelectionStrategyEnum(job.gpu_selection))
+        gpus = self.manager.reserve_available(limit=job.num_gpus, memory_free=job.min_free_memory)
+        if len(gpus) < job.num_gpus or not self.queue.start(job.id, [gpu.id for gpu in gpus]):
+            self.manager.release_reservations(gpus)
+            return False
+
+        log_path = Path(spec.log_path) if spec.log_path else self.job_directory / f"{job.id}.log"
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        runner = CommandRunner([LoggerCallback(log_path)], echo=False)
+        running = _RunningJob(job, spec, gpus, runner)
+        running.thread = threading.Thread(target=self._execute, args=(running,), daemon=True)
+        self._running[job.id] = running
+        running.thread.start()
+        return True
+
+    def _update_running(self, now: float) -> bool:
+        changed = False
+        states = {job.id: job for job in self.queue.jobs([JobState.CANCELLED, JobState.RUNNING], user=self.user)}
+        for job_id, running in list(self._running.items()):
+            process = running.runner.process
+            if running.thread is None or not running.thread.is_alive():
+                self.queue.finish(job_id, running.return_code, running.final_state)
+                remove_spec(job_id, self.queue.spec_directory)
+                self.manager.release_reservations(running.gpus)
+                del self._running[job_id]
+                changed = True
+                continue
+            if process is None:
+                continue
+            if running.job.pid is None:
+                process_started_at = get_process_start_time(process.pid)
+                self.queue.set_pid(job_id, process.pid, process_started_at)
+                running.job = running.job.model_copy(
+                    update={"pid": process.pid, "process_started_at": process_started_at}
+                )
+
+            current = states.get(job_id)
+            if current is not None and current.state == JobState.CANCELLED:
+                running.final_state = JobState.CANCELLED
+            elif running.job.walltime_in_seconds is not None and current is not None:
+                if now > current.expected_end and running.final_state is None:
+                    running.final_state = JobState.TIMEOUT
+            if running.final_state is not None:
+                self._terminate(running, process)
+        return changed
+
+    @staticmethod
+    def _terminate(running: _RunningJob, process: subprocess.Popen):
+        # Terminates the job and kills it, if it is still running TERMINATION_TIMEOUT_IN_SECONDS later
+        if running.kill_at is None:
+            running.kill_at = time.monotonic() + TERMINATION_TIMEOUT_IN_SECONDS
+            process.terminate()
+        elif time.monotonic() > running.kill_at:
+            process.kill()
+
+    def step(self, now: Optional[float] = None) -> List[Job]:
+        """
+        Records finished jobs, terminates cancelled and timed out jobs and starts the planned jobs of this user
+
+        Returns:
+            The started jobs
+        """
+        now = time.time() if now is None else now
+        self._update_running(now)
+
+        pending = self.queue.jobs([JobState.PENDING])
+        scheduled_users = {user for user in {job.user for job in pending} if self.is_scheduler_running(user)}
+        pending = [job for job in pending if job.user in scheduled_users]
+        if not pending:
+            return []
+        running = self.queue.jobs([JobState.RUNNING])
+        snapshot = self.manager.snapshot()
+        claims = self.manager.ledger.claims() if self.manager.ledger else []
+        # The GPUs of a user over their limit stay free for the jobs of others
+        quotas = {user: self.manager.get_remaining_gpus_of_user(user, snapshot, claims) for user in scheduled_users}
+        started = []
+        for job in plan_jobs(pending, running, self._free_gpus(snapshot, claims), now, quotas):
+            # Jobs of other users are started by their schedulers. Running jobs are only started again after
+            # they were requeued.
+            if job.user == self.user and job.id not in self._running and self._dispatch(job):
+                started.append(job)
+        return started
+
+    def serve_forever(self):
+        """
+        Dispatches jobs until stop() is called. Jobs still running then are terminated and requeued.
+
+        Raises:
+            SchedulerAlreadyRunningException: if another scheduler of this user is running
+        """
+        self._acquire_lock()
+        self._stopped.clear()
+        try:
+            self.recover()
+            with WakeupSocket(self.wakeup_directory, f"scheduler-{os.getpid()}") as wakeup:
+                while not self._stopped.is_set():
+                    if self.step():
+                        self.backoff.reset()
+                    if wakeup.wait(self.backoff.next()):
+                        self.backoff.reset()
+        finally:
+            self.close()
+
+    def stop(self):
+        """
+        Stops serve_forever (thread-safe)
+        """
+        self._stopped.set()
+        notify_waiters(self.wakeup_directory)
+
+    def close(self):
+        """
+        Terminates and requeues all running jobs of this scheduler
+        """
+        # Jobs which ended on their own are recorded as usual
+        self._update_running(time.time())
+        for job_id, running in list(self._running.items()):
+            deadline = time.monotonic() + 10
+            # The process may not have been started yet
+            while running.thread is not None and running.thread.is_alive() and time.monotonic() < deadline:
+                process = running.runner.process
+                if process is not None:
+                    self._terminate(running, process)
+                running.thread.join(timeout=0.1)
+            self.manager.release_reservations(running.gpus)
+            self.queue.requeue(job_id)
+            del self._running[job_id]
+        if self._lock_descriptor is not None:
+            os.ftruncate(self._lock_descriptor, 0)
+            os.close(self._lock_descriptor)
+            self._lock_descriptor = None
@@ -4,32 +4,162 @@ This module handles the execution of subcommands in processes.
 
 # pylint: disable=too-few-public-methods
 import atexit
+import codecs
+import errno
+import fcntl
 import os
+import pty
+import selectors
 import shlex
+import shutil
+import socket
+import struct
 import subprocess
 import sys
-from typing import Dict, List, Optional
+import termios
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
 
 import typer
 from rich import print  # pylint: disable=redefined-builtin
 
-from experiment_runner.processing.callbacks import Callback
+from experiment_runner.processing.callbacks import STDERR, STDOUT, Callback, call_on_log
 from experiment_runner.processing.gpu.models import GPU
 
+# Time the other ranks get to exit after one rank failed, before they are killed
+TEARDOWN_TIMEOUT_IN_SECONDS = 5.0
+# Time the outputs of the ranks may stay open after all ranks exited (e.g. held by background children)
+OUTPUT_DRAIN_TIMEOUT_IN_SECONDS = 1.0
+RANK_POLL_INTERVAL_IN_SECONDS = 0.1  # Max. time until an exited rank is noticed
+READ_SIZE = 65536  # Bytes read from an output at once
+MAX_LINE_LENGTH = 1024 * 1024  # Longer lines are passed to the callbacks in parts
+
+
+def get_free_port() -> int:
+    """
+    Returns a TCP port currently free on localhost (e.g. for MASTER_PORT)
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def open_pty() -> Tuple[int, int]:
+    """
+    Opens a pseudo-terminal with the size of the current terminal. Line ends written to it are passed unchanged.
+
+    Returns:
+        The file descriptors of the master (read by us) and the slave (given to the command)
+    """
+    master, slave = pty.openpty()
+    attributes = termios.tcgetattr(slave)
+    attributes[1] &= ~termios.ONLCR  # Output flags: keep \n instead of \r\n
+    termios.tcsetattr(slave, termios.TCSANOW, attributes)
+    size = shutil.get_terminal_size()
+    fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", size.lines, size.columns, 0, 0))
+    return master, slave
+
+
+def _read_into(fd: int, buffer: bytearray) -> int:
+    try:
+        return os.readv(fd, [buffer])
+    except OSError as err:
+        # The master of a pseudo-terminal fails instead of returning the end of file, once the command exited
+        if err.errno == errno.EIO:
+            return 0
+        raise
+
+
+def _split_lines(text: str, overwrite: bool = False) -> List[str]:
+    # Like the universal newlines of text mode: \r\n and \r end lines as well. Like a terminal if overwrite:
+    # \r returns to the start of the line, so only the last text written to a line remains (e.g. of progress bars)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+        if overwrite:
+            lines = []
+            for line in text.split("\n"):
+                parts = [part for part in line.split("\r") if part]
+                lines.append(parts[-1] if parts else "")
+        else:
+            lines = text.replace("\r", "\n").split("\n")
+    else:
+        lines = text.split("\n")
+    last = lines.pop()
+    return [f"{line}\n" for line in lines] + ([last] if last else [])
+
+
+class _OutputStream:
+    """
+    One output (stdout or stderr) of a command, split into lines across reads
+    """
+
+    def __init__(self, name: str, overwrite: bool = False):
+        """
+        Args:
+            name: STDOUT or STDERR
+            overwrite: Carriage returns overwrite the line like on a terminal (see _split_lines)
+        """
+        self.name = name
+        self.overwrite = overwrite
+        self.pending = bytearray()
+        self.decoder = codecs.getincrementaldecoder("utf8")(errors="replace")
+
+    def _drop_overwritten(self):
+        # Only the text after the last carriage return remains visible. A trailing one may start a \r\n.
+        start = self.pending.rfind(b"\r", 0, len(self.pending) - 1)
+        if start >= 0:
+            del self.pending[: start + 1]
+
+    def feed(self, buffer: bytearray, size: int) -> List[str]:
+        """
+        Returns the lines completed by the first size bytes of buffer. Partial lines are kept until they
+        are completed, lines longer than MAX_LINE_LENGTH are returned in parts.
+        """
+        view = memoryview(buffer)[:size]
+        end = buffer.rfind(b"\n", 0, size) + 1
+        if end == 0:
+            self.pending += view
+            if self.overwrite:
+                self._drop_overwritten()
+            if len(self.pending) < MAX_LINE_LENGTH:
+                return []
+            complete, self.pending = self.pending, bytearray()
+        else:
+            complete = self.pending + view[:end]
+            self.pending = bytearray(view[end:])
+            if self.overwrite:
+                self._drop_overwritten()
+        return _split_lines(self.decoder.decode(complete), self.overwrite)
+
+    def finish(self) -> List[str]:
+        """
+        Returns the last line, if it did not end with a line break
+        """
+        lines = _split_lines(self.decoder.decode(self.pending, final=True), self.overwrite)
+        self.pending = bytearray()
+        return lines
+
 
 class CommandRunner:
     """
     Class for running shell commands in a subprocess.
     """
 
-    def __init__(self, callbacks: Optional[List[Callback]] = None) -> None:
+    def __init__(self, callbacks: Optional[List[Callback]] = None, echo: bool = True, use_pty: bool = False) -> None:
         """
         Initializes a command runner.
 
         Args:
             callbacks: A list of callbacks to be called on start and end of the command.
+            echo: Print the output of the command (otherwise it is only passed to the callbacks)
+            use_pty: Run the command on pseudo-terminals instead of pipes, so it keeps the line buffering and
+                progress bars of interactive use
         """
         self.callbacks = callbacks or []
+        self.echo = echo
+        self.use_pty = use_pty
+        self.process: Optional[subprocess.Popen] = None  # The running command, e.g. to terminate it
 
     def register_callback(self, callback: Callback):
         """
@@ -56,21 +186,107 @@ class CommandRunner:
         else:
             self._invoke_callbacks("on_error", command, returncode)
 
-    def __on_log(self, command, log):
-        self._invoke_callbacks("on_log", command, log)
+    def __on_logs(self, command, lines: List[str], stream: str):
+        for callback in self.callbacks:
+            try:
+                on_logs = getattr(callback, "on_logs", None)
+                if on_logs is not None:
+                    on_logs(command, lines, stream=stream)
+                else:
+                    call_on_log(callback.on_log, command, lines, stream)
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                print(f"Error in callback method 'on_logs': {err}")
 
-    def run_gpu(self, command: str, gpus: List[GPU]) -> int:
+    def __echo(self, data: Union[bytes, memoryview], stream: str):
+        if not self.echo:
+            return
+        target = sys.stderr if stream == STDERR else sys.stdout
+        output = getattr(target, "buffer", None)
+        if output is None:
+            # e.g. replaced by a text stream
+            target.write(bytes(data).decode("utf8", errors="replace"))
+        else:
+            output.write(data)
+            output.flush()
+
+    def __output(self, command, lines: List[str], stream: str):
+        self.__echo("".join(lines).encode("utf8", errors="replace"), stream)
+        self.__on_logs(command, lines, stream)
+
+    def _start(
+        self, command: str, cwd: Optional[Path], env: Dict[str, str]
+    ) -> Tuple[subprocess.Popen, Dict[int, _OutputStream]]:
+        """
+        Starts a command with stdout and stderr connected to separate pipes, or pseudo-terminals if use_pty
+
+        Returns:
+            The process and its outputs by the file descriptors to read them from. The caller closes them.
+        """
+        outputs = [open_pty() if self.use_pty else os.pipe() for _ in (STDOUT, STDERR)]
+        try:
+            process = subprocess.Popen(  # pylint: disable=consider-using-with
+                shlex.split(command), cwd=cwd, env=env, stdout=outputs[0][1], stderr=outputs[1][1]
+            )
+        except BaseException:
+            for read_fd, _ in outputs:
+                os.close(read_fd)
+            raise
+        finally:
+            # Only the command writes, so the outputs end when it exits
+            for _, write_fd in outputs:
+                os.close(write_fd)
+        return process, {
+            outputs[0][0]: _OutputStream(STDOUT, overwrite=self.use_pty),
+            outputs[1][0]: _OutputStream(STDERR, overwrite=self.use_pty),
+        }
+
+    def _pump(self, command: str, outputs: Dict[int, _OutputStream]):
+        """
+        Copies the outputs of a command to stdout and stderr as they arrive and passes them to the callbacks
+        line-wise, one batch of lines per read. Returns once all outputs ended.
+        """
+        # Text written before must not show up after the output
+        sys.stdout.flush()
+        sys.stderr.flush()
+        buffer = bytearray(READ_SIZE)
+        view = memoryview(buffer)
+        with selectors.DefaultSelector() as selector:
+            for fd in outputs:
+                selector.register(fd, selectors.EVENT_READ, outputs[fd])
+            while selector.get_map():
+                for key, _ in selector.select():
+                    output: _OutputStream = key.data
+                    size = _read_into(key.fd, buffer)
+                    if size:
+                        self.__echo(view[:size], output.name)
+                        lines = output.feed(buffer, size)
+                    else:
+                        selector.unregister(key.fd)
+                        lines = output.finish()
+                    if lines:
+                        self.__on_logs(command, lines, output.name)
+
+    def run_gpu(
+        self,
+        command: str,
+        gpus: List[GPU],
+        cwd: Optional[Path] = None,
+        env: Optional[Dict[str, str]] = None,
+    ) -> int:
         """
         Uses run to run with specified gpus
 
         Args:
             command: The command to run.
             gpus: List of GPU which will be available for the run command
+            cwd: Working directory of the command (Default: the current one)
+            env: Environment of the command (Default: the environment of this process)
 
         Return:
             The return code of the command. Or -1 if the command could not be run.
         """
-        typer.echo(f"{typer.style('🚀 Running:', fg=typer.colors.GREEN, bold=True)} {command}")
+        if self.echo:
+            typer.echo(f"{typer.style('🚀 Running:', fg=typer.colors.GREEN, bold=True)} {command}")
 
         return self.run(
             command,
@@ -78,15 +294,25 @@ class CommandRunner:
                 "CUDA_DEVICE_ORDER": "PCI_BUS_ID",
                 "CUDA_VISIBLE_DEVICES": f"{','.join([str(cuda_device.id) for cuda_device in gpus])}" if gpus else "",
             },
+            cwd=cwd,
+            env=env,
         )
 
-    def run(self, command: str, additional_env: Dict[str, str]) -> int:
+    def run(
+        self,
+        command: str,
+        additional_env: Dict[str, str],
+        cwd: Optional[Path] = None,
+        env: Optional[Dict[str, str]] = None,
+    ) -> int:
         """
         Uses subprocess library to run a given command.
 
         Args:
             command: The command to run.
             additional_env: Additional environment variables to set.
+            cwd: Working directory of the command (Default: the current one)
+            env: Environment of the command (Default: the environment of this process)
 
         Returns:
             The return code of the command. Or -1 if the command could not be run.
@@ -94,38 +320,197 @@ class CommandRunner:
 
         self.__on_start(command)
 
-        env = os.environ
-        for key, value in additional_env.items():
-            env[key] = value
+        # A copy, so runners on other threads do not see the variables of this command
+        env = dict(os.environ if env is None else env)
+        env.update(additional_env)
 
         returncode = -1
+        outputs: Dict[int, _OutputStream] = {}
         try:
-            with subprocess.Popen(
-                shlex.split(command),
-                env=env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding="utf8",
-                universal_newlines=True,
-            ) as process:
+            process, outputs = self._start(command, cwd, env)
+            with process:
+                self.process = process
                 atexit.register(process.kill)
 
                 # Read and print the subprocess output immediately
-                for line in process.stdout:  # type: ignore
-                    print(
-                        line.encode(sys.stdout.encoding, errors="replace").decode(sys.stdout.encoding),
-                        end="",
-                    )
-                    self.__on_log(command, line)
-                    sys.stdout.flush()  # type: ignore
+                self._pump(command, outputs)
 
                 process.wait()
                 atexit.unregister(process.kill)
                 returncode = process.returncode
-        except RuntimeError as err:
+        except (RuntimeError, OSError) as err:
+            print(f"Error in run_command: {err}")
+        finally:
+            for fd in outputs:
+                os.close(fd)
+            self.process = None
+            self.__on_end(command, returncode)
+
+        return returncode
+
+    def replay(self, command: str, log: str) -> int:
+        """
+        Prints the log of an earlier successful run of the command (e.g. restored from a cache) and passes it to the
+        callbacks as if the command ran again, so they report it as well.
+
+        Returns:
+            0, the return code of the earlier run
+        """
+        self.__on_start(command)
+        lines = _split_lines(log)
+        if lines:
+            self.__output(command, lines, STDOUT)
+        self.__on_end(command, 0)
+        return 0
+
+    def run_per_gpu(
+        self,
+        command: str,
+        gpus: List[GPU],
+        cwd: Optional[Path] = None,
+        env: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """
+        Runs one copy of the command (rank) per GPU, e.g. for data parallel training without torchrun.
+        Every rank sees only its GPU and gets RANK, LOCAL_RANK, WORLD_SIZE, LOCAL_WORLD_SIZE, MASTER_ADDR and
+        MASTER_PORT. The output of all ranks is prefixed with their rank. If a rank fails, the others are
+        terminated (and killed after TEARDOWN_TIMEOUT_IN_SECONDS), so the GPUs become free again.
+
+        Args:
+            command: The command to run.
+            gpus: One rank is started per GPU
+            cwd: Working directory of the command (Default: the current one)
+            env: Environment of the command (Default: the environment of this process)
+
+        Return:
+            The return code of the first failed rank, 0 if all ranks succeeded. Or -1 if the command could not
+            be run.
+        """
+        if self.echo:
+            typer.echo(f"{typer.style(f'🚀 Running {len(gpus)} ranks:', fg=typer.colors.GREEN, bold=True)} {command}")
+        self.__on_start(command)
+
+        env = dict(os.environ if env is None else env)
+        env.setdefault("MASTER_ADDR", "127.0.0.1")
+        env.setdefault("MASTER_PORT", str(get_free_port()))
+
+        processes: List[subprocess.Popen] = []
+        outputs: Dict[int, _OutputStream] = {}
+        ranks: Dict[int, int] = {}  # Rank of every output
+        returncode = -1
+        try:
+            for rank, gpu in enumerate(gpus):
+                process, rank_outputs = self._start(command, cwd, self._get_rank_env(env, rank, gpu, len(gpus)))
+                atexit.register(process.kill)
+                processes.append(process)
+                outputs.update(rank_outputs)
+                ranks.update(dict.fromkeys(rank_outputs, rank))
+            # Terminating rank 0 (e.g. by the scheduler) tears down all ranks
+            self.process = processes[0] if processes else None
+            returncode = self._wait_for_ranks(command, processes, outputs, ranks)
+        except (RuntimeError, OSError) as err:
             print(f"Error in run_command: {err}")
         finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+                atexit.unregister(process.kill)
+            for fd in outputs:
+                os.close(fd)
+            self.process = None
             self.__on_end(command, returncode)
 
         return returncode
+
+    @staticmethod
+    def _get_rank_env(env: Dict[str, str], rank: int, gpu: GPU, world_size: int) -> Dict[str, str]:
+        return dict(
+            env,
+            CUDA_DEVICE_ORDER="PCI_BUS_ID",
+            CUDA_VISIBLE_DEVICES=str(gpu.id),
+            RANK=str(rank),
+            LOCAL_RANK=str(rank),
+            WORLD_SIZE=str(world_size),
+            LOCAL_WORLD_SIZE=str(world_size),
+        )
+
+    def _wait_for_ranks(  # pylint: disable=too-many-locals,too-many-branches
+        self,
+        command: str,
+        processes: List[subprocess.Popen],
+        outputs: Dict[int, _OutputStream],
+        ranks: Dict[int, int],
+    ) -> int:
+        """
+        Multiplexes the outputs of all ranks in one loop until all of them exited.
+        The ranks are polled on every pass, so a failed rank is noticed even if its children keep its outputs open.
+
+        Returns:
+            The return code of the first failed rank or 0
+        """
+        returncode = 0
+        teardown_deadline: Optional[float] = None
+        drain_deadline: Optional[float] = None
+        buffer = bytearray(READ_SIZE)
+        with selectors.DefaultSelector() as selector:
+            for fd in ranks:
+                selector.register(fd, selectors.EVENT_READ, outputs[fd])
+
+            while selector.get_map():
+                for key, _ in selector.select(RANK_POLL_INTERVAL_IN_SECONDS):
+                    output: _OutputStream = key.data
+                    size = _read_into(key.fd, buffer)
+                    if size:
+                        lines = output.feed(buffer, size)
+                    else:
+                        lines = output.finish()
+                        selector.unregister(key.fd)
+                    self._output_rank(command, ranks[key.fd], lines, output.name)
+
+                returncodes = [process.poll() for process in processes]
+                failed = [code for code in returncodes if code not in (None, 0)]
+                if failed and returncode == 0:
+                    returncode = failed[0]
+                    teardown_deadline = self._tear_down(processes)
+                if teardown_deadline is not None and time.monotonic() > teardown_deadline:
+                    for process in processes:
+                        if process.poll() is None:
+                            process.kill()
+                if None not in returncodes:
+                    # Children of the ranks may keep the outputs open
+                    if drain_deadline is None:
+                        drain_deadline = time.monotonic() + OUTPUT_DRAIN_TIMEOUT_IN_SECONDS
+                    elif time.monotonic() > drain_deadline:
+                        break
+
+            for key in list(selector.get_map().values()):
+                self._output_rank(command, ranks[key.fd], key.data.finish(), key.data.name)
+
+        # A rank may close its outputs before it exited, so its return code is collected here
+        wait_deadline = time.monotonic() + OUTPUT_DRAIN_TIMEOUT_IN_SECONDS
+        if teardown_deadline is not None:
+            wait_deadline = max(wait_deadline, teardown_deadline)
+        for process in processes:
+            try:
+                code = process.wait(max(0.0, wait_deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                code = process.wait()
+            if code != 0 and returncode == 0:
+                returncode = code
+        return returncode
+
+    def _output_rank(self, command: str, rank: int, lines: List[str], stream: str):
+        if lines:
+            prefix = f"[rank {rank}] "
+            self.__output(
+                command, [f"{prefix}{line}" if line.endswith("\n") else f"{prefix}{line}\n" for line in lines], stream
+            )
+
+    @staticmethod
+    def _tear_down(processes: List[subprocess.Popen]) -> float:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        return time.monotonic() + TEARDOWN_TIMEOUT_IN_SECONDS
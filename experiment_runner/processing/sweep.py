@@ -0,0 +1,272 @@
+"""
+Hyperparameter sweeps: expands a grid or random search and runs the trials on all free GPUs.
+Every GPU (group) gets one worker, which selects its GPUs once and runs one trial after the other.
+"""
+
+import csv
+import itertools
+import math
+import os
+import queue
+import random
+import threading
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from omegaconf import OmegaConf
+from pydantic import BaseModel, field_validator
+
+from experiment_runner.processing.callbacks import LoggerCallback
+from experiment_runner.processing.gpu.manager import GPUManager
+from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.processing.gpu.waiting import (
+    MAX_BACKOFF_IN_SECONDS,
+    WAIT_DIRECTORY,
+    Backoff,
+    WakeupSocket,
+    notify_waiters,
+)
+from experiment_runner.processing.subprocesses import CommandRunner
+
+DEFAULT_RANDOM_TRIALS = 10
+
+
+class SweepMethod(Enum):
+    """
+    Enum containing all search methods of sweeps
+    """
+
+    GRID = "grid"  # every combination of the parameter values
+    RANDOM = "random"  # num_trials random samples
+
+
+class SweepSpec(BaseModel):
+    """
+    DTO representing a sweep file. Parameters are either a list of values, a constant,
+    or (random search only) a range {min, max, log, int}.
+    """
+
+    method: SweepMethod = SweepMethod.GRID
+    num_trials: int = DEFAULT_RANDOM_TRIALS  # random search only
+    seed: Optional[int] = None
+    parameters: Dict[str, Any] = {}
+
+    @field_validator("parameters")
+    @classmethod
+    def _check_parameter_names(cls, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        if "trial" in parameters:
+            raise ValueError("The parameter name trial is reserved for the index of the trial.")
+        return parameters
+
+
+class Trial(BaseModel):
+    """
+    DTO representing one expanded trial of a sweep
+    """
+
+    index: int
+    parameters: Dict[str, Any]
+    command: str
+
+
+class TrialResult(BaseModel):
+    """
+    DTO representing the outcome of a trial
+    """
+
+    trial: Trial
+    gpus: List[int]
+    return_code: int
+    duration_in_seconds: float
+    log_path: str
+
+
+def load_sweep_spec(path: Path) -> SweepSpec:
+    """
+    Reads a sweep file (YAML, interpolations are resolved by OmegaConf)
+
+    Raises:
+        ValueError: if the file is no valid sweep
+    """
+    content = OmegaConf.to_container(OmegaConf.load(path), resolve=True)
+    if not isinstance(content, dict):
+        raise ValueError(f"{path} does not contain a sweep.")
+    return SweepSpec.model_validate(content)
+
+
+def _sample(name: str, values: Any, rng: random.Random) -> Any:
+    if isinstance(values, list):
+        return rng.choice(values)
+    if isinstance(values, dict):
+        try:
+            low, high = float(values["min"]), float(values["max"])
+        except KeyError as exc:
+            raise ValueError(f"Range of parameter {name} needs min and max.") from exc
+        if values.get("log", False):
+            value = math.exp(rng.uniform(math.log(low), math.log(high)))
+        else:
+            value = rng.uniform(low, high)
+        return round(value) if values.get("int", False) else value
+    return values
+
+
+def expand_trials(template: str, spec: SweepSpec) -> List[Trial]:
+    """
+    Expands a sweep into trials. The command template is formatted with the parameters of every trial
+    (e.g. "python train.py --lr {lr}") and may also use {trial}, the index of the trial.
+
+    Raises:
+        ValueError: if a parameter can not be expanded or the template uses an unknown parameter
+    """
+    names = list(spec.parameters)
+    if spec.method == SweepMethod.GRID:
+        ranges = [name for name in names if isinstance(spec.parameters[name], dict)]
+        if ranges:
+            raise ValueError(f"Ranges are only supported by random search: {ranges}")
+        values = [value if isinstance(value, list) else [value] for value in spec.parameters.values()]
+        combinations = [dict(zip(names, combination)) for combination in itertools.product(*values)]
+    else:
+        rng = random.Random(spec.seed)
+        combinations = [
+            {name: _sample(name, spec.parameters[name], rng) for name in names} for _ in range(spec.num_trials)
+        ]
+
+    trials = []
+    for index, parameters in enumerate(combinations):
+        try:
+            command = template.format(trial=index, **parameters)
+        except (KeyError, IndexError) as exc:
+            raise ValueError(f"The command uses the unknown parameter {exc}. Parameters: {names}") from exc
+        trials.append(Trial(index=index, parameters=parameters, command=command))
+    return trials
+
+
+class SweepRunner:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Runs trials on a pool of workers, one per GPU group. Workers are added whenever more GPUs become available,
+    so the sweep keeps every free GPU busy.
+    """
+
+    def __init__(
+        self,
+        manager: GPUManager,
+        log_directory: Path,
+        *,
+        gpus_per_trial: int = 1,
+        max_workers: Optional[int] = None,
+        backoff: Optional[Backoff] = None,
+        wakeup_directory: Optional[Path] = None,
+        **availability: Any,
+    ):
+        """
+        Args:
+            manager: Selects and claims the GPUs of the workers
+            log_directory: Directory of the trial logs and the summary
+            gpus_per_trial: GPUs of every worker
+            max_workers: Max. number of trials running at once (Default: as many as GPUs are free)
+            backoff: Delays between two checks for free GPUs without notification
+            wakeup_directory: Directory of the wakeup sockets (Default: WAIT_DIRECTORY)
+            availability: max_load, max_memory and memory_free passed to GPUManager.get_available
+        """
+        self.manager = manager
+        self.log_directory = log_directory
+        self.gpus_per_trial = gpus_per_trial
+        self.max_workers = max_workers
+        self.backoff = backoff or Backoff(maximum_in_seconds=MAX_BACKOFF_IN_SECONDS)
+        self.wakeup_directory: Path = wakeup_directory or WAIT_DIRECTORY
+        self.availability = availability
+        self.results: List[TrialResult] = []
+        self._results_lock = threading.Lock()
+        self._trials: "queue.Queue[Trial]" = queue.Queue()
+
+    def _run_trial(self, trial: Trial, gpus: List[GPU]) -> TrialResult:
+        log_path = self.log_directory / f"trial-{trial.index}.log"
+        runner = CommandRunner([LoggerCallback(log_path)], echo=False)
+        started_at = time.monotonic()
+        return_code = runner.run_gpu(trial.command, gpus, env=dict(os.environ, EXPERIMENT_TRIAL=str(trial.index)))
+        return TrialResult(
+            trial=trial,
+            gpus=[gpu.id for gpu in gpus],
+            return_code=return_code,
+            duration_in_seconds=time.monotonic() - started_at,
+            log_path=str(log_path),
+        )
+
+    def _work(self, gpus: List[GPU]):
+        try:
+            while True:
+                try:
+                    trial = self._trials.get_nowait()
+                except queue.Empty:
+                    return
+                result = self._run_trial(trial, gpus)
+                with self._results_lock:
+                    self.results.append(result)
+        finally:
+            self.manager.release_reservations(gpus)
+            notify_waiters(self.wakeup_directory)
+
+    def run(self, trials: List[Trial]) -> List[TrialResult]:
+        """
+        Runs all trials and blocks until they ended
+
+        Returns:
+            The results, ordered by trial
+        """
+        self.log_directory.mkdir(parents=True, exist_ok=True)
+        for trial in trials:
+            self._trials.put(trial)
+
+        workers: List[threading.Thread] = []
+        with WakeupSocket(self.wakeup_directory, f"sweep-{os.getpid()}") as wakeup:
+            while not self._trials.empty():
+                workers = [worker for worker in workers if worker.is_alive()]
+                started = False
+                while (self.max_workers is None or len(workers) < self.max_workers) and not self._trials.empty():
+                    # The GPUs of a worker stay claimed between its trials, so no other worker selects them
+                    gpus = self.manager.reserve_available(
+                        limit=self.gpus_per_trial, until_released=True, **self.availability
+                    )
+                    if len(gpus) < self.gpus_per_trial:
+                        self.manager.release_reservations(gpus)
+                        break
+                    worker = threading.Thread(target=self._work, args=(gpus,), daemon=True)
+                    worker.start()
+                    workers.append(worker)
+                    started = True
+                if started:
+                    self.backoff.reset()
+                if self._trials.empty():
+                    break
+                # Wakes up when GPUs are released, e.g. by other runs
+                if wakeup.wait(self.backoff.next()):
+                    self.backoff.reset()
+
+        for worker in workers:
+            worker.join()
+        return sorted(self.results, key=lambda result: result.trial.index)
+
+    def write_summary(self, path: Optional[Path] = None) -> Path:
+        """
+        Writes the results as CSV (Default: summary.csv in the log directory)
+        """
+        path = path or self.log_directory / "summary.csv"
+        parameter_names = sorted({name for result in self.results for name in result.trial.parameters})
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["trial", *parameter_names, "gpus", "return_code", "duration_in_seconds", "log_path"])
+            for result in sorted(self.results, key=lambda result: result.trial.index):
+                writer.writerow(
+                    [
+                        result.trial.index,
+                        *[result.trial.parameters.get(name, "") for name in parameter_names],
+                        ",".join(str(gpu_id) for gpu_id in result.gpus),
+                        result.return_code,
+                        f"{result.duration_in_seconds:.2f}",
+                        result.log_path,
+                    ]
+                )
+        return path
@@ -2,11 +2,22 @@
 This module contains helper functions
 """
 
+import errno
+import grp
 import math
-from typing import Optional
+import os
+import pwd
+import re
+import stat
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, Optional
 
 import psutil
 
+PROC_PATH = Path("/proc")
+MEMORY_UNITS_IN_MIB = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+
 
 def nan_safe_float(number: float) -> float:
     """
@@ -25,17 +36,196 @@ def safe_float_cast(number: str) -> float:
         return float("nan")
 
 
-def get_user_for_pid(pid) -> Optional[str]:
+def parse_memory_size(size: str) -> int:
     """
-    Returns a process by its id
+    Parses a memory size like 6G, 512M or 1.5GiB (binary units). Numbers without unit are MiB.
 
     Args:
-    pid: process id
+    size: the memory size
+
+    Returns:
+    int: The size in MiB (rounded up)
+
+    Raises:
+    ValueError: if the size can not be parsed
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(?:([KMGT])(?:i?B)?)?\s*", size, flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid memory size: {size} (e.g. 6G or 512M)")
+    number, unit = match.groups()
+    return math.ceil(float(number) * MEMORY_UNITS_IN_MIB[(unit or "M").upper()])
+
+
+@lru_cache(maxsize=None)
+def get_username_for_uid(uid: int) -> str:
+    """
+    Returns the name of a user id. Cached for the lifetime of the process, because
+    lookups are slow on machines using LDAP or SSSD.
+
+    Args:
+    uid: user id
+
+    Returns:
+    str: The username (or the uid if it has no passwd entry)
+    """
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+class InsecureSharedPathException(PermissionError):
+    """
+    A shared directory or file could be replaced by another user (e.g. with a symlink to a file of the current user)
+    """
+
+
+def make_shared_directory(path: Path):
+    """
+    Creates a directory every local user may create files in (like /tmp)
+
+    Raises:
+        InsecureSharedPathException: if the directory belongs to another user than root or the current one, is a
+                                     symlink or others may replace the files of the current user in it (no sticky bit)
+    """
+    if not path.exists():
+        path.mkdir(parents=True, exist_ok=True)
+        try:
+            os.chmod(path, 0o1777)
+        except PermissionError:
+            pass
+    info = os.lstat(path)
+    if (
+        not stat.S_ISDIR(info.st_mode)
+        or info.st_uid not in (0, os.getuid())
+        or (info.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and not info.st_mode & stat.S_ISVTX)
+    ):
+        raise InsecureSharedPathException(
+            f"{path} must be a directory of root or you, with the sticky bit set if others may write to it."
+        )
+
+
+def open_shared_file(path: Path) -> int:
+    """
+    Opens (or creates) a file every local user may read and write, e.g. to lock it with fcntl.
+    Symlinks and hard links are refused, they could point to any file of the current user.
+
+    Returns:
+        The file descriptor
+
+    Raises:
+        InsecureSharedPathException: if the file or its directory are not safe to open (see make_shared_directory)
+    """
+    make_shared_directory(path.parent)
+    try:
+        descriptor = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o666)
+    except OSError as exc:
+        if exc.errno == errno.ELOOP:
+            raise InsecureSharedPathException(f"{path} must not be a symlink.") from exc
+        raise
+    info = os.fstat(descriptor)
+    if not stat.S_ISREG(info.st_mode) or info.st_nlink != 1:
+        os.close(descriptor)
+        raise InsecureSharedPathException(f"{path} must be a regular file without other links.")
+    if info.st_uid == os.getuid():
+        # The umask of the creating user must not lock out the others
+        os.fchmod(descriptor, 0o666)
+    return descriptor
+
+
+def get_current_username() -> str:
+    """
+    Returns the name of the user running this process (cached)
+    """
+    return get_username_for_uid(os.getuid())
+
+
+@lru_cache(maxsize=None)
+def get_group_names_of_user(username: str) -> FrozenSet[str]:
+    """
+    Returns the names of all groups of a user including the primary group.
+    Uses getgrouplist instead of enumerating all groups of the directory and caches the result
+    for the lifetime of the process.
+
+    Args:
+    username: name of the user
 
     Returns:
-    psutil.Process: The user of the process
+    FrozenSet[str]: The group names (or gids of groups without a name)
+    """
+    gids = os.getgrouplist(username, pwd.getpwnam(username).pw_gid)
+
+    names = set()
+    for gid in gids:
+        try:
+            names.add(grp.getgrgid(gid).gr_name)
+        except KeyError:
+            names.add(str(gid))
+    return frozenset(names)
+
+
+def get_users_for_pids(pids: Iterable[int], proc_path: Optional[Path] = None) -> Dict[int, Optional[str]]:
     """
+    Resolves the owners of many processes in one pass over /proc/<pid>/status.
+    The owner is the real uid of the process. /proc/<pid> itself belongs to root for processes that are not dumpable
+    (e.g. after changing their uid). Falls back to psutil on systems without procfs.
+
+    Args:
+    pids: process ids
+    proc_path: mount point of procfs (Default: /proc)
+
+    Returns:
+    Dict[int, Optional[str]]: The user of each process (None if the process does not exist)
+    """
+    proc_path = proc_path or PROC_PATH
+    if not proc_path.is_dir():
+        return {pid: _get_user_for_pid_psutil(pid) for pid in set(pids)}
+
+    users: Dict[int, Optional[str]] = {}
+    for pid in set(pids):
+        try:
+            status = (proc_path / str(pid) / "status").read_text(encoding="utf-8")
+        except OSError:
+            users[pid] = None
+            continue
+        # Uid: real effective saved filesystem
+        uid = next((int(line.split()[1]) for line in status.splitlines() if line.startswith("Uid:")), None)
+        users[pid] = get_username_for_uid(uid) if uid is not None else None
+    return users
+
+
+def _get_user_for_pid_psutil(pid: int) -> Optional[str]:
     try:
         return str(psutil.Process(pid).username())
     except psutil.Error:
         return None
+
+
+def get_process_start_time(pid: int) -> Optional[float]:
+    """
+    Returns the start time of a process in seconds since the epoch. Pids are reused, the pid and its start time
+    identify a process.
+
+    Args:
+    pid: process id
+
+    Returns:
+    Optional[float]: The start time (None if the process does not exist)
+    """
+    try:
+        return float(psutil.Process(pid).create_time())
+    except psutil.Error:
+        return None
+
+
+def get_user_for_pid(pid) -> Optional[str]:
+    """
+    Returns the user of a process by its id
+
+    Args:
+    pid: process id
+
+    Returns:
+    Optional[str]: The user of the process
+    """
+    return get_users_for_pids([pid])[pid]
@@ -0,0 +1,237 @@
+"""
+Tests for the commands of the CLI
+"""
+
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+import pytest
+from gpu_doubles import StaticGPUProvider, get_gpus
+from typer.testing import CliRunner
+
+from experiment_runner.cli import main
+from experiment_runner.cli.main import app
+from experiment_runner.processing.gpu.manager import GPUManager
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.reservations import GPUReservationLedger
+from experiment_runner.processing.gpu.sampler import StreamingGPUSampler
+from experiment_runner.processing.gpu.waiting import WakeupSocket
+from experiment_runner.processing.jobs import JobQueue, JobState
+
+
+class FakeSampler(StaticGPUProvider, StreamingGPUSampler):
+    """
+    Sampler of idle GPUs without nvidia-smi
+    """
+
+    def __init__(self, count: int):
+        super().__init__(count)
+        self.closed = False
+
+    def sample(self) -> Tuple[List[GPU], List[GPUProcess]]:
+        return self.gpus, []
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "config.yml"
+    path.write_text("polling_rate_in_seconds: 1\nmax_gpus_per_other: 4\n")
+    return path
+
+
+@pytest.fixture
+def other_process():
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    yield process
+    process.kill()
+    process.wait()
+
+
+@pytest.fixture
+def provider(mocker):
+    provider = StaticGPUProvider(2)
+    mocker.patch.object(main, "get_provider", return_value=provider)
+    return provider
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    directory = tmp_path / "work"
+    directory.mkdir()
+    monkeypatch.chdir(directory)
+    return directory
+
+
+def invoke(*args: str):
+    return CliRunner().invoke(app, list(args), catch_exceptions=False)
+
+
+def test_run_cleans_up_after_waiting_timed_out(mocker, config_path, other_process):
+    sampler = FakeSampler(2)
+    mocker.patch.object(main, "get_provider", return_value=sampler)
+    notify_waiters = mocker.patch.object(main, "notify_waiters")
+    release_reservations = mocker.spy(GPUManager, "release_reservations")
+    # The processes of the tests belong to alice (see conftest)
+    GPUReservationLedger().claim(lambda claims: get_gpus(0, 1), "alice", pid=other_process.pid)
+
+    result = invoke("run", "true", "--wait-for-gpus", "--wait-timeout", "0.2", "--config-path", str(config_path))
+
+    assert "did not become available" in result.output
+    assert sampler.closed
+    assert release_reservations.called
+    assert notify_waiters.called
+
+
+def test_submit_warns_if_no_scheduler_of_the_user_runs(mocker, config_path, provider):
+    result = invoke("submit", "python train.py", "--config-path", str(config_path))
+
+    assert "Submitted job 1" in result.output
+    assert "No scheduler of" in result.output
+    assert [job.command for job in JobQueue().jobs([JobState.PENDING])] == ["python train.py"]
+
+    mocker.patch.object(main, "is_scheduler_running", return_value=True)
+    result = invoke("submit", "python evaluate.py", "--config-path", str(config_path))
+
+    assert "Submitted job 2" in result.output
+    assert "No scheduler of" not in result.output
+
+
+def test_best_fit_needs_the_memory_of_the_command(config_path, provider):
+    result = CliRunner().invoke(
+        app, ["run", "true", "--gpu-selection", "best_fit", "--config-path", str(config_path)]
+    )
+
+    assert result.exit_code == 2
+    assert "best_fit" in result.output
+
+
+def test_run_starts_one_copy_per_gpu(config_path, provider, workdir):
+    invoke(
+        "run",
+        "sh -c 'touch rank-$RANK-of-$WORLD_SIZE'",
+        "--num-gpus",
+        "2",
+        "--per-gpu",
+        "--config-path",
+        str(config_path),
+    )
+
+    assert sorted(path.name for path in workdir.iterdir()) == ["rank-0-of-2", "rank-1-of-2"]
+
+
+def test_run_restores_cached_results(config_path, provider, workdir):
+    command = "sh -c 'echo trained >> model.txt'"
+    arguments = ["run", command, "--cache", "--output", "model.txt", "--config-path", str(config_path)]
+
+    assert "Restored" not in invoke(*arguments).output
+    (workdir / "model.txt").unlink()
+    result = invoke(*arguments)
+
+    assert "Restored cached result" in result.output
+    assert (workdir / "model.txt").read_text() == "trained\n"
+
+
+def test_queue_and_cancel(config_path, provider):
+    invoke("submit", "python train.py", "--config-path", str(config_path))
+    invoke("submit", "python evaluate.py", "--config-path", str(config_path))
+
+    result = invoke("cancel", "1")
+    assert "Cancelled job 1" in result.output
+
+    assert "evaluate.py" in invoke("queue").output
+    assert "train.py" not in invoke("queue").output
+    assert "train.py" in invoke("queue", "--all").output
+
+    result = invoke("cancel", "42")
+    assert result.exit_code != 0
+    assert "42" in result.output
+
+
+def test_scheduler_runs_submitted_jobs(mocker, config_path, provider, tmp_path):
+    invoke("submit", "echo done", "--logging", str(tmp_path / "job.log"), "--config-path", str(config_path))
+
+    def stop_after_the_job(self, timeout_in_seconds):
+        if JobQueue().jobs([JobState.COMPLETED]):
+            raise KeyboardInterrupt
+        time.sleep(0.05)
+        return False
+
+    mocker.patch.object(WakeupSocket, "wait", stop_after_the_job)
+    result = invoke("scheduler", "--config-path", str(config_path))
+
+    assert "Scheduling the jobs of" in result.output
+    assert "Scheduler stopped" in result.output
+    assert [job.command for job in JobQueue().jobs([JobState.COMPLETED])] == ["echo done"]
+    assert "done" in (tmp_path / "job.log").read_text()
+
+
+def test_second_scheduler_is_rejected(config_path, provider):
+    running = main.Scheduler(main.get_manager(provider=provider))
+    running._acquire_lock()
+    try:
+        result = invoke("scheduler", "--config-path", str(config_path))
+    finally:
+        running.close()
+
+    assert result.exit_code != 0
+    assert "already running" in result.output
+
+
+def test_sweep_runs_all_trials(config_path, provider, tmp_path):
+    spec = tmp_path / "sweep.yml"
+    spec.write_text("parameters:\n  lr: [0.1, 0.2]\n  seed: 1\n")
+
+    result = invoke(
+        "sweep", "echo {lr} {seed}", str(spec), "--log-dir", str(tmp_path / "logs"), "--config-path", str(config_path)
+    )
+
+    assert result.exit_code == 0
+    assert "lr=0.1" in result.output and "lr=0.2" in result.output
+    assert (tmp_path / "logs" / "summary.csv").exists()
+
+
+def test_sweep_rejects_missing_spec_files(config_path, provider, tmp_path):
+    result = invoke("sweep", "echo {lr}", str(tmp_path / "missing.yml"), "--config-path", str(config_path))
+
+    assert result.exit_code == 2
+    assert "does not exist" in result.output
+
+
+def test_pipeline_rejects_missing_files(config_path, provider, tmp_path):
+    result = invoke("pipeline", str(tmp_path / "missing.yml"), "--config-path", str(config_path))
+
+    assert result.exit_code == 2
+    assert "does not exist" in result.output
+
+
+def test_pipeline_skips_stages_after_a_failed_stage(config_path, provider, tmp_path):
+    pipeline = tmp_path / "pipeline.yml"
+    pipeline.write_text(
+        "stages:\n"
+        "  prepare: {command: 'echo prepare'}\n"
+        "  train: {command: 'sh -c \"exit 3\"', needs: [prepare], gpus: 1}\n"
+        "  evaluate: {command: 'echo evaluate', needs: [train]}\n"
+    )
+
+    result = invoke("pipeline", str(pipeline), "--log-dir", str(tmp_path / "logs"), "--config-path", str(config_path))
+
+    assert result.exit_code == 1
+    assert "skipped" in result.output
+
+
+def test_broker_serves_until_interrupted(mocker, config_path, provider, tmp_path):
+    serve_forever = mocker.patch.object(main.GPUBroker, "serve_forever", side_effect=KeyboardInterrupt)
+    mocker.patch.object(main.GPUBroker, "shutdown")
+
+    result = invoke(
+        "broker", "--socket-path", str(tmp_path / "broker" / "broker.sock"), "--config-path", str(config_path)
+    )
+
+    assert "Serving GPU samples on" in result.output
+    assert "Broker stopped" in result.output
+    assert serve_forever.called
@@ -0,0 +1,61 @@
+"""
+Fixtures shared by all tests
+"""
+
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from experiment_runner.processing import cache, jobs, pipeline, scheduler, sweep
+from experiment_runner.processing.gpu import history, providers, reservations, waiting
+from experiment_runner.utils import get_current_username, get_users_for_pids
+
+
+@pytest.fixture(autouse=True)
+def shared_paths(monkeypatch):
+    """
+    Redirects the files shared by all users of the host, so tests neither read nor change them
+    """
+    # Socket paths are limited to 108 characters, pytest's tmp_path may be longer
+    with tempfile.TemporaryDirectory(prefix="shared") as directory:
+        root = Path(directory)
+        monkeypatch.setattr(history, "HISTORY_PATH", root / "history.npy")
+        monkeypatch.setattr(reservations, "RESERVATION_PATH", root / "reservations.json")
+        monkeypatch.setattr(providers, "BROKER_SOCKET_PATH", root / "broker.sock")
+        monkeypatch.setattr(jobs, "JOB_DATABASE_PATH", root / "jobs.sqlite")
+        monkeypatch.setattr(cache, "CACHE_DIRECTORY", root / "cache")
+        for module in (jobs, scheduler):
+            monkeypatch.setattr(module, "JOB_DIRECTORY", root / "jobs")
+        for module in (waiting, scheduler, sweep, pipeline):
+            monkeypatch.setattr(module, "WAIT_DIRECTORY", root / "wait")
+        # The history of the host is cached for the lifetime of the process
+        history.get_history.cache_clear()
+
+        yield root
+
+        history.get_history.cache_clear()
+
+
+@pytest.fixture(autouse=True)
+def processes_of_alice(monkeypatch):
+    """
+    The test doubles claim GPUs as alice (see gpu_doubles), so the ledger sees the processes of the tests as hers
+    """
+    current_user = get_current_username()
+
+    def get_owners(pids, proc_path=None):
+        owners = get_users_for_pids(pids, proc_path)
+        return {pid: "alice" if owner == current_user else owner for pid, owner in owners.items()}
+
+    monkeypatch.setattr(reservations, "get_users_for_pids", get_owners)
+
+
+@pytest.fixture
+def wakeup_directory():
+    """
+    Directory for the wakeup sockets of a test
+    """
+    # Socket paths are limited to 108 characters, pytest's tmp_path may be longer
+    with tempfile.TemporaryDirectory(prefix="wait") as name:
+        yield Path(name)
@@ -0,0 +1,67 @@
+"""
+GPUs, providers and managers shared by the tests
+"""
+
+from typing import List
+
+from experiment_runner.processing.gpu.manager import GPUManager
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.providers import GPUProvider
+
+
+def get_gpu(
+    gpu_id: int, load: float = 0.0, memory_used: int = 0, memory_total: int = 4096, temperature: float = 35
+) -> GPU:
+    """
+    Returns a Quadro RTX 8000 with the uuid GPU-<gpu_id>
+    """
+    return GPU(
+        id=gpu_id,
+        uuid=f"GPU-{gpu_id}",
+        load=load,
+        memory_total=memory_total,
+        memory_used=memory_used,
+        memory_free=memory_total - memory_used,
+        driver="535.104.05",
+        name="Quadro RTX 8000",
+        serial=str(gpu_id),
+        display_mode="Disabled",
+        display_active="Disabled",
+        temperature=temperature,
+    )
+
+
+def get_gpus(*gpu_ids: int, load: float = 0.0) -> List[GPU]:
+    """
+    Returns one GPU per id (see get_gpu)
+    """
+    return [get_gpu(gpu_id, load=load) for gpu_id in gpu_ids]
+
+
+class StaticGPUProvider(GPUProvider):
+    """
+    Provider of idle GPUs
+    """
+
+    def __init__(self, count: int):
+        self._gpus = get_gpus(*range(count))
+
+    def get_compute_processes(self) -> List[GPUProcess]:
+        return []
+
+    @property
+    def gpus(self) -> List[GPU]:
+        return list(self._gpus)
+
+
+class StaticUserManager(GPUManager):
+    """
+    Manager of alice
+    """
+
+    @property
+    def username(self) -> str:
+        return "alice"
+
+    def get_gpu_limit_of_current_user(self) -> int:
+        return 10
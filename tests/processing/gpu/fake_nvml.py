@@ -0,0 +1,151 @@
+"""
+Binding double for libnvidia-ml. Mimics the C functions with ctypes argument semantics
+so NvmlLibrary can be tested on machines without GPUs.
+"""
+
+# The methods mirror the names of the C API and fill ctypes byref() arguments through _obj
+# pylint: disable=invalid-name,missing-function-docstring,protected-access
+
+import ctypes
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from experiment_runner.processing.gpu.nvml import (
+    NVML_ERROR_INSUFFICIENT_SIZE,
+    NVML_ERROR_NOT_SUPPORTED,
+    NVML_SUCCESS,
+)
+
+MIB = 1024 * 1024
+NVML_ERROR_UNINITIALIZED = 1
+NVML_ERROR_INVALID_ARGUMENT = 2
+
+
+@dataclass
+class FakeDevice:  # pylint: disable=too-many-instance-attributes
+    """
+    State of one simulated GPU
+    """
+
+    uuid: str
+    name: str = "Quadro RTX 8000"
+    serial: Optional[str] = "1324821109943"
+    memory_total_mib: int = 49152
+    memory_used_mib: int = 0
+    load: int = 0
+    temperature: int = 35
+    processes: List[tuple] = field(default_factory=list)  # (pid, used_mib)
+
+
+class FakeNvml:
+    """
+    Implements the subset of the NVML C API used by NvmlLibrary
+    """
+
+    def __init__(self, devices: List[FakeDevice], process_names: Optional[Dict[int, str]] = None):
+        self.devices = devices
+        self.process_names = process_names or {}
+        self.initialized = False
+        self.calls: List[str] = []
+
+    def __getattribute__(self, name):
+        if name.startswith("nvml"):
+            object.__getattribute__(self, "calls").append(name)
+        return object.__getattribute__(self, name)
+
+    def _device(self, handle) -> FakeDevice:
+        index: int = handle.value - 1
+        return self.devices[index]
+
+    def nvmlErrorString(self, code) -> bytes:
+        return f"fake error {code}".encode()
+
+    def nvmlInit_v2(self) -> int:
+        self.initialized = True
+        return NVML_SUCCESS
+
+    def nvmlShutdown(self) -> int:
+        self.initialized = False
+        return NVML_SUCCESS
+
+    def nvmlSystemGetDriverVersion(self, buffer, _length) -> int:
+        buffer.value = b"535.104.05"
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetCount_v2(self, count) -> int:
+        if not self.initialized:
+            return NVML_ERROR_UNINITIALIZED
+        count._obj.value = len(self.devices)
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetHandleByIndex_v2(self, index, handle) -> int:
+        if index.value >= len(self.devices):
+            return NVML_ERROR_INVALID_ARGUMENT
+        handle._obj.value = index.value + 1
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetIndex(self, handle, index) -> int:
+        index._obj.value = handle.value - 1
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetUUID(self, handle, buffer, _length) -> int:
+        buffer.value = self._device(handle).uuid.encode()
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetName(self, handle, buffer, _length) -> int:
+        buffer.value = self._device(handle).name.encode()
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetSerial(self, handle, buffer, _length) -> int:
+        serial = self._device(handle).serial
+        if serial is None:
+            return NVML_ERROR_NOT_SUPPORTED
+        buffer.value = serial.encode()
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetMemoryInfo(self, handle, memory) -> int:
+        device = self._device(handle)
+        memory._obj.total = device.memory_total_mib * MIB
+        memory._obj.used = device.memory_used_mib * MIB
+        memory._obj.free = (device.memory_total_mib - device.memory_used_mib) * MIB
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetUtilizationRates(self, handle, utilization) -> int:
+        utilization._obj.gpu = self._device(handle).load
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetTemperature(self, handle, _sensor, temperature) -> int:
+        temperature._obj.value = self._device(handle).temperature
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetDisplayMode(self, _handle, state) -> int:
+        state._obj.value = 0
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetDisplayActive(self, _handle, state) -> int:
+        state._obj.value = 0
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetComputeRunningProcesses_v3(self, handle, count, infos) -> int:
+        processes = self._device(handle).processes
+        if infos is None or count._obj.value < len(processes):
+            count._obj.value = len(processes)
+            return NVML_ERROR_INSUFFICIENT_SIZE if processes else NVML_SUCCESS
+        for i, (pid, used_mib) in enumerate(processes):
+            infos[i].pid = pid
+            infos[i].usedGpuMemory = used_mib * MIB
+        count._obj.value = len(processes)
+        return NVML_SUCCESS
+
+    def nvmlSystemGetProcessName(self, pid, buffer, _length) -> int:
+        buffer.value = self.process_names.get(pid.value, "").encode()
+        return NVML_SUCCESS
+
+
+class MissingNvml(ctypes.CDLL):  # pylint: disable=too-few-public-methods
+    """
+    Stand-in for a machine without libnvidia-ml
+    """
+
+    def __init__(self, *args, **kwargs):  # pylint: disable=super-init-not-called
+        raise OSError("libnvidia-ml.so.1: cannot open shared object file: No such file or directory")
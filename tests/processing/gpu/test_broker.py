@@ -0,0 +1,205 @@
+"""
+Tests for the local GPU broker and its client provider
+"""
+
+import threading
+import time
+from typing import List, Tuple
+
+import pytest
+
+from experiment_runner.processing.gpu.broker import (
+    BrokerAlreadyRunningException,
+    GPUBroker,
+    InsecureSocketDirectoryException,
+)
+from experiment_runner.processing.gpu.exceptions import GPUNotFoundException
+from experiment_runner.processing.gpu.manager import GPUManager
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.providers import (
+    BrokerGPUProvider,
+    GPUProvider,
+    GPUProviderEnum,
+    GPUProviderFactory,
+)
+
+
+class StaticProvider(GPUProvider):
+    def __init__(self):
+        self.samples = 0
+        self.fail = False
+        self.crash = False
+
+    def get_compute_processes(self) -> List[GPUProcess]:
+        return self.sample()[1]
+
+    @property
+    def gpus(self) -> List[GPU]:
+        return self.sample()[0]
+
+    def sample(self) -> Tuple[List[GPU], List[GPUProcess]]:
+        if self.fail:
+            raise GPUNotFoundException("🚨 File 'nvidia-smi' not found. 🚨")
+        if self.crash:
+            raise RuntimeError("driver hiccup")
+        self.samples += 1
+        gpu = GPU(
+            id=0,
+            uuid="GPU-8bfb8a55-1787-40ee-38fc-fe4af7dfdb6c",
+            load=0.25,
+            memory_total=49152,
+            memory_used=1024,
+            memory_free=48128,
+            driver="535.104.05",
+            name="Quadro RTX 8000",
+            serial="1324821109943",
+            display_mode="Disabled",
+            display_active="Disabled",
+            temperature=35,
+            throttle_reasons=["sw_power_cap"],
+        )
+        process = GPUProcess(pid=12809, process_name="python", gpu_uuid=gpu.uuid, used_memory=1000)
+        return [gpu], [process]
+
+
+@pytest.fixture
+def broker(tmp_path):
+    provider = StaticProvider()
+    gpu_broker = GPUBroker(provider, tmp_path / "broker.sock", interval_in_seconds=3600)
+    gpu_broker.start()
+    thread = threading.Thread(target=gpu_broker.serve_forever)
+    thread.start()
+
+    yield gpu_broker
+
+    gpu_broker.shutdown()
+    thread.join()
+
+
+def test_broker_serves_samples(broker):
+    client = BrokerGPUProvider(broker.socket_path)
+    expected_gpus, expected_processes = StaticProvider().sample()
+
+    assert client.sample() == (expected_gpus, expected_processes)
+    assert client.gpus == expected_gpus
+    assert client.get_compute_processes() == expected_processes
+    # All requests are answered from the same sample
+    assert broker.provider.samples == 1
+
+
+def test_manager_uses_broker_transparently(mocker, broker):
+    mocker.patch("experiment_runner.processing.gpu.providers.BROKER_SOCKET_PATH", broker.socket_path)
+
+    manager = GPUManager()
+    assert isinstance(manager.gpu_provider, BrokerGPUProvider)
+    assert [gpu.id for gpu in manager.snapshot().gpus] == [0]
+
+
+def test_broker_forwards_sampling_errors(broker):
+    broker.provider.fail = True
+    broker.update()
+
+    with pytest.raises(GPUNotFoundException) as ex_info:
+        BrokerGPUProvider(broker.socket_path).sample()
+    assert "nvidia-smi" in str(ex_info.value)
+
+
+def test_unexpected_sampling_errors_are_not_served_as_stale_samples(broker):
+    client = BrokerGPUProvider(broker.socket_path)
+    assert len(client.gpus) == 1
+
+    broker.provider.crash = True
+    broker.update()
+    with pytest.raises(GPUNotFoundException) as ex_info:
+        client.sample()
+    assert "driver hiccup" in str(ex_info.value)
+
+    broker.provider.crash = False
+    broker.update()
+    assert len(client.gpus) == 1
+
+
+def test_stale_brokers_hand_over_to_the_next_provider(mocker, broker):
+    mocker.patch("experiment_runner.processing.gpu.providers.BROKER_SOCKET_PATH", broker.socket_path)
+    mocker.patch.object(GPUProviderFactory, "auto_order", [GPUProviderEnum.BROKER, GPUProviderEnum.NVIDIA_SMI])
+    fallback = StaticProvider()
+    mocker.patch.dict(GPUProviderFactory.class_dictionary, {GPUProviderEnum.NVIDIA_SMI: lambda: fallback})
+    provider = GPUProviderFactory.get_instance(GPUProviderEnum.AUTO)
+    assert len(provider.gpus) == 1 and fallback.samples == 0
+
+    # The sampler of the broker hangs
+    mocker.patch("time.time", return_value=time.time() + 4 * broker.interval_in_seconds)
+    assert len(provider.gpus) == 1
+    assert len(provider.gpus) == 1
+    assert fallback.samples == 2
+    with pytest.raises(GPUNotFoundException, match="stale"):
+        BrokerGPUProvider(broker.socket_path)
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"not json\n",
+        b"[]\n",
+        b'{"gpus": [], "processes": []}\n',
+        b'{"timestamp": "yesterday", "gpus": [], "processes": []}\n',
+        b'{"timestamp": 0.0, "interval": 1e12, "gpus": [{"id": 0}], "processes": []}\n',
+    ],
+)
+def test_invalid_samples_hand_over_to_the_next_provider(broker, payload):
+    fallback = StaticProvider()
+    client = BrokerGPUProvider(broker.socket_path, fallback=lambda: fallback)
+
+    # e.g. a broker of another version
+    broker.payload = payload
+    assert len(client.gpus) == 1
+    assert fallback.samples == 1
+    with pytest.raises(GPUNotFoundException, match="invalid sample"):
+        BrokerGPUProvider(broker.socket_path)
+
+
+def test_brokers_of_other_users_are_not_trusted(mocker, broker):
+    mocker.patch("experiment_runner.processing.gpu.providers.get_peer_uid", return_value=4242)
+
+    with pytest.raises(GPUNotFoundException) as ex_info:
+        BrokerGPUProvider(broker.socket_path)
+    assert "untrusted" in str(ex_info.value)
+
+
+def test_broker_rejects_directories_writable_by_others(tmp_path):
+    directory = tmp_path / "shared"
+    directory.mkdir()
+    directory.chmod(0o1777)
+
+    with pytest.raises(InsecureSocketDirectoryException):
+        GPUBroker(StaticProvider(), directory / "broker.sock").start()
+    assert not (directory / "broker.sock").exists()
+
+
+def test_second_broker_is_rejected(broker):
+    with pytest.raises(BrokerAlreadyRunningException):
+        GPUBroker(StaticProvider(), broker.socket_path).start()
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    socket_path = tmp_path / "broker.sock"
+    socket_path.touch()
+
+    gpu_broker = GPUBroker(StaticProvider(), socket_path)
+    gpu_broker.start()
+    thread = threading.Thread(target=gpu_broker.serve_forever)
+    thread.start()
+    try:
+        assert len(BrokerGPUProvider(socket_path).gpus) == 1
+    finally:
+        gpu_broker.shutdown()
+        thread.join()
+    assert not socket_path.exists()
+
+
+def test_client_without_broker(tmp_path):
+    with pytest.raises(GPUNotFoundException):
+        BrokerGPUProvider(tmp_path / "missing.sock")
+
+    with pytest.raises(GPUNotFoundException):
+        GPUProviderFactory.get_instance(GPUProviderEnum.BROKER)
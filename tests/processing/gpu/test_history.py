@@ -0,0 +1,155 @@
+"""
+Tests for the memory-mapped GPU utilization history
+"""
+
+import math
+import stat
+
+import numpy as np
+import pytest
+
+from experiment_runner.processing.gpu.history import GPUUtilizationHistory, get_history
+from experiment_runner.processing.gpu.records import GPURecord
+
+
+def get_record(uuid: str, load: float, memory_used: int = 1024, memory_total: int = 4096) -> GPURecord:
+    return GPURecord(
+        0,
+        uuid,
+        load,
+        memory_total,
+        memory_used,
+        memory_total - memory_used,
+        "535.104.05",
+        "Quadro RTX 8000",
+        "0",
+        "Disabled",
+        "Disabled",
+        35.0,
+    )
+
+
+@pytest.fixture
+def history(tmp_path):
+    return GPUUtilizationHistory(tmp_path / "shm" / "history.npy", length=8, max_gpus=2)
+
+
+def test_file_size_is_bounded(history):
+    history.append([get_record("GPU-0", 0.5)], timestamp=1000.0)
+    size = history.path.stat().st_size
+
+    for second in range(100):
+        history.append([get_record("GPU-0", 0.5), get_record("GPU-1", 0.1)], timestamp=1001.0 + second)
+
+    assert history.path.stat().st_size == size
+    assert size - history.size_in_bytes <= 4096  # .npy header
+    _, _, valid = history.window(["GPU-0", "GPU-1"], now=2000.0)
+    assert valid.sum(axis=1).tolist() == [8, 8]
+
+
+def test_history_is_shared_between_instances(history):
+    history.append([get_record("GPU-0", 0.25)], timestamp=1000.0)
+
+    other = GPUUtilizationHistory(history.path, length=8, max_gpus=2)
+    _, loads, valid = other.window(["GPU-0"], now=1000.0)
+    assert loads[valid].tolist() == [0.25]
+
+
+def test_samples_arriving_too_fast_are_dropped(history):
+    history.append([get_record("GPU-0", 0.9)], timestamp=1000.0)
+    history.append([get_record("GPU-0", 0.0)], timestamp=1000.5)
+
+    _, loads, valid = history.window(["GPU-0"], now=1001.0)
+    assert loads[valid].tolist() == pytest.approx([0.9])
+
+
+def test_least_recently_sampled_gpu_is_replaced(history):
+    history.append([get_record("GPU-0", 0.1)], timestamp=1000.0)
+    history.append([get_record("GPU-1", 0.2)], timestamp=1001.0)
+    history.append([get_record("GPU-2", 0.3)], timestamp=1002.0)
+
+    _, _, valid = history.window(["GPU-0", "GPU-1", "GPU-2"], now=1003.0)
+    assert valid.sum(axis=1).tolist() == [0, 1, 1]
+
+
+def test_ewma_smooths_short_pauses(history):
+    # Busy for 6 seconds, then a pause of 2 seconds between two epochs
+    for second, load in enumerate([1.0] * 6 + [0.0] * 2):
+        history.append([get_record("GPU-0", load)], timestamp=1000.0 + second)
+
+    smoothed = history.ewma(["GPU-0", "GPU-1"], half_life_in_seconds=30, now=1008.0)
+
+    assert 0.5 < smoothed[0] < 1.0
+    assert math.isnan(smoothed[1])
+    # A short half-life follows the last samples
+    assert history.ewma(["GPU-0"], half_life_in_seconds=0.1, now=1008.0)[0] < 0.01
+
+
+def test_percentile(history):
+    for second, load in enumerate([0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.9]):
+        history.append([get_record("GPU-0", load)], timestamp=1000.0 + second)
+
+    assert history.percentile(["GPU-0"], 95, window_in_seconds=100, now=1008.0)[0] == pytest.approx(0.9)
+    assert history.percentile(["GPU-0"], 50, window_in_seconds=100, now=1008.0)[0] == pytest.approx(0.3)
+    # Only the last three samples are in the window
+    assert history.percentile(["GPU-0"], 0, window_in_seconds=3, now=1008.0)[0] == pytest.approx(0.5)
+    assert np.isnan(history.percentile(["GPU-1"], 95, window_in_seconds=100, now=1008.0)).all()
+
+
+def test_idle_seconds(history):
+    for second, load in enumerate([0.9, 0.9, 0.0, 0.0, 0.0]):
+        history.append([get_record("GPU-0", load), get_record("GPU-1", 0.0)], timestamp=1000.0 + second)
+
+    idle = history.idle_seconds(["GPU-0", "GPU-1", "GPU-2"], max_load=0.05, now=1010.0)
+
+    assert idle.tolist() == [9.0, 10.0, 0.0]
+
+
+def test_damaged_file_is_recreated(history):
+    history.path.parent.mkdir(parents=True)
+    history.path.write_bytes(b"not a numpy file")
+
+    history.append([get_record("GPU-0", 0.5)], timestamp=1000.0)
+
+    _, loads, valid = history.window(["GPU-0"], now=1000.0)
+    assert loads[valid].tolist() == [0.5]
+
+
+def test_memory_util_of_gpus_without_memory(history):
+    history.append([get_record("GPU-0", 0.5, memory_used=0, memory_total=0)], timestamp=1000.0)
+
+    with history._locked() as buffers:
+        assert math.isnan(buffers["memory_util"][0, 0])
+
+
+def test_default_history_is_redirected_in_tests(shared_paths):
+    assert get_history().path == shared_paths / "history.npy"
+    assert get_history().read_only
+
+
+def test_history_file_is_only_writable_by_its_owner(history):
+    history.append([get_record("GPU-0", 0.5)], timestamp=1000.0)
+
+    assert not history.path.stat().st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def test_read_only_history_reads_the_samples_of_the_writer(history):
+    reader = GPUUtilizationHistory(history.path, length=8, max_gpus=2, read_only=True)
+    _, _, valid = reader.window(["GPU-0"], now=1000.0)
+    assert not valid.any()
+    assert not history.path.exists()
+
+    history.append([get_record("GPU-0", 0.25)], timestamp=1000.0)
+    _, loads, valid = reader.window(["GPU-0"], now=1000.0)
+    assert loads[valid].tolist() == [0.25]
+    with pytest.raises(PermissionError):
+        reader.append([get_record("GPU-0", 1.0)], timestamp=1001.0)
+
+
+def test_read_only_history_ignores_files_of_untrusted_users(mocker, history):
+    history.append([get_record("GPU-0", 0.25)], timestamp=1000.0)
+    mocker.patch("experiment_runner.processing.gpu.history.is_trusted_broker", return_value=False)
+
+    reader = GPUUtilizationHistory(history.path, length=8, max_gpus=2, read_only=True)
+    _, _, valid = reader.window(["GPU-0"], now=1000.0)
+    assert not valid.any()
@@ -0,0 +1,128 @@
+"""
+Tests for the GPU limits of the GPUManager
+"""
+
+import pytest
+from gpu_doubles import get_gpus
+
+from experiment_runner.processing.gpu.limits import (
+    MAX_GPUS_PER_OTHER,
+    MAX_GPUS_PER_STAFF,
+)
+from experiment_runner.processing.gpu.manager import GPUManager
+from experiment_runner.processing.gpu.models import GPUProcess
+from experiment_runner.processing.gpu.providers import NvidiaGPUProvider
+from experiment_runner.processing.gpu.reservations import GPUClaim
+from experiment_runner.processing.gpu.snapshot import GPUSnapshot
+from experiment_runner.utils import get_group_names_of_user
+
+
+class FakePasswd:
+    pw_gid = 1000
+
+
+class FakeGroup:
+    def __init__(self, name):
+        self.gr_name = name
+
+
+GROUPS = {1000: "students", 1001: "mitarbeiter", 1002: "docker"}
+
+
+def getgrgid(gid):
+    # Raises KeyError for unknown gids like grp.getgrgid
+    return FakeGroup(GROUPS[gid])
+
+
+@pytest.fixture(autouse=True)
+def clear_group_cache():
+    get_group_names_of_user.cache_clear()
+    yield
+    get_group_names_of_user.cache_clear()
+
+
+@pytest.fixture
+def groups(mocker):
+    """
+    Returns a function to set the gids of the current user
+    """
+    mocker.patch("experiment_runner.processing.gpu.manager.get_current_username", return_value="alice")
+    mocker.patch("pwd.getpwnam", return_value=FakePasswd())
+    mocker.patch("grp.getgrgid", side_effect=getgrgid)
+    getgrouplist = mocker.patch("os.getgrouplist")
+
+    def set_gids(*gids):
+        getgrouplist.return_value = list(gids)
+        return getgrouplist
+
+    return set_gids
+
+
+def test_staff_members_get_the_staff_limit(groups):
+    groups(1000, 1001)
+    manager = GPUManager(provider=NvidiaGPUProvider())
+
+    assert manager.get_groups_of_current_user() == ["mitarbeiter", "students"]
+    assert manager.get_gpu_limit_of_current_user() == MAX_GPUS_PER_STAFF == 10
+
+
+def test_other_users_get_the_other_limit(groups):
+    groups(1000, 1002)
+    manager = GPUManager(provider=NvidiaGPUProvider())
+
+    assert manager.get_gpu_limit_of_current_user() == MAX_GPUS_PER_OTHER == 1
+
+
+def test_limits_and_group_are_configurable(groups):
+    groups(1000, 1002)
+    manager = GPUManager(
+        provider=NvidiaGPUProvider(), staff_group_name="docker", max_gpus_per_staff=4, max_gpus_per_other=2
+    )
+    assert manager.get_gpu_limit_of_current_user() == 4
+
+    manager.staff_group_name = "mitarbeiter"
+    assert manager.get_gpu_limit_of_current_user() == 2
+
+
+def test_remaining_gpus_count_used_and_claimed_gpus(groups):
+    groups(1000, 1002)
+    manager = GPUManager(provider=NvidiaGPUProvider(), max_gpus_per_other=3)
+    processes = [GPUProcess(pid=42, process_name="python", gpu_uuid="GPU-0")]
+    snapshot = GPUSnapshot(get_gpus(0, 1, 2), processes, user_resolver=lambda pids: {42: "bob"})
+    claims = [
+        GPUClaim(gpu_uuid="GPU-0", user="bob", pid=42, expires_at=0),
+        GPUClaim(gpu_uuid="GPU-1", user="bob", pid=None, expires_at=0),
+        GPUClaim(gpu_uuid="GPU-2", user="carol", pid=None, expires_at=0),
+    ]
+
+    assert manager.get_remaining_gpus_of_user("bob", snapshot, claims) == 1
+    assert manager.get_remaining_gpus_of_user("alice", snapshot, claims) == 3
+
+
+def test_groups_are_resolved_once_per_process(groups):
+    getgrouplist = groups(1000, 1001)
+    manager = GPUManager(provider=NvidiaGPUProvider())
+
+    for _ in range(3):
+        manager.get_gpu_limit_of_current_user()
+        manager.get_groups_of_current_user()
+
+    getgrouplist.assert_called_once_with("alice", 1000)
+
+
+def test_unnamed_groups_are_kept_as_gid(groups):
+    groups(1000, 4242)
+
+    assert get_group_names_of_user("alice") == {"students", "4242"}
+
+
+def test_empty_snapshots_are_not_replaced(mocker):
+    manager = GPUManager(provider=NvidiaGPUProvider())
+    fresh_snapshot = mocker.patch.object(manager, "snapshot")
+    mocker.patch.object(manager, "get_gpu_limit_of_current_user", return_value=10)
+    empty = GPUSnapshot([], [], user_resolver=lambda pids: {})
+
+    assert not manager.get_gpus_of_user("alice", empty)
+    assert not manager.get_gpu_processes_of_user("alice", empty)
+    assert not manager.get_available(snapshot=empty)
+    fresh_snapshot.assert_not_called()
@@ -0,0 +1,153 @@
+"""
+Tests for the in-process NVML provider using a binding double
+"""
+
+import pytest
+from fake_nvml import FakeDevice, FakeNvml, MissingNvml
+
+from experiment_runner.processing.gpu.exceptions import GPUNotFoundException
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.nvml import (
+    NvmlError,
+    NvmlLibrary,
+    get_nvml_library,
+)
+from experiment_runner.processing.gpu.providers import (
+    GPUProviderEnum,
+    GPUProviderFactory,
+    NvidiaGPUProvider,
+    NvmlGPUProvider,
+)
+
+
+@pytest.fixture(autouse=True)
+def nvml_of_process():
+    # NVML is initialized once per process
+    get_nvml_library.cache_clear()
+    yield
+    get_nvml_library.cache_clear()
+
+
+@pytest.fixture
+def fake_nvml():
+    return FakeNvml(
+        [
+            FakeDevice(uuid="GPU-8bfb8a55-1787-40ee-38fc-fe4af7dfdb6c", memory_used_mib=1, load=3),
+            FakeDevice(
+                uuid="GPU-3b91b854-3dfa-fa53-5612-52ccda6d8f2a",
+                serial=None,
+                memory_used_mib=48353,
+                load=97,
+                temperature=49,
+                processes=[(12809, 24000), (12810, 24353)],
+            ),
+        ],
+        process_names={12809: "/opt/conda/bin/python3.9", 12810: "/usr/bin/python3"},
+    )
+
+
+@pytest.fixture
+def provider(fake_nvml):
+    return NvmlGPUProvider(NvmlLibrary(fake_nvml))
+
+
+def test_nvml_provider_fills_gpu_models(provider):
+    assert provider.gpus == [
+        GPU(
+            id=0,
+            uuid="GPU-8bfb8a55-1787-40ee-38fc-fe4af7dfdb6c",
+            load=0.03,
+            memory_total=49152,
+            memory_used=1,
+            memory_free=49151,
+            driver="535.104.05",
+            name="Quadro RTX 8000",
+            serial="1324821109943",
+            display_mode="Disabled",
+            display_active="Disabled",
+            temperature=35,
+        ),
+        GPU(
+            id=1,
+            uuid="GPU-3b91b854-3dfa-fa53-5612-52ccda6d8f2a",
+            load=0.97,
+            memory_total=49152,
+            memory_used=48353,
+            memory_free=799,
+            driver="535.104.05",
+            name="Quadro RTX 8000",
+            serial="[N/A]",
+            display_mode="Disabled",
+            display_active="Disabled",
+            temperature=49,
+        ),
+    ]
+
+
+def test_nvml_provider_fills_process_models(provider):
+    assert provider.get_compute_processes() == [
+        GPUProcess(
+            pid=12809,
+            process_name="/opt/conda/bin/python3.9",
+            gpu_uuid="GPU-3b91b854-3dfa-fa53-5612-52ccda6d8f2a",
+            used_memory=24000,
+        ),
+        GPUProcess(
+            pid=12810,
+            process_name="/usr/bin/python3",
+            gpu_uuid="GPU-3b91b854-3dfa-fa53-5612-52ccda6d8f2a",
+            used_memory=24353,
+        ),
+    ]
+
+
+def test_nvml_provider_sample_looks_up_handles_once(provider, fake_nvml):
+    fake_nvml.calls.clear()
+    gpus, processes = provider.sample()
+
+    assert len(gpus) == 2 and len(processes) == 2
+    assert fake_nvml.calls.count("nvmlDeviceGetHandleByIndex_v2") == 2
+
+
+def test_nvml_errors_are_raised_with_code(fake_nvml):
+    library = NvmlLibrary(fake_nvml)
+    fake_nvml.initialized = False
+
+    with pytest.raises(NvmlError) as ex_info:
+        library.device_count()
+
+    assert ex_info.value.code == 1
+    assert "fake error 1" in str(ex_info.value)
+
+
+def test_nvml_provider_without_library(mocker):
+    mocker.patch("ctypes.CDLL", MissingNvml)
+    mocker.patch("ctypes.util.find_library", return_value=None)
+
+    with pytest.raises(GPUNotFoundException):
+        NvmlGPUProvider()
+
+
+def test_factory_prefers_nvml(mocker, fake_nvml):
+    mocker.patch("experiment_runner.processing.gpu.nvml.load_library", return_value=fake_nvml)
+
+    assert isinstance(GPUProviderFactory.get_instance(GPUProviderEnum.AUTO), NvmlGPUProvider)
+
+
+def test_nvml_is_initialized_once_per_process(mocker, fake_nvml):
+    mocker.patch("experiment_runner.processing.gpu.nvml.load_library", return_value=fake_nvml)
+    register = mocker.patch("atexit.register")
+
+    first, second = NvmlGPUProvider(), NvmlGPUProvider()
+
+    assert first.nvml is second.nvml
+    assert fake_nvml.calls.count("nvmlInit_v2") == 1
+    register.assert_called_once_with(first.nvml.shutdown)
+
+
+def test_factory_falls_back_to_nvidia_smi(mocker):
+    mocker.patch("ctypes.CDLL", MissingNvml)
+    mocker.patch("ctypes.util.find_library", return_value=None)
+
+    assert isinstance(GPUProviderFactory.get_instance(GPUProviderEnum.AUTO), NvidiaGPUProvider)
+    assert isinstance(GPUProviderFactory.get_instance(GPUProviderEnum.NVIDIA_SMI), NvidiaGPUProvider)
@@ -2,14 +2,20 @@
 Class for testing running with and without 'nvidia-smi'
 """
 
+import math
 import os
+from pathlib import Path
 from unittest.mock import MagicMock
 
 import pytest
 
 from experiment_runner.processing.gpu.exceptions import GPUNotFoundException
 from experiment_runner.processing.gpu.models import GPU, GPUProcess
-from experiment_runner.processing.gpu.providers import NvidiaGPUProvider
+from experiment_runner.processing.gpu.providers import (
+    NvidiaGPUProvider,
+    NvidiaXMLGPUProvider,
+    parse_nvidia_smi_xml,
+)
 
 
 @pytest.fixture
@@ -250,3 +256,102 @@ def test_gpus_should_return_installed_gpus(mocker, nvidia_smi_gpu_output_csv):
     Compare the mock-results to the expected
     """
     assert result == expected_result
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def test_parse_nvidia_smi_xml_535():
+    """
+    Function to test parsing a recorded 'nvidia-smi -q -x' output (driver 535)
+    """
+    with open(FIXTURES / "nvidia_smi_q_x_535.xml", "rb") as stream:
+        gpus, processes = parse_nvidia_smi_xml(stream)
+
+    assert [gpu.id for gpu in gpus] == [0, 1, 2]
+    assert gpus[0] == GPU(
+        id=0,
+        uuid="GPU-8bfb8a55-1787-40ee-38fc-fe4af7dfdb6c",
+        load=0,
+        memory_total=49152,
+        memory_used=1,
+        memory_free=48592,
+        driver="535.104.05",
+        name="Quadro RTX 8000",
+        serial="1324821109943",
+        display_mode="Enabled",
+        display_active="Disabled",
+        temperature=35,
+        throttle_reasons=["gpu_idle"],
+    )
+    assert gpus[1].load == 0.97
+    assert gpus[1].throttle_reasons == ["sw_power_cap", "sw_thermal_slowdown"]
+    assert math.isnan(gpus[2].load)
+    assert math.isnan(gpus[2].temperature)
+
+    # Graphics-only processes (Xorg) are skipped like in --query-compute-apps
+    assert processes == [
+        GPUProcess(
+            pid=12809,
+            process_name="/opt/conda/bin/python3.9",
+            gpu_uuid="GPU-3b91b854-3dfa-fa53-5612-52ccda6d8f2a",
+            used_memory=24000,
+        ),
+        GPUProcess(
+            pid=12810,
+            process_name="/opt/conda/bin/python3.9",
+            gpu_uuid="GPU-3b91b854-3dfa-fa53-5612-52ccda6d8f2a",
+            used_memory=24350,
+        ),
+        GPUProcess(
+            pid=13001,
+            process_name="/usr/bin/python3",
+            gpu_uuid="GPU-5139bf4a-32d0-a429-d3b8-be21a674e15f",
+            used_memory=None,
+        ),
+    ]
+
+
+def test_parse_nvidia_smi_xml_470():
+    """
+    Function to test parsing a recorded output of older drivers (clocks_throttle_reasons)
+    """
+    with open(FIXTURES / "nvidia_smi_q_x_470.xml", "rb") as stream:
+        gpus, processes = parse_nvidia_smi_xml(stream)
+
+    assert [(gpu.name, gpu.driver, gpu.memory_used) for gpu in gpus] == [
+        ("Tesla V100-PCIE-32GB", "470.199.02", 0),
+        ("Tesla V100-PCIE-32GB", "470.199.02", 10240),
+    ]
+    assert [gpu.throttle_reasons for gpu in gpus] == [["gpu_idle"], []]
+    assert [(proc.pid, proc.gpu_uuid, proc.used_memory) for proc in processes] == [
+        (40211, "GPU-2b5d5a3c-8f5d-2e6f-1a6b-7c4f3e2d1b88", 10237)
+    ]
+
+
+def test_xml_provider_uses_one_nvidia_smi_call(mocker):
+    """
+    Function to test that sample() returns GPUs and processes from a single exec
+    """
+    mock = mocker.patch("subprocess.Popen")
+    process = mock.return_value.__enter__.return_value
+    process.stdout = open(FIXTURES / "nvidia_smi_q_x_535.xml", "rb")
+    process.wait.return_value = 0
+
+    with process.stdout:
+        gpus, processes = NvidiaXMLGPUProvider().sample()
+
+    assert mock.call_count == 1
+    assert mock.call_args.args[0] == ["nvidia-smi", "-q", "-x"]
+    assert len(gpus) == 3
+    assert len(processes) == 3
+
+
+def test_xml_provider_without_nvidia_smi(mocker):
+    """
+    Function to test the XML provider without 'nvidia-smi'
+    """
+    mocker.patch("subprocess.Popen", side_effect=FileNotFoundError())
+
+    with pytest.raises(GPUNotFoundException):
+        NvidiaXMLGPUProvider().sample()
@@ -0,0 +1,90 @@
+"""
+Tests for the lightweight GPU records and the fast nvidia-smi CSV path
+"""
+
+import pytest
+
+from experiment_runner.processing.gpu.exceptions import GPUNotFoundException
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.providers import (
+    NvidiaGPUProvider,
+    decode_sample,
+    encode_sample,
+)
+from experiment_runner.processing.gpu.records import (
+    GPUProcessRecord,
+    GPURecord,
+    parse_nvidia_smi_csv,
+)
+
+GPU_CSV = (
+    "0, GPU-8bfb8a55-1787-40ee-38fc-fe4af7dfdb6c, 12, 49152, 1, 48592, 535.104.05, Quadro RTX 8000, 1324821109943,"
+    " Enabled, Disabled, 35\n"
+    "1, GPU-3b91b854-3dfa-fa53-5612-52ccda6d8f2a, [N/A], 49152, 48353, 231, 535.104.05, Quadro RTX 8000, 1324821109359,"
+    " Disabled, Disabled, 49\n"
+)
+PROCESS_CSV = "12809, /opt/conda/bin/python3.9, GPU-3b91b854-3dfa-fa53-5612-52ccda6d8f2a\n"
+
+
+def test_records_match_models():
+    for row in parse_nvidia_smi_csv(GPU_CSV):
+        record = GPURecord.from_nvidia_smi_list(row)
+        expected = GPU.from_nvidia_smi_list(row)
+        # NaN != NaN, so compare the load separately
+        assert record.to_model().model_dump(exclude={"load"}) == expected.model_dump(exclude={"load"})
+        assert str(record.load) == str(expected.load)
+        assert record.memory_util == expected.memory_util
+
+    row = parse_nvidia_smi_csv(PROCESS_CSV)[0]
+    assert GPUProcessRecord.from_nvidia_smi_list(row).to_model() == GPUProcess.from_nvidia_smi_list(row)
+
+
+def test_records_are_tuples_without_dict():
+    record = GPURecord.from_nvidia_smi_list(parse_nvidia_smi_csv(GPU_CSV)[0])
+
+    assert not hasattr(record, "__dict__")
+    assert record.display_mode == "Disabled" and record.display_active == "Enabled"
+    assert record.load == 0.12
+    assert GPURecord.from_model(record.to_model()) == record
+
+
+def test_separator_in_names():
+    process = GPUProcessRecord.from_nvidia_smi_list("42, python train.py --lr=1,2, GPU-1".split(","))
+    assert process == GPUProcessRecord(42, "python train.py --lr=1,2", "GPU-1")
+
+    row = "3, GPU-3, 0, 100, 10, 90, 535.104.05, Vendor, Model X, 17, Disabled, Disabled, 40".split(",")
+    gpu = GPURecord.from_nvidia_smi_list(row)
+    assert (gpu.name, gpu.serial, gpu.temperature) == ("Vendor, Model X", "17", 40.0)
+
+
+def test_provider_sample_records(mocker):
+    run = mocker.patch("subprocess.run")
+    run.side_effect = [mocker.MagicMock(stdout=GPU_CSV), mocker.MagicMock(stdout=PROCESS_CSV)]
+
+    gpus, processes = NvidiaGPUProvider().sample_records()
+
+    assert [gpu.id for gpu in gpus] == [0, 1]
+    assert processes == [
+        GPUProcessRecord(12809, "/opt/conda/bin/python3.9", "GPU-3b91b854-3dfa-fa53-5612-52ccda6d8f2a")
+    ]
+
+
+def test_broker_protocol_with_records():
+    gpu = GPURecord.from_nvidia_smi_list(parse_nvidia_smi_csv(GPU_CSV)[0])._replace(
+        throttle_reasons=("sw_power_cap",)
+    )
+    process = GPUProcessRecord(12809, "python", gpu.uuid, 1000)
+
+    gpus, processes = decode_sample(encode_sample([gpu], [process]))
+
+    assert gpus == [gpu.to_model()]
+    assert gpus[0].throttle_reasons == ["sw_power_cap"]
+    assert processes == [process.to_model()]
+
+
+def test_stale_broker_samples_are_rejected():
+    line = encode_sample([], [], timestamp=1000.0, interval_in_seconds=2.0)
+
+    assert decode_sample(line, now=1006.0) == ([], [])
+    with pytest.raises(GPUNotFoundException, match="stale"):
+        decode_sample(line, now=1006.5)
@@ -0,0 +1,77 @@
+"""
+Tests for rendering GPU information
+"""
+
+import json
+import math
+
+import pytest
+
+from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.processing.gpu.rendering import (
+    OutputFormat,
+    render_utilization,
+    validate_attributes,
+)
+
+
+@pytest.fixture
+def gpus():
+    return [
+        GPU(
+            id=gpu_id,
+            uuid=f"GPU-{gpu_id}",
+            load=load,
+            memory_total=49152,
+            memory_used=memory_used,
+            memory_free=49152 - memory_used,
+            driver="535.104.05",
+            name='Quadro "RTX" 8000',
+            serial=str(gpu_id),
+            display_mode="Disabled",
+            display_active="Disabled",
+            temperature=35,
+        )
+        for gpu_id, load, memory_used in [(0, 0.0, 1), (1, 1.0, 48353), (2, math.nan, 219)]
+    ]
+
+
+def test_render_table(gpus):
+    assert render_utilization(gpus).splitlines() == [
+        "| ID | GPU util. | Memory util. | GPU temp. | ",
+        "|----|-----------|--------------|-----------|",
+        "| 0  |   0.00    |     0.00     |   35.00   | ",
+        "| 1  |   1.00    |     0.98     |   35.00   | ",
+        "| 2  |    nan    |     0.00     |   35.00   | ",
+    ]
+
+
+def test_render_json_and_csv(gpus):
+    rows = json.loads(render_utilization(gpus, ["load", "name"], OutputFormat.JSON))
+    assert rows[2] == {"id": 2, "load": None, "name": 'Quadro "RTX" 8000'}
+
+    assert render_utilization(gpus, ["memory_free"], OutputFormat.CSV).splitlines() == [
+        "id,memory_free",
+        "0,49151",
+        "1,799",
+        "2,48933",
+    ]
+    assert render_utilization(gpus, ["load"], OutputFormat.CSV).splitlines()[-1] == "2,"
+
+
+def test_render_prometheus(gpus):
+    lines = render_utilization(gpus, ["load", "name"], OutputFormat.PROM).splitlines()
+
+    labels = 'uuid="GPU-2",id="2",name="Quadro \\"RTX\\" 8000"'
+    assert "# TYPE experiment_runner_gpu_load gauge" in lines
+    assert f"experiment_runner_gpu_info{{{labels}}} 1.0" in lines
+    assert f"experiment_runner_gpu_load{{{labels}}} NaN" in lines
+    assert len([line for line in lines if line.startswith("# HELP")]) == 2
+
+
+def test_unknown_attributes_are_rejected_before_rendering(gpus):
+    assert validate_attributes(["load", "id"]) == ("id", "load")
+
+    with pytest.raises(ValueError) as ex_info:
+        render_utilization(gpus, ["load", "driver", "power"])
+    assert "['driver', 'power']" in str(ex_info.value)
@@ -0,0 +1,75 @@
+"""
+Tests for the GPU usage report
+"""
+
+import json
+
+import pytest
+from gpu_doubles import get_gpu
+
+from experiment_runner.processing.gpu.models import GPUProcess
+from experiment_runner.processing.gpu.report import (
+    OutputFormat,
+    create_usage_report,
+    render_usage_report,
+)
+from experiment_runner.processing.gpu.snapshot import GPUSnapshot
+
+
+@pytest.fixture
+def snapshot():
+    processes = [
+        GPUProcess(pid=100, process_name="python", gpu_uuid="GPU-1", used_memory=1000),
+        GPUProcess(pid=100, process_name="python", gpu_uuid="GPU-0", used_memory=500),
+        GPUProcess(pid=200, process_name="train.py", gpu_uuid="GPU-1"),
+        GPUProcess(pid=300, process_name="gone", gpu_uuid="GPU-1", used_memory=10),
+    ]
+    users = {100: "bob", 200: "alice", 300: None}
+    return GPUSnapshot([get_gpu(0), get_gpu(1)], processes, user_resolver=lambda pids: users)
+
+
+def test_usage_report_groups_by_user(snapshot):
+    report = create_usage_report(snapshot)
+
+    assert [usage.user for usage in report] == ["alice", "bob"]
+    assert report[1].gpus == [0, 1]
+    assert report[1].pids == [100]
+    assert report[1].used_memory == 1500
+    assert report[0].used_memory == 0
+
+
+def test_usage_report_as_json(snapshot):
+    report = json.loads(render_usage_report(create_usage_report(snapshot), OutputFormat.JSON))
+
+    assert report[0]["user"] == "alice"
+    assert report[0]["processes"] == [
+        {"pid": 200, "process_name": "train.py", "gpu_id": 1, "gpu_uuid": "GPU-1", "used_memory": None}
+    ]
+
+
+def test_usage_report_as_csv(snapshot):
+    assert render_usage_report(create_usage_report(snapshot), OutputFormat.CSV).splitlines() == [
+        "user,gpu_id,gpu_uuid,pid,process_name,used_memory",
+        "alice,1,GPU-1,200,train.py,",
+        "bob,1,GPU-1,100,python,1000",
+        "bob,0,GPU-0,100,python,500",
+    ]
+
+
+def test_usage_report_as_table(snapshot):
+    table = render_usage_report(create_usage_report(snapshot))
+
+    assert "Report for user alice:\n\tUsed GPUs: [1]\n\tPIDs: [200]" in table
+    assert "Report for user bob:" in table
+
+
+def test_usage_report_as_prometheus(snapshot):
+    lines = render_usage_report(create_usage_report(snapshot), OutputFormat.PROM).splitlines()
+
+    assert lines[:4] == [
+        "# HELP experiment_runner_user_gpus Number of GPUs used by the user",
+        "# TYPE experiment_runner_user_gpus gauge",
+        'experiment_runner_user_gpus{user="alice"} 1.0',
+        'experiment_runner_user_gpus{user="bob"} 2.0',
+    ]
+    assert 'experiment_runner_user_used_memory_mib{user="bob"} 1500.0' in lines
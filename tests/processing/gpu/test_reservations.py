@@ -0,0 +1,279 @@
+"""
+Tests for the host-wide GPU reservation ledger
+"""
+
+import json
+import multiprocessing
+import os
+import time
+from typing import List
+
+import pytest
+from gpu_doubles import get_gpus
+
+from experiment_runner.processing.gpu.manager import GPUManager
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.providers import NvidiaGPUProvider
+from experiment_runner.processing.gpu.reservations import GPUClaim, GPUReservationLedger
+from experiment_runner.processing.gpu.snapshot import GPUSnapshot
+from experiment_runner.processing.gpu.strategies import (
+    SelectionStrategyEnum,
+    SelectionStrategyFactory,
+)
+
+GPU_COUNT = 8
+SELECTORS = 24
+
+
+class StaticUserManager(GPUManager):
+    """
+    Manager of a fixed user without running GPU processes
+    """
+
+    def __init__(self, ledger: GPUReservationLedger, user: str, limit: int):
+        super().__init__(
+            SelectionStrategyFactory.get_instance(SelectionStrategyEnum.RANDOM),
+            provider=NvidiaGPUProvider(),
+            ledger=ledger,
+        )
+        self.user = user
+        self.limit = limit
+
+    @property
+    def username(self) -> str:
+        return self.user
+
+    def get_gpu_limit_of_current_user(self) -> int:
+        return self.limit
+
+    def get_gpus_of_current_user(self, snapshot=None):
+        return set()
+
+
+def get_manager(ledger: GPUReservationLedger, user: str = "alice", limit: int = 10) -> GPUManager:
+    return StaticUserManager(ledger, user, limit)
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return GPUReservationLedger(tmp_path / "shm" / "reservations.json", grace_period_in_seconds=60)
+
+
+@pytest.fixture
+def snapshot():
+    return GPUSnapshot(get_gpus(*range(GPU_COUNT)), [], user_resolver=lambda pids: {})
+
+
+def test_claimed_gpus_are_busy_for_every_strategy(ledger, snapshot):
+    manager = get_manager(ledger)
+    claimed = manager.reserve_available(limit=3, snapshot=snapshot)
+
+    assert ledger.claimed_uuids() == {gpu.uuid for gpu in claimed}
+    for strategy_type in SelectionStrategyEnum:
+        manager.strategy = SelectionStrategyFactory.get_instance(strategy_type)
+        available = manager.get_available(limit=GPU_COUNT, memory_free=1024, snapshot=snapshot)
+        assert not {gpu.uuid for gpu in available} & ledger.claimed_uuids()
+
+
+def test_claims_count_towards_the_limit(ledger, snapshot):
+    get_manager(ledger, user="alice", limit=2).reserve_available(limit=1, snapshot=snapshot)
+
+    assert len(get_manager(ledger, user="alice", limit=2).get_available(limit=4, snapshot=snapshot)) == 1
+    assert len(get_manager(ledger, user="bob", limit=2).get_available(limit=4, snapshot=snapshot)) == 2
+
+
+def test_excluded_gpus_are_neither_selected_nor_claimed(ledger, snapshot):
+    excluded = {f"GPU-{gpu_id}" for gpu_id in range(GPU_COUNT - 2)}
+
+    claimed = get_manager(ledger).reserve_available(limit=GPU_COUNT, snapshot=snapshot, excluded=excluded)
+
+    assert {gpu.uuid for gpu in claimed} == {f"GPU-{GPU_COUNT - 2}", f"GPU-{GPU_COUNT - 1}"}
+    assert ledger.claimed_uuids() == {gpu.uuid for gpu in claimed}
+
+
+def test_claims_expire(ledger, snapshot):
+    ledger.claim(lambda claims: get_gpus(0), "alice", pid=None)
+    ledger.claim(lambda claims: get_gpus(1), "alice", pid=os.getpid())
+    assert ledger.claimed_uuids() == {"GPU-0", "GPU-1"}
+
+    # Process exited
+    process = multiprocessing.get_context("fork").Process(target=time.sleep, args=(0,))
+    process.start()
+    process.join()
+    ledger.claim(lambda claims: get_gpus(2), "bob", pid=process.pid)
+    assert "GPU-2" not in ledger.claimed_uuids()
+
+    # Grace period over
+    ledger.grace_period_in_seconds = -1
+    ledger.claim(lambda claims: get_gpus(3), "bob", pid=None)
+    assert ledger.claimed_uuids() == {"GPU-0", "GPU-1"}
+
+    assert ledger.release() == 1
+    assert ledger.claimed_uuids() == {"GPU-0"}
+
+
+def test_forged_claims_are_dropped(ledger):
+    forged = [
+        # pid 1 never exits and does not belong to bob
+        {"gpu_uuid": "GPU-0", "user": "bob", "pid": 1, "expires_at": 0, "held": True},
+        # Outlasts the grace period
+        {"gpu_uuid": "GPU-1", "user": "bob", "pid": None, "expires_at": time.time() + 10**9},
+    ]
+    ledger.path.parent.mkdir(parents=True)
+    ledger.path.write_text(json.dumps(forged))
+    ledger.claim(lambda claims: get_gpus(2), "alice", pid=os.getpid())
+
+    assert ledger.claimed_uuids() == {"GPU-2"}
+
+
+def test_held_claims_of_a_user_are_capped(tmp_path):
+    ledger = GPUReservationLedger(tmp_path / "reservations.json", max_held_claims_per_user=2)
+
+    ledger.claim(lambda claims: get_gpus(0, 1, 2), "alice", pid=os.getpid(), held=True)
+
+    assert ledger.claimed_uuids() == {"GPU-0", "GPU-1"}
+
+
+def test_damaged_ledger_is_reset(ledger):
+    ledger.path.parent.mkdir(parents=True)
+    ledger.path.write_text("{not json")
+
+    assert ledger.claims() == []
+    ledger.claim(lambda claims: get_gpus(0), "alice", pid=None)
+    assert [claim.gpu_uuid for claim in ledger.claims()] == ["GPU-0"]
+
+
+def test_failed_selection_does_not_change_the_ledger(ledger):
+    ledger.claim(lambda claims: get_gpus(0), "alice", pid=None)
+
+    def fail(claims: List[GPUClaim]) -> List[GPU]:
+        raise ValueError("Selection failed")
+
+    with pytest.raises(ValueError):
+        ledger.claim(fail, "alice", pid=None)
+    assert ledger.claimed_uuids() == {"GPU-0"}
+
+
+def test_packed_jobs_share_a_gpu_within_the_memory_budget(ledger):
+    snapshot = GPUSnapshot(get_gpus(0), [], user_resolver=lambda pids: {})
+    manager = get_manager(ledger)
+
+    # 4096 MiB minus the safety margin hold three jobs of 1024 MiB
+    packed = [manager.reserve_available(snapshot=snapshot, job_memory=1024) for _ in range(4)]
+
+    assert [[gpu.uuid for gpu in gpus] for gpus in packed] == [["GPU-0"], ["GPU-0"], ["GPU-0"], []]
+    assert [claim.memory for claim in ledger.claims()] == [1024, 1024, 1024]
+
+
+def test_packed_and_exclusive_claims_exclude_each_other(ledger):
+    snapshot = GPUSnapshot(get_gpus(0, 1), [], user_resolver=lambda pids: {})
+    manager = get_manager(ledger)
+    manager.strategy = SelectionStrategyFactory.get_instance(SelectionStrategyEnum.FIRST)
+
+    exclusive = manager.reserve_available(snapshot=snapshot)
+    packed = manager.reserve_available(snapshot=snapshot, job_memory=1024)
+
+    assert [gpu.uuid for gpu in exclusive] == ["GPU-0"]
+    assert [gpu.uuid for gpu in packed] == ["GPU-1"]
+    assert manager.get_available(limit=2, snapshot=snapshot) == []
+
+
+def test_packed_jobs_ignore_load_but_not_observed_memory(ledger):
+    gpus = get_gpus(0, 1)
+    gpus[0] = gpus[0].model_copy(update={"load": 0.9, "memory_used": 2048, "memory_free": 2048})
+    gpus[1] = gpus[1].model_copy(update={"memory_used": 3072, "memory_free": 1024})
+    snapshot = GPUSnapshot(gpus, [], user_resolver=lambda pids: {})
+
+    available = get_manager(ledger).get_available(limit=2, snapshot=snapshot, job_memory=1024)
+
+    assert [gpu.uuid for gpu in available] == ["GPU-0"]
+
+
+def test_observed_memory_of_packed_jobs_is_not_counted_twice(ledger):
+    processes = [
+        GPUProcess(pid=os.getpid(), process_name="python", gpu_uuid="GPU-0", used_memory=768),
+        GPUProcess(pid=1, process_name="other", gpu_uuid="GPU-1", used_memory=512),
+    ]
+    gpus = get_gpus(0, 1)
+    gpus[0] = gpus[0].model_copy(update={"memory_used": 768, "memory_free": 3328})
+    gpus[1] = gpus[1].model_copy(update={"memory_used": 512, "memory_free": 3584})
+    snapshot = GPUSnapshot(gpus, processes, user_resolver=lambda pids: {})
+    ledger.claim(lambda claims: gpus, "alice", pid=os.getpid(), memory=1024)
+
+    committed = GPUManager.get_committed_memory(snapshot, ledger.claims())
+
+    # The job allocated 768 of 1024 MiB on GPU-0, nothing on GPU-1
+    assert list(committed) == [1024, 1536]
+
+
+def test_packed_claims_last_until_the_job_exits(ledger):
+    ledger.grace_period_in_seconds = -1
+    ledger.claim(lambda claims: get_gpus(0), "alice", pid=os.getpid(), memory=1024)
+
+    assert ledger.claimed_uuids() == {"GPU-0"}
+    assert ledger.release() == 1
+
+
+def test_held_claims_last_until_they_are_released(ledger):
+    ledger.grace_period_in_seconds = -1
+    ledger.claim(lambda claims: get_gpus(0), "alice", pid=os.getpid(), held=True)
+    ledger.claim(lambda claims: get_gpus(1), "alice", pid=os.getpid())
+
+    assert ledger.claimed_uuids() == {"GPU-0"}
+    assert ledger.release() == 1
+    assert not ledger.claimed_uuids()
+
+
+def test_best_fit_fills_gpus_with_memory_committed_to_packed_jobs(ledger):
+    snapshot = GPUSnapshot(get_gpus(0, 1, 2), [], user_resolver=lambda pids: {})
+    ledger.claim(lambda claims: get_gpus(1), "bob", pid=None, memory=2048)
+    ledger.claim(lambda claims: get_gpus(2), "bob", pid=None, memory=3072)
+    manager = get_manager(ledger)
+    manager.strategy = SelectionStrategyFactory.get_instance(SelectionStrategyEnum.BEST_FIT)
+
+    # All GPUs look empty, but the job of bob on GPU-1 did not allocate its memory yet. GPU-2 is too full.
+    assert [gpu.uuid for gpu in manager.get_available(limit=3, snapshot=snapshot, job_memory=1024)] == [
+        "GPU-1",
+        "GPU-0",
+    ]
+
+
+def test_packing_onto_own_gpus_does_not_count_towards_the_limit(ledger):
+    snapshot = GPUSnapshot(get_gpus(0, 1), [], user_resolver=lambda pids: {})
+    manager = get_manager(ledger, limit=1)
+
+    first = manager.reserve_available(snapshot=snapshot, job_memory=1024)
+    second = manager.reserve_available(limit=2, snapshot=snapshot, job_memory=1024)
+
+    assert second == first
+
+
+def select_concurrently(ledger, barrier, holder_pid, results):
+    manager = get_manager(ledger, user=f"user-{os.getpid()}", limit=1)
+    snapshot = GPUSnapshot(get_gpus(*range(GPU_COUNT)), [], user_resolver=lambda pids: {})
+    barrier.wait()
+    gpus = manager.ledger.claim(
+        lambda claims: manager.get_available(limit=1, snapshot=snapshot, claims=claims),
+        manager.username,
+        holder_pid,
+    )
+    results.put([gpu.uuid for gpu in gpus])
+
+
+def test_concurrent_selectors_never_share_a_gpu(ledger):
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(SELECTORS)
+    results = context.Queue()
+    # Claims without process last for the grace period, so they outlive the short-lived selectors
+    selectors = [
+        context.Process(target=select_concurrently, args=(ledger, barrier, None, results)) for _ in range(SELECTORS)
+    ]
+    for selector in selectors:
+        selector.start()
+    claimed = [uuid for _ in selectors for uuid in results.get(timeout=30)]
+    for selector in selectors:
+        selector.join(timeout=30)
+
+    assert len(claimed) == GPU_COUNT
+    assert len(set(claimed)) == GPU_COUNT
+    assert ledger.claimed_uuids() == set(claimed)
@@ -0,0 +1,202 @@
+"""
+Tests for the streaming nvidia-smi sampler
+"""
+
+import os
+import time
+from typing import List
+
+import pytest
+
+from experiment_runner.processing.gpu.exceptions import GPUNotFoundException
+from experiment_runner.processing.gpu.manager import GPUManager
+from experiment_runner.processing.gpu.providers import NvidiaGPUProvider
+from experiment_runner.processing.gpu.records import GPUProcessRecord
+from experiment_runner.processing.gpu.sampler import StreamingGPUSampler, _StreamReader
+
+GPU_ROWS = [
+    "0, GPU-8bfb8a55-1787-40ee-38fc-fe4af7dfdb6c, {load}, 49152, 1, 48592, 535.104.05, Quadro RTX 8000, 1324821109943, Disabled, Disabled, 35",
+    "1, GPU-3b91b854-3dfa-fa53-5612-52ccda6d8f2a, 100, 49152, 48353, 231, 535.104.05, Quadro RTX 8000, 1324821109359, Disabled, Disabled, 49",
+]
+PROCESS_ROW = "12809, /opt/conda/bin/python3.9, GPU-3b91b854-3dfa-fa53-5612-52ccda6d8f2a"
+
+
+class FakeNvidiaSmi:
+    """
+    Popen double whose stdout is fed by the test
+    """
+
+    instances: List["FakeNvidiaSmi"] = []
+
+    def __init__(self, command, **_kwargs):
+        self.command = command
+        read_fd, write_fd = os.pipe()
+        self.stdout = os.fdopen(read_fd, "r")
+        self.writer = os.fdopen(write_fd, "w", buffering=1)
+        self.returncode = None
+        FakeNvidiaSmi.instances.append(self)
+
+    def emit(self, timestamp, rows):
+        for row in rows:
+            self.writer.write(f"{timestamp}, {row}\n")
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = -15
+        self.writer.close()
+
+    def kill(self):
+        self.terminate()
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+def wait_until(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "Condition not reached in time"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def fake_popen(mocker):
+    FakeNvidiaSmi.instances = []
+    # Queried instead while the process stream did not deliver its first sample
+    mocker.patch.object(NvidiaGPUProvider, "_process_records", return_value=[])
+    return mocker.patch("subprocess.Popen", FakeNvidiaSmi)
+
+
+def test_sampler_starts_one_process_per_query(fake_popen):
+    with StreamingGPUSampler(interval_in_seconds=0.5):
+        gpu_smi, process_smi = FakeNvidiaSmi.instances
+        assert gpu_smi.command[1].startswith("--query-gpu=timestamp,index,uuid")
+        assert process_smi.command[1] == "--query-compute-apps=timestamp,pid,process_name,gpu_uuid"
+        assert gpu_smi.command[-2:] == ["-lms", "500"]
+
+    assert gpu_smi.returncode == -15 and process_smi.returncode == -15
+
+
+def test_sampler_exposes_latest_sample_without_forking(fake_popen):
+    with StreamingGPUSampler(interval_in_seconds=60) as sampler:
+        gpu_smi, process_smi = FakeNvidiaSmi.instances
+
+        # The first sample is complete once the next one starts
+        gpu_smi.emit("2024/03/12 14:03:11.000", [row.format(load=0) for row in GPU_ROWS])
+        process_smi.emit("2024/03/12 14:03:11.000", [PROCESS_ROW])
+        gpu_smi.emit("2024/03/12 14:04:11.000", [GPU_ROWS[0].format(load=10)])
+        process_smi.emit("2024/03/12 14:04:11.000", [PROCESS_ROW])
+
+        wait_until(lambda: sampler._process_reader.published.is_set())
+        gpus, processes = sampler.sample()
+        assert [gpu.load for gpu in gpus] == [0.0, 1.0]
+        assert [proc.pid for proc in processes] == [12809]
+
+        # Afterwards samples are published as soon as all GPUs are read
+        gpu_smi.emit("2024/03/12 14:04:11.000", [GPU_ROWS[1]])
+        wait_until(lambda: sampler.gpus[0].load == 0.1)
+
+        manager = GPUManager(provider=sampler)
+        assert len(manager.snapshot()) == 2
+        assert len(FakeNvidiaSmi.instances) == 2
+
+
+def test_sampler_drops_processes_when_nvidia_smi_is_quiet(fake_popen):
+    with StreamingGPUSampler(interval_in_seconds=0.05) as sampler:
+        gpu_smi, process_smi = FakeNvidiaSmi.instances
+        process_smi.emit("2024/03/12 14:03:11.000", [PROCESS_ROW])
+        process_smi.emit("2024/03/12 14:03:12.000", [PROCESS_ROW])
+        gpu_smi.emit("2024/03/12 14:03:11.000", [row.format(load=0) for row in GPU_ROWS])
+        gpu_smi.emit("2024/03/12 14:03:12.000", [GPU_ROWS[0].format(load=0)])
+
+        wait_until(lambda: sampler._gpu_reader.published.is_set())
+        time.sleep(0.2)
+        # GPU samples keep coming
+        emitted_at = time.monotonic()
+        gpu_smi.emit("2024/03/12 14:03:12.000", [GPU_ROWS[1]])
+        wait_until(lambda: sampler._gpu_reader.last_line_at > emitted_at)
+        assert sampler.get_compute_processes() == []
+
+
+def test_processes_are_queried_once_until_the_first_process_sample(fake_popen, mocker):
+    record = GPUProcessRecord.from_nvidia_smi_list(PROCESS_ROW.split(","))
+    query = mocker.patch.object(NvidiaGPUProvider, "_process_records", return_value=[record])
+    with StreamingGPUSampler(interval_in_seconds=60) as sampler:
+        gpu_smi, process_smi = FakeNvidiaSmi.instances
+        gpu_smi.emit("2024/03/12 14:03:11.000", [row.format(load=0) for row in GPU_ROWS])
+        wait_until(lambda: sampler._gpu_reader.published.is_set())
+
+        # The process stream did not print its first sample yet
+        assert [proc.pid for proc in sampler.get_compute_processes()] == [12809]
+
+        process_smi.emit("2024/03/12 14:03:11.000", [PROCESS_ROW])
+        wait_until(lambda: sampler._process_reader.published.is_set())
+        assert [proc.pid for proc in sampler.get_compute_processes()] == [12809]
+        assert query.call_count == 1
+
+
+def test_process_groups_are_published_when_they_end(fake_popen):
+    with StreamingGPUSampler(interval_in_seconds=60) as sampler:
+        _, process_smi = FakeNvidiaSmi.instances
+        process_smi.emit("2024/03/12 14:03:11.000", [PROCESS_ROW])
+
+        # No following group is needed
+        wait_until(lambda: [proc.pid for proc in sampler._process_reader.latest] == [12809])
+
+
+def test_malformed_rows_are_skipped(fake_popen):
+    with StreamingGPUSampler(interval_in_seconds=60) as sampler:
+        gpu_smi, _ = FakeNvidiaSmi.instances
+        gpu_smi.emit("2024/03/12 14:03:11.000", ["[Unknown Error]", *(row.format(load=0) for row in GPU_ROWS)])
+
+        wait_until(lambda: sampler._gpu_reader.published.is_set())
+        assert len(sampler.gpus) == 2
+        assert sampler._gpu_reader.thread.is_alive()
+
+
+def test_outdated_samples_are_replaced_by_forking_nvidia_smi(fake_popen, mocker):
+    query = mocker.patch.object(NvidiaGPUProvider, "sample_records", return_value=([], []))
+    with StreamingGPUSampler(interval_in_seconds=0.05) as sampler:
+        gpu_smi, _ = FakeNvidiaSmi.instances
+        gpu_smi.emit("2024/03/12 14:03:11.000", [row.format(load=0) for row in GPU_ROWS])
+        wait_until(lambda: sampler._gpu_reader.published.is_set())
+
+        # nvidia-smi hangs
+        time.sleep(0.2)
+        assert sampler.sample() == ([], [])
+        assert query.call_count == 1
+        assert gpu_smi.returncode is not None
+
+
+def test_reader_errors_are_reported(fake_popen):
+    def parse(values):
+        raise RuntimeError("unexpected")
+
+    reader = _StreamReader(["nvidia-smi"], parse)
+    FakeNvidiaSmi.instances[0].emit("2024/03/12 14:03:11.000", [PROCESS_ROW])
+
+    reader.thread.join(timeout=5)
+    assert "unexpected" in reader.error
+    assert reader.published.is_set()
+    reader.close()
+
+
+def test_sampler_forks_nvidia_smi_once_the_stream_exited(fake_popen, mocker):
+    query = mocker.patch.object(NvidiaGPUProvider, "sample_records", return_value=([], []))
+    with StreamingGPUSampler(interval_in_seconds=0.05) as sampler:
+        gpu_smi, _ = FakeNvidiaSmi.instances
+        gpu_smi.returncode = 9
+        gpu_smi.writer.close()
+
+        assert sampler.sample() == ([], [])
+        assert sampler.sample() == ([], [])
+        assert query.call_count == 2
+
+
+def test_sampler_without_nvidia_smi(mocker):
+    mocker.patch("subprocess.Popen", side_effect=FileNotFoundError())
+
+    with pytest.raises(GPUNotFoundException):
+        StreamingGPUSampler()
@@ -0,0 +1,117 @@
+"""
+Tests for the point-in-time GPU snapshot and its use in the GPUManager
+"""
+
+from typing import List, Tuple
+
+import pytest
+from gpu_doubles import get_gpu
+
+from experiment_runner.processing.gpu.manager import GPUManager
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.providers import GPUProvider
+from experiment_runner.processing.gpu.snapshot import GPUSnapshot
+
+
+class CountingProvider(GPUProvider):
+    """
+    Provider returning fixed values while counting the queries
+    """
+
+    def __init__(self, gpus: List[GPU], processes: List[GPUProcess]):
+        self._gpus = gpus
+        self._processes = processes
+        self.calls = 0
+
+    def get_compute_processes(self) -> List[GPUProcess]:
+        self.calls += 1
+        return self._processes
+
+    @property
+    def gpus(self) -> List[GPU]:
+        self.calls += 1
+        return self._gpus
+
+    def sample(self) -> Tuple[List[GPU], List[GPUProcess]]:
+        self.calls += 1
+        return self._gpus, self._processes
+
+
+USERS = {100: "alice", 101: "alice", 200: "bob", 300: None}
+
+
+def resolve_users(pids):
+    return {pid: USERS[pid] for pid in pids}
+
+
+@pytest.fixture
+def provider():
+    gpus = [get_gpu(0), get_gpu(1, load=0.9, memory_used=4000), get_gpu(2, memory_used=3000), get_gpu(3)]
+    processes = [
+        GPUProcess(pid=100, process_name="python", gpu_uuid="GPU-1"),
+        GPUProcess(pid=101, process_name="python", gpu_uuid="GPU-2"),
+        GPUProcess(pid=100, process_name="python", gpu_uuid="GPU-2"),
+        GPUProcess(pid=200, process_name="python", gpu_uuid="GPU-1"),
+        GPUProcess(pid=300, process_name="zombie", gpu_uuid="GPU-3"),
+        GPUProcess(pid=200, process_name="python", gpu_uuid="GPU-unknown"),
+    ]
+    return CountingProvider(gpus, processes)
+
+
+@pytest.fixture
+def snapshot(provider):
+    gpus, processes = provider.sample()
+    return GPUSnapshot(gpus, processes, user_resolver=resolve_users)
+
+
+def test_snapshot_indexes(snapshot):
+    assert len(snapshot) == 4
+    assert snapshot["GPU-2"].id == 2
+    assert snapshot.get_by_id(3).uuid == "GPU-3"
+    assert snapshot.get_by_id(7) is None
+    assert [proc.gpu_uuid for proc in snapshot.get_processes_of_pid(100)] == ["GPU-1", "GPU-2"]
+    assert snapshot.get_user_of_pid(300) is None
+
+    with pytest.raises(ValueError):
+        _ = snapshot["GPU-unknown"]
+
+
+def test_snapshot_user_queries(snapshot):
+    assert snapshot.users == {"alice", "bob"}
+    assert {gpu.id for gpu in snapshot.get_gpus_of_user("alice")} == {1, 2}
+    # Processes on unknown GPUs are kept but do not resolve to a GPU
+    assert {gpu.id for gpu in snapshot.get_gpus_of_user("bob")} == {1}
+    assert len(snapshot.get_processes_of_user("bob")) == 2
+    assert snapshot.get_gpus_of_user("carol") == set()
+
+
+def test_snapshot_resolves_all_pids_at_once(provider):
+    resolved: List[List[int]] = []
+
+    def resolver(pids):
+        resolved.append(sorted(pids))
+        return resolve_users(pids)
+
+    snapshot = GPUSnapshot(*provider.sample(), user_resolver=resolver)
+    assert resolved == [[100, 101, 200, 300]]
+    assert snapshot.users_of_pids == USERS
+
+
+def test_snapshot_is_immutable(snapshot):
+    with pytest.raises(AttributeError):
+        snapshot.timestamp = 0
+
+    snapshot.gpus.clear()
+    assert len(snapshot.gpus) == 4
+
+
+def test_manager_decision_uses_a_single_sample(mocker, provider):
+    mocker.patch("experiment_runner.processing.gpu.snapshot.get_users_for_pids", side_effect=resolve_users)
+    manager = GPUManager(provider=provider)
+    mocker.patch.object(GPUManager, "username", new_callable=mocker.PropertyMock, return_value="alice")
+    mocker.patch.object(manager, "get_gpu_limit_of_current_user", return_value=10)
+
+    snapshot = manager.snapshot()
+    assert {gpu.id for gpu in manager.get_gpus_of_current_user(snapshot)} == {1, 2}
+    assert [gpu.id for gpu in manager.get_available(limit=4, snapshot=snapshot)] == [0, 3]
+    assert provider.calls == 1
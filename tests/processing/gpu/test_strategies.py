@@ -1,11 +1,21 @@
 import random
+import time
 from typing import List
 
+import pytest
+from gpu_doubles import get_gpu
+
+from experiment_runner.processing.gpu.history import GPUUtilizationHistory
+from experiment_runner.processing.gpu.manager import GPUManager
 from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.processing.gpu.providers import NvidiaGPUProvider
+from experiment_runner.processing.gpu.snapshot import GPUSnapshot
 from experiment_runner.processing.gpu.strategies import (
     SelectionStrategyEnum,
     SelectionStrategyFactory,
+    get_table_strategy,
 )
+from experiment_runner.processing.gpu.table import GPUTable
 
 
 def get_gpus(count, load: List = [], memory_usage: List = []):
@@ -83,3 +93,104 @@ def test_strategy_SelectMemory():
     sorted_gpus = strategy(gpus)
     for g in range(len(gpus)):
         assert sorted_gpus[g].memory_used == memory_order[g]
+
+
+def test_strategy_SelectBestFit():
+    strategy = SelectionStrategyFactory.get_instance(SelectionStrategyEnum.BEST_FIT)
+
+    gpus = [get_gpu(0, 0.3, 1024), get_gpu(1, 0.1, 3072), get_gpu(2, 0.2, 3072), get_gpu(3, 0.0, 0)]
+
+    # Least free memory first, then least load
+    assert [gpu.id for gpu in strategy(gpus)] == [1, 2, 0, 3]
+
+
+def test_best_fit_keeps_large_gpus_free(mocker):
+    manager = GPUManager(
+        SelectionStrategyFactory.get_instance(SelectionStrategyEnum.BEST_FIT), provider=NvidiaGPUProvider()
+    )
+    mocker.patch.object(manager, "get_gpu_limit_of_current_user", return_value=10)
+    mocker.patch.object(manager, "get_gpus_of_current_user", return_value=set())
+    snapshot = GPUSnapshot(
+        [
+            get_gpu(0, memory_used=0),
+            get_gpu(1, memory_used=1536),
+            get_gpu(2, memory_used=2048),
+            get_gpu(3, memory_used=3584),
+        ],
+        [],
+        user_resolver=lambda pids: {},
+    )
+
+    # GPU 3 has too little free memory, GPU 2 fits most tightly
+    selected = manager.get_available(limit=1, max_memory=1.0, memory_free=2048, snapshot=snapshot)
+    assert [gpu.id for gpu in selected] == [2]
+    selected = manager.get_available(limit=2, max_memory=1.0, memory_free=2048, snapshot=snapshot)
+    assert [gpu.id for gpu in selected] == [2, 1]
+
+
+def test_best_fit_needs_the_memory_of_the_job():
+    manager = GPUManager(
+        SelectionStrategyFactory.get_instance(SelectionStrategyEnum.BEST_FIT), provider=NvidiaGPUProvider()
+    )
+    snapshot = GPUSnapshot([get_gpu(0), get_gpu(1, memory_used=1024)], [], user_resolver=lambda pids: {})
+
+    with pytest.raises(ValueError, match="memory"):
+        manager.get_available(snapshot=snapshot)
+
+
+def test_history_strategies(tmp_path):
+    history = GPUUtilizationHistory(tmp_path / "history.npy")
+    gpus = [get_gpu(0, 0.0), get_gpu(1, 0.1), get_gpu(2, 0.2), get_gpu(3, 0.0)]
+
+    now = time.time()
+    # GPU 0 only pauses between two epochs, GPU 2 had a short spike and GPU 3 is idle since 70 seconds
+    for second in range(120):
+        loads = [0.0 if second >= 115 else 1.0, 0.1, 0.8 if 60 <= second < 70 else 0.2, 1.0 if second < 50 else 0.0]
+        samples = [gpu.model_copy(update={"load": load}) for gpu, load in zip(gpus, loads)]
+        history.append(samples, timestamp=now - 120 + second)
+
+    def select(strategy_type):
+        table = GPUTable.from_gpus(gpus)
+        strategy = SelectionStrategyFactory.get_instance(strategy_type)
+        return [gpu.id for gpu in table.to_gpus(get_table_strategy(strategy, history)(table))]
+
+    assert select(SelectionStrategyEnum.LOAD) == [0, 3, 1, 2]
+    assert select(SelectionStrategyEnum.EWMA_LOAD) == [1, 3, 2, 0]
+    assert select(SelectionStrategyEnum.P95_LOAD) == [1, 2, 0, 3]
+    assert select(SelectionStrategyEnum.IDLE) == [3, 1, 2, 0]
+
+
+def test_history_strategies_without_history():
+    gpus = [get_gpu(0, 0.2), get_gpu(1, 0.0), get_gpu(2, 0.1)]
+
+    for strategy_type in (
+        SelectionStrategyEnum.EWMA_LOAD,
+        SelectionStrategyEnum.P95_LOAD,
+        SelectionStrategyEnum.IDLE,
+    ):
+        assert [gpu.id for gpu in SelectionStrategyFactory.get_instance(strategy_type)(gpus)] == [1, 2, 0]
+
+
+def test_history_strategies_judge_availability_by_the_history(mocker, tmp_path):
+    history = GPUUtilizationHistory(tmp_path / "history.npy")
+    gpus = [get_gpu(0), get_gpu(1)]
+
+    now = time.time()
+    # GPU 0 only pauses between two epochs
+    for second in range(120):
+        loads = [0.0 if second >= 115 else 1.0, 0.0]
+        history.append([gpu.model_copy(update={"load": load}) for gpu, load in zip(gpus, loads)], now - 120 + second)
+    snapshot = GPUSnapshot(gpus, [], user_resolver=lambda pids: {})
+
+    def available(strategy_type):
+        manager = GPUManager(
+            SelectionStrategyFactory.get_instance(strategy_type), provider=NvidiaGPUProvider(), history=history
+        )
+        mocker.patch.object(manager, "get_gpu_limit_of_current_user", return_value=10)
+        mocker.patch.object(manager, "get_gpus_of_current_user", return_value=set())
+        return sorted(gpu.id for gpu in manager.get_available(limit=2, max_load=0.5, snapshot=snapshot))
+
+    assert available(SelectionStrategyEnum.LOAD) == [0, 1]
+    assert available(SelectionStrategyEnum.EWMA_LOAD) == [1]
+    assert available(SelectionStrategyEnum.P95_LOAD) == [1]
+    assert available(SelectionStrategyEnum.IDLE) == [1]
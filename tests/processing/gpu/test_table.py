@@ -0,0 +1,110 @@
+"""
+Tests for the columnar GPUTable and the vectorized selection strategies
+"""
+
+import math
+import random
+from typing import List
+
+import numpy as np
+import pytest
+from gpu_doubles import get_gpu
+
+from experiment_runner.processing.gpu.models import GPU
+from experiment_runner.processing.gpu.strategies import (
+    SelectionStrategyEnum,
+    SelectionStrategyFactory,
+    as_selection_strategy,
+    get_table_strategy,
+)
+from experiment_runner.processing.gpu.table import GPUTable
+from experiment_runner.utils import nan_safe_float
+
+
+@pytest.fixture
+def gpus() -> List[GPU]:
+    random.seed(7)
+    return [
+        get_gpu(gpu_id, random.choice([0.0, 0.25, 0.5, 0.75, math.nan]), random.choice([0, 1024, 2048, 4096]))
+        for gpu_id in random.sample(range(200), 200)
+    ]
+
+
+def test_table_columns(gpus):
+    table = GPUTable.from_gpus(gpus)
+
+    assert len(table) == len(gpus)
+    assert table.id.tolist() == [gpu.id for gpu in gpus]
+    np.testing.assert_array_equal(table.memory_util, [gpu.memory_util for gpu in gpus])
+    assert table.to_gpus() == gpus
+    assert len(GPUTable.from_gpus([])) == 0
+
+
+def test_is_available_matches_gpu_objects(gpus):
+    table = GPUTable.from_gpus(gpus)
+
+    for kwargs in ({}, {"max_load": 1.0, "max_memory": 1.0}, {"max_load": 0.3, "memory_free": 2048}):
+        mask = table.is_available(**kwargs)
+        assert table.to_gpus(np.flatnonzero(mask)) == [gpu for gpu in gpus if gpu.is_available(**kwargs)]
+        assert table.take(mask).to_gpus() == [gpu for gpu in gpus if gpu.is_available(**kwargs)]
+
+
+def test_unknown_total_memory_is_not_available():
+    table = GPUTable.from_gpus([get_gpu(0, 0.0, 0, memory_total=0)])
+
+    assert math.isnan(table.memory_util[0])
+    assert not table.is_available(max_memory=1.0).any()
+
+
+@pytest.mark.parametrize(
+    "strategy_type, key",
+    [
+        (SelectionStrategyEnum.FIRST, lambda gpu: gpu.id),
+        (SelectionStrategyEnum.LAST, lambda gpu: -gpu.id),
+        (SelectionStrategyEnum.LOAD, lambda gpu: nan_safe_float(gpu.load)),
+        (SelectionStrategyEnum.MEMORY, lambda gpu: nan_safe_float(gpu.memory_util)),
+    ],
+)
+def test_strategies_match_list_sorts(gpus, strategy_type, key):
+    strategy = SelectionStrategyFactory.get_instance(strategy_type)
+
+    assert strategy(gpus) == sorted(gpus, key=key)
+
+
+def test_load_memory_random_uses_lexicographic_order(gpus):
+    strategy = SelectionStrategyFactory.get_instance(SelectionStrategyEnum.LOAD_MEMORY_RANDOM)
+
+    def key(gpu):
+        return nan_safe_float(gpu.load), nan_safe_float(gpu.memory_util)
+
+    selected = strategy(gpus)
+    assert sorted(selected, key=key) == selected
+    assert set(selected) == set(gpus)
+
+    random.seed(1)
+    first = strategy(gpus)
+    random.seed(1)
+    assert strategy(gpus) == first
+
+
+def test_random_and_none(gpus):
+    assert set(SelectionStrategyFactory.get_instance(SelectionStrategyEnum.RANDOM)(gpus)) == set(gpus)
+    assert SelectionStrategyFactory.get_instance(SelectionStrategyEnum.NONE)(gpus) == []
+
+
+def test_adapters(gpus):
+    table = GPUTable.from_gpus(gpus)
+
+    @as_selection_strategy
+    def select_highest_id(table: GPUTable) -> np.ndarray:
+        return np.argsort(table.id)[::-1]
+
+    assert select_highest_id.__name__ == "select_highest_id"
+    assert select_highest_id(gpus)[0].id == 199
+    assert get_table_strategy(select_highest_id)(table)[0] == int(np.argmax(table.id))
+
+    # Plain list strategies keep working on tables
+    def select_reversed(gpus: List[GPU]) -> List[GPU]:
+        return list(reversed(gpus))
+
+    assert get_table_strategy(select_reversed)(table).tolist() == list(range(len(gpus)))[::-1]
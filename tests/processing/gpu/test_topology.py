@@ -0,0 +1,138 @@
+"""
+Tests for the GPU topology and the topology-aware selection
+"""
+
+import subprocess
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+from gpu_doubles import get_gpus
+
+from experiment_runner.processing.gpu.exceptions import GPUNotFoundException
+from experiment_runner.processing.gpu.manager import GPUManager
+from experiment_runner.processing.gpu.providers import NvidiaGPUProvider
+from experiment_runner.processing.gpu.snapshot import GPUSnapshot
+from experiment_runner.processing.gpu.strategies import (
+    SelectionStrategyEnum,
+    SelectionStrategyFactory,
+    get_group_selection,
+)
+from experiment_runner.processing.gpu.topology import (
+    GPUTopology,
+    NvidiaTopologyProvider,
+    parse_nvidia_smi_topo,
+    select_best_connected,
+)
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def read_topology(name: str) -> GPUTopology:
+    return parse_nvidia_smi_topo((FIXTURES / f"nvidia_smi_topo_{name}.txt").read_text())
+
+
+@pytest.mark.parametrize("name, gpu_count", [("dgx1", 8), ("rtx8000", 8), ("470", 2)])
+def test_parse_fixtures(name, gpu_count):
+    topology = read_topology(name)
+
+    assert topology.gpu_ids == list(range(gpu_count))
+    for (first, second), link in topology.links.items():
+        assert topology.link(second, first) == link
+
+
+def test_parse_links():
+    dgx1 = read_topology("dgx1")
+    assert dgx1.link(0, 3) == "NV2"
+    assert dgx1.nvlinks(0, 3) == 2
+    assert dgx1.rank(0, 5) == 5
+
+    assert read_topology("470").link(0, 1) == "PHB"
+    assert read_topology("rtx8000").link(1, 3) == "PIX"
+
+    with pytest.raises(ValueError):
+        parse_nvidia_smi_topo("No devices were found\n")
+
+
+def test_prefers_nvlink_then_switch_then_numa_node():
+    topology = read_topology("rtx8000")
+
+    def select(*gpu_ids):
+        return [gpu.id for gpu in select_best_connected(get_gpus(*gpu_ids), 2, topology)]
+
+    # NVLink bridge
+    assert select(0, 4, 2, 3) == [2, 3]
+    # Same PCIe switch
+    assert select(0, 5, 2) == [0, 2]
+    # Same NUMA node
+    assert select(0, 4, 3) == [0, 3]
+    # Order of preference breaks ties
+    assert select(4, 0, 1, 5) == [4, 5]
+
+
+def test_prefers_more_nvlinks():
+    topology = read_topology("dgx1")
+
+    assert [gpu.id for gpu in select_best_connected(get_gpus(0, 1, 2, 3), 2, topology)] == [0, 3]
+    # Four GPUs of the same cube face are all connected with NVLink
+    selected = select_best_connected(get_gpus(*range(8)), 4, topology)
+    assert max(topology.rank(a.id, b.id) for a in selected for b in selected if a != b) == 0
+
+
+def test_greedy_selection_for_large_searches(mocker):
+    mocker.patch("experiment_runner.processing.gpu.topology.MAX_COMBINATIONS", 1)
+    topology = read_topology("rtx8000")
+
+    assert [gpu.id for gpu in select_best_connected(get_gpus(0, 4, 2, 3), 2, topology)] == [2, 3]
+
+
+def test_without_topology(mocker):
+    mocker.patch("experiment_runner.processing.gpu.topology.get_topology", return_value=None)
+
+    assert [gpu.id for gpu in select_best_connected(get_gpus(5, 1, 3), 2)] == [5, 1]
+
+
+def test_topology_strategy():
+    strategy = SelectionStrategyFactory.get_instance(SelectionStrategyEnum.TOPOLOGY)
+    gpus = get_gpus(3, 1, load=0.5) + get_gpus(2, 0)
+
+    assert [gpu.id for gpu in strategy(gpus)] == [0, 2, 1, 3]
+    group = get_group_selection(strategy)(strategy(gpus), 2, read_topology("rtx8000"))  # type: ignore[call-arg]
+    assert [gpu.id for gpu in group] == [0, 1]
+    # Other strategies select the first GPUs
+    assert (
+        get_group_selection(SelectionStrategyFactory.get_instance(SelectionStrategyEnum.FIRST))(gpus, 2) == gpus[:2]
+    )
+
+
+def test_provider_reads_topology_once(mocker):
+    run = mocker.patch("subprocess.run")
+    run.return_value = MagicMock(stdout=(FIXTURES / "nvidia_smi_topo_470.txt").read_text())
+    provider = NvidiaTopologyProvider()
+
+    assert provider.topology is provider.topology
+    assert run.call_count == 1
+    assert run.call_args.args[0] == ["nvidia-smi", "topo", "-m"]
+
+    run.side_effect = FileNotFoundError()
+    with pytest.raises(GPUNotFoundException):
+        _ = NvidiaTopologyProvider().topology
+
+    run.side_effect = subprocess.CalledProcessError(1, "nvidia-smi")
+    with pytest.raises(ValueError):
+        _ = NvidiaTopologyProvider().topology
+
+
+def test_manager_selects_best_connected_gpus(mocker):
+    mocker.patch("experiment_runner.processing.gpu.topology.get_topology", return_value=read_topology("rtx8000"))
+    manager = GPUManager(
+        SelectionStrategyFactory.get_instance(SelectionStrategyEnum.TOPOLOGY), provider=NvidiaGPUProvider()
+    )
+    mocker.patch.object(manager, "get_gpu_limit_of_current_user", return_value=10)
+    mocker.patch.object(manager, "get_gpus_of_current_user", return_value=set())
+    # GPU 1 and 4 have the lowest load, but GPU 2 and 3 are connected by NVLink
+    gpus = get_gpus(1, 4, load=0.1) + get_gpus(2, 3, load=0.2)
+    snapshot = GPUSnapshot(gpus, [], user_resolver=lambda pids: {})
+
+    assert [gpu.id for gpu in manager.get_available(limit=2, snapshot=snapshot)] == [2, 3]
+    assert [gpu.id for gpu in manager.get_available(limit=1, snapshot=snapshot)] == [1]
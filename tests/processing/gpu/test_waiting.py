@@ -0,0 +1,247 @@
+"""
+Tests for waiting for GPUs in the host-wide queue
+"""
+
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from gpu_doubles import get_gpu
+
+from experiment_runner.processing.gpu.waiting import (
+    UNATTEMPTED_TICKET_TIMEOUT_IN_SECONDS,
+    Backoff,
+    GPUWaiter,
+    WaitQueue,
+    WaitTicket,
+    WaitTimeoutException,
+    WakeupSocket,
+    notify_waiters,
+)
+
+
+@pytest.fixture
+def directory():
+    # Socket paths are limited to 108 characters, pytest's tmp_path may be longer
+    with tempfile.TemporaryDirectory(prefix="wait") as name:
+        yield Path(name)
+
+
+@pytest.fixture
+def other_process():
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    yield process
+    process.kill()
+    process.wait()
+
+
+def test_backoff_grows_with_jitter():
+    backoff = Backoff(1.0, 8.0)
+
+    delays = [backoff.next() for _ in range(6)]
+
+    for delay, step in zip(delays, [1, 2, 4, 8, 8, 8]):
+        assert step / 2 <= delay <= step
+    backoff.reset()
+    assert backoff.next() <= 1.0
+
+
+def test_queue_is_fifo(directory, other_process):
+    queue = WaitQueue(directory)
+    first = queue.enqueue(1, pid=other_process.pid)
+    second = queue.enqueue(2)
+
+    assert [ticket.ticket_id for ticket in queue.tickets()] == [first.ticket_id, second.ticket_id]
+    assert queue.position(first) == 0
+    assert queue.position(second) == 1
+
+    queue.leave(first)
+    assert queue.position(second) == 0
+
+
+def test_tickets_of_exited_processes_are_dropped(directory, other_process):
+    queue = WaitQueue(directory)
+    first = queue.enqueue(1, pid=other_process.pid)
+    second = queue.enqueue(1)
+
+    other_process.kill()
+    other_process.wait()
+
+    assert queue.position(second) == 0
+    assert [ticket.ticket_id for ticket in queue.tickets()] == [second.ticket_id]
+    assert first not in queue.tickets()
+
+
+def test_lost_tickets_keep_their_position(directory, other_process):
+    queue = WaitQueue(directory)
+    first = queue.enqueue(1)
+    queue.path.write_text("{damaged")
+    queue.enqueue(1, pid=other_process.pid)
+
+    assert queue.position(first) == 0
+
+
+def test_forged_tickets_are_dropped(directory, other_process):
+    queue = WaitQueue(directory)
+    own = queue.enqueue(1, pid=other_process.pid)
+    now = time.time()
+    forged = [
+        # pid 1 never exits and does not belong to mallory
+        WaitTicket(ticket_id="forged", user="mallory", pid=1, num_gpus=1, created_at=0),
+        # Never tried to acquire its GPUs
+        own.model_copy(
+            update={"ticket_id": "stalled", "created_at": now - UNATTEMPTED_TICKET_TIMEOUT_IN_SECONDS - 1}
+        ),
+        own.model_copy(update={"ticket_id": "future", "created_at": 0, "attempted_at": now + 3600}),
+    ]
+    queue.path.write_text(json.dumps([ticket.model_dump() for ticket in [own, *forged]]))
+
+    assert [ticket.ticket_id for ticket in queue.tickets()] == [own.ticket_id]
+
+
+def test_notify_wakes_up_waiters(directory):
+    with WakeupSocket(directory, "waiter") as wakeup:
+        assert not wakeup.wait(0.01)
+        notify_waiters(directory)
+        notify_waiters(directory)
+        assert wakeup.wait(1.0)
+        # Both notifications were consumed at once
+        assert not wakeup.wait(0.01)
+
+
+def test_notify_removes_stale_sockets(directory):
+    stale = WakeupSocket(directory, "stale")
+    stale.socket.close()
+
+    notify_waiters(directory)
+
+    assert not stale.path.exists()
+
+
+def test_wait_returns_acquired_gpus(directory):
+    gpus = [object()]
+
+    assert GPUWaiter(directory).wait(1, lambda reserved: gpus, lambda: None) == gpus
+    assert not WaitQueue(directory).tickets()
+
+
+def test_wait_times_out_and_leaves_the_queue(directory):
+    released = []
+    progress = []
+
+    with pytest.raises(WaitTimeoutException):
+        GPUWaiter(directory, timeout_in_seconds=0.2, backoff=Backoff(0.05, 0.05)).wait(
+            2, lambda reserved: [get_gpu(0)], lambda: released.append(True), progress.append
+        )
+
+    assert released
+    # Unchanged status is reported once
+    assert progress == ["Waiting for GPUs (1/2 available)"]
+    assert not WaitQueue(directory).tickets()
+
+
+def test_later_runs_wait_for_earlier_ones(directory, other_process):
+    queue = WaitQueue(directory)
+    earlier = queue.enqueue(1, pid=other_process.pid)
+    acquired = []
+
+    def acquire(reserved):
+        acquired.append(time.monotonic())
+        return [object()]
+
+    # The backoff alone would not check again within the test
+    waiter = GPUWaiter(directory, timeout_in_seconds=10, backoff=Backoff(30, 30))
+    thread = threading.Thread(target=waiter.wait, args=(1, acquire, lambda: None))
+    thread.start()
+    time.sleep(0.3)
+    assert not acquired
+
+    left_at = time.monotonic()
+    queue.leave(earlier)
+    notify_waiters(directory)
+    thread.join(timeout=5)
+
+    assert len(acquired) == 1
+    assert acquired[0] - left_at < 2
+
+
+def test_runs_that_can_not_start_do_not_block_later_runs(directory):
+    backoff = Backoff(0.05, 0.05)
+    # Over the limit of its user, the first run gets no GPUs at all
+    head = threading.Thread(
+        target=lambda: pytest.raises(
+            WaitTimeoutException,
+            GPUWaiter(directory, timeout_in_seconds=1, backoff=backoff).wait,
+            1,
+            lambda reserved: [],
+            lambda: None,
+        )
+    )
+    head.start()
+    while not any(ticket.attempted_at for ticket in WaitQueue(directory).tickets()):
+        time.sleep(0.01)
+
+    gpus = GPUWaiter(directory, timeout_in_seconds=1, backoff=backoff).wait(
+        1, lambda reserved: [get_gpu(0)], lambda: None
+    )
+
+    assert [gpu.uuid for gpu in gpus] == ["GPU-0"]
+    head.join()
+
+
+def test_failed_attempts_wake_up_the_next_run(directory):
+    attempt = threading.Event()
+
+    def acquire_nothing(reserved):
+        attempt.wait(timeout=5)
+        return []
+
+    # The backoff alone would not check again within the test
+    head = GPUWaiter(directory, timeout_in_seconds=2, backoff=Backoff(30, 30))
+    head_thread = threading.Thread(
+        target=lambda: pytest.raises(WaitTimeoutException, head.wait, 1, acquire_nothing, lambda: None)
+    )
+    head_thread.start()
+    while not WaitQueue(directory).tickets():
+        time.sleep(0.01)
+    acquired = []
+
+    def acquire(reserved):
+        acquired.append(time.monotonic())
+        return [get_gpu(0)]
+
+    later = GPUWaiter(directory, timeout_in_seconds=10, backoff=Backoff(30, 30))
+    thread = threading.Thread(target=later.wait, args=(1, acquire, lambda: None))
+    thread.start()
+    time.sleep(0.3)
+    # The run ahead did not try yet
+    assert not acquired
+
+    attempted_at = time.monotonic()
+    attempt.set()
+    thread.join(timeout=5)
+
+    assert len(acquired) == 1
+    assert acquired[0] - attempted_at < 1
+    head_thread.join()
+
+
+def test_later_runs_do_not_take_gpus_usable_by_runs_ahead(directory, other_process):
+    queue = WaitQueue(directory)
+    earlier = queue.enqueue(2, pid=other_process.pid)
+    queue.record_attempt(earlier, ["GPU-0"])
+    reserved_by_later = []
+
+    def acquire(reserved):
+        reserved_by_later.append(reserved)
+        return [gpu for gpu in [get_gpu(0), get_gpu(1)] if gpu.uuid not in reserved][:1]
+
+    gpus = GPUWaiter(directory, timeout_in_seconds=1).wait(1, acquire, lambda: None)
+
+    assert [gpu.uuid for gpu in gpus] == ["GPU-1"]
+    assert reserved_by_later == [frozenset({"GPU-0"})]
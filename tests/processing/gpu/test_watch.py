@@ -0,0 +1,86 @@
+"""
+Tests for the live GPU view
+"""
+
+import io
+import math
+from typing import List, Tuple
+
+from gpu_doubles import get_gpu
+from rich.console import Console
+
+from experiment_runner.processing.gpu.models import GPU, GPUProcess
+from experiment_runner.processing.gpu.providers import GPUProvider
+from experiment_runner.processing.gpu.watch import (
+    GPUHistory,
+    GPUWatchView,
+    sparkline,
+    watch_gpus,
+)
+
+
+class SequenceProvider(GPUProvider):
+    def __init__(self, samples: List[List[GPU]]):
+        self.samples = samples
+        self.calls = 0
+
+    def get_compute_processes(self) -> List[GPUProcess]:
+        return []
+
+    @property
+    def gpus(self) -> List[GPU]:
+        gpus = self.samples[min(self.calls, len(self.samples) - 1)]
+        self.calls += 1
+        return gpus
+
+    def sample(self) -> Tuple[List[GPU], List[GPUProcess]]:
+        return self.gpus, []
+
+
+def test_sparkline():
+    assert sparkline([0.0, 0.5, 1.0, math.nan, 7.0]) == "▁▅█ █"
+    assert sparkline([]) == ""
+
+
+def test_history_is_a_ring_buffer():
+    history = GPUHistory(length=3)
+    for load in (0.1, 0.2, 0.3, 0.4):
+        history.append([get_gpu(0, load=load, memory_used=2048)])
+
+    assert history.load("GPU-0") == [0.2, 0.3, 0.4]
+    assert history.memory("GPU-0") == [0.5, 0.5, 0.5]
+    assert history.load("GPU-unknown") == []
+
+
+def test_view_shows_the_latest_sample():
+    view = GPUWatchView(history_length=2)
+    view.update([get_gpu(0, load=0.5), get_gpu(1)])
+    view.update([get_gpu(0, load=1.0), get_gpu(1, temperature=80)])
+
+    table = view.render()
+    assert table.row_count == 2
+    cells = [[str(cell) for cell in column.cells] for column in table.columns]
+    assert cells[1] == ["1.00", "0.00"]
+    assert cells[3] == ["35.00", "80.00"]
+    assert cells[4] == ["▅█", "▁▁"]
+
+
+def test_view_bounds_rendered_rows():
+    view = GPUWatchView()
+    view.update([get_gpu(gpu_id) for gpu_id in range(100)])
+
+    table = view.render(max_rows=10)
+    assert table.row_count == 10
+    assert table.caption == "90 more GPUs not shown"
+
+
+def test_watch_draws_latest_sample():
+    provider = SequenceProvider([[get_gpu(0, load=0.5)]] * 3 + [[get_gpu(0, load=1.0)]])
+    output = io.StringIO()
+    console = Console(file=output, force_terminal=True, width=120, height=20)
+
+    watch_gpus(provider, ["load"], interval_in_seconds=0, console=console, max_updates=4)
+
+    assert provider.calls == 4
+    assert "1.00" in output.getvalue()
+    assert "▅▅▅█" in output.getvalue()
@@ -0,0 +1,174 @@
+"""
+Tests for the result cache
+"""
+
+import hashlib
+import json
+import os
+
+import pytest
+
+from experiment_runner.processing import cache as cache_module
+from experiment_runner.processing.cache import OutputCapture, ResultCache, hash_file
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultCache(tmp_path / "store")
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    directory = tmp_path / "work"
+    directory.mkdir()
+    monkeypatch.chdir(directory)
+    return directory
+
+
+def test_hash_file_streams_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_module, "HASH_CHUNK_SIZE", 7)
+    content = os.urandom(1000)
+    (tmp_path / "data").write_bytes(content)
+    (tmp_path / "empty").write_bytes(b"")
+
+    assert hash_file(tmp_path / "data") == hashlib.sha256(content).hexdigest()
+    assert hash_file(tmp_path / "empty") == hashlib.sha256(b"").hexdigest()
+
+
+def test_unchanged_inputs_are_not_hashed_again(store, workdir, mocker):
+    (workdir / "data.csv").write_text("a,b\n1,2\n")
+    first = store.key("python train.py", [workdir / "data.csv"])
+    spy = mocker.spy(cache_module, "hash_file")
+
+    assert store.key("python train.py", [workdir / "data.csv"]) == first
+    assert spy.call_count == 0
+
+    (workdir / "data.csv").write_text("a,b\n1,3\n")
+    assert store.key("python train.py", [workdir / "data.csv"]) != first
+    assert spy.call_count == 1
+
+
+def test_hashes_of_deleted_files_are_forgotten(store, workdir, monkeypatch):
+    for name in ("a.csv", "b.csv", "c.csv"):
+        (workdir / name).write_text(name)
+    store.key("train", [workdir / "a.csv", workdir / "b.csv"])
+    stats = store.directory / "stats.json"
+    written = stats.stat().st_mtime_ns
+
+    # Nothing hashed, nothing written
+    store.key("train", [workdir / "a.csv"])
+    assert stats.stat().st_mtime_ns == written
+
+    (workdir / "a.csv").unlink()
+    monkeypatch.setattr(cache_module, "MAX_KNOWN_FILES", 1)
+    store.key("train", [workdir / "c.csv"])
+    assert list(json.loads(stats.read_text())) == [str(workdir / "c.csv")]
+
+
+def test_key_depends_on_command_inputs_and_selected_env(store, workdir, monkeypatch):
+    (workdir / "data").mkdir()
+    (workdir / "data" / "a.txt").write_text("a")
+    monkeypatch.setenv("SEED", "1")
+    monkeypatch.setenv("UNRELATED", "1")
+    key = store.key("train", [workdir / "data"], ["SEED"])
+
+    monkeypatch.setenv("UNRELATED", "2")
+    assert store.key("train", [workdir / "data"], ["SEED"]) == key
+    assert store.key("evaluate", [workdir / "data"], ["SEED"]) != key
+
+    monkeypatch.setenv("SEED", "2")
+    assert store.key("train", [workdir / "data"], ["SEED"]) != key
+
+    monkeypatch.setenv("SEED", "1")
+    (workdir / "data" / "b.txt").write_text("b")
+    assert store.key("train", [workdir / "data"], ["SEED"]) != key
+
+
+def test_key_depends_on_the_declared_outputs(store, workdir):
+    key = store.key("train", outputs=[workdir / "model", workdir / "metrics.json"])
+
+    assert store.key("train", outputs=[workdir / "metrics.json", workdir / "model"]) == key
+    assert store.key("train", outputs=[workdir / "model"]) != key
+    assert store.key("train") != key
+
+
+def test_missing_inputs_are_rejected(store, workdir):
+    with pytest.raises(FileNotFoundError):
+        store.key("train", [workdir / "missing.csv"])
+
+
+def test_outputs_and_log_are_restored(store, workdir):
+    key = store.key("train")
+    assert store.lookup(key) is None
+
+    (workdir / "model").mkdir()
+    (workdir / "model" / "weights.bin").write_bytes(b"\x00\x01" * 100)
+    (workdir / "metrics.json").write_text('{"accuracy": 0.9}')
+    os.chmod(workdir / "metrics.json", 0o640)
+    capture = OutputCapture(store.captures / "run.log")
+    capture.on_start("train")
+    capture.on_log("train", "epoch 1\n")
+    capture.on_log("train", "done\n")
+    capture.on_end("train", 0)
+    store.store(key, "train", [workdir / "model", workdir / "metrics.json"], capture.path)
+
+    (workdir / "model" / "weights.bin").unlink()
+    (workdir / "metrics.json").write_text("changed")
+    entry = store.lookup(key)
+    assert entry is not None
+
+    assert store.restore(entry) == "epoch 1\ndone\n"
+    assert (workdir / "model" / "weights.bin").read_bytes() == b"\x00\x01" * 100
+    assert (workdir / "metrics.json").read_text() == '{"accuracy": 0.9}'
+    assert (workdir / "metrics.json").stat().st_mode & 0o777 == 0o640
+
+
+def test_entries_evicted_after_their_lookup_are_not_restored(store, workdir):
+    (workdir / "model.bin").write_bytes(b"model")
+    key = store.key("train")
+    store.store(key, "train", [workdir / "model.bin"])
+    entry = store.lookup(key)
+    assert entry is not None
+
+    (workdir / "model.bin").unlink()
+    store.max_size_in_bytes = 0
+    store._evict()
+
+    assert store.restore(entry) is None
+    assert not (workdir / "model.bin").exists()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, workdir):
+    store = ResultCache(tmp_path / "store", max_size_in_bytes=250)
+    keys = []
+    for index in range(3):
+        (workdir / f"out-{index}").write_bytes(bytes([index]) * 100)
+        keys.append(store.key(f"run {index}"))
+        store.store(keys[-1], f"run {index}", [workdir / f"out-{index}"])
+        # Entry 0 is used again before entry 2 is added
+        assert store.lookup(keys[0]) is not None
+
+    assert store.lookup(keys[1]) is None
+    assert store.lookup(keys[0]) is not None
+    assert store.lookup(keys[2]) is not None
+    # Objects of evicted entries are removed as well
+    assert sum(path.stat().st_size for path in store.objects.glob("*/*")) == 200
+
+
+def test_objects_shared_by_entries_are_kept_until_the_last_entry_is_evicted(tmp_path, workdir):
+    store = ResultCache(tmp_path / "store", max_size_in_bytes=250)
+    (workdir / "shared").write_bytes(b"s" * 100)
+    (workdir / "other").write_bytes(b"o" * 100)
+    store.store(store.key("run 0"), "run 0", [workdir / "shared"])
+    store.store(store.key("run 1"), "run 1", [workdir / "shared"])
+    store.store(store.key("run 2"), "run 2", [workdir / "other"])
+
+    # Both objects fit, no entry is evicted
+    assert all(store.lookup(store.key(f"run {index}")) is not None for index in range(3))
+
+    (workdir / "large").write_bytes(b"l" * 100)
+    store.store(store.key("run 3"), "run 3", [workdir / "large"])
+
+    # Evicting run 0 frees nothing, run 1 frees the shared object
+    assert [store.lookup(store.key(f"run {index}")) is not None for index in range(4)] == [False, False, True, True]
+    assert sum(path.stat().st_size for path in store.objects.glob("*/*")) == 200
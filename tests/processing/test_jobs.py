@@ -0,0 +1,126 @@
+"""
+Tests for the persistent job queue
+"""
+
+import os
+import stat
+
+import pytest
+
+from experiment_runner.processing.jobs import (
+    JobNotFoundException,
+    JobQueue,
+    JobState,
+    load_spec,
+    spec_path,
+)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(tmp_path / "shared" / "jobs.sqlite", tmp_path / "specs")
+
+
+def test_jobs_are_ordered_by_priority_then_submission(queue, tmp_path):
+    first = queue.submit("python first.py", user="alice", working_directory=tmp_path)
+    second = queue.submit("python second.py", num_gpus=2, priority=5, walltime_in_seconds=60, user="bob")
+    third = queue.submit("python third.py", user="alice")
+
+    assert [job.id for job in queue.jobs()] == [second.id, first.id, third.id]
+    assert [job.id for job in queue.jobs(user="alice")] == [first.id, third.id]
+    assert queue.get(second.id).walltime_in_seconds == 60
+    assert queue.get(first.id).working_directory == str(tmp_path)
+    assert queue.get(first.id).state == JobState.PENDING
+
+
+def test_queue_survives_reopening(queue):
+    job = queue.submit("python train.py", user="alice")
+
+    assert JobQueue(queue.path).get(job.id).command == "python train.py"
+
+
+def test_start_and_finish(queue):
+    job = queue.submit("python train.py", user="alice")
+
+    assert queue.start(job.id, [0, 3])
+    # Only pending jobs can be started, so two schedulers never start the same job
+    assert not queue.start(job.id, [1])
+
+    running = queue.get(job.id)
+    assert running.state == JobState.RUNNING
+    assert running.gpu_ids == [0, 3]
+    assert running.started_at is not None
+
+    queue.finish(job.id, 1)
+    assert queue.get(job.id).state == JobState.FAILED
+    assert queue.get(job.id).return_code == 1
+
+
+def test_requeue(queue):
+    job = queue.submit("python train.py", user="alice")
+    queue.start(job.id, [0], pid=4711)
+
+    queue.requeue(job.id)
+
+    requeued = queue.get(job.id)
+    assert requeued.state == JobState.PENDING
+    assert requeued.pid is None
+    assert requeued.gpus == ""
+
+
+def test_cancel(queue):
+    pending = queue.submit("python a.py", user="alice")
+    running = queue.submit("python b.py", user="alice")
+    queue.start(running.id, [0])
+
+    queue.cancel(pending.id, user="alice")
+    queue.cancel(running.id, user="alice")
+    # The scheduler records the end of the terminated job
+    queue.finish(running.id, -15)
+
+    assert queue.get(pending.id).state == JobState.CANCELLED
+    assert queue.get(running.id).state == JobState.CANCELLED
+    assert queue.get(running.id).return_code == -15
+
+
+def test_cancel_errors(queue):
+    job = queue.submit("python a.py", user="alice")
+
+    with pytest.raises(JobNotFoundException):
+        queue.cancel(job.id + 1, user="alice")
+    with pytest.raises(PermissionError):
+        queue.cancel(job.id, user="bob")
+
+    queue.cancel(job.id, user="alice")
+    with pytest.raises(ValueError):
+        queue.cancel(job.id, user="alice")
+
+
+def test_specs_are_private(queue, tmp_path):
+    job = queue.submit(
+        "python a.py", user="alice", working_directory=tmp_path, environment={"WANDB_API_KEY": "secret"}
+    )
+
+    assert stat.S_IMODE(os.stat(spec_path(job.id, queue.spec_directory)).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(queue.spec_directory).st_mode) == 0o700
+    spec = load_spec(job, queue.spec_directory)
+    assert spec is not None
+    assert (spec.command, spec.working_directory) == ("python a.py", str(tmp_path))
+    assert spec.environment == {"WANDB_API_KEY": "secret"}
+
+
+def test_specs_only_match_their_job(queue):
+    job = queue.submit("python a.py", user="alice")
+
+    # e.g. a job of another queue with the same id
+    assert load_spec(job.model_copy(update={"submitted_at": job.submitted_at + 1}), queue.spec_directory) is None
+    os.chmod(spec_path(job.id, queue.spec_directory), 0o644)
+    assert load_spec(job, queue.spec_directory) is None
+
+
+def test_cancelled_pending_jobs_lose_their_spec(queue):
+    job = queue.submit("python a.py", user="alice")
+
+    queue.cancel(job.id, user="alice")
+
+    assert not spec_path(job.id, queue.spec_directory).exists()
@@ -0,0 +1,171 @@
+"""
+Tests for multi-stage pipelines
+"""
+
+import shlex
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from gpu_doubles import StaticGPUProvider, StaticUserManager
+
+from experiment_runner.processing.gpu.reservations import GPUReservationLedger
+from experiment_runner.processing.gpu.waiting import Backoff
+from experiment_runner.processing.pipeline import (
+    Pipeline,
+    PipelineRunner,
+    Stage,
+    load_pipeline,
+    summarize,
+)
+
+
+@pytest.fixture
+def runner(tmp_path, wakeup_directory):
+    manager = StaticUserManager(
+        provider=StaticGPUProvider(2), ledger=GPUReservationLedger(tmp_path / "reservations.json")
+    )
+    return PipelineRunner(
+        manager, tmp_path / "logs", wakeup_directory=wakeup_directory, backoff=Backoff(0.05, 0.05), max_load=1.0
+    )
+
+
+def python(script: str) -> str:
+    return f"{shlex.quote(sys.executable)} -c {shlex.quote(script)}"
+
+
+def record(path: Path, seconds: float = 0.0, exit_code: int = 0) -> str:
+    # Appends the stage name, its start and end time to a shared file
+    return python(
+        "import os, sys, time; start = time.time(); time.sleep(%r);"
+        " open(%r, 'a').write(f\"{os.environ['EXPERIMENT_STAGE']} {start} {time.time()}\\n\"); sys.exit(%d)"
+        % (seconds, str(path), exit_code)
+    )
+
+
+def read_times(path: Path):
+    times = {}
+    for line in path.read_text().splitlines():
+        name, start, end = line.split()
+        times[name] = (float(start), float(end))
+    return times
+
+
+def test_unknown_dependencies_are_rejected():
+    with pytest.raises(ValueError):
+        Pipeline(stages={"train": Stage(command="train", needs=["prepare"])}).validate_graph()
+
+
+def test_cycles_are_rejected():
+    pipeline = Pipeline(stages={"a": Stage(command="a", needs=["b"]), "b": Stage(command="b", needs=["a"])})
+
+    with pytest.raises(ValueError):
+        pipeline.validate_graph()
+
+
+def test_critical_path_lengths():
+    pipeline = Pipeline(
+        stages={
+            "prepare": Stage(command="prepare"),
+            "train": Stage(command="train", needs=["prepare"]),
+            "evaluate": Stage(command="evaluate", needs=["train"]),
+            "lint": Stage(command="lint"),
+        }
+    )
+
+    assert pipeline.critical_path_lengths() == {"prepare": 3, "train": 2, "evaluate": 1, "lint": 1}
+
+
+def test_pipeline_files_are_loaded(tmp_path):
+    path = tmp_path / "pipeline.yml"
+    path.write_text(
+        "epochs: 3\n"
+        "stages:\n"
+        "  prepare:\n"
+        "    command: python prepare.py\n"
+        "  train:\n"
+        "    command: python train.py --epochs ${epochs}\n"
+        "    needs: [prepare]\n"
+        "    gpus: 1\n",
+        encoding="utf-8",
+    )
+
+    pipeline = load_pipeline(path)
+
+    assert pipeline.stages["train"].command == "python train.py --epochs 3"
+    assert pipeline.stages["train"].needs == ["prepare"]
+    assert pipeline.stages["train"].gpus == 1
+
+
+def test_independent_stages_run_concurrently_after_their_dependencies(tmp_path, runner):
+    times_path = tmp_path / "times.txt"
+    pipeline = Pipeline(
+        stages={
+            "prepare": Stage(command=record(times_path)),
+            "train_a": Stage(command=record(times_path, 0.5), needs=["prepare"], gpus=1),
+            "train_b": Stage(command=record(times_path, 0.5), needs=["prepare"], gpus=1),
+            "evaluate": Stage(command=record(times_path), needs=["train_a", "train_b"]),
+        }
+    )
+    started_at = time.time()
+
+    results = runner.run(pipeline)
+
+    assert [result.name for result in results] == ["prepare", "train_a", "train_b", "evaluate"]
+    assert all(result.succeeded for result in results)
+    assert sorted(gpu for result in results for gpu in result.gpus) == [0, 1]
+    times = read_times(times_path)
+    assert times["train_a"][0] >= times["prepare"][1]
+    assert times["evaluate"][0] >= max(times["train_a"][1], times["train_b"][1])
+    # Both trainings overlap
+    assert times["train_a"][0] < times["train_b"][1] and times["train_b"][0] < times["train_a"][1]
+    assert time.time() - started_at < 5
+    assert Path(results[1].log_path).exists()
+    assert not runner.manager.ledger.claimed_uuids()
+
+
+def test_stages_wait_for_free_gpus(tmp_path, runner):
+    times_path = tmp_path / "times.txt"
+    pipeline = Pipeline(
+        stages={
+            "a": Stage(command=record(times_path, 0.3), gpus=2),
+            "b": Stage(command=record(times_path, 0.3), gpus=2),
+        }
+    )
+
+    runner.run(pipeline)
+
+    times = read_times(times_path)
+    first, second = sorted(times.values())
+    assert second[0] >= first[1]
+
+
+def test_dependents_of_failed_stages_are_skipped(tmp_path, runner):
+    times_path = tmp_path / "times.txt"
+    pipeline = Pipeline(
+        stages={
+            "prepare": Stage(command=record(times_path, exit_code=3)),
+            "train": Stage(command=record(times_path), needs=["prepare"]),
+            "evaluate": Stage(command=record(times_path), needs=["train"]),
+            "lint": Stage(command=record(times_path)),
+        }
+    )
+
+    results = runner.run(pipeline)
+
+    assert [result.return_code for result in results] == [3, None, None, 0]
+    assert set(read_times(times_path)) == {"prepare", "lint"}
+    return_code, lines = summarize(results)
+    assert return_code == 3
+    assert lines[1].startswith("train: skipped")
+
+
+def test_the_stage_name_wins_over_the_env_of_the_stage(tmp_path, runner):
+    times_path = tmp_path / "times.txt"
+    pipeline = Pipeline(stages={"train": Stage(command=record(times_path), env={"EXPERIMENT_STAGE": "other"})})
+
+    results = runner.run(pipeline)
+
+    assert results[0].succeeded
+    assert set(read_times(times_path)) == {"train"}
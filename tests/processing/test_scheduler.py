@@ -0,0 +1,277 @@
+"""
+Tests for the backfilling scheduler
+"""
+
+import os
+import shlex
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+from typing import List
+
+import pytest
+from gpu_doubles import StaticGPUProvider, StaticUserManager
+
+from experiment_runner.processing.gpu.reservations import GPUReservationLedger
+from experiment_runner.processing.gpu.waiting import Backoff
+from experiment_runner.processing.jobs import Job, JobQueue, JobState
+from experiment_runner.processing.scheduler import (
+    Scheduler,
+    SchedulerAlreadyRunningException,
+    is_scheduler_running,
+    plan_jobs,
+)
+from experiment_runner.utils import get_process_start_time
+
+NOW = 10_000.0
+SLEEP = f"{sys.executable} -c 'import time; time.sleep(30)'"
+
+
+def get_job(job_id: int, num_gpus: int, walltime=None, started_at=None, min_free_memory=0, user="alice") -> Job:
+    return Job(
+        id=job_id,
+        user=user,
+        command="python train.py",
+        working_directory="/",
+        num_gpus=num_gpus,
+        walltime_in_seconds=walltime,
+        min_free_memory=min_free_memory,
+        submitted_at=job_id,
+        started_at=started_at,
+    )
+
+
+def ids(jobs: List[Job]) -> List[int]:
+    return [job.id for job in jobs]
+
+
+def test_jobs_start_in_order_while_they_fit():
+    pending = [get_job(1, 2), get_job(2, 1), get_job(3, 1)]
+
+    assert ids(plan_jobs(pending, [], free_gpus=3, now=NOW)) == [1, 2]
+
+
+def test_short_jobs_are_backfilled_before_the_reservation():
+    # Two GPUs are free, job 1 needs four: two more are released in 100 seconds
+    running = [get_job(10, 2, walltime=200, started_at=NOW - 100)]
+    pending = [get_job(1, 4), get_job(2, 1, walltime=50), get_job(3, 1, walltime=500), get_job(4, 1, walltime=90)]
+
+    assert ids(plan_jobs(pending, running, free_gpus=2, now=NOW)) == [2, 4]
+
+
+def test_jobs_are_backfilled_on_gpus_the_reservation_does_not_need():
+    running = [get_job(10, 2, walltime=200, started_at=NOW - 100)]
+    pending = [get_job(1, 3), get_job(2, 1), get_job(3, 1)]
+
+    # At the reservation four GPUs are free, job 1 needs three of them
+    assert ids(plan_jobs(pending, running, free_gpus=2, now=NOW)) == [2]
+
+
+def test_jobs_without_walltime_do_not_delay_the_reservation():
+    running = [get_job(10, 2)]
+    pending = [get_job(1, 4), get_job(2, 1), get_job(3, 1, walltime=60)]
+
+    # Job 1 can not be planned, only jobs with walltime are backfilled
+    assert ids(plan_jobs(pending, running, free_gpus=2, now=NOW)) == [3]
+
+
+def test_jobs_over_the_quota_of_their_user_do_not_hold_gpus():
+    running = [get_job(10, 1, user="alice")]
+    pending = [get_job(1, 1, user="alice"), get_job(2, 1, user="bob"), get_job(3, 1, user="bob")]
+
+    # alice used up her limit, bob may use one more GPU
+    assert ids(plan_jobs(pending, running, 2, NOW, {"alice": 0, "bob": 1})) == [2]
+
+
+def test_jobs_only_start_on_gpus_with_enough_free_memory():
+    pending = [get_job(1, 1, min_free_memory=3000), get_job(2, 1, min_free_memory=3000), get_job(3, 1)]
+
+    # Job 1 gets the GPU with 4000 MiB, job 2 fits on none of the others, job 3 takes the small one
+    assert ids(plan_jobs(pending, [], free_gpus=[1000, 4000], now=NOW)) == [1, 3]
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(tmp_path / "shared" / "jobs.sqlite", tmp_path / "specs")
+
+
+@pytest.fixture
+def scheduler(tmp_path, queue, wakeup_directory):
+    manager = StaticUserManager(
+        provider=StaticGPUProvider(2), ledger=GPUReservationLedger(tmp_path / "shared" / "reservations.json")
+    )
+    job_scheduler = Scheduler(manager, queue, tmp_path / "jobs", wakeup_directory, Backoff(0.05, 0.05))
+    yield job_scheduler
+    job_scheduler.close()
+
+
+def wait_for_state(scheduler: Scheduler, job_id: int, state: JobState, timeout: float = 10) -> Job:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        scheduler.step()
+        job = scheduler.queue.get(job_id)
+        if job.state == state:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not reach {state} ({scheduler.queue.get(job_id).state})")
+
+
+def test_scheduler_runs_jobs_of_its_user(scheduler, queue, tmp_path):
+    job = queue.submit(f"{sys.executable} -c 'print(42)'", user="alice", working_directory=tmp_path)
+    other = queue.submit("python train.py", user="bob")
+
+    assert ids(scheduler.step()) == [job.id]
+
+    finished = wait_for_state(scheduler, job.id, JobState.COMPLETED)
+    assert finished.return_code == 0
+    assert len(finished.gpu_ids) == 1
+    assert "42" in (tmp_path / "jobs" / f"{job.id}.log").read_text()
+    # Jobs of other users are started by their schedulers
+    assert queue.get(other.id).state == JobState.PENDING
+    assert not scheduler.manager.ledger.claims()
+
+
+def test_scheduler_waits_for_free_gpus(scheduler, queue):
+    first = queue.submit(SLEEP, num_gpus=2, user="alice")
+    second = queue.submit(SLEEP, num_gpus=1, user="alice")
+
+    assert ids(scheduler.step()) == [first.id]
+    assert scheduler.step() == []
+    assert queue.get(second.id).state == JobState.PENDING
+
+
+def test_cancelled_jobs_are_terminated(scheduler, queue):
+    job = queue.submit(SLEEP, user="alice")
+    wait_for_state(scheduler, job.id, JobState.RUNNING)
+    while queue.get(job.id).pid is None:
+        scheduler.step()
+
+    queue.cancel(job.id, user="alice")
+
+    assert wait_for_state(scheduler, job.id, JobState.CANCELLED).return_code is None
+    deadline = time.monotonic() + 10
+    while queue.get(job.id).return_code is None and time.monotonic() < deadline:
+        scheduler.step()
+    assert queue.get(job.id).return_code != 0
+
+
+def test_jobs_are_terminated_after_their_walltime(scheduler, queue):
+    job = queue.submit(SLEEP, walltime_in_seconds=0.5, user="alice")
+
+    assert wait_for_state(scheduler, job.id, JobState.TIMEOUT).return_code != 0
+
+
+def test_jobs_ignoring_sigterm_are_killed(mocker, scheduler, queue, tmp_path):
+    mocker.patch("experiment_runner.processing.scheduler.TERMINATION_TIMEOUT_IN_SECONDS", 0.5)
+    ready = tmp_path / "ready"
+    script = (
+        f"import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); open('{ready}', 'w'); time.sleep(30)"
+    )
+    job = queue.submit(f"{sys.executable} -c {shlex.quote(script)}", user="alice")
+    deadline = time.monotonic() + 10
+    while not ready.exists() and time.monotonic() < deadline:
+        scheduler.step()
+        time.sleep(0.05)
+
+    queue.cancel(job.id, user="alice")
+
+    while queue.get(job.id).return_code is None and time.monotonic() < deadline:
+        scheduler.step()
+        time.sleep(0.05)
+    assert queue.get(job.id).return_code == -signal.SIGKILL
+    assert not scheduler.manager.ledger.claims()
+
+
+def test_running_jobs_are_requeued_on_restart(scheduler, queue):
+    job = queue.submit(SLEEP, user="alice")
+    queue.start(job.id, [0], pid=2**22 + 1)
+
+    scheduler.recover()
+
+    assert queue.get(job.id).state == JobState.PENDING
+
+
+def test_restart_terminates_only_the_recorded_process(scheduler, queue):
+    orphan = subprocess.Popen(shlex.split(SLEEP))
+    # Runs with the pid of an ended job
+    stranger = subprocess.Popen(shlex.split(SLEEP))
+    try:
+        orphaned_job = queue.submit(SLEEP, user="alice")
+        queue.start(orphaned_job.id, [0])
+        queue.set_pid(orphaned_job.id, orphan.pid, get_process_start_time(orphan.pid))
+        ended_job = queue.submit(SLEEP, user="alice")
+        queue.start(ended_job.id, [1])
+        queue.set_pid(ended_job.id, stranger.pid, get_process_start_time(stranger.pid) - 60)
+
+        scheduler.recover()
+
+        assert orphan.wait(timeout=5) != 0
+        assert stranger.poll() is None
+        assert queue.get(orphaned_job.id).state == queue.get(ended_job.id).state == JobState.PENDING
+    finally:
+        orphan.kill()
+        stranger.kill()
+        orphan.wait()
+        stranger.wait()
+
+
+def test_closing_requeues_running_jobs(scheduler, queue):
+    job = queue.submit(SLEEP, user="alice")
+    wait_for_state(scheduler, job.id, JobState.RUNNING)
+
+    scheduler.close()
+
+    assert queue.get(job.id).state == JobState.PENDING
+
+
+def test_one_scheduler_per_user(scheduler):
+    scheduler._acquire_lock()
+    other = Scheduler(scheduler.manager, scheduler.queue, wakeup_directory=scheduler.wakeup_directory)
+
+    with pytest.raises(SchedulerAlreadyRunningException):
+        other._acquire_lock()
+
+
+def test_jobs_are_only_run_from_the_spec_of_their_user(scheduler, queue, tmp_path):
+    marker = tmp_path / "forged"
+    forged_command = f"{sys.executable} -c 'open({str(marker)!r}, \"w\")'"
+    job = queue.submit(f"{sys.executable} -c 'print(42)'", user="alice", working_directory=tmp_path)
+    # Any user can write the shared queue: add a job in the name of alice and change the command of hers
+    with sqlite3.connect(queue.path) as connection:
+        forged_id = connection.execute(
+            "INSERT INTO jobs (user, command, working_directory, num_gpus, priority, gpu_selection,"
+            " min_free_memory, state, submitted_at) VALUES ('alice', ?, '/', 1, 10, 'load_memory_random', 0,"
+            " 'pending', 0)",
+            (forged_command,),
+        ).lastrowid
+        connection.execute("UPDATE jobs SET command = ? WHERE id = ?", (forged_command, job.id))
+
+    assert ids(scheduler.step()) == [job.id]
+
+    wait_for_state(scheduler, job.id, JobState.COMPLETED)
+    assert "42" in (tmp_path / "jobs" / f"{job.id}.log").read_text()
+    assert queue.get(forged_id).state == JobState.CANCELLED
+    assert not marker.exists()
+
+
+def test_jobs_of_users_without_scheduler_do_not_hold_gpus(scheduler, queue):
+    blocked = queue.submit(SLEEP, num_gpus=2, priority=5, user="bob")
+    job = queue.submit(SLEEP, user="alice")
+
+    assert ids(scheduler.step()) == [job.id]
+    assert queue.get(blocked.id).state == JobState.PENDING
+
+
+def test_jobs_of_users_with_scheduler_are_planned(scheduler, queue):
+    scheduler.manager.max_gpus_per_other = 2  # bob may use both GPUs
+    queue.submit(SLEEP, num_gpus=2, priority=5, user="bob")
+    job = queue.submit(SLEEP, user="alice")
+    # The scheduler of bob is alive
+    (queue.path.parent / "scheduler-bob.lock").write_text(str(os.getpid()))
+
+    assert is_scheduler_running("bob", queue)
+    assert not is_scheduler_running("carol", queue)
+    assert scheduler.step() == []
+    assert queue.get(job.id).state == JobState.PENDING
@@ -0,0 +1,316 @@
+"""
+Tests for running commands
+"""
+
+import shlex
+import sys
+import time
+from typing import List, Tuple
+
+from gpu_doubles import get_gpus
+
+from experiment_runner.processing.callbacks import STDERR, STDOUT, Callback
+from experiment_runner.processing.subprocesses import CommandRunner
+
+
+class CollectingCallback(Callback):
+    """
+    Keeps all log lines and return codes
+    """
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self.streams: List[str] = []  # Of every line
+        self.ends: List[Tuple[str, int]] = []
+
+    def on_start(self, command):
+        pass
+
+    def on_end(self, command, returncode):
+        self.ends.append((command, returncode))
+
+    def on_log(self, command, log, stream=STDOUT):
+        self.lines.append(log)
+        self.streams.append(stream)
+
+    def on_error(self, command, returncode):
+        pass
+
+    def on_success(self, command, returncode):
+        pass
+
+
+def python(script: str) -> str:
+    return f"{shlex.quote(sys.executable)} -c {shlex.quote(script)}"
+
+
+def test_run_gpu_shows_all_gpus():
+    callback = CollectingCallback()
+
+    returncode = CommandRunner([callback], echo=False).run_gpu(
+        python("import os; print(os.environ['CUDA_VISIBLE_DEVICES'])"), get_gpus(3, 4)
+    )
+
+    assert returncode == 0
+    assert callback.lines == ["3,4\n"]
+
+
+def test_every_rank_sees_its_gpu():
+    callback = CollectingCallback()
+    script = (
+        "import os; print(*(os.environ[name] for name in"
+        " ('CUDA_VISIBLE_DEVICES', 'RANK', 'LOCAL_RANK', 'WORLD_SIZE', 'MASTER_PORT')), end='')"
+    )
+
+    returncode = CommandRunner([callback], echo=False).run_per_gpu(python(script), get_gpus(3, 4, 5))
+
+    assert returncode == 0
+    assert len(callback.ends) == 1
+    lines = sorted(callback.lines)
+    ports = {line.split()[-1] for line in lines}
+    assert len(ports) == 1
+    assert [line.rsplit(" ", 1)[0] for line in lines] == [
+        "[rank 0] 3 0 0 3",
+        "[rank 1] 4 1 1 3",
+        "[rank 2] 5 2 2 3",
+    ]
+
+
+def test_output_of_the_ranks_is_split_into_prefixed_lines():
+    callback = CollectingCallback()
+    script = (
+        "import sys; sys.stderr.write('err\\n'); sys.stdout.write('a\\nb\\n' * 1000); sys.stdout.write('partial')"
+    )
+
+    CommandRunner([callback], echo=False).run_per_gpu(python(script), get_gpus(3, 4))
+
+    for rank in (0, 1):
+        lines = [line for line in callback.lines if line.startswith(f"[rank {rank}] ")]
+        assert len(lines) == 2002
+        assert f"[rank {rank}] partial\n" in lines
+        assert f"[rank {rank}] err\n" in lines
+        assert callback.streams[callback.lines.index(f"[rank {rank}] err\n")] == STDERR
+
+
+def test_failed_rank_tears_down_the_others():
+    callback = CollectingCallback()
+    script = "import os, sys, time; sys.exit(3) if os.environ['RANK'] == '1' else time.sleep(60)"
+    started_at = time.monotonic()
+
+    returncode = CommandRunner([callback], echo=False).run_per_gpu(python(script), get_gpus(3, 4, 5))
+
+    assert returncode == 3
+    assert callback.ends[0][1] == 3
+    assert time.monotonic() - started_at < 10
+
+
+def test_failed_ranks_are_noticed_while_their_children_hold_the_outputs():
+    script = (
+        "import os, subprocess, sys, time; subprocess.Popen(['sleep', '30']) if os.environ['RANK'] == '1' else None;"
+        " sys.exit(3) if os.environ['RANK'] == '1' else time.sleep(60)"
+    )
+    started_at = time.monotonic()
+
+    returncode = CommandRunner(echo=False).run_per_gpu(python(script), get_gpus(3, 4))
+
+    assert returncode == 3
+    assert time.monotonic() - started_at < 10
+
+
+def test_children_holding_the_outputs_do_not_block_finished_ranks():
+    script = "import subprocess; subprocess.Popen(['sleep', '30']); print('done')"
+    callback = CollectingCallback()
+    started_at = time.monotonic()
+
+    returncode = CommandRunner([callback], echo=False).run_per_gpu(python(script), get_gpus(3, 4))
+
+    assert returncode == 0
+    assert sorted(callback.lines) == ["[rank 0] done\n", "[rank 1] done\n"]
+    assert time.monotonic() - started_at < 10
+
+
+def test_ranks_ignoring_sigterm_are_killed(mocker):
+    mocker.patch("experiment_runner.processing.subprocesses.TEARDOWN_TIMEOUT_IN_SECONDS", 0.5)
+    script = (
+        "import os, signal, sys, time; signal.signal(signal.SIGTERM, signal.SIG_IGN);"
+        " sys.exit(2) if os.environ['RANK'] == '0' else time.sleep(60)"
+    )
+    started_at = time.monotonic()
+
+    returncode = CommandRunner(echo=False).run_per_gpu(python(script), get_gpus(3, 4))
+
+    assert returncode == 2
+    assert time.monotonic() - started_at < 10
+
+
+def test_ranks_failing_right_after_closing_their_outputs_fail_the_command():
+    for _ in range(50):
+        assert CommandRunner(echo=False).run_per_gpu("sh -c 'echo hi; exit 3'", get_gpus(3)) == 3
+
+
+def test_ranks_running_on_after_closing_their_outputs_are_killed(mocker):
+    mocker.patch("experiment_runner.processing.subprocesses.OUTPUT_DRAIN_TIMEOUT_IN_SECONDS", 0.5)
+    started_at = time.monotonic()
+
+    returncode = CommandRunner(echo=False).run_per_gpu("sh -c 'exec >&- 2>&-; sleep 30'", get_gpus(3))
+
+    assert returncode != 0
+    assert time.monotonic() - started_at < 10
+
+
+class BatchCallback(CollectingCallback):
+    """
+    Keeps the batches of log lines
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.batches: List[List[str]] = []
+
+    def on_logs(self, command, logs, stream=STDOUT):
+        self.batches.append(list(logs))
+        self.lines.extend(logs)
+        self.streams.extend([stream] * len(logs))
+
+
+def test_output_is_split_into_lines_across_reads(mocker):
+    mocker.patch("experiment_runner.processing.subprocesses.READ_SIZE", 7)
+    callback = BatchCallback()
+    script = "import sys; sys.stdout.buffer.write('line 1\\nzwölf äpfel\\r\\nprogress\\rdone\\nno newline'.encode())"
+
+    returncode = CommandRunner([callback], echo=False).run(python(script), {})
+
+    assert returncode == 0
+    assert callback.lines == ["line 1\n", "zwölf äpfel\n", "progress\n", "done\n", "no newline"]
+
+
+def test_lines_read_at_once_are_one_batch():
+    callback = BatchCallback()
+
+    CommandRunner([callback], echo=False).run(python("import os; os.write(1, b'a\\nb\\nc\\n')"), {})
+
+    assert callback.batches == [["a\n", "b\n", "c\n"]]
+
+
+def test_long_lines_are_delivered_in_parts(mocker):
+    mocker.patch("experiment_runner.processing.subprocesses.MAX_LINE_LENGTH", 100)
+    callback = CollectingCallback()
+
+    script = "import os, time; os.write(1, b'x' * 1000); time.sleep(0.1); os.write(1, b'\\n')"
+
+    CommandRunner([callback], echo=False).run(python(script), {})
+
+    assert "".join(callback.lines) == "x" * 1000 + "\n"
+    assert len(callback.lines) > 1
+
+
+def test_output_is_echoed_unchanged(capfd):
+    script = "import sys; sys.stdout.buffer.write(b'[bold]raw[/bold]\\r\\n\\xff\\n')"
+
+    CommandRunner().run(python(script), {})
+
+    assert capfd.readouterr().out.endswith("[bold]raw[/bold]\r\n�\n")
+
+
+def test_callbacks_without_batch_method_get_single_lines():
+    class LineCallback:  # pylint: disable=too-few-public-methods
+        """
+        Callback implementing only on_log
+        """
+
+        def __init__(self):
+            self.lines = []
+
+        def on_log(self, command, log, stream):
+            self.lines.append((log, stream))
+
+    callback = LineCallback()
+
+    CommandRunner([callback], echo=False).run(python("print('a\\nb')"), {})  # type: ignore[list-item]
+
+    assert callback.lines == [("a\n", STDOUT), ("b\n", STDOUT)]
+
+
+def test_callbacks_overriding_on_log_without_stream_get_all_lines():
+    class LegacyCallback(Callback):
+        """
+        Callback overriding on_log with the signature from before stdout and stderr were separated
+        """
+
+        def __init__(self):
+            self.lines = []
+
+        def on_start(self, command):
+            pass
+
+        def on_end(self, command, returncode):
+            pass
+
+        def on_log(self, command, log):  # pylint: disable=arguments-differ
+            self.lines.append(log)
+
+    callback = LegacyCallback()
+
+    CommandRunner([callback], echo=False).run(python("import sys; print('a'); print('b', file=sys.stderr)"), {})
+
+    assert sorted(callback.lines) == ["a\n", "b\n"]
+
+
+def test_stdout_and_stderr_are_separate_streams(capfd):
+    callback = CollectingCallback()
+    script = "import sys; sys.stderr.write('err\\n'); sys.stderr.flush(); sys.stdout.write('out\\n')"
+
+    returncode = CommandRunner([callback]).run(python(script), {})
+
+    assert returncode == 0
+    assert sorted(zip(callback.lines, callback.streams)) == [("err\n", STDERR), ("out\n", STDOUT)]
+    captured = capfd.readouterr()
+    assert captured.out.endswith("out\n") and "err" not in captured.out
+    assert captured.err == "err\n"
+
+
+def test_commands_on_pseudo_terminals_see_terminals():
+    callback = CollectingCallback()
+    script = "import sys; print(sys.stdout.isatty()); print(sys.stderr.isatty(), file=sys.stderr)"
+
+    returncode = CommandRunner([callback], echo=False, use_pty=True).run(python(script), {})
+
+    assert returncode == 0
+    assert sorted(zip(callback.lines, callback.streams)) == [("True\n", STDERR), ("True\n", STDOUT)]
+
+
+def test_progress_bars_on_pseudo_terminals_keep_their_last_state(mocker, capfd):
+    mocker.patch("experiment_runner.processing.subprocesses.READ_SIZE", 3)
+    callback = CollectingCallback()
+    script = (
+        "import os, time; [(os.write(2, text), time.sleep(0.01))"
+        " for text in (b'10%', b'\\r50%', b'\\r100%', b'\\r\\n', b'done\\r\\n')]"
+    )
+
+    CommandRunner([callback], use_pty=True).run(python(script), {})
+
+    assert callback.lines == ["100%\n", "done\n"]
+    # The terminal shows the progress
+    assert capfd.readouterr().err == "10%\r50%\r100%\r\ndone\r\n"
+
+
+def test_ranks_on_pseudo_terminals():
+    callback = CollectingCallback()
+    script = "import sys; sys.stderr.write(f'{sys.stderr.isatty()}\\rdone')"
+
+    returncode = CommandRunner([callback], echo=False, use_pty=True).run_per_gpu(python(script), get_gpus(3, 4))
+
+    assert returncode == 0
+    assert sorted(callback.lines) == ["[rank 0] done\n", "[rank 1] done\n"]
+    assert callback.streams == [STDERR, STDERR]
+
+
+def test_replayed_logs_reach_the_callbacks(capfd):
+    callback = CollectingCallback()
+
+    returncode = CommandRunner([callback]).replay("train", "epoch 1\ndone\n")
+
+    assert returncode == 0
+    assert callback.lines == ["epoch 1\n", "done\n"]
+    assert callback.ends == [("train", 0)]
+    assert capfd.readouterr().out == "epoch 1\ndone\n"
@@ -0,0 +1,135 @@
+"""
+Tests for hyperparameter sweeps
+"""
+
+import csv
+import re
+import sys
+from pathlib import Path
+
+import pytest
+from gpu_doubles import StaticGPUProvider, StaticUserManager
+
+from experiment_runner.processing.gpu.reservations import GPUReservationLedger
+from experiment_runner.processing.gpu.waiting import Backoff
+from experiment_runner.processing.sweep import (
+    SweepMethod,
+    SweepRunner,
+    SweepSpec,
+    expand_trials,
+    load_sweep_spec,
+)
+
+
+def test_grid_expands_every_combination_in_order():
+    spec = SweepSpec(parameters={"lr": [0.1, 0.01], "depth": [2, 4], "optimizer": "adam"})
+
+    trials = expand_trials("train --lr {lr} --depth {depth} --optimizer {optimizer} --seed {trial}", spec)
+
+    assert [trial.command for trial in trials] == [
+        "train --lr 0.1 --depth 2 --optimizer adam --seed 0",
+        "train --lr 0.1 --depth 4 --optimizer adam --seed 1",
+        "train --lr 0.01 --depth 2 --optimizer adam --seed 2",
+        "train --lr 0.01 --depth 4 --optimizer adam --seed 3",
+    ]
+
+
+def test_random_search_samples_ranges_reproducibly():
+    spec = SweepSpec(
+        method=SweepMethod.RANDOM,
+        num_trials=20,
+        seed=7,
+        parameters={
+            "lr": {"min": 1e-5, "max": 1e-1, "log": True},
+            "layers": {"min": 1, "max": 8, "int": True},
+            "activation": ["relu", "gelu"],
+        },
+    )
+
+    trials = expand_trials("train --lr {lr}", spec)
+
+    assert len(trials) == 20
+    assert [trial.parameters for trial in trials] == [trial.parameters for trial in expand_trials("train", spec)]
+    for trial in trials:
+        assert 1e-5 <= trial.parameters["lr"] <= 1e-1
+        assert isinstance(trial.parameters["layers"], int) and 1 <= trial.parameters["layers"] <= 8
+        assert trial.parameters["activation"] in ("relu", "gelu")
+
+
+def test_unknown_template_parameters_are_rejected():
+    with pytest.raises(ValueError):
+        expand_trials("train --lr {learning_rate}", SweepSpec(parameters={"lr": [0.1]}))
+
+
+def test_trial_is_no_parameter_name():
+    with pytest.raises(ValueError):
+        SweepSpec(parameters={"trial": [1, 2]})
+
+
+def test_grid_search_rejects_ranges():
+    with pytest.raises(ValueError):
+        expand_trials("train", SweepSpec(parameters={"lr": {"min": 0.0, "max": 1.0}}))
+
+
+def test_sweep_files_are_loaded(tmp_path):
+    path = tmp_path / "sweep.yaml"
+    path.write_text("method: random\nnum_trials: 3\nseed: 1\nparameters:\n  lr: [0.1, 0.2]\n", encoding="utf-8")
+
+    spec = load_sweep_spec(path)
+
+    assert spec.method == SweepMethod.RANDOM
+    assert spec.num_trials == 3
+    assert spec.parameters == {"lr": [0.1, 0.2]}
+
+
+def test_trials_run_on_all_free_gpus(tmp_path, wakeup_directory):
+    manager = StaticUserManager(
+        provider=StaticGPUProvider(2), ledger=GPUReservationLedger(tmp_path / "reservations.json")
+    )
+    script = (
+        "import os, time; time.sleep(0.3); print(os.environ['CUDA_VISIBLE_DEVICES'], os.environ['EXPERIMENT_TRIAL'])"
+    )
+    trials = expand_trials(f'{sys.executable} -c "{script}" {{value}}', SweepSpec(parameters={"value": [1, 2, 3, 4]}))
+    runner = SweepRunner(
+        manager, tmp_path / "logs", wakeup_directory=wakeup_directory, backoff=Backoff(0.05, 0.05), max_load=1.0
+    )
+
+    results = runner.run(trials)
+    summary = runner.write_summary()
+
+    assert [result.trial.index for result in results] == [0, 1, 2, 3]
+    assert all(result.return_code == 0 for result in results)
+    # Both GPUs were busy at once
+    assert {gpu_id for result in results for gpu_id in result.gpus} == {0, 1}
+    for result in results:
+        log = Path(result.log_path).read_text(encoding="utf-8")
+        assert f"{result.gpus[0]} {result.trial.index}" in log
+    # All GPUs were released
+    assert not manager.ledger.claimed_uuids()
+    with open(summary, encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+    assert [row["value"] for row in rows] == ["1", "2", "3", "4"]
+
+
+def test_gpus_of_workers_stay_claimed_between_trials(tmp_path, wakeup_directory):
+    manager = StaticUserManager(
+        provider=StaticGPUProvider(2),
+        ledger=GPUReservationLedger(tmp_path / "reservations.json", grace_period_in_seconds=-1),
+    )
+    script = "import time; print('T' + '=%f' % time.time()); time.sleep(0.2); print('T' + '=%f' % time.time())"
+    trials = expand_trials(f'{sys.executable} -c "{script}"', SweepSpec(method="random", num_trials=6))
+    runner = SweepRunner(
+        manager, tmp_path / "logs", wakeup_directory=wakeup_directory, backoff=Backoff(0.05, 0.05), max_load=1.0
+    )
+
+    results = runner.run(trials)
+
+    intervals = {}
+    for result in results:
+        start, end = map(float, re.findall(r"T=([0-9.]+)", Path(result.log_path).read_text(encoding="utf-8")))
+        intervals.setdefault(result.gpus[0], []).append((start, end))
+    # No GPU ran two trials at once, although the claims have no grace period
+    for gpu_intervals in intervals.values():
+        gpu_intervals.sort()
+        assert all(end <= start for (_, end), (start, _) in zip(gpu_intervals, gpu_intervals[1:]))
+    assert not manager.ledger.claimed_uuids()
@@ -0,0 +1,146 @@
+"""
+Tests for the helper functions
+"""
+
+import os
+import pwd
+import stat
+import time
+from pathlib import Path
+
+import pytest
+
+from experiment_runner.utils import (
+    InsecureSharedPathException,
+    get_process_start_time,
+    get_user_for_pid,
+    get_username_for_uid,
+    get_users_for_pids,
+    open_shared_file,
+    parse_memory_size,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_uid_cache():
+    get_username_for_uid.cache_clear()
+    yield
+    get_username_for_uid.cache_clear()
+
+
+def write_status(proc_path: Path, pid: int, real_uid: int, effective_uid: int):
+    (proc_path / str(pid)).mkdir()
+    (proc_path / str(pid) / "status").write_text(
+        f"Name:\tpython\nPid:\t{pid}\nUid:\t{real_uid}\t{effective_uid}\t{effective_uid}\t{effective_uid}\n"
+    )
+
+
+def test_get_users_for_pids_reads_proc_once_per_pid(mocker, tmp_path):
+    for pid in (100, 101, 102):
+        write_status(tmp_path, pid, os.getuid(), os.getuid())
+    current_user = pwd.getpwuid(os.getuid()).pw_name
+    getpwuid = mocker.spy(pwd, "getpwuid")
+    read_text = mocker.spy(Path, "read_text")
+
+    users = get_users_for_pids([100, 101, 102, 101, 999], proc_path=tmp_path)
+
+    assert users == {100: current_user, 101: current_user, 102: current_user, 999: None}
+    # One read per distinct pid
+    assert read_text.call_count == 4
+    # All pids belong to the same uid, which is looked up only once
+    assert getpwuid.call_count == 1
+
+
+def test_get_users_for_pids_uses_the_real_uid(tmp_path):
+    # The directory belongs to the current user, the process to root
+    write_status(tmp_path, 100, 0, os.getuid())
+    (tmp_path / "101").mkdir()
+
+    assert get_users_for_pids([100, 101], proc_path=tmp_path) == {100: pwd.getpwuid(0).pw_name, 101: None}
+
+
+def test_get_username_for_uid_is_cached(mocker):
+    getpwuid = mocker.patch("pwd.getpwuid", side_effect=KeyError(4711))
+
+    assert get_username_for_uid(4711) == "4711"
+    assert get_username_for_uid(4711) == "4711"
+    assert getpwuid.call_count == 1
+
+
+def test_get_users_for_pids_without_procfs(mocker, tmp_path):
+    process = mocker.patch("psutil.Process")
+    process.return_value.username.return_value = "alice"
+
+    assert get_users_for_pids([1, 2], proc_path=tmp_path / "missing") == {1: "alice", 2: "alice"}
+
+
+def test_get_user_for_pid_of_own_process():
+    assert get_user_for_pid(os.getpid()) == pwd.getpwuid(os.getuid()).pw_name
+
+
+def test_process_start_time_identifies_a_process():
+    started_at = get_process_start_time(os.getpid())
+
+    assert started_at is not None and started_at <= time.time()
+    assert get_process_start_time(os.getpid()) == started_at
+    assert get_process_start_time(2**22 + 1) is None
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [("6G", 6144), ("6GB", 6144), ("1.5GiB", 1536), ("512m", 512), ("512", 512), ("100K", 1), ("1T", 1048576)],
+)
+def test_parse_memory_size(size, expected):
+    assert parse_memory_size(size) == expected
+
+
+@pytest.mark.parametrize("size", ["", "G", "6 X", "-1G"])
+def test_parse_memory_size_rejects_invalid_sizes(size):
+    with pytest.raises(ValueError):
+        parse_memory_size(size)
+
+
+def test_shared_files_are_created_for_all_users(tmp_path):
+    path = tmp_path / "shared" / "state.json"
+
+    os.close(open_shared_file(path))
+
+    assert stat.S_IMODE(path.stat().st_mode) == 0o666
+    assert stat.S_IMODE(path.parent.stat().st_mode) == 0o1777
+
+
+def test_shared_files_do_not_follow_links(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir(mode=0o1777)
+    private = tmp_path / "private"
+    private.write_text("precious")
+    private.chmod(0o600)
+    (shared / "symlink.json").symlink_to(private)
+    os.link(private, shared / "hardlink.json")
+
+    for name in ["symlink.json", "hardlink.json"]:
+        with pytest.raises(InsecureSharedPathException):
+            open_shared_file(shared / name)
+
+    assert private.read_text() == "precious"
+    assert stat.S_IMODE(private.stat().st_mode) == 0o600
+
+
+def test_shared_directories_must_protect_the_files_of_their_users(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)  # Everyone may replace the files of others
+
+    with pytest.raises(InsecureSharedPathException):
+        open_shared_file(shared / "state.json")
+    assert not (shared / "state.json").exists()
+
+
+def test_shared_directories_of_other_users_are_refused(mocker, tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir(mode=0o1777)
+    owner = os.getuid() + 4242
+    mocker.patch("os.lstat", return_value=os.stat_result((stat.S_IFDIR | 0o1777, 0, 0, 1, owner, 0, 0, 0, 0, 0)))
+
+    with pytest.raises(InsecureSharedPathException):
+        open_shared_file(shared / "state.json")